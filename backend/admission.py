@@ -0,0 +1,365 @@
+import asyncio
+import inspect
+import json
+import logging
+import math
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional: only needed for ADMISSION_REDIS_URL
+    redis = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Admission control for the API. Each request first has to take a token
+# from the buckets of its LO (X-LO-Phone header), its client IP and its
+# route, or it gets 429 with Retry-After. Behind a proxy the client IP
+# comes from X-Forwarded-For (see client_ip); otherwise every device
+# shares the proxy's address and bucket. It then needs one of
+# ADMISSION_MAX_CONCURRENCY slots. When ADMISSION_MAX_QUEUE requests are
+# already waiting, or a slot does not free up within ADMISSION_MAX_WAIT
+# seconds, it gets 503 with Retry-After. That way the database pool never
+# sees more work than it can take, and retry storms are turned away cheaply.
+LO_PHONE_HEADER = "x-lo-phone"
+
+
+def _limit(name: str, rate: str, burst: str) -> Tuple[float, float]:
+    # (tokens per second, bucket size); a rate of 0 disables the limit
+    return float(os.getenv(f"ADMISSION_{name}_RATE", rate)), float(os.getenv(f"ADMISSION_{name}_BURST", burst))
+
+
+LIMITS = {
+    "phone": _limit("PHONE", "1", "30"),
+    "ip": _limit("IP", "5", "100"),
+    "route": _limit("ROUTE", "200", "400"),
+}
+
+# The default matches SQLAlchemy's pool (5 connections + 10 overflow)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "15"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2.0"))
+
+# Buckets kept per key type before idle (full) ones are dropped
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "50000"))
+
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL")
+# Seconds a Redis call may take before the worker falls back to its own buckets
+ADMISSION_REDIS_TIMEOUT = float(os.getenv("ADMISSION_REDIS_TIMEOUT", "0.1"))
+
+# Proxies uvicorn trusts to set X-Forwarded-For ("*" trusts any peer)
+FORWARDED_ALLOW_IPS = {host.strip() for host in os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1").split(",")}
+
+# Paths that are never limited: health checks and API docs
+EXEMPT_PATHS = {"/", "/health", "/api/v1/ping", "/docs", "/redoc", "/openapi.json"}
+# Long-lived streams: rate limited, but they do not hold a concurrency slot
+UNCAPPED_PATHS = {"/api/v1/stream"}
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def client_ip(scope) -> Optional[str]:
+    """The client address a request's IP bucket is keyed on.
+
+    When uvicorn trusts every peer it reports the first X-Forwarded-For
+    entry, which the client writes itself. Each proxy appends the address
+    it got the request from, so the rightmost entry that is not one of our
+    proxies is the nearest hop a client cannot forge.
+    """
+    if "*" in FORWARDED_ALLOW_IPS:
+        forwarded = dict(scope.get("headers") or []).get(b"x-forwarded-for")
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.decode("latin1").split(",") if hop.strip()]
+            for hop in reversed(hops):
+                if hop not in FORWARDED_ALLOW_IPS:
+                    return hop
+    # Otherwise uvicorn has already picked the rightmost untrusted hop
+    return scope["client"][0] if scope.get("client") else None
+
+
+def route_key(method: str, path: str) -> str:
+    """Route of a request with ids folded, e.g. ``PUT /api/v1/mpr/{id}``"""
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+class TokenBuckets:
+    """Token buckets for one kind of key, as {key: (tokens, last refill)}.
+
+    A bucket that has refilled completely is the same as no bucket, so
+    when the map grows past ``max_keys`` those are dropped first.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = ADMISSION_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str) -> float:
+        """Take a token; returns 0 if admitted, else seconds until one is free"""
+        if self.rate <= 0:
+            return 0.0
+        now = self._clock()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if now - last < full_after
+        }
+        # Still too many active keys: keep the most recently used half
+        if len(self._buckets) > self.max_keys:
+            recent = sorted(self._buckets.items(), key=lambda item: item[1][1])[-self.max_keys // 2:]
+            self._buckets = dict(recent)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Token bucket in Redis: KEYS[1] bucket, ARGV rate, burst, now; returns the
+# wait in milliseconds (0 = admitted)
+_REDIS_TAKE = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens < 1 then
+  wait = math.ceil((1 - tokens) / rate * 1000)
+else
+  tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return wait
+"""
+
+
+class RedisTokenBuckets:
+    """Token buckets shared by all workers through Redis.
+
+    ``client`` is a redis.asyncio client, so a slow Redis never blocks the
+    event loop; calls are bounded by the client's socket timeouts.
+    """
+
+    def __init__(self, client, kind: str, rate: float, burst: float):
+        self.client = client
+        self.kind = kind
+        self.rate = rate
+        self.burst = burst
+        self._take = client.register_script(_REDIS_TAKE)
+        self._local = TokenBuckets(rate, burst)
+
+    async def take(self, key: str) -> float:
+        if self.rate <= 0:
+            return 0.0
+        try:
+            wait = await self._take(keys=[f"emtc:admission:{self.kind}:{key}"], args=[self.rate, self.burst, time.time()])
+            return wait / 1000
+        except Exception as e:
+            # Redis trouble must not take the API down; limit per worker instead
+            logger.warning(f"Shared rate limit unavailable, using local buckets: {str(e)}")
+            return self._local.take(key)
+
+    def __len__(self):
+        return len(self._local)
+
+
+class Overloaded(Exception):
+    """No capacity for the request; retry after ``retry_after`` seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Caps requests in flight; waiting is bounded by queue depth and time"""
+
+    def __init__(self, limit: int = ADMISSION_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._waiters: List[asyncio.Future] = []
+        # Recent slot waits (seconds), smoothed, for Retry-After and stats
+        self.wait_ewma = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _retry_after(self) -> float:
+        return max(1.0, self.wait_ewma * 2)
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded("queue_full", self._retry_after())
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the wait ran out
+            self._give_back(waiter)
+            raise Overloaded("wait_timeout", self._retry_after())
+        except asyncio.CancelledError:
+            # The request was cancelled (e.g. the client went away), perhaps
+            # after a slot was handed over
+            self._give_back(waiter)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self.wait_ewma = 0.8 * self.wait_ewma + 0.2 * (time.monotonic() - started)
+
+    def release(self):
+        self._release_slot()
+
+    def _give_back(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the oldest waiter, if any
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionController:
+    """Rate limits and the concurrency cap, with counters for /admission"""
+
+    def __init__(self, buckets: Dict[str, object] = None, limiter: ConcurrencyLimiter = None):
+        self.buckets = buckets if buckets is not None else {
+            kind: TokenBuckets(rate, burst) for kind, (rate, burst) in LIMITS.items()
+        }
+        self.limiter = limiter or ConcurrencyLimiter()
+        self.admitted = 0
+        self.rate_limited = {kind: 0 for kind in self.buckets}
+        self.shed = {"queue_full": 0, "wait_timeout": 0}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        if ADMISSION_REDIS_URL:
+            if redis is None:
+                logger.warning("ADMISSION_REDIS_URL is set but redis is not installed; rate limits stay per worker")
+            else:
+                client = redis.Redis.from_url(
+                    ADMISSION_REDIS_URL,
+                    socket_timeout=ADMISSION_REDIS_TIMEOUT,
+                    socket_connect_timeout=ADMISSION_REDIS_TIMEOUT
+                )
+                return cls({kind: RedisTokenBuckets(client, kind, rate, burst) for kind, (rate, burst) in LIMITS.items()})
+        return cls()
+
+    async def check_rate(self, phone: Optional[str], ip: Optional[str], route: str) -> Optional[Tuple[str, float]]:
+        """The first limit the request exceeds, as (kind, retry after); None if admitted"""
+        for kind, key in (("phone", phone), ("ip", ip), ("route", route)):
+            if key:
+                wait = self.buckets[kind].take(key)
+                if inspect.isawaitable(wait):
+                    # Shared buckets answer asynchronously
+                    wait = await wait
+                if wait > 0:
+                    self.rate_limited[kind] += 1
+                    return kind, wait
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rate_limited": dict(self.rate_limited),
+            "shed": dict(self.shed),
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "max_concurrency": self.limiter.limit,
+            "max_queue": self.limiter.max_queue,
+            "avg_wait_seconds": round(self.limiter.wait_ewma, 4),
+            "tracked_keys": {kind: len(buckets) for kind, buckets in self.buckets.items()}
+        }
+
+
+def _reject(status: int, detail: str, retry_after: float) -> Tuple[int, list, bytes]:
+    body = json.dumps({"status": "error", "message": detail, "error_code": "overloaded" if status == 503 else "rate_limited"})
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ]
+    return status, headers, body.encode()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to API requests"""
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        phone = headers.get(LO_PHONE_HEADER.encode(), b"").decode().strip() or None
+        ip = client_ip(scope)
+        limited = await self.controller.check_rate(phone, ip, route_key(scope["method"], scope["path"]))
+        if limited is not None:
+            kind, wait = limited
+            await self._send(send, *_reject(429, f"Too many requests ({kind} limit)", wait))
+            return
+
+        if scope["path"] in UNCAPPED_PATHS:
+            self.controller.admitted += 1
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.limiter.acquire()
+        except Overloaded as e:
+            self.controller.shed[e.reason] += 1
+            logger.warning(f"Shedding {scope['method']} {scope['path']}: {e.reason}")
+            await self._send(send, *_reject(503, "Server busy, retry later", e.retry_after))
+            return
+
+        self.controller.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.limiter.release()
+
+    @staticmethod
+    async def _send(send, status: int, headers: list, body: bytes):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": headers + [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+admission = AdmissionController.from_env()
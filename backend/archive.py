@@ -0,0 +1,397 @@
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from contextlib import ExitStack, closing, contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+from sqlalchemy import DateTime, func, select, text
+from sqlalchemy.orm import Session
+from database import PeriodPartition
+from periods import format_period
+import crud
+import partitions
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Closed periods are moved out of the live DPR/MPR tables into one
+# compressed file per table and month. Files are columnar: a ZIP with one
+# member per column holding one JSON value per line, so a reader pulls only
+# the columns it needs and can stop part-way through. Format 1 files (one
+# JSON array per column) are still read. manifest.json lists every file
+# with its row count and SHA-256.
+ARCHIVE_DIR = os.getenv(
+    "ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "archive")
+)
+
+# Periods older than this many months are closed and get archived
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+
+# Rows moved per round trip when a period is archived or restored
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVE_PREFIX = "archive:"
+FORMAT_VERSION = 2
+
+# Guards the manifest between threads; the lock file guards it between
+# processes (flock, where the platform has it)
+_manifest_thread_lock = threading.Lock()
+
+# Checksums already verified in this process, keyed by (path, mtime)
+_verified = set()
+
+
+def archive_dir(db: Session) -> str:
+    """The archive directory of the session's shard"""
+    return partitions.storage_dir(ARCHIVE_DIR, db)
+
+
+def load_manifest(directory: str) -> dict:
+    """Load an archive manifest; an empty one if nothing is archived yet"""
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"format_version": FORMAT_VERSION, "entries": {}}
+
+
+@contextmanager
+def manifest_lock(directory: str):
+    """Hold the archive directory's manifest lock across processes"""
+    os.makedirs(directory, exist_ok=True)
+    with _manifest_thread_lock, open(os.path.join(directory, "manifest.lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _save_manifest(directory: str, manifest: dict):
+    # Written to a temporary file and renamed so readers never see half a manifest
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "manifest.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _entry_key(table_name: str, period: int) -> str:
+    return f"{table_name}/{period}"
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _datetime_columns(table) -> set:
+    return {column.name for column in table.columns if isinstance(column.type, DateTime)}
+
+
+def write_archive_file(path: str, table, rows: Iterable[dict]) -> dict:
+    """Write rows to a columnar archive file; returns the row count and id range.
+
+    Rows are consumed one at a time: each column is spooled to its own
+    temporary file, which is then compressed into the archive, so memory
+    use does not grow with the number of rows. Rows must come in id order.
+    """
+    datetime_columns = _datetime_columns(table)
+    names = [column.name for column in table.columns]
+    directory = os.path.dirname(path)
+    stats = {"rows": 0, "min_id": None, "max_id": None}
+    with ExitStack() as stack:
+        spools = {name: stack.enter_context(tempfile.TemporaryFile(dir=directory)) for name in names}
+        for row in rows:
+            for name in names:
+                value = row[name]
+                if name in datetime_columns and value is not None:
+                    value = value.isoformat()
+                spools[name].write(json.dumps(value, separators=(",", ":")).encode("utf-8") + b"\n")
+            if stats["min_id"] is None:
+                stats["min_id"] = row["id"]
+            stats["max_id"] = row["id"]
+            stats["rows"] += 1
+
+        tmp_path = path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9, allowZip64=True) as zf:
+            zf.writestr("schema.json", json.dumps({
+                "format_version": FORMAT_VERSION,
+                "table": table.name,
+                "columns": {column.name: str(column.type) for column in table.columns},
+                "rows": stats["rows"]
+            }))
+            for name in names:
+                spools[name].seek(0)
+                with zf.open(f"columns/{name}.jsonl", "w", force_zip64=True) as member:
+                    shutil.copyfileobj(spools[name], member, 1 << 20)
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return stats
+
+
+def _column_values(zf: zipfile.ZipFile, name: str) -> Iterator:
+    # Format 2 streams one value per line; format 1 has to load the array
+    try:
+        member = zf.open(f"columns/{name}.jsonl")
+    except KeyError:
+        yield from json.loads(zf.read(f"columns/{name}.json"))
+        return
+    with io.TextIOWrapper(member, encoding="utf-8") as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def iter_archive_file(path: str, table, columns: Optional[List[str]] = None) -> Iterator[dict]:
+    """Stream rows from a columnar archive file, optionally only some columns.
+
+    Columns are decoded a row at a time, so a reader that stops early does
+    not pay for the rest of the file.
+    """
+    datetime_columns = _datetime_columns(table)
+    names = columns or [column.name for column in table.columns]
+    with zipfile.ZipFile(path) as zf:
+        for values in zip(*[_column_values(zf, name) for name in names]):
+            row = dict(zip(names, values))
+            for name in datetime_columns.intersection(names):
+                if row[name] is not None:
+                    row[name] = datetime.fromisoformat(row[name])
+            yield row
+
+
+def read_archive_file(path: str, table, columns: Optional[List[str]] = None) -> List[dict]:
+    """Read rows back from a columnar archive file, optionally only some columns"""
+    return list(iter_archive_file(path, table, columns))
+
+
+def verify_file(directory: str, entry: dict) -> bool:
+    """Check an archive file against its manifest checksum"""
+    path = os.path.join(directory, entry["file"])
+    if not os.path.exists(path):
+        return False
+    key = (path, os.path.getmtime(path))
+    if key in _verified:
+        return True
+    if _sha256(path) != entry["sha256"]:
+        return False
+    _verified.add(key)
+    return True
+
+
+def verify_all(directory: str) -> Dict[str, bool]:
+    """Verify every archived file; returns {entry key: ok}"""
+    return {key: verify_file(directory, entry) for key, entry in load_manifest(directory)["entries"].items()}
+
+
+def archived_periods(db: Session, table_name: str) -> set:
+    """Periods of a table that live in the archive"""
+    rows = db.query(PeriodPartition.period).filter(
+        PeriodPartition.table_name == table_name,
+        PeriodPartition.location.like(ARCHIVE_PREFIX + "%")
+    )
+    return {period for period, in rows}
+
+
+def is_archived(db: Session, table_name: str, period: int) -> bool:
+    detached = db.get(PeriodPartition, (table_name, period))
+    return detached is not None and detached.location.startswith(ARCHIVE_PREFIX)
+
+
+def archive_period(db: Session, table_name: str, period: int) -> dict:
+    """Move one month of a table into the archive.
+
+    The file and manifest are written and fsynced before the rows are
+    removed from the database, so a crash part-way leaves the data in the
+    live table. A month detached earlier is attached again first.
+    """
+    model = partitions.PARTITIONED_TABLES[table_name]
+    table = model.__table__
+    detached = db.get(PeriodPartition, (table_name, period))
+    if detached is not None:
+        if detached.location.startswith(ARCHIVE_PREFIX):
+            raise ValueError(f"Period {format_period(period)} of {table_name} is already archived")
+        partitions.attach_period(db, table_name, period)
+
+    try:
+        if db.query(model.id).filter(model.period == period).first() is None:
+            raise ValueError(f"No records for period {format_period(period)} of {table_name}")
+
+        directory = archive_dir(db)
+        os.makedirs(directory, exist_ok=True)
+        file_name = partitions.partition_name(table_name, period) + ".zip"
+        path = os.path.join(directory, file_name)
+        # Streamed in batches straight into the file, never held whole
+        rows = db.execute(
+            select(table).where(table.c.period == period).order_by(table.c.id)
+            .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+        ).mappings()
+        stats = write_archive_file(path, table, rows)
+        entry = {
+            "table": table_name,
+            "period": format_period(period),
+            "file": file_name,
+            "rows": stats["rows"],
+            "bytes": os.path.getsize(path),
+            "sha256": _sha256(path),
+            "columns": [column.name for column in table.columns],
+            "min_id": stats["min_id"],
+            "max_id": stats["max_id"],
+            "archived_at": datetime.now().isoformat()
+        }
+        with manifest_lock(directory):
+            manifest = load_manifest(directory)
+            manifest["entries"][_entry_key(table_name, period)] = entry
+            _save_manifest(directory, manifest)
+
+        if partitions.is_partitioned(db, table_name):
+            name = partitions.partition_name(table_name, period)
+            db.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+        else:
+            db.query(model).filter(model.period == period).delete(synchronize_session=False)
+        db.add(PeriodPartition(
+            table_name=table_name,
+            period=period,
+            location=ARCHIVE_PREFIX + file_name,
+            row_count=stats["rows"],
+            detached_at=datetime.now()
+        ))
+        crud.bump_change_counter(db, table_name)
+        db.commit()
+        partitions.forget_writable(db, table_name, period)
+        crud.invalidate_cached_table(db, table_name)
+
+        logger.info(f"Archived {table_name} period {format_period(period)} - {stats['rows']} rows, {entry['bytes']} bytes")
+        return entry
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error archiving {table_name} period {period}: {str(e)}")
+        raise
+
+
+def closed_before(now: datetime = None, months: int = None) -> int:
+    """First period that is still open; everything before it is closed"""
+    now = now or datetime.now()
+    months = ARCHIVE_AFTER_MONTHS if months is None else months
+    index = now.year * 12 + (now.month - 1) - months
+    return (index // 12) * 100 + index % 12 + 1
+
+
+def archive_closed_periods(db: Session, now: datetime = None) -> List[dict]:
+    """Archive every live period older than ARCHIVE_AFTER_MONTHS"""
+    cutoff = closed_before(now)
+    archived = []
+    for table_name, model in partitions.PARTITIONED_TABLES.items():
+        closed = [
+            period for period, in db.query(model.period)
+            .filter(model.period.isnot(None), model.period < cutoff)
+            .distinct()
+            .order_by(model.period)
+        ]
+        for period in closed:
+            archived.append(archive_period(db, table_name, period))
+    return archived
+
+
+def period_file(db: Session, table_name: str, period: int) -> str:
+    """Path of an archived month's file, after checking it against the manifest"""
+    directory = archive_dir(db)
+    entry = load_manifest(directory)["entries"].get(_entry_key(table_name, period))
+    if entry is None:
+        raise ValueError(f"Period {format_period(period)} of {table_name} is not in the archive")
+    if not verify_file(directory, entry):
+        raise ValueError(f"Archive file {entry['file']} failed its checksum")
+    return os.path.join(directory, entry["file"])
+
+
+def read_period(db: Session, table_name: str, period: int, centre_code: str = None,
+                columns: Optional[List[str]] = None, skip: int = 0, limit: int = None) -> List[dict]:
+    """Read an archived month as row dicts, verifying its checksum first.
+
+    With ``skip``/``limit`` only that page is returned, and the file is
+    read no further than its last row.
+    """
+    table = partitions.PARTITIONED_TABLES[table_name].__table__
+    if columns is not None and centre_code and "centre_code" not in columns:
+        columns = list(columns) + ["centre_code"]
+    with closing(iter_archive_file(period_file(db, table_name, period), table, columns)) as rows:
+        if centre_code:
+            rows = (row for row in rows if row["centre_code"] == centre_code)
+        return list(itertools.islice(rows, skip, None if limit is None else skip + limit))
+
+
+def read_records(db: Session, table_name: str, period: int, centre_code: str = None,
+                 skip: int = 0, limit: int = None) -> list:
+    """Read an archived month as detached model instances, for the record serializers"""
+    model = partitions.PARTITIONED_TABLES[table_name]
+    return [model(**row) for row in read_period(db, table_name, period, centre_code, skip=skip, limit=limit)]
+
+
+def restore_period(db: Session, table_name: str, period: int) -> dict:
+    """Copy an archived month back into the live table and drop its file"""
+    model = partitions.PARTITIONED_TABLES[table_name]
+    try:
+        if not is_archived(db, table_name, period):
+            raise ValueError(f"Period {format_period(period)} of {table_name} is not archived")
+        path = period_file(db, table_name, period)
+        db.delete(db.get(PeriodPartition, (table_name, period)))
+        db.flush()
+        # The partition was dropped when the period was archived, perhaps
+        # by another process, so it is created again whatever the cache says
+        partitions.forget_writable(db, table_name, period)
+        partitions.ensure_partition(db, table_name, period)
+        restored = 0
+        with closing(iter_archive_file(path, model.__table__)) as rows:
+            while True:
+                batch = list(itertools.islice(rows, ARCHIVE_BATCH_SIZE))
+                if not batch:
+                    break
+                db.execute(model.__table__.insert(), batch)
+                restored += len(batch)
+        crud.bump_change_counter(db, table_name)
+        db.commit()
+        crud.invalidate_cached_table(db, table_name)
+
+        directory = archive_dir(db)
+        with manifest_lock(directory):
+            manifest = load_manifest(directory)
+            entry = manifest["entries"].pop(_entry_key(table_name, period))
+            _save_manifest(directory, manifest)
+        os.remove(os.path.join(directory, entry["file"]))
+
+        logger.info(f"Restored {table_name} period {format_period(period)} - {restored} rows")
+        return {"table_name": table_name, "period": format_period(period), "rows": restored}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error restoring {table_name} period {period}: {str(e)}")
+        raise
+
+
+def archived_counts(db: Session) -> Dict[str, int]:
+    """Rows held in the archive per table"""
+    rows = db.query(PeriodPartition.table_name, func.sum(PeriodPartition.row_count)).filter(
+        PeriodPartition.location.like(ARCHIVE_PREFIX + "%")
+    ).group_by(PeriodPartition.table_name)
+    return {table_name: int(total or 0) for table_name, total in rows}
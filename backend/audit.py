@@ -0,0 +1,256 @@
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import DPR, MPR, Centre, AuditFlag, Tombstone
+import geo
+from sync_ledger import claim_ranges, complete_range, release_range
+import shards
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Ledger consumer used by the screening stage
+AUDIT_CONSUMER = "audit"
+
+SCREENED_TABLES = {"dpr": DPR, "mpr": MPR}
+
+# Flags owned by GPS screening; re-screening a record replaces them
+SCREENING_FLAGS = ("far_from_centre", "duplicate_coordinates")
+
+# Returns further than this from their panel centre are flagged
+MAX_CENTRE_DISTANCE_KM = float(os.getenv("AUDIT_MAX_CENTRE_DISTANCE_KM", "10"))
+
+# This many distinct returns sharing one geohash cell (~5 m) are flagged
+DUPLICATE_COORDINATE_THRESHOLD = int(os.getenv("AUDIT_DUPLICATE_THRESHOLD", "3"))
+
+# Seconds between background screening passes (a maintenance.py job); 0 disables them
+SCREENING_INTERVAL = int(os.getenv("AUDIT_SCREENING_INTERVAL", "60"))
+
+
+def get_centre_coordinates(db: Session, centre_codes) -> Dict[str, tuple]:
+    """Get {centre_code: (latitude, longitude)} for the given centres"""
+    rows = db.query(Centre.centre_code, Centre.latitude, Centre.longitude).filter(
+        Centre.centre_code.in_(set(centre_codes))
+    )
+    return {code: (latitude, longitude) for code, latitude, longitude in rows}
+
+
+def screen_batch(db: Session, table_name: str, records: List) -> int:
+    """Screen a batch of records and replace their GPS flags.
+
+    ``records`` are rows with id, centre_code, return_no, latitude,
+    longitude and geohash. Distances to the panel centres are computed as
+    one vectorized haversine over the batch. Coordinate clusters are counted
+    with one grouped query on the geohash index. Returns the number of flags
+    written; the caller commits.
+    """
+    if not records:
+        return 0
+
+    model = SCREENED_TABLES[table_name]
+    record_ids = [record.id for record in records]
+    centre_codes = [record.centre_code for record in records]
+    centres = get_centre_coordinates(db, centre_codes)
+    missing = (np.nan, np.nan)
+
+    latitude = np.array([record.latitude for record in records], dtype=np.float64)
+    longitude = np.array([record.longitude for record in records], dtype=np.float64)
+    centre_latitude = np.array([centres.get(code, missing)[0] for code in centre_codes], dtype=np.float64)
+    centre_longitude = np.array([centres.get(code, missing)[1] for code in centre_codes], dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        distance = geo.haversine_km_array(latitude, longitude, centre_latitude, centre_longitude)
+        far = distance > MAX_CENTRE_DISTANCE_KM
+
+    cells = {record.geohash for record in records if record.geohash}
+    cluster_sizes = dict(
+        db.query(model.geohash, func.count(func.distinct(model.return_no)))
+        .filter(model.geohash.in_(cells))
+        .group_by(model.geohash)
+        .all()
+    ) if cells else {}
+
+    # A cell that crosses the threshold flags every return in it, including
+    # ones screened in earlier batches before the cluster formed
+    hot_cells = [cell for cell, size in cluster_sizes.items() if size >= DUPLICATE_COORDINATE_THRESHOLD]
+    clustered = db.query(model.id, model.centre_code, model.geohash).filter(
+        model.geohash.in_(hot_cells)
+    ).all() if hot_cells else []
+
+    db.query(AuditFlag).filter(
+        AuditFlag.record_type == table_name,
+        AuditFlag.record_id.in_(record_ids),
+        AuditFlag.flag_type.in_(SCREENING_FLAGS)
+    ).delete(synchronize_session=False)
+    if clustered:
+        db.query(AuditFlag).filter(
+            AuditFlag.record_type == table_name,
+            AuditFlag.record_id.in_([record.id for record in clustered]),
+            AuditFlag.flag_type == "duplicate_coordinates"
+        ).delete(synchronize_session=False)
+
+    now = datetime.now()
+    flags = []
+    for index in np.flatnonzero(far):
+        record = records[index]
+        flags.append(AuditFlag(
+            record_type=table_name,
+            record_id=record.id,
+            centre_code=record.centre_code,
+            flag_type="far_from_centre",
+            distance_km=round(float(distance[index]), 3),
+            detail=f"Submitted {distance[index]:.1f} km from centre {record.centre_code}",
+            created_at=now
+        ))
+    for record in clustered:
+        flags.append(AuditFlag(
+            record_type=table_name,
+            record_id=record.id,
+            centre_code=record.centre_code,
+            flag_type="duplicate_coordinates",
+            detail=f"{cluster_sizes[record.geohash]} returns submitted from location cell {record.geohash}",
+            created_at=now
+        ))
+    db.add_all(flags)
+    return len(flags)
+
+
+def clear_stale_flags(db: Session, table_name: str) -> int:
+    """Drop GPS flags that no longer hold.
+
+    A cluster shrinks when one of its returns is deleted or moves to another
+    cell; screening only revisits the cells of changed records, so flagged
+    cells that fell below the threshold are recounted here. Flags of deleted
+    records are dropped as well. Returns the number of flags removed; the
+    caller commits.
+    """
+    model = SCREENED_TABLES[table_name]
+    removed = db.query(AuditFlag).filter(
+        AuditFlag.record_type == table_name,
+        AuditFlag.record_id.in_(
+            db.query(Tombstone.record_id).filter(Tombstone.table_name == table_name)
+        )
+    ).delete(synchronize_session=False)
+
+    flagged = db.query(model.id, model.geohash).join(
+        AuditFlag, (AuditFlag.record_id == model.id) & (AuditFlag.record_type == table_name)
+    ).filter(AuditFlag.flag_type == "duplicate_coordinates").all()
+    cells = {geohash for _, geohash in flagged if geohash}
+    cluster_sizes = dict(
+        db.query(model.geohash, func.count(func.distinct(model.return_no)))
+        .filter(model.geohash.in_(cells))
+        .group_by(model.geohash)
+        .all()
+    ) if cells else {}
+    stale = [
+        record_id for record_id, geohash in flagged
+        if cluster_sizes.get(geohash, 0) < DUPLICATE_COORDINATE_THRESHOLD
+    ]
+    if stale:
+        removed += db.query(AuditFlag).filter(
+            AuditFlag.record_type == table_name,
+            AuditFlag.record_id.in_(stale),
+            AuditFlag.flag_type == "duplicate_coordinates"
+        ).delete(synchronize_session=False)
+    return removed
+
+
+def screen_pending(db: Session, worker: str = "audit-screening", max_ranges: int = 10) -> Dict[str, int]:
+    """Screen DPR/MPR changes not yet seen by the audit consumer.
+
+    Work is claimed through the sync ledger, so several workers can screen
+    in parallel and each change is screened once. Returns flags written per
+    table.
+    """
+    written = {}
+    for table_name, model in SCREENED_TABLES.items():
+        ranges = [
+            (ledger_range.id, ledger_range.start_seq, ledger_range.end_seq)
+            for ledger_range in claim_ranges(db, AUDIT_CONSUMER, table_name, worker, max_ranges)
+        ]
+        written[table_name] = 0
+        for range_id, start_seq, end_seq in ranges:
+            try:
+                records = db.query(
+                    model.id, model.centre_code, model.return_no,
+                    model.latitude, model.longitude, model.geohash
+                ).filter(model.change_seq > start_seq, model.change_seq <= end_seq).all()
+                written[table_name] += screen_batch(db, table_name, records)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                release_range(db, range_id)
+                logger.error(f"Error screening {table_name} range {range_id}: {str(e)}")
+                raise
+            complete_range(db, range_id, worker)
+        if ranges:
+            try:
+                clear_stale_flags(db, table_name)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error clearing stale {table_name} flags: {str(e)}")
+                raise
+    return written
+
+
+def screen_all_shards():
+    """Screen pending returns on every shard"""
+    # Each shard has its own ledger, so every shard is screened separately
+    router = shards.get_router()
+    for name in router.names:
+        with router.open(name) as db:
+            written = screen_pending(db)
+            if any(written.values()):
+                logger.info(f"Audit screening wrote flags on {name}: {written}")
+
+
+def audit_flag_to_dict(flag: AuditFlag) -> dict:
+    """Convert an audit flag to the dict returned by the API"""
+    return {
+        "id": flag.id,
+        "record_type": flag.record_type,
+        "record_id": flag.record_id,
+        "centre_code": flag.centre_code,
+        "flag_type": flag.flag_type,
+        "distance_km": flag.distance_km,
+        "detail": flag.detail,
+        "created_at": flag.created_at.isoformat() if flag.created_at else None
+    }
+
+
+def get_audit_flags(db: Session, flag_type: str = None, centre_code: str = None, record_type: str = None,
+                    skip: int = 0, limit: int = 100):
+    """Get audit flags, newest first"""
+    query = db.query(AuditFlag)
+    if flag_type:
+        query = query.filter(AuditFlag.flag_type == flag_type)
+    if centre_code:
+        query = query.filter(AuditFlag.centre_code == centre_code)
+    if record_type:
+        query = query.filter(AuditFlag.record_type == record_type)
+    return query.order_by(AuditFlag.created_at.desc(), AuditFlag.id.desc()).offset(skip).limit(limit).all()
+
+
+def upsert_centre(db: Session, centre_code: str, latitude: float, longitude: float,
+                  centre_name: str = None, state: str = None) -> Centre:
+    """Create or update a panel centre's reference coordinates"""
+    try:
+        centre = db.query(Centre).filter(Centre.centre_code == centre_code).first()
+        if centre is None:
+            centre = Centre(centre_code=centre_code)
+            db.add(centre)
+        centre.latitude = latitude
+        centre.longitude = longitude
+        centre.centre_name = centre_name
+        centre.state = state
+        centre.updated_at = datetime.now()
+        db.commit()
+        return centre
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error saving centre {centre_code}: {str(e)}")
+        raise
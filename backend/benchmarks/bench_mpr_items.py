@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark for MPR purchase item validation.
+
+Compares the per-object path (one PurchaseItem model per item, then
+``model_dump()`` and ``json.dumps``) against the batch path used by MPRBase
+(TypedDict list validation, columnar checks and a single ``dump_json``
+pass). Prints the per-item cost of each for a few payload sizes.
+
+Run from the backend directory:
+    python benchmarks/bench_mpr_items.py
+"""
+
+import json
+import os
+import sys
+import timeit
+from typing import List
+
+from pydantic import TypeAdapter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import PurchaseItem, PurchaseItemList  # noqa: E402
+from validation import check_purchase_items  # noqa: E402
+
+
+def make_items(count):
+    return [
+        {
+            "item_name": f"Item {i}",
+            "item_code": "401",
+            "month_of_purchase": "01",
+            "fibre_code": "01",
+            "sector_of_manufacture_code": "01",
+            "colour_design_code": "04",
+            "gender": "M",
+            "age": 30,
+            "type_of_shop_code": "01",
+            "purchase_type_code": "01",
+            "dress_intended_code": "01",
+            "length_in_meters": 2.5,
+            "price_per_meter": 120.0,
+            "total_amount_paid": 300.0,
+            "brand_mill_name": "Brand",
+            "is_imported": False,
+        }
+        for i in range(count)
+    ]
+
+
+per_object_adapter = TypeAdapter(List[PurchaseItem])
+
+
+def per_object_path(raw):
+    items = per_object_adapter.validate_python(raw)
+    return json.dumps([item.model_dump() for item in items])
+
+
+def batch_path(raw):
+    items = PurchaseItemList.validate_python(raw)
+    check_purchase_items(items)
+    return PurchaseItemList.dump_json(items).decode()
+
+
+def main():
+    print(f"{'items':>6} {'per-object us/item':>20} {'batch us/item':>15} {'speedup':>8}")
+    for count in (10, 50, 200, 1000):
+        raw = make_items(count)
+        number = max(1, 20000 // count)
+        before = min(timeit.repeat(lambda: per_object_path(raw), number=number, repeat=5))
+        after = min(timeit.repeat(lambda: batch_path(raw), number=number, repeat=5))
+        before_us = before / number / count * 1e6
+        after_us = after / number / count * 1e6
+        print(f"{count:>6} {before_us:>20.2f} {after_us:>15.2f} {before_us / after_us:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the DPR/MPR/FP write paths.
+
+Compares the old write path, where sessions expire everything on commit
+and every create/update ends with ``refresh()``, against the current one
+(``expire_on_commit=False``, no refresh; the id comes back from the
+INSERT itself). Prints statements and time per write for MPR creates and
+updates.
+
+Run from the backend directory:
+    python benchmarks/bench_writes.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# A scratch database, set before the backend modules create their engine
+_scratch = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ["DATABASE_URL"] = f"sqlite:///{_scratch.name}"
+os.environ["CACHE_TTL"] = "0"
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database import create_tables, engine, SessionLocal  # noqa: E402
+from models import MPRCreate  # noqa: E402
+import crud  # noqa: E402
+
+WRITES = 500
+
+LegacySession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def make_mpr(i):
+    return MPRCreate(
+        name_and_address="Address", district_state_tel="District, State, 1234567890", panel_centre="Centre",
+        centre_code="BENCH", return_no=f"B{i}", family_size=4, income_group="04",
+        month_and_year="2024-01", occupation_of_head="03", items=[],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+
+
+def run(session_factory, refresh, statements):
+    db = session_factory()
+    results = {}
+    try:
+        statements.clear()
+        start = time.perf_counter()
+        records = []
+        for i in range(WRITES):
+            record = crud.create_mpr(db, make_mpr(i))
+            if refresh:
+                db.refresh(record)
+            records.append(record.id)
+        results["create"] = (time.perf_counter() - start, len(statements))
+
+        statements.clear()
+        start = time.perf_counter()
+        for record_id in records:
+            record = crud.update_mpr(db, record_id, {"family_size": 5})
+            if refresh:
+                db.refresh(record)
+        results["update"] = (time.perf_counter() - start, len(statements))
+    finally:
+        db.close()
+    return results
+
+
+def main():
+    create_tables()
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    # Warm up the partition cache and change counters
+    run(SessionLocal, False, statements)
+
+    before = run(LegacySession, True, statements)
+    after = run(SessionLocal, False, statements)
+    print(f"{'operation':>10} {'refresh us':>11} {'stmts':>6} {'current us':>11} {'stmts':>6} {'speedup':>8}")
+    for operation in ("create", "update"):
+        (before_s, before_n), (after_s, after_n) = before[operation], after[operation]
+        print(
+            f"{operation:>10} {before_s / WRITES * 1e6:>11.0f} {before_n / WRITES:>6.1f}"
+            f" {after_s / WRITES * 1e6:>11.0f} {after_n / WRITES:>6.1f} {before_s / after_s:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        engine.dispose()
+        os.remove(_scratch.name)
@@ -0,0 +1,461 @@
+import csv
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import or_
+from database import DPR, MPR, ImportJob, ImportRowError
+from models import DPRCreate, MPRCreate, HouseholdMember, PurchaseItem
+from periods import parse_period
+import crud
+import shards
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bulk import of paper DPR/MPR returns keyed into spreadsheets (CSV or
+# XLSX). A sheet has one row per household member (DPR) or purchase item
+# (MPR), with the return's own columns repeated or left blank on the rows
+# after its first; consecutive rows with the same centre code, return
+# number and month make one return. A nil MPR is a row without item
+# columns. Members or items may instead sit in one JSON column named
+# household_members / items.
+#
+# The file is read as a stream and cut into chunks of returns. Chunks are
+# validated against DPRCreate / MPRCreate in a pool of worker processes,
+# and loaded in file order through crud.bulk_create, one transaction per
+# chunk and shard, with every hook of a single create. Returns already on
+# file for their centre, number and month are skipped, and each problem is
+# recorded against its source row in import_errors.
+#
+# After each chunk the job's committed_row moves past it. A failed import
+# is rerun (same file, same job) from there; a chunk cut short by a crash
+# between its shard commits and the job update is loaded again, and the
+# returns it had already written are skipped as on file.
+IMPORT_CHUNK_RECORDS = int(os.getenv("IMPORT_CHUNK_RECORDS", "500"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMPORT_DIR = os.getenv("IMPORT_DIR", "./imports")
+# A running job that has not moved for this long is taken to be dead
+IMPORT_STALE_SECONDS = float(os.getenv("IMPORT_STALE_SECONDS", "600"))
+
+MODELS = {"dpr": DPRCreate, "mpr": MPRCreate}
+RECORD_MODELS = {"dpr": DPR, "mpr": MPR}
+# The list field of each return type, its row model and column prefix
+CHILDREN = {
+    "dpr": ("household_members", HouseholdMember, "member_"),
+    "mpr": ("items", PurchaseItem, "item_")
+}
+KEY_FIELDS = ("centre_code", "return_no", "month_and_year")
+COLUMN_ALIASES = {
+    "center_code": "centre_code",
+    "centre": "centre_code",
+    "return_number": "return_no",
+    "month": "month_and_year",
+    "month_year": "month_and_year",
+    "period": "month_and_year",
+    "lat": "latitude",
+    "lon": "longitude",
+    "lng": "longitude",
+    "otp": "otp_code"
+}
+EXTENSIONS = (".csv", ".xlsx")
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# (first row, last row, return columns, [(row, member/item columns)])
+Record = Tuple[int, int, dict, List[Tuple[int, dict]]]
+# (row, field, message)
+RowError = Tuple[int, Optional[str], str]
+
+
+def check_table(table_name: str) -> str:
+    if table_name not in MODELS:
+        raise ValueError(f"Unknown return type: {table_name}; use dpr or mpr")
+    return table_name
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _cell(value) -> Optional[str]:
+    # Everything goes to the models as text, like a JSON payload's strings;
+    # Excel numbers lose their ".0" and dates become their month
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m")
+    text = str(value).strip()
+    return text or None
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, list]]:
+    """(sheet row number, cell values) for every row of a CSV or XLSX file, header first"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for number, values in enumerate(csv.reader(f), start=1):
+                yield number, [_cell(value) for value in values]
+    elif extension == ".xlsx":
+        if openpyxl is None:
+            raise ValueError("XLSX import needs openpyxl; install it or save the sheet as CSV")
+        # Read-only mode streams the sheet instead of loading it whole
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for number, values in enumerate(workbook.active.iter_rows(values_only=True), start=1):
+                yield number, [_cell(value) for value in values]
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f"Unsupported file type {extension or '(none)'}; use {' or '.join(EXTENSIONS)}")
+
+
+def map_columns(table_name: str, header: list) -> Tuple[List[Optional[Tuple[str, str]]], List[str]]:
+    """Where each column goes: ("record", field), ("child", field) or None; and the unknown columns"""
+    model = MODELS[table_name]
+    child_field, child_model, prefix = CHILDREN[table_name]
+    record_fields = set(model.model_fields)
+    child_fields = set(child_model.model_fields)
+    columns, unknown, seen = [], [], set()
+    for heading in header:
+        name = _NON_WORD.sub("_", (heading or "").lower()).strip("_")
+        name = COLUMN_ALIASES.get(name, name)
+        if name in record_fields:
+            target = ("record", name)
+        elif name in child_fields:
+            target = ("child", name)
+        elif name.startswith(prefix) and name[len(prefix):] in child_fields:
+            target = ("child", name[len(prefix):])
+        else:
+            target = None
+            if heading:
+                unknown.append(heading)
+        if target in seen:
+            raise ValueError(f"Column {heading!r} appears more than once")
+        if target is not None:
+            seen.add(target)
+        columns.append(target)
+    missing = [name for name in KEY_FIELDS if ("record", name) not in seen]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return columns, unknown
+
+
+def group_records(rows: Iterator[Tuple[int, list]], columns: List[Optional[Tuple[str, str]]]) -> Iterator[Record]:
+    """Returns from data rows: consecutive rows of one centre, return number and month"""
+    current, current_key = None, None
+    for number, values in rows:
+        record, child = {}, {}
+        for target, value in zip(columns, values):
+            if target is not None and value is not None:
+                (record if target[0] == "record" else child)[target[1]] = value
+        if not record and not child:
+            continue
+        key = tuple(record.get(name) for name in KEY_FIELDS)
+        # Rows that leave the key blank carry on the return above
+        if current is not None and (key == current_key or not any(key)):
+            current[1] = number
+            for name, value in record.items():
+                current[2].setdefault(name, value)
+        else:
+            if current is not None:
+                yield tuple(current)
+            current, current_key = [number, number, record, []], key
+        if child:
+            current[3].append((number, child))
+    if current is not None:
+        yield tuple(current)
+
+
+def _row_errors(error: ValidationError, record: Record, child_field: str) -> List[RowError]:
+    first, _, _, children = record
+    child_rows = [number for number, _ in children]
+
+    def child_row(index) -> int:
+        return child_rows[index] if isinstance(index, int) and index < len(child_rows) else first
+
+    found = []
+    for detail in error.errors():
+        loc = detail["loc"]
+        nested = (detail.get("ctx") or {}).get("errors")
+        if loc and loc[0] == child_field and nested:
+            # Member and item checks report every failing entry at once
+            found.extend((child_row(entry["index"]), entry["field"], entry["message"]) for entry in nested)
+        elif len(loc) >= 2 and loc[0] == child_field:
+            found.append((child_row(loc[1]), str(loc[2]) if len(loc) > 2 else child_field, detail["msg"]))
+        else:
+            found.append((first, str(loc[0]) if loc else None, detail["msg"]))
+    return found
+
+
+def validate_record(table_name: str, record: Record):
+    """(first row, last row, validated model or None, row errors)"""
+    first, last, values, children = record
+    child_field = CHILDREN[table_name][0]
+    data = dict(values)
+    if children:
+        data[child_field] = [child for _, child in children]
+    elif isinstance(data.get(child_field), str):
+        try:
+            data[child_field] = json.loads(data[child_field])
+        except ValueError:
+            return first, last, None, [(first, child_field, "Not valid JSON")]
+    elif table_name == "mpr":
+        # A nil return
+        data.setdefault(child_field, [])
+    try:
+        return first, last, MODELS[table_name].model_validate(data), []
+    except ValidationError as e:
+        return first, last, None, _row_errors(e, record, child_field)
+
+
+def validate_chunk(table_name: str, chunk: List[Record]) -> list:
+    """Validate a chunk of returns; runs in a worker process"""
+    return [validate_record(table_name, record) for record in chunk]
+
+
+def _chunks(records: Iterator[Record], size: int) -> Iterator[List[Record]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validated_chunks(table_name: str, chunks: Iterator[List[Record]], workers: int) -> Iterator[list]:
+    """Validated chunks in file order, at most two per worker in flight"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield validate_chunk(table_name, chunk)
+        return
+    # Spawned, not forked: the API process has threads and open connections
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(validate_chunk, table_name, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _on_file(db, table_name: str, models: list) -> set:
+    """Natural keys of these returns that a shard already holds"""
+    model = RECORD_MODELS[table_name]
+    keys = {(data.centre_code, data.return_no, parse_period(data.month_and_year)) for data in models}
+    rows = db.query(model.centre_code, model.return_no, model.period).filter(
+        model.centre_code.in_({key[0] for key in keys}),
+        model.period.in_({key[2] for key in keys})
+    ).distinct()
+    return {tuple(row) for row in rows} & keys
+
+
+def load_chunk(router, table_name: str, validated: list, shard_of: Dict[str, str]) -> Tuple[int, int, List[RowError], List[RowError]]:
+    """Load a validated chunk; returns (created, failed, errors, skipped)"""
+    errors = [error for _, _, _, row_errors in validated for error in row_errors]
+    failed = sum(1 for _, _, data, _ in validated if data is None)
+    skipped = []
+    by_shard = {}
+    for first, _, data, _ in validated:
+        if data is None:
+            continue
+        if data.centre_code not in shard_of:
+            shard_of[data.centre_code] = router.shard_for_centre(data.centre_code)
+        by_shard.setdefault(shard_of[data.centre_code], []).append((first, data))
+
+    created = 0
+    for shard, entries in by_shard.items():
+        with router.open(shard) as db:
+            on_file = _on_file(db, table_name, [data for _, data in entries])
+            new = []
+            for first, data in entries:
+                key = (data.centre_code, data.return_no, parse_period(data.month_and_year))
+                if key in on_file:
+                    skipped.append((first, None, f"Return {data.return_no} of {data.month_and_year} is already on file"))
+                else:
+                    # A return repeated further down the file is skipped too
+                    on_file.add(key)
+                    new.append((first, data))
+            results = crud.bulk_create(db, table_name, [data for _, data in new]) if new else []
+            for (first, _), (record, reason) in zip(new, results):
+                if record is None:
+                    failed += 1
+                    errors.append((first, "month_and_year", reason))
+                else:
+                    created += 1
+    return created, failed, errors, skipped
+
+
+def _primary():
+    return shards.get_router().open()
+
+
+def start_job(path: str, table_name: str, filename: str = None, session_factory: Callable = None) -> ImportJob:
+    """The import job for a file: the earlier job for the same file and type, or a new one"""
+    check_table(table_name)
+    session_factory = session_factory or _primary
+    digest = file_digest(path)
+    with session_factory() as db:
+        try:
+            job = db.query(ImportJob).filter(
+                ImportJob.sha256 == digest,
+                ImportJob.table_name == table_name
+            ).order_by(ImportJob.id.desc()).first()
+            if job is None:
+                job = ImportJob(
+                    table_name=table_name, filename=filename or os.path.basename(path), path=path, sha256=digest,
+                    status="pending", committed_row=0, imported=0, failed=0, skipped=0, created_at=datetime.now()
+                )
+                db.add(job)
+            elif job.path != path and not os.path.exists(job.path or ""):
+                # The earlier copy is gone; carry on from this one
+                job.path = path
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return job
+
+
+def _claim(db, job_id: int) -> bool:
+    now = datetime.now()
+    claimed = db.query(ImportJob).filter(
+        ImportJob.id == job_id,
+        or_(
+            ImportJob.status != "running",
+            ImportJob.updated_at < now - timedelta(seconds=IMPORT_STALE_SECONDS)
+        )
+    ).update({"status": "running", "started_at": now, "updated_at": now, "last_error": None},
+             synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def run_job(job_id: int, path: str = None, workers: int = None, chunk_records: int = None,
+            session_factory: Callable = None) -> dict:
+    """Run (or carry on) an import job to the end; returns its summary.
+
+    Raises ValueError for an unknown job, one that is already running, or
+    a file that is not the job's. Other failures are recorded on the job,
+    which can then be run again.
+    """
+    workers = IMPORT_WORKERS if workers is None else workers
+    chunk_records = chunk_records or IMPORT_CHUNK_RECORDS
+    session_factory = session_factory or _primary
+    router = shards.get_router()
+    with session_factory() as db:
+        job = db.get(ImportJob, job_id)
+        if job is None:
+            raise ValueError(f"Import job {job_id} not found")
+        if job.status == "completed":
+            return job_to_dict(job)
+        path = path or job.path
+        if not path or not os.path.exists(path) or file_digest(path) != job.sha256:
+            raise ValueError(f"The file of import job {job_id} is missing or has changed; upload it again")
+        if not _claim(db, job_id):
+            raise ValueError(f"Import job {job_id} is already running")
+        db.refresh(job)
+        table_name = job.table_name
+
+        try:
+            rows = read_rows(path)
+            header = next(rows, (1, []))[1]
+            columns, unknown = map_columns(table_name, header)
+            if job.committed_row == 0 and unknown:
+                db.add_all([
+                    ImportRowError(job_id=job_id, row=1, field=heading, kind="warning", message="Unknown column, ignored")
+                    for heading in unknown
+                ])
+            # Returns of chunks already loaded are passed over
+            records = (record for record in group_records(rows, columns) if record[1] > job.committed_row)
+            shard_of = {}
+            for validated in validated_chunks(table_name, _chunks(records, chunk_records), workers):
+                created, failed, errors, skipped = load_chunk(router, table_name, validated, shard_of)
+                db.add_all(
+                    [ImportRowError(job_id=job_id, row=row, field=field, kind="error", message=message)
+                     for row, field, message in errors]
+                    + [ImportRowError(job_id=job_id, row=row, field=field, kind="skipped", message=message)
+                       for row, field, message in skipped]
+                )
+                job.committed_row = validated[-1][1]
+                job.imported += created
+                job.failed += failed
+                job.skipped += len(skipped)
+                job.updated_at = datetime.now()
+                db.commit()
+                logger.info(f"Import job {job_id}: loaded through row {job.committed_row} - "
+                            f"{job.imported} imported, {job.failed} failed, {job.skipped} skipped")
+            job.status = "completed"
+            job.finished_at = job.updated_at = datetime.now()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.last_error = str(e)
+            job.updated_at = datetime.now()
+            db.commit()
+            logger.error(f"Import job {job_id} failed after row {job.committed_row}: {str(e)}")
+            raise
+        return job_to_dict(job)
+
+
+def run_job_in_background(job_id: int):
+    """run_job for a background task: failures are on the job, not raised"""
+    try:
+        run_job(job_id)
+    except Exception as e:
+        logger.error(f"Import job {job_id} stopped: {str(e)}")
+
+
+def get_errors(db, job_id: int, kind: str = None, skip: int = 0, limit: int = 100) -> List[ImportRowError]:
+    query = db.query(ImportRowError).filter(ImportRowError.job_id == job_id)
+    if kind:
+        query = query.filter(ImportRowError.kind == kind)
+    return query.order_by(ImportRowError.row, ImportRowError.id).offset(skip).limit(limit).all()
+
+
+def job_to_dict(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "table": job.table_name,
+        "filename": job.filename,
+        "status": job.status,
+        "committed_row": job.committed_row,
+        "imported": job.imported,
+        "failed": job.failed,
+        "skipped": job.skipped,
+        "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def row_error_to_dict(error: ImportRowError) -> dict:
+    return {"row": error.row, "field": error.field, "kind": error.kind, "message": error.message}
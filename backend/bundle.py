@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import zipfile
+from datetime import datetime
+from typing import Iterator
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database import MPR
+from periods import format_period
+import archive
+import crud
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# MPR bundles: every MPR of a centre and period as a ZIP, in the layout of
+# the app's handoff package. Each MPR is mpr/<return_no>_<id>.json, and
+# manifest.json (the app's BackupManifest) maps every file to its SHA-256.
+# The ZIP is written to a stream that is emptied after each entry, rows
+# come from a server-side cursor, and entries use data descriptors with
+# zip64, so neither memory nor disk grows with the size of the bundle.
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_BATCH_SIZE = 500
+API_VERSION = "1.0.0"
+
+
+class ZipStream:
+    """Write-only file object collecting ZIP output until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # zipfile records entry offsets with tell(); it never seeks
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def bundle_filename(centre_code: str, period: int) -> str:
+    return f"mpr_{centre_code}_{format_period(period)}.zip"
+
+
+def _records(db: Session, centre_code: str, period: int) -> Iterator[MPR]:
+    if archive.is_archived(db, "mpr", period):
+        yield from archive.read_records(db, "mpr", period, centre_code)
+        return
+    # yield_per streams from a server-side cursor on PostgreSQL
+    rows = db.execute(
+        select(MPR).where(MPR.centre_code == centre_code, MPR.period == period)
+        .order_by(MPR.return_no, MPR.id)
+        .execution_options(yield_per=BUNDLE_BATCH_SIZE)
+    ).scalars()
+    yield from rows
+
+
+def has_records(db: Session, centre_code: str, period: int) -> bool:
+    if archive.is_archived(db, "mpr", period):
+        # Reads only the centre_code column, up to the first match
+        return bool(archive.read_period(db, "mpr", period, centre_code, columns=["centre_code"], limit=1))
+    return db.query(MPR.id).filter(MPR.centre_code == centre_code, MPR.period == period).first() is not None
+
+
+def stream_bundle(db: Session, centre_code: str, period: int) -> Iterator[bytes]:
+    """Yield the ZIP bundle of a centre's MPRs for a period, one entry at a time"""
+    stream = ZipStream()
+    file_hashes = {}
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as bundle:
+        for mpr in _records(db, centre_code, period):
+            name = f"mpr/{mpr.return_no}_{mpr.id}.json"
+            data = json.dumps(crud.mpr_to_dict(mpr), ensure_ascii=False).encode()
+            file_hashes[name] = hashlib.sha256(data).hexdigest()
+            with bundle.open(name, mode="w", force_zip64=True) as entry:
+                entry.write(data)
+            yield stream.drain()
+
+        manifest = {
+            "fileHashes": file_hashes,
+            "createdAt": datetime.now().isoformat(),
+            "appVersion": API_VERSION,
+            "deviceId": "server",
+            "centerCode": centre_code,
+            "periodId": format_period(period),
+            "loId": "",
+            "version": BUNDLE_FORMAT_VERSION
+        }
+        bundle.writestr("manifest.json", json.dumps(manifest, indent=2))
+    # The central directory is written on close
+    yield stream.drain()
+    logger.info(f"Streamed MPR bundle for {centre_code} {format_period(period)} - {len(file_hashes)} MPRs")
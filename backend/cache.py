@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+try:
+    import redis
+except ImportError:  # optional: only needed for CACHE_REDIS_URL
+    redis = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bounded in-process cache of record snapshots (column values), keyed by
+# (shard, table, id). Natural keys map to ids through aliases. Entries
+# expire after CACHE_TTL seconds, so an invalidation that never arrives
+# costs at most that much staleness. CACHE_TTL=0 turns the cache off.
+# Without CACHE_REDIS_URL a worker never hears of other workers' writes,
+# so the default TTL is then short.
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL = float(os.environ["CACHE_TTL"]) if os.getenv("CACHE_TTL") else None
+SHARED_CACHE_TTL = 300.0
+LOCAL_CACHE_TTL = 5.0
+
+# With several workers, invalidations are also published on Redis so every
+# worker drops its copy
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+CACHE_CHANNEL = os.getenv("CACHE_CHANNEL", "emtc:cache")
+
+
+def default_ttl(shared: bool) -> float:
+    """CACHE_TTL if set, otherwise the default for shared or local invalidation"""
+    if CACHE_TTL is not None:
+        return CACHE_TTL
+    return SHARED_CACHE_TTL if shared else LOCAL_CACHE_TTL
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters.
+
+    Every key has a generation that invalidation bumps (and bulk
+    invalidation bumps a cache-wide epoch). Readers take a
+    token before loading from the database and ``put`` drops the value if
+    the key was invalidated in between, so a slow reader cannot put back
+    a value that a concurrent write has just replaced.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = default_ttl(shared=False) if ttl is None else ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: Hashable):
+        """The cached value, or None; counts a hit or a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def token(self, key: Hashable) -> tuple:
+        """Generation of a key, taken before loading it from the database"""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def put(self, key: Hashable, value, token: Optional[tuple] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if token is not None and token != (self._epoch, self._generations.get(key, 0)):
+                return
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+            # Generations only matter while a read may be in flight; keep
+            # the map bounded, bumping the epoch for the dropped ones
+            if len(self._generations) > 2 * self.max_entries:
+                self._generations.clear()
+                self._epoch += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+            # Keys without a tracked generation are covered by the epoch
+            self._epoch += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+
+class RedisInvalidation:
+    """Publishes invalidations on a Redis channel and applies other workers' ones"""
+
+    def __init__(self, url: str, channel: str = CACHE_CHANNEL):
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._pubsub = None
+        self._thread = None
+
+    def publish(self, message: dict):
+        try:
+            self.client.publish(self.channel, json.dumps(dict(message, origin=self.origin)))
+        except Exception as e:
+            # Other workers fall back to the TTL
+            logger.warning(f"Could not publish cache invalidation: {str(e)}")
+
+    def start(self, apply: Callable[[dict], None]):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+        def on_message(raw):
+            message = json.loads(raw["data"])
+            if message.pop("origin", None) != self.origin:
+                apply(message)
+
+        self._pubsub.subscribe(**{self.channel: on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+
+class RecordCache:
+    """Record snapshots by (shard, table, id), plus natural-key aliases"""
+
+    def __init__(self, store: LRUCache = None, backend: RedisInvalidation = None):
+        self.store = store or LRUCache()
+        self.backend = backend
+
+    @classmethod
+    def from_env(cls) -> "RecordCache":
+        backend = None
+        if CACHE_REDIS_URL:
+            if redis is None:
+                logger.warning("CACHE_REDIS_URL is set but redis is not installed; cache invalidation stays local")
+            else:
+                backend = RedisInvalidation(CACHE_REDIS_URL)
+        return cls(LRUCache(ttl=default_ttl(shared=backend is not None)), backend)
+
+    @staticmethod
+    def record_key(shard: str, table_name: str, record_id: int) -> tuple:
+        return ("record", shard, table_name, record_id)
+
+    @staticmethod
+    def alias_key(shard: str, table_name: str, natural_key: tuple) -> tuple:
+        return ("alias", shard, table_name) + tuple(natural_key)
+
+    def start(self):
+        if self.backend is not None:
+            self.backend.start(self._apply)
+            logger.info(f"Cache invalidations shared on {self.backend.channel}")
+
+    def stop(self):
+        if self.backend is not None:
+            self.backend.stop()
+
+    def _apply(self, message: dict):
+        if message["op"] == "key":
+            self.store.invalidate(tuple(message["key"]))
+        elif message["op"] == "table":
+            self._drop_table(message["shard"], message["table"])
+
+    def _drop_table(self, shard: str, table_name: str):
+        self.store.invalidate_where(lambda key: key[1] == shard and key[2] == table_name)
+
+    def invalidate(self, shard: str, table_name: str, record_id: int = None, natural_key: tuple = None):
+        """Drop a record and/or a natural key, here and in other workers"""
+        keys = []
+        if record_id is not None:
+            keys.append(self.record_key(shard, table_name, record_id))
+        if natural_key is not None:
+            keys.append(self.alias_key(shard, table_name, natural_key))
+        for key in keys:
+            self.store.invalidate(key)
+            if self.backend is not None:
+                self.backend.publish({"op": "key", "key": list(key)})
+
+    def invalidate_table(self, shard: str, table_name: str):
+        """Drop every entry of a table, e.g. after a period is detached"""
+        self._drop_table(shard, table_name)
+        if self.backend is not None:
+            self.backend.publish({"op": "table", "shard": shard, "table": table_name})
+
+
+record_cache = RecordCache.from_env()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Mapping, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CODEBOOK_PATH = os.getenv(
+    "CODEBOOK_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "codebook.json")
+)
+
+# Which code lists each coded field is checked against. Item codes span the
+# piece length, garment, household and hosiery masters.
+PURCHASE_ITEM_FIELDS = {
+    "item_code": ("variety", "garment", "woven_garment", "household", "knitted"),
+    "month_of_purchase": ("month",),
+    "fibre_code": ("fibre",),
+    "sector_of_manufacture_code": ("sector",),
+    "colour_design_code": ("colour",),
+    "gender": ("gender",),
+    "type_of_shop_code": ("shop_type",),
+    "purchase_type_code": ("purchase_type",),
+    "dress_intended_code": ("dress_intended",),
+}
+
+HOUSEHOLD_MEMBER_FIELDS = {
+    "relationship_with_head": ("relationship",),
+    "gender": ("gender",),
+    "education": ("education",),
+    "occupation": ("dpr_occupation",),
+}
+
+DPR_FIELDS = {
+    "income_group": ("income_group",),
+}
+
+MPR_FIELDS = {
+    "income_group": ("income_group",),
+    "occupation_of_head": ("occupation",),
+}
+
+# DPR member occupations ("dpr_occupation", 01-14) and the MPR's occupation
+# of head ("occupation", 01-11) are different lists. Codes with one clear
+# counterpart are mapped; the rest (self employed, labourers, pension/rent,
+# infant) could be filed under several MPR codes and are left out.
+DPR_TO_MPR_OCCUPATION = MappingProxyType({
+    "01": "03",  # Service -> Service
+    "03": "02",  # Business: Petty/Small Scale -> Business
+    "04": "02",  # Business: Medium Scale -> Business
+    "05": "02",  # Business: Large Scale -> Business
+    "06": "04",  # Professionals -> Professional
+    "07": "01",  # Agriculture / Dairy / Poultry -> Agriculture
+    "11": "08",  # Housewife
+    "12": "07",  # Student
+    "14": "10",  # Unemployed
+})
+
+
+class CodeBook:
+    """Immutable set of code master lists, compiled into frozen lookup sets"""
+
+    def __init__(self, version: str, lists: Dict[str, Dict[str, str]], etag: str):
+        self.version = version
+        self.etag = etag
+        self.lists = MappingProxyType({name: MappingProxyType(dict(codes)) for name, codes in lists.items()})
+        self.purchase_item_codes = self._compile(PURCHASE_ITEM_FIELDS)
+        self.household_member_codes = self._compile(HOUSEHOLD_MEMBER_FIELDS)
+        self.dpr_codes = self._compile(DPR_FIELDS)
+        self.mpr_codes = self._compile(MPR_FIELDS)
+
+    def _compile(self, fields: Mapping[str, Tuple[str, ...]]) -> Mapping[str, FrozenSet[str]]:
+        return MappingProxyType({
+            field: frozenset(code for name in list_names for code in self.lists.get(name, {}))
+            for field, list_names in fields.items()
+        })
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "lists": {name: dict(codes) for name, codes in self.lists.items()}
+        }
+
+
+def load_codebook(path: str = CODEBOOK_PATH) -> CodeBook:
+    """Load a code book file; the ETag is derived from the file contents"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    etag = '"' + hashlib.sha256(raw).hexdigest()[:32] + '"'
+    return CodeBook(version=str(data["version"]), lists=data["lists"], etag=etag)
+
+
+def check_codes(record: Mapping, allowed: Mapping[str, FrozenSet[str]]) -> Dict[str, str]:
+    """Return {field: code} for every coded field whose value is not in its list"""
+    return {
+        field: record[field]
+        for field, codes in allowed.items()
+        if record.get(field) is not None and record[field] not in codes
+    }
+
+
+def mpr_occupation(dpr_occupation: str):
+    """The MPR occupation code for a DPR member's occupation, or None if there is no single match"""
+    return DPR_TO_MPR_OCCUPATION.get(dpr_occupation)
+
+
+_codebook = load_codebook()
+logger.info(f"Code book {_codebook.version} loaded with {len(_codebook.lists)} lists")
+
+
+def get_codebook() -> CodeBook:
+    """Return the code book loaded at startup"""
+    return _codebook
+
+
+def reload_codebook(path: str = CODEBOOK_PATH) -> CodeBook:
+    """Swap in a new code book revision, e.g. after the lists file is updated"""
+    global _codebook
+    _codebook = load_codebook(path)
+    logger.info(f"Code book reloaded - version {_codebook.version}")
+    return _codebook
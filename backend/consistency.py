@@ -0,0 +1,216 @@
+import json
+import logging
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import DPR, MPR, DPRHead, ConsistencyMismatch
+from codebook import mpr_occupation
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# "Self" in the relationship code list marks the head of household
+HEAD_RELATIONSHIP = "01"
+
+# MPR header fields that must agree with the matching DPR. The head's DPR
+# occupation is stored in the index as its MPR code, and heads whose
+# occupation has no MPR counterpart are not checked on that field.
+CHECKED_FIELDS = ("family_size", "income_group", "occupation_of_head")
+
+
+def head_of_household(household_members) -> Optional[dict]:
+    """Pick the head of household the way the app's MPR auto-fill does.
+
+    The member whose relationship is "Self", otherwise the first member.
+    """
+    if isinstance(household_members, str):
+        household_members = json.loads(household_members)
+    if not household_members:
+        return None
+    for member in household_members:
+        if member.get("relationship_with_head") == HEAD_RELATIONSHIP:
+            return member
+    return household_members[0]
+
+
+def index_dpr(db: Session, dpr: DPR):
+    """Add or refresh a DPR's entry in the head-of-household index.
+
+    MPRs filed against the DPR's return, and against its previous return
+    if the key changed, are re-checked. The caller commits.
+    """
+    for stale in db.query(DPRHead).filter(DPRHead.dpr_id == dpr.id).all():
+        if (stale.centre_code, stale.return_no) != (dpr.centre_code, dpr.return_no):
+            db.delete(stale)
+            db.flush()
+            _reindex_key(db, stale.centre_code, stale.return_no)
+
+    head = head_of_household(dpr.household_members) or {}
+    entry = db.get(DPRHead, (dpr.centre_code, dpr.return_no))
+    if entry is None:
+        entry = DPRHead(centre_code=dpr.centre_code, return_no=dpr.return_no)
+        db.add(entry)
+    entry.dpr_id = dpr.id
+    entry.family_size = dpr.family_size
+    entry.income_group = dpr.income_group
+    entry.occupation_of_head = mpr_occupation(head.get("occupation"))
+    entry.updated_at = datetime.now()
+    db.flush()
+    recheck_return(db, dpr.centre_code, dpr.return_no)
+
+
+def unindex_dpr(db: Session, dpr: DPR):
+    """Drop a deleted DPR from the index.
+
+    An older DPR for the same return, if any, takes its place. The caller
+    commits.
+    """
+    for entry in db.query(DPRHead).filter(DPRHead.dpr_id == dpr.id).all():
+        db.delete(entry)
+    db.flush()
+    _reindex_key(db, dpr.centre_code, dpr.return_no, exclude_id=dpr.id)
+
+
+def _reindex_key(db: Session, centre_code: str, return_no: str, exclude_id: int = None):
+    query = db.query(DPR).filter(DPR.centre_code == centre_code, DPR.return_no == return_no)
+    if exclude_id is not None:
+        query = query.filter(DPR.id != exclude_id)
+    previous = query.order_by(DPR.id.desc()).first()
+    if previous is not None:
+        index_dpr(db, previous)
+    else:
+        recheck_return(db, centre_code, return_no)
+
+
+def _mismatches(mpr, entry: DPRHead) -> List[ConsistencyMismatch]:
+    now = datetime.now()
+    mismatches = []
+    for field in CHECKED_FIELDS:
+        expected = getattr(entry, field)
+        actual = getattr(mpr, field)
+        if expected is None or actual is None or str(expected) == str(actual):
+            continue
+        mismatches.append(ConsistencyMismatch(
+            mpr_id=mpr.id,
+            dpr_id=entry.dpr_id,
+            centre_code=mpr.centre_code,
+            return_no=mpr.return_no,
+            field=field,
+            mpr_value=str(actual),
+            dpr_value=str(expected),
+            detected_at=now
+        ))
+    return mismatches
+
+
+def check_mpr(db: Session, mpr) -> List[ConsistencyMismatch]:
+    """Check one MPR against the index and replace its mismatch rows.
+
+    One primary-key lookup, no matter how many DPRs exist. MPRs without a
+    matching DPR are not reported. The caller commits.
+    """
+    db.flush()
+    clear_mpr(db, mpr.id)
+    entry = db.get(DPRHead, (mpr.centre_code, mpr.return_no))
+    mismatches = _mismatches(mpr, entry) if entry is not None else []
+    db.add_all(mismatches)
+    return mismatches
+
+
+def recheck_return(db: Session, centre_code: str, return_no: str) -> int:
+    """Re-check every MPR filed against one return; returns the mismatch count"""
+    db.flush()
+    entry = db.get(DPRHead, (centre_code, return_no))
+    mprs = db.query(
+        MPR.id, MPR.centre_code, MPR.return_no, MPR.family_size, MPR.income_group, MPR.occupation_of_head
+    ).filter(MPR.centre_code == centre_code, MPR.return_no == return_no).all()
+    if mprs:
+        db.query(ConsistencyMismatch).filter(
+            ConsistencyMismatch.mpr_id.in_([mpr.id for mpr in mprs])
+        ).delete(synchronize_session=False)
+    mismatches = [m for mpr in mprs for m in _mismatches(mpr, entry)] if entry is not None else []
+    db.add_all(mismatches)
+    return len(mismatches)
+
+
+def clear_mpr(db: Session, mpr_id: int):
+    """Remove the mismatch rows of an MPR, e.g. when it is deleted"""
+    db.query(ConsistencyMismatch).filter(ConsistencyMismatch.mpr_id == mpr_id).delete(synchronize_session=False)
+
+
+def rebuild(db: Session) -> dict:
+    """Rebuild the index and the mismatch report from scratch.
+
+    Only needed for data written before the index existed; normal writes
+    keep both up to date incrementally.
+    """
+    try:
+        db.query(ConsistencyMismatch).delete(synchronize_session=False)
+        db.query(DPRHead).delete()
+        db.flush()
+
+        # Later DPRs for the same return overwrite earlier ones
+        entries = {}
+        for dpr in db.query(DPR).order_by(DPR.id).yield_per(1000):
+            head = head_of_household(dpr.household_members) or {}
+            entries[(dpr.centre_code, dpr.return_no)] = DPRHead(
+                centre_code=dpr.centre_code,
+                return_no=dpr.return_no,
+                dpr_id=dpr.id,
+                family_size=dpr.family_size,
+                income_group=dpr.income_group,
+                occupation_of_head=mpr_occupation(head.get("occupation")),
+                updated_at=datetime.now()
+            )
+        db.add_all(entries.values())
+        db.flush()
+
+        mismatches = 0
+        for mpr in db.query(
+            MPR.id, MPR.centre_code, MPR.return_no, MPR.family_size, MPR.income_group, MPR.occupation_of_head
+        ).yield_per(1000):
+            entry = entries.get((mpr.centre_code, mpr.return_no))
+            if entry is not None:
+                found = _mismatches(mpr, entry)
+                db.add_all(found)
+                mismatches += len(found)
+        db.commit()
+        logger.info(f"Consistency index rebuilt - {len(entries)} returns, {mismatches} mismatches")
+        return {"indexed_returns": len(entries), "mismatches": mismatches}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error rebuilding consistency index: {str(e)}")
+        raise
+
+
+def get_mismatches(db: Session, centre_code: str = None, field: str = None, skip: int = 0, limit: int = 100):
+    """Get DPR/MPR mismatches, most recently detected first"""
+    query = db.query(ConsistencyMismatch)
+    if centre_code:
+        query = query.filter(ConsistencyMismatch.centre_code == centre_code)
+    if field:
+        query = query.filter(ConsistencyMismatch.field == field)
+    return query.order_by(ConsistencyMismatch.detected_at.desc(), ConsistencyMismatch.id.desc()).offset(skip).limit(limit).all()
+
+
+def get_mismatch_counts(db: Session, centre_code: str = None) -> dict:
+    """Count mismatches per field"""
+    query = db.query(ConsistencyMismatch.field, func.count())
+    if centre_code:
+        query = query.filter(ConsistencyMismatch.centre_code == centre_code)
+    return dict(query.group_by(ConsistencyMismatch.field).all())
+
+
+def mismatch_to_dict(mismatch: ConsistencyMismatch) -> dict:
+    """Convert a mismatch row to the dict returned by the API"""
+    return {
+        "mpr_id": mismatch.mpr_id,
+        "dpr_id": mismatch.dpr_id,
+        "centre_code": mismatch.centre_code,
+        "return_no": mismatch.return_no,
+        "field": mismatch.field,
+        "mpr_value": mismatch.mpr_value,
+        "dpr_value": mismatch.dpr_value,
+        "detected_at": mismatch.detected_at.isoformat() if mismatch.detected_at else None
+    }
@@ -1,40 +1,219 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, event, or_, update, func, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
 import json
-from database import DPR, MPR, FP
-from models import DPRCreate, MPRCreate, FPCreate
+import numpy as np
+from typing import List, Optional, Tuple
+from database import DPR, MPR, FP, ChangeCounter, Tombstone, SyncCursor, AuditFlag
+from models import DPRCreate, MPRCreate, FPCreate, DPRUpdate, MPRUpdate, PurchaseItemList
 import logging
+import geo
+import patching
+import history
+import consistency
+import similarity
+import partitions
+import archive
+import reconciliation
+import events
+from periods import parse_period, format_period
+from cache import record_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class VersionConflict(Exception):
+    """The record changed since the version the caller read"""
+
+# Change counters
+# Change sequence numbers are taken when a transaction commits, not at the
+# write itself. A table's counter row stays locked from its bump until
+# commit, so bumping last keeps concurrent writers from queueing on it for
+# a whole transaction, while sequence numbers still become visible in
+# commit order - delta sync tokens and ledger watermarks rely on that, and
+# a database sequence would hand them out in allocation order instead.
+PENDING_CHANGES = "pending_changes"
+
+def bump_change_counter(db: Session, table_name: str, now: datetime = None, count: int = 1) -> int:
+    """Add ``count`` to a table's change counter inside the caller's transaction.
+
+    Returns the new counter value. The counter row stays locked until the
+    caller commits, so change sequence numbers become visible in order.
+    """
+    now = now or datetime.now()
+    version = db.execute(
+        update(ChangeCounter)
+        .where(ChangeCounter.table_name == table_name)
+        .values(version=ChangeCounter.version + count, updated_at=now)
+        .returning(ChangeCounter.version)
+    ).scalar_one_or_none()
+    if version is None:
+        version = count
+        db.add(ChangeCounter(table_name=table_name, version=version, updated_at=now))
+        db.flush()
+    return version
+
+def queue_change(db: Session, table_name: str, row):
+    """Give a record or tombstone its table's next change sequence number when the session commits"""
+    db.info.setdefault(PENDING_CHANGES, {}).setdefault(table_name, {})[id(row)] = row
+
+def mark_changed(db: Session, table_name: str, record):
+    """Stamp a record as changed; its change sequence number is taken at commit"""
+    record.updated_at = datetime.now()
+    queue_change(db, table_name, record)
+
+@event.listens_for(Session, "before_commit")
+def _stamp_change_seqs(db: Session):
+    pending = db.info.pop(PENDING_CHANGES, None)
+    if not pending:
+        return
+    now = datetime.now()
+    # Counters in a fixed order, so two commits never wait on each other's
+    for table_name in sorted(pending):
+        rows = [row for row in pending[table_name].values() if row not in db.deleted]
+        if not rows:
+            continue
+        last = bump_change_counter(db, table_name, now, len(rows))
+        for seq, row in enumerate(rows, start=last - len(rows) + 1):
+            row.change_seq = seq
+    db.flush()
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_change_seqs(db: Session, previous_transaction):
+    db.info.pop(PENDING_CHANGES, None)
+
+def set_geohash(record):
+    """Refresh a record's geohash from its latitude/longitude"""
+    record.geohash = geo.encode(record.latitude, record.longitude)
+
+def get_change_counters(db: Session, *table_names: str):
+    """Get (version, updated_at) for each named table, in the order given"""
+    rows = {
+        row.table_name: (row.version, row.updated_at)
+        for row in db.query(ChangeCounter).filter(ChangeCounter.table_name.in_(table_names))
+    }
+    return [rows.get(name, (0, None)) for name in table_names]
+
+# Record cache
+# Lookups by id (and by natural key for DPR/MPR) are answered from the
+# record cache; every write path invalidates after it commits
+NATURAL_KEY_TABLES = {"dpr", "mpr"}
+
+def natural_key(table_name: str, record):
+    """(centre_code, return_no, period) of a DPR/MPR; None for other tables"""
+    if table_name not in NATURAL_KEY_TABLES:
+        return None
+    return (record.centre_code, record.return_no, record.period)
+
+def _snapshot(record) -> dict:
+    return {attr.key: getattr(record, attr.key) for attr in inspect(record).mapper.column_attrs}
+
+def _attach(db: Session, model, values: dict):
+    # A cached snapshot becomes a persistent instance without a query; an
+    # instance the session already holds wins
+    record = model(**values)
+    make_transient_to_detached(record)
+    existing = db.identity_map.get(inspect(record).key)
+    if existing is not None:
+        return existing
+    db.add(record)
+    return record
+
+def get_cached_record(db: Session, model, table_name: str, record_id: int):
+    """Get a record by ID through the record cache"""
+    key = record_cache.record_key(partitions.shard_of(db), table_name, record_id)
+    values = record_cache.store.get(key)
+    if values is not None:
+        return _attach(db, model, values)
+    token = record_cache.store.token(key)
+    record = db.query(model).filter(model.id == record_id).first()
+    # Only committed state is cached, never a caller's pending changes
+    if record is not None and record not in db.new and not db.is_modified(record):
+        record_cache.store.put(key, _snapshot(record), token)
+    return record
+
+def get_record_by_natural_key(db: Session, model, table_name: str, centre_code: str, return_no: str, period: int):
+    """Get the latest record for a centre, return number and period"""
+    key = record_cache.alias_key(partitions.shard_of(db), table_name, (centre_code, return_no, period))
+    record_id = record_cache.store.get(key)
+    if record_id is None:
+        token = record_cache.store.token(key)
+        row = db.query(model.id).filter(
+            model.centre_code == centre_code,
+            model.return_no == return_no,
+            model.period == period
+        ).order_by(model.id.desc()).first()
+        if row is None:
+            return None
+        record_id = row.id
+        record_cache.store.put(key, record_id, token)
+    return get_cached_record(db, model, table_name, record_id)
+
+def invalidate_cached(db: Session, table_name: str, record_id: int = None, *natural_keys):
+    """Drop a record and its natural keys from the cache, after the write commits"""
+    shard = partitions.shard_of(db)
+    if record_id is not None:
+        record_cache.invalidate(shard, table_name, record_id)
+    for key in set(natural_keys) - {None}:
+        record_cache.invalidate(shard, table_name, natural_key=key)
+
+def invalidate_cached_table(db: Session, table_name: str):
+    """Drop a whole table of the session's shard from the cache"""
+    record_cache.invalidate_table(partitions.shard_of(db), table_name)
+
+# Downstream consumer watermarks
+# Consumer whose progress backs the "unsynced" views and statistics
+DEFAULT_CONSUMER = "central_tc"
+
+def get_committed_seq(db: Session, consumer: str, table_name: str) -> int:
+    """Get the change sequence up to which a consumer has processed a table"""
+    cursor = db.query(SyncCursor).filter(
+        SyncCursor.consumer == consumer,
+        SyncCursor.table_name == table_name
+    ).first()
+    return cursor.committed_seq if cursor else 0
+
 # DPR CRUD operations
+def _add_dpr(db: Session, dpr_data: DPRCreate) -> DPR:
+    """Write a new DPR in the caller's transaction; ValueError for a detached period"""
+    # Convert household members to JSON
+    household_members_json = json.dumps([member.dict() for member in dpr_data.household_members])
+
+    db_dpr = DPR(
+        name_and_address=dpr_data.name_and_address,
+        district=dpr_data.district,
+        state=dpr_data.state,
+        family_size=dpr_data.family_size,
+        income_group=dpr_data.income_group,
+        centre_code=dpr_data.centre_code,
+        return_no=dpr_data.return_no,
+        month_and_year=dpr_data.month_and_year,
+        household_members=household_members_json,
+        latitude=dpr_data.latitude,
+        longitude=dpr_data.longitude,
+        otp_code=dpr_data.otp_code,
+        created_at=datetime.now(),
+        version=1
+    )
+    set_geohash(db_dpr)
+    # Raises before anything of the record is written
+    partitions.prepare_write(db, "dpr", db_dpr)
+    mark_changed(db, "dpr", db_dpr)
+    db.add(db_dpr)
+    db.flush()
+    consistency.index_dpr(db, db_dpr)
+    return db_dpr
+
 def create_dpr(db: Session, dpr_data: DPRCreate) -> DPR:
     """Create a new DPR record in the database"""
     try:
-        # Convert household members to JSON
-        household_members_json = json.dumps([member.dict() for member in dpr_data.household_members])
-        
-        db_dpr = DPR(
-            name_and_address=dpr_data.name_and_address,
-            district=dpr_data.district,
-            state=dpr_data.state,
-            family_size=dpr_data.family_size,
-            income_group=dpr_data.income_group,
-            centre_code=dpr_data.centre_code,
-            return_no=dpr_data.return_no,
-            month_and_year=dpr_data.month_and_year,
-            household_members=household_members_json,
-            latitude=dpr_data.latitude,
-            longitude=dpr_data.longitude,
-            otp_code=dpr_data.otp_code,
-            created_at=datetime.now(),
-            is_synced=False
-        )
-        db.add(db_dpr)
+        db_dpr = _add_dpr(db, dpr_data)
         db.commit()
-        db.refresh(db_dpr)
+        # An older record may be cached under the same natural key
+        invalidate_cached(db, "dpr", None, natural_key("dpr", db_dpr))
+        events.publish_write(db, "dpr", "created", db_dpr)
         
         logger.info(f"DPR record created successfully - ID: {db_dpr.id}, Return No: {dpr_data.return_no}")
         return db_dpr
@@ -45,31 +224,41 @@ def create_dpr(db: Session, dpr_data: DPRCreate) -> DPR:
 
 def get_dpr_by_id(db: Session, dpr_id: int) -> DPR:
     """Get a DPR record by ID"""
-    return db.query(DPR).filter(DPR.id == dpr_id).first()
+    return get_cached_record(db, DPR, "dpr", dpr_id)
 
-def get_all_dpr(db: Session, skip: int = 0, limit: int = 100):
-    """Get all DPR records with pagination"""
-    return db.query(DPR).offset(skip).limit(limit).all()
+def get_dpr_by_return(db: Session, centre_code: str, return_no: str, period: int) -> DPR:
+    """Get the latest DPR for a centre, return number and period"""
+    return get_record_by_natural_key(db, DPR, "dpr", centre_code, return_no, period)
 
-def get_unsynced_dpr(db: Session):
-    """Get all unsynced DPR records"""
-    return db.query(DPR).filter(DPR.is_synced == False).all()
+def get_all_dpr(db: Session, skip: int = 0, limit: int = 100, period: int = None):
+    """Get all DPR records with pagination, optionally for one period"""
+    if period is not None and archive.is_archived(db, "dpr", period):
+        return archive.read_records(db, "dpr", period, skip=skip, limit=limit)
+    query = db.query(DPR)
+    if period is not None:
+        # Pruned to one partition on PostgreSQL
+        query = query.filter(DPR.period == period)
+    return query.order_by(DPR.id).offset(skip).limit(limit).all()
 
-def update_dpr_sync_status(db: Session, dpr_id: int, synced: bool = True):
-    """Update the sync status of a DPR record"""
-    dpr = get_dpr_by_id(db, dpr_id)
-    if dpr:
-        dpr.is_synced = synced
-        db.commit()
-        logger.info(f"DPR sync status updated - ID: {dpr_id}, Synced: {synced}")
-    return dpr
+def get_unsynced_dpr(db: Session, consumer: str = DEFAULT_CONSUMER):
+    """Get all DPR records a downstream consumer has not processed yet"""
+    committed_seq = get_committed_seq(db, consumer, "dpr")
+    return db.query(DPR).filter(DPR.change_seq > committed_seq).all()
+
+def update_dpr(db: Session, dpr_id: int, dpr_data: dict, expected_version: int = None) -> DPR:
+    """Update an existing DPR record in the database.
 
-def update_dpr(db: Session, dpr_id: int, dpr_data: dict) -> DPR:
-    """Update an existing DPR record in the database"""
+    With ``expected_version``, the update is refused (VersionConflict)
+    unless the record is still at that version.
+    """
     try:
         dpr = get_dpr_by_id(db, dpr_id)
         if not dpr:
             raise ValueError(f"DPR record with ID {dpr_id} not found")
+        if expected_version is not None and dpr.version != expected_version:
+            raise VersionConflict(f"DPR record {dpr_id} is at version {dpr.version}, not {expected_version}")
+        old_key = natural_key("dpr", dpr)
+        before = dpr_to_dict(dpr)
         
         # Convert household members to JSON if provided. When data comes
         # from the API layer it's already been converted to a plain dict
@@ -91,46 +280,75 @@ def update_dpr(db: Session, dpr_id: int, dpr_data: dict) -> DPR:
             if hasattr(dpr, field):
                 setattr(dpr, field, value)
         
-        # Mark as unsynced when updated
-        dpr.is_synced = False
+        set_geohash(dpr)
+        partitions.prepare_write(db, "dpr", dpr)
+
+        # Re-queue the record for downstream consumers
+        mark_changed(db, "dpr", dpr)
+        dpr.version = dpr.version + 1
+        db.flush()
+        consistency.index_dpr(db, dpr)
+        history.record_update(db, "dpr", before, dpr_to_dict(dpr))
         
         db.commit()
-        db.refresh(dpr)
+        invalidate_cached(db, "dpr", dpr_id, old_key, natural_key("dpr", dpr))
+        events.publish_write(db, "dpr", "updated", dpr)
         
         logger.info(f"DPR record updated successfully - ID: {dpr_id}, Return No: {dpr_data.get('return_no', 'N/A')}")
         return dpr
+    except StaleDataError:
+        # Another writer got there first; our copy (perhaps cached) is stale
+        db.rollback()
+        invalidate_cached(db, "dpr", dpr_id)
+        raise VersionConflict(f"DPR record {dpr_id} was changed by another update")
     except Exception as e:
         db.rollback()
         logger.error(f"Error updating DPR record: {str(e)}")
         raise
 
 # MPR CRUD operations
+def _add_mpr(db: Session, mpr_data: MPRCreate) -> MPR:
+    """Write a new MPR in the caller's transaction; ValueError for a detached period"""
+    # Purchase items are already validated into plain dicts, so the
+    # list can be serialized in one pass by the item list adapter
+    items_json = PurchaseItemList.dump_json(mpr_data.items).decode()
+
+    db_mpr = MPR(
+        name_and_address=mpr_data.name_and_address,
+        district_state_tel=mpr_data.district_state_tel,
+        panel_centre=mpr_data.panel_centre,
+        centre_code=mpr_data.centre_code,
+        return_no=mpr_data.return_no,
+        family_size=mpr_data.family_size,
+        income_group=mpr_data.income_group,
+        month_and_year=mpr_data.month_and_year,
+        occupation_of_head=mpr_data.occupation_of_head,
+        items=items_json,
+        item_count=len(mpr_data.items),
+        latitude=mpr_data.latitude,
+        longitude=mpr_data.longitude,
+        otp_code=mpr_data.otp_code,
+        created_at=datetime.now(),
+        version=1
+    )
+    set_geohash(db_mpr)
+    # Raises before anything of the record is written
+    partitions.prepare_write(db, "mpr", db_mpr)
+    mark_changed(db, "mpr", db_mpr)
+    db.add(db_mpr)
+    db.flush()
+    consistency.check_mpr(db, db_mpr)
+    similarity.index_mpr(db, db_mpr)
+    return db_mpr
+
 def create_mpr(db: Session, mpr_data: MPRCreate) -> MPR:
     """Create a new MPR record in the database"""
     try:
-        # Convert purchase items to JSON
-        items_json = json.dumps([item.dict() for item in mpr_data.items])
-        
-        db_mpr = MPR(
-            name_and_address=mpr_data.name_and_address,
-            district_state_tel=mpr_data.district_state_tel,
-            panel_centre=mpr_data.panel_centre,
-            centre_code=mpr_data.centre_code,
-            return_no=mpr_data.return_no,
-            family_size=mpr_data.family_size,
-            income_group=mpr_data.income_group,
-            month_and_year=mpr_data.month_and_year,
-            occupation_of_head=mpr_data.occupation_of_head,
-            items=items_json,
-            latitude=mpr_data.latitude,
-            longitude=mpr_data.longitude,
-            otp_code=mpr_data.otp_code,
-            created_at=datetime.now(),
-            is_synced=False
-        )
-        db.add(db_mpr)
+        db_mpr = _add_mpr(db, mpr_data)
         db.commit()
-        db.refresh(db_mpr)
+        # An older record may be cached under the same natural key
+        invalidate_cached(db, "mpr", None, natural_key("mpr", db_mpr))
+        events.publish_write(db, "mpr", "created", db_mpr)
         
         logger.info(f"MPR record created successfully - ID: {db_mpr.id}, Return No: {mpr_data.return_no}")
         return db_mpr
@@ -141,62 +359,139 @@ def create_mpr(db: Session, mpr_data: MPRCreate) -> MPR:
 
 def get_mpr_by_id(db: Session, mpr_id: int) -> MPR:
     """Get an MPR record by ID"""
-    return db.query(MPR).filter(MPR.id == mpr_id).first()
+    return get_cached_record(db, MPR, "mpr", mpr_id)
 
-def get_all_mpr(db: Session, skip: int = 0, limit: int = 100):
-    """Get all MPR records with pagination"""
-    return db.query(MPR).offset(skip).limit(limit).all()
+def get_mpr_by_return(db: Session, centre_code: str, return_no: str, period: int) -> MPR:
+    """Get the latest MPR for a centre, return number and period"""
+    return get_record_by_natural_key(db, MPR, "mpr", centre_code, return_no, period)
 
-def get_unsynced_mpr(db: Session):
-    """Get all unsynced MPR records"""
-    return db.query(MPR).filter(MPR.is_synced == False).all()
+def get_all_mpr(db: Session, skip: int = 0, limit: int = 100, period: int = None):
+    """Get all MPR records with pagination, optionally for one period"""
+    if period is not None and archive.is_archived(db, "mpr", period):
+        return archive.read_records(db, "mpr", period, skip=skip, limit=limit)
+    query = db.query(MPR)
+    if period is not None:
+        # Pruned to one partition on PostgreSQL
+        query = query.filter(MPR.period == period)
+    return query.order_by(MPR.id).offset(skip).limit(limit).all()
 
-def update_mpr_sync_status(db: Session, mpr_id: int, synced: bool = True):
-    """Update the sync status of an MPR record"""
-    mpr = get_mpr_by_id(db, mpr_id)
-    if mpr:
-        mpr.is_synced = synced
-        db.commit()
-        logger.info(f"MPR sync status updated - ID: {mpr_id}, Synced: {synced}")
-    return mpr
+def get_unsynced_mpr(db: Session, consumer: str = DEFAULT_CONSUMER):
+    """Get all MPR records a downstream consumer has not processed yet"""
+    committed_seq = get_committed_seq(db, consumer, "mpr")
+    return db.query(MPR).filter(MPR.change_seq > committed_seq).all()
+
+def update_mpr(db: Session, mpr_id: int, mpr_data: dict, expected_version: int = None) -> MPR:
+    """Update an existing MPR record in the database.
 
-def update_mpr(db: Session, mpr_id: int, mpr_data: dict) -> MPR:
-    """Update an existing MPR record in the database"""
+    With ``expected_version``, the update is refused (VersionConflict)
+    unless the record is still at that version.
+    """
     try:
         mpr = get_mpr_by_id(db, mpr_id)
         if not mpr:
             raise ValueError(f"MPR record with ID {mpr_id} not found")
+        if expected_version is not None and mpr.version != expected_version:
+            raise VersionConflict(f"MPR record {mpr_id} is at version {mpr.version}, not {expected_version}")
+        old_key = natural_key("mpr", mpr)
+        before = mpr_to_dict(mpr)
         
-        # Convert purchase items to JSON if provided. Similar to the DPR
-        # update above, ``mpr_data['items']`` may contain plain
-        # dictionaries if it originated from a Pydantic model that was
-        # converted using ``.dict()``.  Support both dicts and models to
-        # avoid ``AttributeError`` during updates.
+        # Convert purchase items to JSON if provided, with the same item
+        # list adapter as create. ``mpr_data['items']`` may still hold
+        # PurchaseItem models from callers that build them explicitly.
         if 'items' in mpr_data:
-            items_json = json.dumps([
-                item if isinstance(item, dict) else item.dict()
-                for item in mpr_data['items']
-            ])
-            mpr_data['items'] = items_json
+            items = [item.model_dump() if hasattr(item, "model_dump") else item for item in mpr_data['items']]
+            mpr_data['items'] = PurchaseItemList.dump_json(items).decode()
+            mpr_data['item_count'] = len(items)
         
         # Update all fields
         for field, value in mpr_data.items():
             if hasattr(mpr, field):
                 setattr(mpr, field, value)
         
-        # Mark as unsynced when updated
-        mpr.is_synced = False
+        set_geohash(mpr)
+        partitions.prepare_write(db, "mpr", mpr)
+
+        # Re-queue the record for downstream consumers
+        mark_changed(db, "mpr", mpr)
+        mpr.version = mpr.version + 1
+        consistency.check_mpr(db, mpr)
+        similarity.index_mpr(db, mpr)
+        history.record_update(db, "mpr", before, mpr_to_dict(mpr))
         
         db.commit()
-        db.refresh(mpr)
+        invalidate_cached(db, "mpr", mpr_id, old_key, natural_key("mpr", mpr))
+        events.publish_write(db, "mpr", "updated", mpr)
         
         logger.info(f"MPR record updated successfully - ID: {mpr_id}, Return No: {mpr_data.get('return_no', 'N/A')}")
         return mpr
+    except StaleDataError:
+        # Another writer got there first; our copy (perhaps cached) is stale
+        db.rollback()
+        invalidate_cached(db, "mpr", mpr_id)
+        raise VersionConflict(f"MPR record {mpr_id} was changed by another update")
     except Exception as e:
         db.rollback()
         logger.error(f"Error updating MPR record: {str(e)}")
         raise
 
+# Partial updates (PATCH)
+def dpr_document(dpr: DPR) -> dict:
+    """The editable fields of a DPR, as the document a PATCH applies to"""
+    document = {field: getattr(dpr, field) for field in DPRUpdate.model_fields}
+    document["household_members"] = json.loads(dpr.household_members) if dpr.household_members else []
+    return document
+
+def mpr_document(mpr: MPR) -> dict:
+    """The editable fields of an MPR, as the document a PATCH applies to"""
+    document = {field: getattr(mpr, field) for field in MPRUpdate.model_fields}
+    document["items"] = json.loads(mpr.items) if mpr.items else []
+    return document
+
+def patch_changes(document: dict, update_model, patch, media_type: str) -> dict:
+    """Apply a patch to a record document and return the changed fields only.
+
+    The patched document is validated as a whole, so a patch cannot leave
+    a record that a full update would have rejected. Raises
+    patching.PatchError for a patch that does not apply and pydantic's
+    ValidationError for an invalid result.
+    """
+    patched = patching.apply_patch(document, patch, media_type)
+    changed = patching.changed_fields(document, patched)
+    if not changed:
+        return {}
+    validated = update_model.model_validate(patched).model_dump()
+    return {field: validated[field] for field in changed if field in validated}
+
+# Bulk DPR/MPR loading (see bulk_import.py)
+BULK_WRITERS = {"dpr": _add_dpr, "mpr": _add_mpr}
+
+def bulk_create(db: Session, table_name: str, records: List) -> List[Tuple[Optional[object], Optional[str]]]:
+    """Create many DPRs or MPRs in one transaction.
+
+    Every record goes through the same write path as a single create.
+    Returns (record, None) or (None, reason) for each input, in order: a
+    record for a detached period is left out and the rest still go in.
+    """
+    add = BULK_WRITERS[table_name]
+    results = []
+    try:
+        for data in records:
+            try:
+                results.append((add(db, data), None))
+            except ValueError as e:
+                results.append((None, str(e)))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error bulk creating {table_name.upper()} records: {str(e)}")
+        raise
+    created = [record for record, _ in results if record is not None]
+    for record in created:
+        invalidate_cached(db, table_name, None, natural_key(table_name, record))
+        events.publish_write(db, table_name, "created", record)
+    logger.info(f"Bulk created {len(created)} of {len(results)} {table_name.upper()} record(s)")
+    return results
+
 # FP CRUD operations
 def create_fp(db: Session, fp_data: FPCreate) -> FP:
     """Create a new FP record in the database"""
@@ -210,14 +505,17 @@ def create_fp(db: Session, fp_data: FPCreate) -> FP:
             with_purchase_data=fp_data.with_purchase_data,
             nil_mprs=fp_data.nil_mprs,
             nil_serial_nos=fp_data.nil_serial_nos,
+            month_and_year=fp_data.month_and_year,
+            period=parse_period(fp_data.month_and_year) if fp_data.month_and_year else None,
             latitude=fp_data.latitude,
             longitude=fp_data.longitude,
-            created_at=datetime.now(),
-            is_synced=False
+            created_at=datetime.now()
         )
+        set_geohash(db_fp)
+        mark_changed(db, "fp", db_fp)
         db.add(db_fp)
         db.commit()
-        db.refresh(db_fp)
+        events.publish_write(db, "fp", "created", db_fp)
         
         logger.info(f"FP record created successfully - ID: {db_fp.id}, Centre: {fp_data.centre_name}")
         return db_fp
@@ -226,26 +524,244 @@ def create_fp(db: Session, fp_data: FPCreate) -> FP:
         logger.error(f"Error creating FP record: {str(e)}")
         raise
 
+def reconcile_fp(db: Session, fp: FP):
+    """Check an FP's counts against the MPRs on file and flag differences.
+
+    Differences are flagged for review, never refused: the FP is already
+    stored when this runs.
+    """
+    try:
+        result = reconciliation.reconcile_fp(db, fp)
+        db.commit()
+        return result
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error reconciling FP record {fp.id}: {str(e)}")
+        raise
+
 def get_fp_by_id(db: Session, fp_id: int) -> FP:
     """Get an FP record by ID"""
-    return db.query(FP).filter(FP.id == fp_id).first()
+    return get_cached_record(db, FP, "fp", fp_id)
 
 def get_all_fp(db: Session, skip: int = 0, limit: int = 100):
     """Get all FP records with pagination"""
-    return db.query(FP).offset(skip).limit(limit).all()
+    return db.query(FP).order_by(FP.id).offset(skip).limit(limit).all()
+
+def get_unsynced_fp(db: Session, consumer: str = DEFAULT_CONSUMER):
+    """Get all FP records a downstream consumer has not processed yet"""
+    committed_seq = get_committed_seq(db, consumer, "fp")
+    return db.query(FP).filter(FP.change_seq > committed_seq).all()
+
+# Delete operations
+def delete_record(db: Session, model, table_name: str, record_id: int, expected_change_seq: int = None) -> bool:
+    """Delete a record and leave a tombstone for delta sync.
 
-def get_unsynced_fp(db: Session):
-    """Get all unsynced FP records"""
-    return db.query(FP).filter(FP.is_synced == False).all()
+    With ``expected_change_seq`` the record is only deleted if it has not
+    been written since (VersionConflict otherwise); its row is locked for
+    the check on PostgreSQL.
+    """
+    try:
+        record = get_cached_record(db, model, table_name, record_id)
+        if not record:
+            return False
+        if expected_change_seq is not None:
+            current = db.query(model.change_seq).filter(model.id == record_id).with_for_update().scalar()
+            if current != expected_change_seq:
+                raise VersionConflict(f"{table_name.upper()} record {record_id} was written after change {expected_change_seq}")
 
-def update_fp_sync_status(db: Session, fp_id: int, synced: bool = True):
-    """Update the sync status of an FP record"""
-    fp = get_fp_by_id(db, fp_id)
-    if fp:
-        fp.is_synced = synced
+        if table_name == "dpr":
+            consistency.unindex_dpr(db, record)
+        elif table_name == "mpr":
+            consistency.clear_mpr(db, record.id)
+            similarity.unindex_mpr(db, record.id)
+        if table_name in history.VERSIONED_TABLES:
+            history.record_deletion(db, table_name, (dpr_to_dict if table_name == "dpr" else mpr_to_dict)(record))
+        db.query(AuditFlag).filter(
+            AuditFlag.record_type == table_name,
+            AuditFlag.record_id == record.id
+        ).delete(synchronize_session=False)
+        key = natural_key(table_name, record)
+        db.delete(record)
+        # Nothing flushes between here and commit, which stamps the change
+        # sequence before the tombstone is written
+        tombstone = Tombstone(
+            table_name=table_name,
+            record_id=record.id,
+            centre_code=record.centre_code,
+            deleted_at=datetime.now()
+        )
+        db.add(tombstone)
+        queue_change(db, table_name, tombstone)
         db.commit()
-        logger.info(f"FP sync status updated - ID: {fp_id}, Synced: {synced}")
-    return fp
+        invalidate_cached(db, table_name, record_id, key)
+        events.publish_write(db, table_name, "deleted", record)
+
+        logger.info(f"{table_name.upper()} record deleted - ID: {record_id}")
+        return True
+    except StaleDataError:
+        db.rollback()
+        invalidate_cached(db, table_name, record_id)
+        raise VersionConflict(f"{table_name.upper()} record {record_id} was changed by another update")
+    except VersionConflict:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error deleting {table_name.upper()} record: {str(e)}")
+        raise
+
+def delete_dpr(db: Session, dpr_id: int) -> bool:
+    """Delete a DPR record"""
+    return delete_record(db, DPR, "dpr", dpr_id)
+
+def delete_mpr(db: Session, mpr_id: int) -> bool:
+    """Delete an MPR record"""
+    return delete_record(db, MPR, "mpr", mpr_id)
+
+def delete_fp(db: Session, fp_id: int) -> bool:
+    """Delete an FP record"""
+    return delete_record(db, FP, "fp", fp_id)
+
+# Delta sync queries
+def get_changed_records(db: Session, model, since_seq: int, upto_seq: int, centre_code: str = None, limit: int = 500):
+    """Get records whose change sequence is in (since_seq, upto_seq], oldest first"""
+    query = db.query(model).filter(model.change_seq > since_seq, model.change_seq <= upto_seq)
+    if centre_code:
+        query = query.filter(model.centre_code == centre_code)
+    return query.order_by(model.change_seq).limit(limit).all()
+
+def get_tombstones(db: Session, table_name: str, since_seq: int, upto_seq: int, centre_code: str = None, limit: int = 500):
+    """Get deletions whose change sequence is in (since_seq, upto_seq], oldest first"""
+    query = db.query(Tombstone).filter(
+        Tombstone.table_name == table_name,
+        Tombstone.change_seq > since_seq,
+        Tombstone.change_seq <= upto_seq
+    )
+    if centre_code:
+        query = query.filter(Tombstone.centre_code == centre_code)
+    return query.order_by(Tombstone.change_seq).limit(limit).all()
+
+# Geographic queries
+def geohash_prefix_filter(model, prefix: str):
+    """Records whose geohash starts with ``prefix``, as a range scan on the geohash index"""
+    upper = geo.prefix_upper_bound(prefix)
+    if upper is None:
+        return model.geohash >= prefix
+    return and_(model.geohash >= prefix, model.geohash < upper)
+
+def find_nearby(db: Session, model, latitude: float, longitude: float, radius_km: float,
+                centre_code: str = None, limit: int = 100, max_candidates: int = None):
+    """Records within a radius of a point, nearest first, and whether candidates were cut off.
+
+    The geohash cells and the circle's bounding box are filtered in SQL,
+    fetching only ids and coordinates; every candidate's distance is then
+    computed in one pass and only the nearest ``limit`` records are loaded.
+    When there are more than ``max_candidates`` candidates the rest are
+    not ranked and the second value is True.
+    """
+    max_candidates = max_candidates or geo.GEO_MAX_CANDIDATES
+    min_lat, max_lat, min_lon, max_lon = geo.bounding_box(latitude, longitude, radius_km)
+    query = db.query(model.id, model.latitude, model.longitude).filter(
+        # Each prefix is a range scan on the geohash index
+        or_(*[geohash_prefix_filter(model, cell) for cell in geo.covering_cells(latitude, longitude, radius_km)]),
+        model.latitude.between(min_lat, max_lat)
+    )
+    if min_lon is not None:
+        query = query.filter(model.longitude.between(min_lon, max_lon))
+    if centre_code:
+        query = query.filter(model.centre_code == centre_code)
+    rows = query.limit(max_candidates + 1).all()
+    truncated = len(rows) > max_candidates
+    if truncated:
+        logger.warning(f"Radius search around ({latitude}, {longitude}) has over {max_candidates} candidates")
+        rows = rows[:max_candidates]
+    if not rows:
+        return [], truncated
+
+    ids = np.array([row[0] for row in rows])
+    distances = geo.haversine_km_array(
+        latitude, longitude, np.array([row[1] for row in rows]), np.array([row[2] for row in rows])
+    )
+    inside = np.flatnonzero(distances <= radius_km)
+    nearest = inside[np.argsort(distances[inside], kind="stable")[:limit]]
+    records = {record.id: record for record in db.query(model).filter(model.id.in_(ids[nearest].tolist()))}
+    return [(float(distances[index]), records[int(ids[index])]) for index in nearest], truncated
+
+def get_grid_counts(db: Session, model, precision: int, centre_code: str = None, prefix: str = None):
+    """Count records per geohash cell of the given precision"""
+    cell = func.substr(model.geohash, 1, precision)
+    query = db.query(cell.label("cell"), func.count().label("count")).filter(model.geohash.isnot(None))
+    if prefix:
+        query = query.filter(geohash_prefix_filter(model, prefix))
+    if centre_code:
+        query = query.filter(model.centre_code == centre_code)
+    return query.group_by(cell).order_by(cell).all()
+
+# Serialization helpers
+def dpr_to_dict(dpr: DPR) -> dict:
+    """Convert a DPR record to the dict returned by the API"""
+    return {
+        "id": dpr.id,
+        "name_and_address": dpr.name_and_address,
+        "district": dpr.district,
+        "state": dpr.state,
+        "family_size": dpr.family_size,
+        "income_group": dpr.income_group,
+        "centre_code": dpr.centre_code,
+        "return_no": dpr.return_no,
+        "month_and_year": dpr.month_and_year,
+        "period": format_period(dpr.period) if dpr.period else None,
+        "household_members": json.loads(dpr.household_members) if dpr.household_members else [],
+        "latitude": dpr.latitude,
+        "longitude": dpr.longitude,
+        "otp_code": dpr.otp_code,
+        "version": dpr.version,
+        "created_at": dpr.created_at.isoformat(),
+        "updated_at": dpr.updated_at.isoformat() if dpr.updated_at else None
+    }
+
+def mpr_to_dict(mpr: MPR) -> dict:
+    """Convert an MPR record to the dict returned by the API"""
+    return {
+        "id": mpr.id,
+        "name_and_address": mpr.name_and_address,
+        "district_state_tel": mpr.district_state_tel,
+        "panel_centre": mpr.panel_centre,
+        "centre_code": mpr.centre_code,
+        "return_no": mpr.return_no,
+        "family_size": mpr.family_size,
+        "income_group": mpr.income_group,
+        "month_and_year": mpr.month_and_year,
+        "period": format_period(mpr.period) if mpr.period else None,
+        "occupation_of_head": mpr.occupation_of_head,
+        "items": json.loads(mpr.items) if mpr.items else [],
+        "latitude": mpr.latitude,
+        "longitude": mpr.longitude,
+        "otp_code": mpr.otp_code,
+        "version": mpr.version,
+        "created_at": mpr.created_at.isoformat(),
+        "updated_at": mpr.updated_at.isoformat() if mpr.updated_at else None
+    }
+
+def fp_to_dict(fp: FP) -> dict:
+    """Convert an FP record to the dict returned by the API"""
+    return {
+        "id": fp.id,
+        "centre_name": fp.centre_name,
+        "centre_code": fp.centre_code,
+        "panel_size": fp.panel_size,
+        "mpr_collected": fp.mpr_collected,
+        "not_collected": fp.not_collected,
+        "with_purchase_data": fp.with_purchase_data,
+        "nil_mprs": fp.nil_mprs,
+        "nil_serial_nos": fp.nil_serial_nos,
+        "month_and_year": fp.month_and_year,
+        "period": format_period(fp.period) if fp.period else None,
+        "latitude": fp.latitude,
+        "longitude": fp.longitude,
+        "created_at": fp.created_at.isoformat(),
+        "updated_at": fp.updated_at.isoformat() if fp.updated_at else None
+    }
 
 # Statistics functions
 def get_database_stats(db: Session):
@@ -253,9 +769,12 @@ def get_database_stats(db: Session):
     total_dpr = db.query(DPR).count()
     total_mpr = db.query(MPR).count()
     total_fp = db.query(FP).count()
-    unsynced_dpr = db.query(DPR).filter(DPR.is_synced == False).count()
-    unsynced_mpr = db.query(MPR).filter(MPR.is_synced == False).count()
-    unsynced_fp = db.query(FP).filter(FP.is_synced == False).count()
+    # Records above the central consumer's committed watermark; answered
+    # from the change_seq index rather than a flag scan
+    unsynced_dpr = db.query(DPR).filter(DPR.change_seq > get_committed_seq(db, DEFAULT_CONSUMER, "dpr")).count()
+    unsynced_mpr = db.query(MPR).filter(MPR.change_seq > get_committed_seq(db, DEFAULT_CONSUMER, "mpr")).count()
+    unsynced_fp = db.query(FP).filter(FP.change_seq > get_committed_seq(db, DEFAULT_CONSUMER, "fp")).count()
+    archived = archive.archived_counts(db)
     
     return {
         "total_dpr": total_dpr,
@@ -263,5 +782,8 @@ def get_database_stats(db: Session):
         "total_fp": total_fp,
         "unsynced_dpr": unsynced_dpr,
         "unsynced_mpr": unsynced_mpr,
-        "unsynced_fp": unsynced_fp
+        "unsynced_fp": unsynced_fp,
+        # Rows moved to cold storage are not in the totals above
+        "archived_dpr": archived.get("dpr", 0),
+        "archived_mpr": archived.get("mpr", 0)
     } 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, JSON
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, DateTime, Boolean, Text, JSON, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -10,18 +10,28 @@ load_dotenv('config.env')
 # Database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./mtc_nanna.db")
 
+# PostgreSQL gets declaratively partitioned DPR/MPR tables (see partitions.py)
+IS_POSTGRES = DATABASE_URL.startswith("postgresql")
+
 # Create SQLAlchemy engine
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 )
 
-# Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create SessionLocal class. Sessions live for one request and DPR/MPR/FP
+# have no server-side defaults, so objects keep their values after commit
+# instead of being reloaded with a second SELECT.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Create Base class
 Base = declarative_base()
 
+# Geohash prefix scans are range comparisons (see geo.prefix_upper_bound);
+# on PostgreSQL the column compares bytewise, whatever the database's
+# locale, so the index serves them
+GEOHASH = String().with_variant(String(collation="C"), "postgresql")
+
 # Database dependency
 def get_db():
     db = SessionLocal()
@@ -34,7 +44,7 @@ def get_db():
 class DPR(Base):
     __tablename__ = "dpr"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name_and_address = Column(String)
     district = Column(String)
     state = Column(String)
@@ -43,17 +53,34 @@ class DPR(Base):
     centre_code = Column(String)
     return_no = Column(String)
     month_and_year = Column(String)
+    # month_and_year as YYYYMM; the partition key on PostgreSQL, where it
+    # must also be part of the primary key
+    period = Column(Integer, primary_key=IS_POSTGRES, nullable=not IS_POSTGRES)
     household_members = Column(JSON)  # Store as JSON array
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(GEOHASH, index=True)  # Geohash of latitude/longitude, see geo.py
     otp_code = Column(String)
     created_at = Column(DateTime)
-    is_synced = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
+    change_seq = Column(Integer, index=True)  # Value of the table's change counter at the last write
+    version = Column(Integer)  # Record version, bumped by every update (see history.py)
+
+    # Updates carry "WHERE version = <version read>", so concurrent edits
+    # fail instead of overwriting each other; crud sets the new value
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+
+    __table_args__ = (
+        Index("ix_dpr_centre_change_seq", "centre_code", "change_seq"),
+        Index("ix_dpr_period_centre", "period", "centre_code"),
+        # AUTOINCREMENT stops SQLite reusing the ids of detached periods
+        {"postgresql_partition_by": "RANGE (period)", "sqlite_autoincrement": True},
+    )
 
 class MPR(Base):
     __tablename__ = "mpr"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name_and_address = Column(String)
     district_state_tel = Column(String)
     panel_centre = Column(String)
@@ -62,13 +89,34 @@ class MPR(Base):
     family_size = Column(Integer)
     income_group = Column(String)
     month_and_year = Column(String)
+    # month_and_year as YYYYMM; the partition key on PostgreSQL, where it
+    # must also be part of the primary key
+    period = Column(Integer, primary_key=IS_POSTGRES, nullable=not IS_POSTGRES)
     occupation_of_head = Column(String)
     items = Column(JSON)  # Store as JSON array of PurchaseItem objects
+    item_count = Column(Integer)  # Number of purchase items, for FP reconciliation (see reconciliation.py)
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(GEOHASH, index=True)  # Geohash of latitude/longitude, see geo.py
     otp_code = Column(String)
     created_at = Column(DateTime)
-    is_synced = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
+    change_seq = Column(Integer, index=True)  # Value of the table's change counter at the last write
+    version = Column(Integer)  # Record version, bumped by every update (see history.py)
+
+    # Updates carry "WHERE version = <version read>", so concurrent edits
+    # fail instead of overwriting each other; crud sets the new value
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+
+    __table_args__ = (
+        Index("ix_mpr_centre_change_seq", "centre_code", "change_seq"),
+        Index("ix_mpr_period_centre", "period", "centre_code"),
+        Index("ix_mpr_centre_return_no", "centre_code", "return_no"),
+        # Covers the per-return item counts behind the FP counts
+        Index("ix_mpr_centre_period_return_items", "centre_code", "period", "return_no", "item_count"),
+        # AUTOINCREMENT stops SQLite reusing the ids of detached periods
+        {"postgresql_partition_by": "RANGE (period)", "sqlite_autoincrement": True},
+    )
 
 class FP(Base):
     __tablename__ = "fp"
@@ -82,11 +130,268 @@ class FP(Base):
     with_purchase_data = Column(Integer)
     nil_mprs = Column(Integer)
     nil_serial_nos = Column(Integer)
+    month_and_year = Column(String)  # Reporting month of the counts, optional
+    period = Column(Integer)  # month_and_year as YYYYMM
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(GEOHASH, index=True)  # Geohash of latitude/longitude, see geo.py
     created_at = Column(DateTime)
-    is_synced = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
+    change_seq = Column(Integer, index=True)  # Value of the table's change counter at the last write
+
+    __table_args__ = (
+        Index("ix_fp_centre_change_seq", "centre_code", "change_seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+
+    # Deleted records, kept so delta sync can tell devices what to drop
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    centre_code = Column(String)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_tombstones_table_change_seq", "table_name", "change_seq"),
+    )
+
+class DPRHead(Base):
+    __tablename__ = "dpr_heads"
+
+    # Head-of-household attributes of the latest DPR per return, used to
+    # check the MPRs filed against it (see consistency.py)
+    centre_code = Column(String, primary_key=True)
+    return_no = Column(String, primary_key=True)
+    dpr_id = Column(Integer, nullable=False, index=True)
+    family_size = Column(Integer)
+    income_group = Column(String)
+    occupation_of_head = Column(String)
+    updated_at = Column(DateTime)
+
+class ConsistencyMismatch(Base):
+    __tablename__ = "consistency_mismatches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    mpr_id = Column(Integer, nullable=False)
+    dpr_id = Column(Integer, nullable=False)
+    centre_code = Column(String)
+    return_no = Column(String)
+    field = Column(String, nullable=False)
+    mpr_value = Column(String)
+    dpr_value = Column(String)
+    detected_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_consistency_mismatches_mpr", "mpr_id", "field", unique=True),
+        Index("ix_consistency_mismatches_centre_field", "centre_code", "field"),
+    )
+
+class MPRSignature(Base):
+    __tablename__ = "mpr_signatures"
+
+    # MinHash signature of each MPR's household fields and items, for
+    # near-duplicate detection (see similarity.py)
+    mpr_id = Column(Integer, primary_key=True)
+    centre_code = Column(String)
+    period = Column(Integer)
+    signature = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime)
+
+class MPRBucket(Base):
+    __tablename__ = "mpr_lsh_buckets"
+
+    # LSH band buckets of the signatures; MPRs sharing a bucket are
+    # near-duplicate candidates. The primary key indexes bucket lookups.
+    bucket = Column(BigInteger, primary_key=True, autoincrement=False)
+    mpr_id = Column(Integer, primary_key=True, autoincrement=False)
+
+    __table_args__ = (
+        Index("ix_mpr_lsh_buckets_mpr", "mpr_id"),
+    )
+
+class PeriodPartition(Base):
+    __tablename__ = "period_partitions"
+
+    # Periods detached from the live DPR/MPR tables
+    table_name = Column(String, primary_key=True)
+    period = Column(Integer, primary_key=True)
+    location = Column(String, nullable=False)
+    row_count = Column(Integer)
+    detached_at = Column(DateTime)
+
+class ShardAssignment(Base):
+    __tablename__ = "shard_assignments"
+
+    # Which shard holds a centre's (or a whole state's) records; kept on
+    # the primary shard (see shards.py)
+    key_type = Column(String, primary_key=True)  # "centre" or "state"
+    key = Column(String, primary_key=True)
+    shard = Column(String, nullable=False)
+    moving_from = Column(String)  # Source shard of a centre move that has not finished
+    updated_at = Column(DateTime)
+
+class Centre(Base):
+    __tablename__ = "centres"
+
+    # Reference coordinates of each panel centre, used by audit screening
+    centre_code = Column(String, primary_key=True)
+    centre_name = Column(String)
+    state = Column(String)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    updated_at = Column(DateTime)
+
+class AuditFlag(Base):
+    __tablename__ = "audit_flags"
+
+    id = Column(Integer, primary_key=True, index=True)
+    record_type = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    centre_code = Column(String)
+    flag_type = Column(String, nullable=False)
+    distance_km = Column(Float)
+    detail = Column(String)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_audit_flags_record", "record_type", "record_id", "flag_type", unique=True),
+        Index("ix_audit_flags_type_centre", "flag_type", "centre_code", "created_at"),
+    )
+
+class RecordHistory(Base):
+    __tablename__ = "record_history"
+
+    # Earlier versions of DPR/MPR records. Each row holds a compressed JSON
+    # Patch that turns version + 1 back into version; a deleted record's
+    # last version is kept whole (snapshot) as the base to rebuild from
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, nullable=False)
+    record_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    valid_from = Column(DateTime)
+    valid_to = Column(DateTime)
+    changed = Column(String)  # Fields changed by the next version, comma separated
+    snapshot = Column(Boolean, nullable=False, default=False)
+    delta = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ix_record_history_record_version", "table_name", "record_id", "version", unique=True),
+    )
+
+class SyncCursor(Base):
+    __tablename__ = "sync_cursors"
+
+    # Per downstream consumer and table: change sequences up to planned_seq
+    # have been cut into ledger ranges, and everything up to committed_seq
+    # has been processed
+    consumer = Column(String, primary_key=True)
+    table_name = Column(String, primary_key=True)
+    planned_seq = Column(Integer, nullable=False, default=0)
+    committed_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+class SyncLedgerRange(Base):
+    __tablename__ = "sync_ledger"
+
+    # A batch of work for one consumer: changes with start_seq < change_seq <= end_seq
+    id = Column(Integer, primary_key=True, index=True)
+    consumer = Column(String, nullable=False)
+    table_name = Column(String, nullable=False)
+    start_seq = Column(Integer, nullable=False)
+    end_seq = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / claimed / done
+    claimed_by = Column(String)
+    claimed_at = Column(DateTime)
+    completed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_sync_ledger_consumer_status", "consumer", "table_name", "status", "start_seq"),
+    )
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counters"
+
+    # Bumped in the same transaction as every write to the named table, so
+    # clients can revalidate cached lists with a single primary key lookup
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    # Migrations applied to this database (see migrations/)
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime)
+
+class MaintenanceJob(Base):
+    __tablename__ = "maintenance_jobs"
+
+    # One row per scheduled job (see scheduler.py), on the primary shard:
+    # the worker holding its lease and its last run, so each job runs once
+    # per interval across all workers
+    name = Column(String, primary_key=True)
+    holder = Column(String)
+    lease_until = Column(DateTime)
+    last_started_at = Column(DateTime)
+    last_finished_at = Column(DateTime)
+    last_duration = Column(Float)
+    last_status = Column(String)
+    last_error = Column(Text)
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    # A bulk import of a DPR/MPR spreadsheet (see bulk_import.py), on the
+    # primary shard. Source rows up to committed_row have been loaded, so a
+    # rerun of the same file carries on after it
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, nullable=False)
+    filename = Column(String)
+    path = Column(String)
+    sha256 = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="pending")  # pending / running / completed / failed
+    committed_row = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+class ImportRowError(Base):
+    __tablename__ = "import_errors"
+
+    # One problem with one source row of an import: a validation error, a
+    # return already on file (skipped) or an unknown column (warning)
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, nullable=False)
+    row = Column(Integer, nullable=False)
+    field = Column(String)
+    kind = Column(String, nullable=False)  # error / skipped / warning
+    message = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index("ix_import_errors_job_row", "job_id", "row"),
+    )
+
+class SchemaLock(Base):
+    __tablename__ = "schema_lock"
+
+    # Held by the process running migrations on SQLite; PostgreSQL uses an
+    # advisory lock instead
+    id = Column(Integer, primary_key=True)
+    holder = Column(String)
+    acquired_at = Column(DateTime)
 
-# Create tables
+# Create tables directly from the models, for tests and throwaway databases;
+# deployed databases are kept current by migrations (python migrate.py)
 def create_tables():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
@@ -0,0 +1,88 @@
+from sqlalchemy.orm import Session
+from typing import Dict, Optional
+from database import DPR, MPR, FP
+from crud import get_change_counters, get_changed_records, get_tombstones, dpr_to_dict, mpr_to_dict, fp_to_dict
+
+# Tables included in a sync token, in token order
+SYNC_TABLES = (
+    ("dpr", DPR, dpr_to_dict),
+    ("mpr", MPR, mpr_to_dict),
+    ("fp", FP, fp_to_dict),
+)
+
+TOKEN_PREFIX = "v1"
+
+
+def encode_token(watermarks: Dict[str, int]) -> str:
+    """Encode per-table watermarks as an opaque sync token, e.g. ``v1.12.40.3``"""
+    return ".".join([TOKEN_PREFIX] + [str(watermarks[name]) for name, _, _ in SYNC_TABLES])
+
+
+def decode_token(token: Optional[str]) -> Dict[str, int]:
+    """Decode a sync token; an empty token means "from the beginning"."""
+    if not token:
+        return {name: 0 for name, _, _ in SYNC_TABLES}
+
+    parts = token.split(".")
+    if len(parts) != len(SYNC_TABLES) + 1 or parts[0] != TOKEN_PREFIX:
+        raise ValueError(f"Invalid sync token: {token}")
+    try:
+        values = [int(part) for part in parts[1:]]
+    except ValueError:
+        raise ValueError(f"Invalid sync token: {token}")
+    if any(value < 0 for value in values):
+        raise ValueError(f"Invalid sync token: {token}")
+    return {name: value for (name, _, _), value in zip(SYNC_TABLES, values)}
+
+
+def collect_changes(db: Session, since: Optional[str], centre_code: Optional[str] = None, limit: int = 500) -> dict:
+    """Collect upserts and deletions since a sync token.
+
+    Each table returns at most ``limit`` changes. If a table is cut short, its
+    watermark in the new token stops at the last change returned and
+    ``has_more`` is set, so the client calls again with the new token.
+    """
+    watermarks = decode_token(since)
+    current = dict(zip(
+        [name for name, _, _ in SYNC_TABLES],
+        [version for version, _ in get_change_counters(db, *[name for name, _, _ in SYNC_TABLES])]
+    ))
+
+    changes = {}
+    new_watermarks = {}
+    has_more = False
+    for name, model, to_dict in SYNC_TABLES:
+        since_seq = watermarks[name]
+        upto_seq = current[name]
+        if since_seq >= upto_seq:
+            changes[name] = {"upserts": [], "deleted": []}
+            new_watermarks[name] = max(since_seq, upto_seq)
+            continue
+
+        records = get_changed_records(db, model, since_seq, upto_seq, centre_code, limit)
+        tombstones = get_tombstones(db, name, since_seq, upto_seq, centre_code, limit)
+
+        # Merge both streams by sequence number and keep the first ``limit``
+        merged = sorted(
+            [(record.change_seq, record, None) for record in records]
+            + [(tombstone.change_seq, None, tombstone) for tombstone in tombstones],
+            key=lambda change: change[0]
+        )
+        truncated = len(merged) > limit or len(records) == limit or len(tombstones) == limit
+        merged = merged[:limit]
+        if truncated and merged:
+            new_watermarks[name] = merged[-1][0]
+            has_more = has_more or new_watermarks[name] < upto_seq
+        else:
+            new_watermarks[name] = upto_seq
+
+        changes[name] = {
+            "upserts": [to_dict(record) for _, record, _ in merged if record is not None],
+            "deleted": [tombstone.record_id for _, _, tombstone in merged if tombstone is not None],
+        }
+
+    return {
+        "token": encode_token(new_watermarks),
+        "has_more": has_more,
+        "changes": changes,
+    }
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from database import MPR, DPR, DPRHead, Centre
+from cache import LRUCache
+from periods import format_period
+import archive
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Per-capita textile consumption estimates for a period. A period's panel
+# is loaded once into NumPy arrays: one entry per household (its latest
+# MPR of the period, persons from its DPR, income group and state) and one
+# per purchase item (household index, codes, metres and rupees). Every
+# estimate is then a handful of bincounts over those arrays.
+#
+# Households are the sampling units, with equal design weight. Within a
+# domain (a combination of the household dimensions) the per-capita
+# consumption of a category (a combination of the item dimensions) is the
+# ratio R = sum(w * y) / sum(w * x) of purchases y to persons x, and its
+# standard error comes from the linearized variance of a ratio,
+# v(R) = n / (n - 1) * sum((w * (y - R * x)) ** 2) / sum(w * x) ** 2.
+#
+# Results are cached per period and grouping, keyed on the MPR and DPR
+# change counters of every shard, so a cached result is only served while
+# no MPR or DPR has been written since.
+HOUSEHOLD_DIMENSIONS = ("income_group", "state")
+ITEM_DIMENSIONS = {"item": "item_code", "fibre": "fibre_code", "sector": "sector_of_manufacture_code"}
+DIMENSIONS = HOUSEHOLD_DIMENSIONS + tuple(ITEM_DIMENSIONS)
+
+ESTIMATE_CACHE_ENTRIES = int(os.getenv("ESTIMATE_CACHE_ENTRIES", "64"))
+ESTIMATE_CACHE_TTL = float(os.getenv("ESTIMATE_CACHE_TTL", "3600"))
+
+estimate_cache = LRUCache(max_entries=ESTIMATE_CACHE_ENTRIES, ttl=ESTIMATE_CACHE_TTL)
+
+
+@dataclass
+class Panel:
+    """A period's households and purchase items as arrays"""
+    persons: np.ndarray
+    weights: np.ndarray
+    household: Dict[str, np.ndarray]
+    item_household: np.ndarray
+    item: Dict[str, np.ndarray]
+    quantity: np.ndarray
+    value: np.ndarray
+
+    @property
+    def households(self) -> int:
+        return len(self.persons)
+
+    @staticmethod
+    def concat(panels: Sequence["Panel"]) -> "Panel":
+        offsets = np.cumsum([0] + [panel.households for panel in panels[:-1]])
+        return Panel(
+            persons=np.concatenate([panel.persons for panel in panels]),
+            weights=np.concatenate([panel.weights for panel in panels]),
+            household={name: np.concatenate([panel.household[name] for panel in panels])
+                       for name in HOUSEHOLD_DIMENSIONS},
+            item_household=np.concatenate([panel.item_household + offset for panel, offset in zip(panels, offsets)]),
+            item={name: np.concatenate([panel.item[name] for panel in panels]) for name in ITEM_DIMENSIONS},
+            quantity=np.concatenate([panel.quantity for panel in panels]),
+            value=np.concatenate([panel.value for panel in panels])
+        )
+
+
+def _mpr_rows(db: Session, period: int) -> List[tuple]:
+    columns = ["id", "centre_code", "return_no", "family_size", "income_group", "items"]
+    if archive.is_archived(db, "mpr", period):
+        rows = [tuple(row[name] for name in columns) for row in archive.read_period(db, "mpr", period, columns=columns)]
+        return sorted(rows)
+    return db.query(
+        MPR.id, MPR.centre_code, MPR.return_no, MPR.family_size, MPR.income_group, MPR.items
+    ).filter(MPR.period == period).order_by(MPR.id).all()
+
+
+def load_panel(db: Session, period: int) -> Panel:
+    """One shard's panel for a period, live or archived"""
+    # A return's latest MPR of the period stands for its household
+    latest = {}
+    for record_id, centre_code, return_no, family_size, income_group, items in _mpr_rows(db, period):
+        latest[(centre_code, return_no)] = (family_size, income_group, items)
+
+    centre_codes = {centre_code for centre_code, _ in latest}
+    heads = {
+        (centre_code, return_no): (family_size, state)
+        for centre_code, return_no, family_size, state in db.query(
+            DPRHead.centre_code, DPRHead.return_no, DPRHead.family_size, DPR.state
+        ).outerjoin(DPR, DPR.id == DPRHead.dpr_id).filter(DPRHead.centre_code.in_(centre_codes))
+    } if centre_codes else {}
+    centre_states = dict(
+        db.query(Centre.centre_code, Centre.state).filter(Centre.centre_code.in_(centre_codes))
+    ) if centre_codes else {}
+
+    persons, income_groups, states = [], [], []
+    item_household, codes, quantity, value = [], {name: [] for name in ITEM_DIMENSIONS}, [], []
+    for (centre_code, return_no), (mpr_family_size, income_group, items) in latest.items():
+        dpr_family_size, state = heads.get((centre_code, return_no), (None, None))
+        size = dpr_family_size or mpr_family_size
+        if not size or size <= 0:
+            continue
+        index = len(persons)
+        persons.append(size)
+        income_groups.append(income_group or "")
+        states.append(state or centre_states.get(centre_code) or "")
+        for item in (json.loads(items) if isinstance(items, str) else items or []):
+            item_household.append(index)
+            for name, field in ITEM_DIMENSIONS.items():
+                codes[name].append(item.get(field) or "")
+            quantity.append(item.get("length_in_meters") or 0.0)
+            value.append(item.get("total_amount_paid") or 0.0)
+
+    return Panel(
+        persons=np.array(persons, dtype=float),
+        weights=np.ones(len(persons)),
+        household={"income_group": np.array(income_groups, dtype=object), "state": np.array(states, dtype=object)},
+        item_household=np.array(item_household, dtype=np.int64),
+        item={name: np.array(values, dtype=object) for name, values in codes.items()},
+        quantity=np.array(quantity, dtype=float),
+        value=np.array(value, dtype=float)
+    )
+
+
+def _factorize(columns: List[np.ndarray], length: int) -> Tuple[List[tuple], np.ndarray]:
+    """Codes 0..k-1 for the distinct combinations of some columns, and the combinations"""
+    if not columns:
+        return [()], np.zeros(length, dtype=np.int64)
+    uniques, inverses = zip(*(np.unique(column.astype(str), return_inverse=True) for column in columns))
+    combined = np.ravel_multi_index(inverses, [len(values) for values in uniques]) if length else np.zeros(0, np.int64)
+    keys, codes = np.unique(combined, return_inverse=True)
+    positions = np.unravel_index(keys, [len(values) for values in uniques])
+    labels = [tuple(values[position[i]] for values, position in zip(uniques, positions)) for i in range(len(keys))]
+    return labels, codes.reshape(-1)
+
+
+def _standard_error(ratio, yy, yx, xx, x_total, n):
+    # n / (n - 1) * sum((w * (y - R * x)) ** 2) / X ** 2, expanded so that
+    # households without purchases in the cell only enter through xx
+    spread = np.maximum(yy - 2 * ratio * yx + ratio ** 2 * xx, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = np.where(n > 1, n / (n - 1) * spread / x_total ** 2, np.nan)
+    return np.sqrt(variance)
+
+
+def compute(panel: Panel, by: Sequence[str]) -> List[dict]:
+    """Per-capita quantity and value, with standard errors, for each cell of ``by``"""
+    household_dims = [name for name in by if name in HOUSEHOLD_DIMENSIONS]
+    item_dims = [name for name in by if name in ITEM_DIMENSIONS]
+    domains, domain = _factorize([panel.household[name] for name in household_dims], panel.households)
+    categories, category = _factorize([panel.item[name] for name in item_dims], len(panel.item_household))
+    domain_count, category_count = len(domains), len(categories)
+
+    w, x = panel.weights, panel.persons
+    households = np.bincount(domain, minlength=domain_count)
+    x_total = np.bincount(domain, weights=w * x, minlength=domain_count)
+    xx = np.bincount(domain, weights=(w * x) ** 2, minlength=domain_count)
+
+    # Purchases per (household, category)
+    pair_keys, pair = np.unique(panel.item_household * category_count + category, return_inverse=True)
+    pair = pair.reshape(-1)
+    pair_household = pair_keys // category_count
+    cell_keys, cell = np.unique(domain[pair_household] * category_count + pair_keys % category_count,
+                                return_inverse=True)
+    cell = cell.reshape(-1)
+    cell_domain = cell_keys // category_count
+    cell_category = cell_keys % category_count
+    wp, xp = w[pair_household], x[pair_household]
+    buyers = np.bincount(cell, minlength=len(cell_keys))
+
+    results = {}
+    for measure, amounts in (("quantity", panel.quantity), ("value", panel.value)):
+        y = np.bincount(pair, weights=amounts, minlength=len(pair_keys))
+        y_total = np.bincount(cell, weights=wp * y, minlength=len(cell_keys))
+        yy = np.bincount(cell, weights=(wp * y) ** 2, minlength=len(cell_keys))
+        yx = np.bincount(cell, weights=wp ** 2 * y * xp, minlength=len(cell_keys))
+        ratio = y_total / x_total[cell_domain]
+        results[measure] = (ratio, _standard_error(
+            ratio, yy, yx, xx[cell_domain], x_total[cell_domain], households[cell_domain]
+        ))
+
+    rows = []
+    for index in range(len(cell_keys)):
+        row = dict(zip(household_dims, domains[cell_domain[index]]))
+        row.update(zip(item_dims, categories[cell_category[index]]))
+        row["households"] = int(households[cell_domain[index]])
+        row["purchasing_households"] = int(buyers[index])
+        row["persons"] = float(x_total[cell_domain[index]])
+        for measure, (ratio, error) in results.items():
+            row[f"{measure}_per_capita"] = round(float(ratio[index]), 4)
+            row[f"{measure}_se"] = round(float(error[index]), 4) if np.isfinite(error[index]) else None
+        rows.append(row)
+    return rows
+
+
+def parse_dimensions(by: str) -> List[str]:
+    """``income_group,item`` -> ["income_group", "item"]; ValueError for unknown ones"""
+    names = [name.strip() for name in (by or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimension(s): {', '.join(unknown)}; use {', '.join(DIMENSIONS)}")
+    return list(dict.fromkeys(names))
+
+
+def get_estimates(period: int, by: Sequence[str], counters: Sequence[tuple], load) -> Tuple[dict, bool]:
+    """Estimates for a period and grouping, from the cache when no MPR/DPR changed.
+
+    ``load(period)`` returns the period's panel from every shard; it is
+    only called on a miss. Returns (estimates, served from cache).
+    """
+    key = (period, tuple(by), tuple(version for version, _ in counters))
+    cached = estimate_cache.get(key)
+    if cached is not None:
+        return cached, True
+    token = estimate_cache.token(key)
+    panel = load(period)
+    result = {
+        "period": format_period(period),
+        "by": list(by),
+        "households": panel.households,
+        "persons": float(panel.persons.sum()),
+        "items": len(panel.item_household),
+        "estimates": compute(panel, by)
+    }
+    estimate_cache.put(key, result, token)
+    logger.info(f"Computed estimates for {format_period(period)} by {list(by)} - {panel.households} households")
+    return result, False
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+from database import Centre
+
+try:
+    import redis
+except ImportError:  # optional: only needed for EVENTS_REDIS_URL
+    redis = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Live submission feed. The crud write paths publish one compact event per
+# committed write (record type, id, centre, state, period, item count) to
+# an in-process bus, and every dashboard connected to /api/v1/stream gets
+# it from its own bounded queue. A dashboard that falls EVENT_QUEUE_SIZE
+# events behind is disconnected rather than buffered without limit; it
+# reconnects and reloads. Publishing costs nothing while nobody listens.
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+# Seconds between keep-alive comments on an idle stream
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", "15"))
+
+# With several workers, events are also published on Redis so dashboards
+# see writes handled by any worker
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "emtc:events")
+
+
+def _split(values: Optional[Iterable[str]]) -> Optional[frozenset]:
+    values = frozenset(value for value in (values or ()) if value)
+    return values or None
+
+
+class Subscriber:
+    """One connected dashboard: its filters and its bounded event queue"""
+
+    def __init__(self, centre_codes=None, states=None, record_types=None, queue_size: int = EVENT_QUEUE_SIZE):
+        self.centre_codes = _split(centre_codes)
+        self.states = _split(states)
+        self.record_types = _split(record_types)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    def matches(self, event: dict) -> bool:
+        return (self.centre_codes is None or event.get("centre_code") in self.centre_codes) and \
+            (self.states is None or event.get("state") in self.states) and \
+            (self.record_types is None or event.get("record_type") in self.record_types)
+
+    async def get(self) -> Optional[dict]:
+        """The next event; None once the subscriber is closed or dropped"""
+        return await self.queue.get()
+
+
+class EventBus:
+    """In-process fan-out of write events to subscribers"""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, relay: "RedisRelay" = None):
+        self.queue_size = queue_size
+        self.relay = relay
+        self._subscribers = set()
+        self._loop = None
+        self._lock = threading.Lock()
+        self.seq = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> "EventBus":
+        relay = None
+        if EVENTS_REDIS_URL:
+            if redis is None:
+                logger.warning("EVENTS_REDIS_URL is set but redis is not installed; events stay in this worker")
+            else:
+                relay = RedisRelay(EVENTS_REDIS_URL)
+        return cls(EVENT_QUEUE_SIZE, relay)
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers) or self.relay is not None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self.relay is not None:
+            self.relay.start(self._dispatch)
+            logger.info(f"Events shared on {self.relay.channel}")
+
+    def stop(self):
+        if self.relay is not None:
+            self.relay.stop()
+        # Ends every open stream
+        for subscriber in list(self._subscribers):
+            self._close(subscriber)
+        self._loop = None
+
+    def subscribe(self, centre_codes=None, states=None, record_types=None) -> Subscriber:
+        """Register a subscriber; must be called on the event loop"""
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(centre_codes, states, record_types, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event: dict):
+        """Send an event to every matching subscriber; safe from any thread"""
+        if self.relay is not None:
+            self.relay.publish(event)
+        self._dispatch(event)
+
+    def _dispatch(self, event: dict):
+        if not self._subscribers or self._loop is None:
+            return
+        with self._lock:
+            self.seq += 1
+            event = dict(event, seq=self.seq)
+        self.published += 1
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(event)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: dict):
+        for subscriber in list(self._subscribers):
+            if not subscriber.matches(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # A slow consumer is cut off instead of holding events
+                self.dropped += 1
+                subscriber.dropped = True
+                self._close(subscriber)
+                logger.warning("Dropped a live feed subscriber that fell behind")
+
+    def _close(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "shared": self.relay is not None
+        }
+
+
+class RedisRelay:
+    """Publishes events on a Redis channel and dispatches other workers' ones"""
+
+    def __init__(self, url: str, channel: str = EVENTS_CHANNEL):
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._pubsub = None
+        self._thread = None
+
+    def publish(self, event: dict):
+        try:
+            self.client.publish(self.channel, json.dumps(dict(event, origin=self.origin)))
+        except Exception as e:
+            logger.warning(f"Could not publish event: {str(e)}")
+
+    def start(self, dispatch: Callable[[dict], None]):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+        def on_message(raw):
+            event = json.loads(raw["data"])
+            if event.pop("origin", None) != self.origin:
+                dispatch(event)
+
+        self._pubsub.subscribe(**{self.channel: on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+
+def format_sse(event: dict) -> str:
+    """One server-sent event: id, event name and JSON data"""
+    return f"id: {event['seq']}\nevent: {event['record_type']}.{event['action']}\ndata: {json.dumps(event)}\n\n"
+
+
+event_bus = EventBus.from_env()
+
+
+def record_event(table_name: str, action: str, record, state: str = None) -> dict:
+    """The compact event for a write to a DPR, MPR or FP"""
+    return {
+        "record_type": table_name,
+        "action": action,
+        "id": record.id,
+        "centre_code": record.centre_code,
+        "state": state,
+        "period": getattr(record, "period", None),
+        "return_no": getattr(record, "return_no", None),
+        "item_count": getattr(record, "item_count", None),
+        "at": datetime.now().isoformat()
+    }
+
+
+def publish_write(db, table_name: str, action: str, record):
+    """Publish a committed write. Never raises: the write already succeeded."""
+    if not event_bus.has_subscribers:
+        return
+    try:
+        state = getattr(record, "state", None)
+        if state is None:
+            # MPRs and FPs carry no state; the centre list has it
+            centre = db.get(Centre, record.centre_code)
+            state = centre.state if centre else None
+        event_bus.publish(record_event(table_name, action, record, state))
+    except Exception as e:
+        logger.warning(f"Could not publish {table_name} {action} event: {str(e)}")
@@ -0,0 +1,180 @@
+import math
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+
+# Geohash cells give every record a string key whose prefixes are nested
+# grid cells, so "near this point" and "per grid cell" questions become
+# B-tree range scans on an ordinary indexed column.
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+BASE32_INDEX = {char: index for index, char in enumerate(BASE32)}
+
+# Precision stored on every record (cells of roughly 5 m x 5 m)
+GEOHASH_PRECISION = 9
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Radius searches rank at most this many candidates and say when there were more
+GEO_MAX_CANDIDATES = int(os.getenv("GEO_MAX_CANDIDATES", "200000"))
+
+NEIGHBOUR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def encode(latitude: Optional[float], longitude: Optional[float], precision: int = GEOHASH_PRECISION) -> Optional[str]:
+    """Encode a coordinate as a geohash; returns None for missing or invalid coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        return None
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """The first cell after every geohash starting with ``prefix``.
+
+    Prefix scans are ``prefix <= geohash < bound``. The bound is the next
+    cell in base32 order rather than a sentinel character such as "{", so
+    the range holds under locale collations too, where punctuation sorts
+    before digits and letters. None when nothing sorts after the prefix.
+    """
+    if any(char not in BASE32_INDEX for char in prefix):
+        # No geohash contains this prefix: an empty range
+        return prefix
+    for end in range(len(prefix), 0, -1):
+        index = BASE32_INDEX[prefix[end - 1]]
+        if index + 1 < len(BASE32):
+            return prefix[:end - 1] + BASE32[index + 1]
+    return None
+
+
+def decode_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """Return (min_lat, min_lon, max_lat, max_lon) of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def decode_center(geohash: str) -> Tuple[float, float]:
+    """Return the (latitude, longitude) centre of a geohash cell"""
+    min_lat, min_lon, max_lat, max_lon = decode_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def cell_size_degrees(precision: int) -> Tuple[float, float]:
+    """Return (lat_degrees, lon_degrees) covered by a cell of the given precision"""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def neighbours(geohash: str) -> List[str]:
+    """Return the eight cells surrounding a geohash cell, at the same precision"""
+    lat, lon = decode_center(geohash)
+    lat_step, lon_step = cell_size_degrees(len(geohash))
+    cells = []
+    for dlat, dlon in NEIGHBOUR_OFFSETS:
+        neighbour_lat = lat + dlat * lat_step
+        if not -90.0 <= neighbour_lat <= 90.0:
+            continue
+        neighbour_lon = (lon + dlon * lon_step + 180.0) % 360.0 - 180.0
+        cells.append(encode(neighbour_lat, neighbour_lon, len(geohash)))
+    return cells
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two coordinates in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized great-circle distance in kilometres over NumPy arrays"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    """(min_lat, max_lat, min_lon, max_lon) of a circle.
+
+    The longitude bounds are None when the circle reaches a pole or
+    crosses the 180th meridian.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+    # Widest longitude offset of the circle, reached north or south of the centre
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+    if longitude - dlon < -180 or longitude + dlon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, longitude - dlon, longitude + dlon
+
+
+def covering_cells(latitude: float, longitude: float, radius_km: float) -> List[str]:
+    """Geohash prefixes whose cells together cover a circle.
+
+    Picks the finest precision whose cells are still at least as large as
+    the radius in both directions, then takes the centre cell and its eight
+    neighbours.
+    """
+    lat_km_per_degree = 111.32
+    lon_km_per_degree = max(111.32 * math.cos(math.radians(latitude)), 1e-6)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = cell_size_degrees(candidate)
+        if lat_step * lat_km_per_degree >= radius_km and lon_step * lon_km_per_degree >= radius_km:
+            precision = candidate
+            break
+
+    center = encode(latitude, longitude, precision)
+    return sorted(set([center] + neighbours(center)))
@@ -0,0 +1,156 @@
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from database import DPR, MPR, RecordHistory
+import patching
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Updates to DPR/MPR keep the previous version as a reverse delta: a JSON
+# Patch from the new version back to the old one, zlib-compressed. The live
+# row is always the newest version, so reading it costs nothing extra and
+# older versions are rebuilt by walking the deltas backwards. A deleted
+# record leaves its last version as a compressed snapshot to start from.
+VERSIONED_TABLES = {"dpr": DPR, "mpr": MPR}
+
+# Record fields that are bookkeeping rather than content
+_UNTRACKED = {"version", "updated_at"}
+
+
+def encode(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode(), 9)
+
+
+def decode(data: bytes):
+    return json.loads(zlib.decompress(data))
+
+
+def _to_dict(table_name: str):
+    # crud imports this module, so its serializers are looked up lazily
+    import crud
+    return crud.dpr_to_dict if table_name == "dpr" else crud.mpr_to_dict
+
+
+def _timestamp(document: dict) -> Optional[datetime]:
+    value = document.get("updated_at") or document.get("created_at")
+    return datetime.fromisoformat(value) if value else None
+
+
+def record_update(db: Session, table_name: str, before: dict, after: dict):
+    """Store the version being replaced as a delta against the new one.
+
+    ``before`` and ``after`` are the API dicts of the record around the
+    update, in the caller's transaction.
+    """
+    changed = [field for field in patching.changed_fields(before, after) if field not in _UNTRACKED]
+    db.add(RecordHistory(
+        table_name=table_name,
+        record_id=before["id"],
+        version=before["version"],
+        valid_from=_timestamp(before),
+        valid_to=_timestamp(after),
+        changed=",".join(changed),
+        snapshot=False,
+        delta=encode(patching.make_patch(after, before))
+    ))
+
+
+def record_deletion(db: Session, table_name: str, document: dict, deleted_at: datetime = None):
+    """Keep a deleted record's last version so its history can still be rebuilt"""
+    db.add(RecordHistory(
+        table_name=table_name,
+        record_id=document["id"],
+        version=document["version"],
+        valid_from=_timestamp(document),
+        valid_to=deleted_at or datetime.now(),
+        changed="",
+        snapshot=True,
+        delta=encode(document)
+    ))
+
+
+def _rows(db: Session, table_name: str, record_id: int) -> List[RecordHistory]:
+    return db.query(RecordHistory).filter(
+        RecordHistory.table_name == table_name,
+        RecordHistory.record_id == record_id
+    ).order_by(RecordHistory.version.desc()).all()
+
+
+def _latest(db: Session, table_name: str, record_id: int, rows: List[RecordHistory]):
+    """The newest version as (document, valid_to); valid_to is set once deleted"""
+    model = VERSIONED_TABLES[table_name]
+    record = db.query(model).filter(model.id == record_id).first()
+    if record is not None:
+        return _to_dict(table_name)(record), None
+    if rows and rows[0].snapshot:
+        return decode(rows[0].delta), rows[0].valid_to
+    return None, None
+
+
+def list_versions(db: Session, table_name: str, record_id: int) -> List[dict]:
+    """Every version of a record, newest first, with what each one changed"""
+    rows = _rows(db, table_name, record_id)
+    latest, deleted_at = _latest(db, table_name, record_id, rows)
+    if latest is None:
+        return []
+
+    deltas = [row for row in rows if not row.snapshot]
+    changed_by = {row.version + 1: row.changed.split(",") if row.changed else [] for row in deltas}
+    versions = [{
+        "version": latest["version"],
+        "valid_from": _timestamp(latest).isoformat() if _timestamp(latest) else None,
+        "valid_to": deleted_at.isoformat() if deleted_at else None,
+        "changed": changed_by.get(latest["version"], []),
+        "deleted": deleted_at is not None
+    }]
+    for row in deltas:
+        versions.append({
+            "version": row.version,
+            "valid_from": row.valid_from.isoformat() if row.valid_from else None,
+            "valid_to": row.valid_to.isoformat() if row.valid_to else None,
+            "changed": changed_by.get(row.version, []),
+            "deleted": False
+        })
+    return versions
+
+
+def reconstruct(db: Session, table_name: str, record_id: int, version: int = None,
+                at: datetime = None) -> Optional[dict]:
+    """A record as it was at a version, or at a point in time.
+
+    Returns None if the record (or that version) did not exist.
+    """
+    rows = _rows(db, table_name, record_id)
+    document, deleted_at = _latest(db, table_name, record_id, rows)
+    if document is None:
+        return None
+
+    deltas = [row for row in rows if not row.snapshot]
+    if at is not None:
+        if deleted_at is not None and at >= deleted_at:
+            return None
+        # The newest version that had been written by then
+        version = document["version"]
+        for row in deltas:
+            if row.valid_to is None or row.valid_to <= at:
+                break
+            version = row.version
+        if version == (deltas[-1].version if deltas else document["version"]):
+            valid_from = deltas[-1].valid_from if deltas else _timestamp(document)
+            if valid_from is not None and at < valid_from:
+                return None
+    if version is None or version == document["version"]:
+        return document
+    if version > document["version"] or version < 1:
+        return None
+
+    for row in deltas:
+        if row.version < version:
+            break
+        document = patching.json_patch(document, decode(row.delta))
+    return document if document.get("version") == version else None
+
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Optional, Tuple
+from fastapi import Request
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against the current ETag"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def build_validators(prefix: str, counters: Iterable[Tuple[int, Optional[datetime]]]) -> Tuple[str, Optional[datetime]]:
+    """Build an ETag and Last-Modified value from (version, updated_at) change counters"""
+    counters = list(counters)
+    etag = '"' + "-".join([prefix] + [str(version) for version, _ in counters]) + '"'
+    timestamps = [updated_at for _, updated_at in counters if updated_at is not None]
+    return etag, max(timestamps) if timestamps else None
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    """Response headers that let clients revalidate instead of re-downloading"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Evaluate If-None-Match (preferred) or If-Modified-Since for a request"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one second resolution
+        return _as_utc(last_modified).replace(microsecond=0) <= _as_utc(since)
+    return False
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Timestamps are stored as naive local time, like created_at
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.astimezone(timezone.utc)
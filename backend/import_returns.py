@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Bulk import paper DPR/MPR returns from a CSV or XLSX sheet.
+
+    python import_returns.py dpr sheets/dpr_june.xlsx
+    python import_returns.py mpr sheets/mpr_june.csv --workers 8 --report errors.csv
+
+Running the same file again carries on a failed import where it stopped.
+See bulk_import.py for the sheet layout.
+"""
+
+import argparse
+import csv
+import logging
+import sys
+import bulk_import
+from shards import get_router
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def write_report(job_id: int, path: str):
+    with get_router().open() as db, open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["row", "field", "kind", "message"])
+        skip = 0
+        while True:
+            errors = bulk_import.get_errors(db, job_id, skip=skip, limit=1000)
+            if not errors:
+                break
+            writer.writerows([error.row, error.field, error.kind, error.message] for error in errors)
+            skip += len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import paper DPR/MPR returns")
+    parser.add_argument("table", choices=sorted(bulk_import.MODELS), help="return type")
+    parser.add_argument("path", help="CSV or XLSX file")
+    parser.add_argument("--workers", type=int, default=bulk_import.IMPORT_WORKERS,
+                        help="validation processes (1 validates in this process)")
+    parser.add_argument("--chunk", type=int, default=bulk_import.IMPORT_CHUNK_RECORDS,
+                        help="returns per chunk")
+    parser.add_argument("--report", help="write every row error to this CSV file")
+    args = parser.parse_args()
+
+    job = bulk_import.start_job(args.path, args.table)
+    if job.committed_row:
+        print(f"Resuming import job {job.id} after row {job.committed_row}")
+    try:
+        summary = bulk_import.run_job(job.id, args.path, workers=args.workers, chunk_records=args.chunk)
+    except Exception as e:
+        print(f"Import job {job.id} stopped: {str(e)}; run the same command again to resume")
+        sys.exit(1)
+    finally:
+        if args.report:
+            write_report(job.id, args.report)
+    print(f"Import job {summary['id']} {summary['status']}: {summary['imported']} imported, "
+          f"{summary['failed']} failed, {summary['skipped']} skipped")
+
+
+if __name__ == "__main__":
+    main()
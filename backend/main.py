@@ -2,8 +2,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
-from database import create_tables
 from routes import router
+from scheduler import scheduler, MAINTENANCE_ENABLED
+from maintenance import register_jobs
+from shards import get_router
+from cache import record_cache
+from events import event_bus
+from migrations import AUTO_MIGRATE
+from admission import AdmissionMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -16,11 +22,25 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting eMTC API server...")
-    create_tables()
-    logger.info("Database tables created successfully")
+    shard_router = get_router()
+    # Migrations run once per deployment (python migrate.py); workers only
+    # check that every shard is at the schema version this code expects
+    if AUTO_MIGRATE:
+        shard_router.migrate()
+    shard_router.check_schema()
+    logger.info(f"Database schema is current on shard(s): {', '.join(shard_router.names)}")
+    record_cache.start()
+    event_bus.start()
+    # Audit screening, OTP purge and database housekeeping
+    if MAINTENANCE_ENABLED:
+        register_jobs(scheduler)
+        scheduler.start()
     yield
     # Shutdown
     logger.info("Shutting down eMTC API server...")
+    await scheduler.stop()
+    event_bus.stop()
+    record_cache.stop()
 
 # Create FastAPI app
 app = FastAPI(
@@ -32,6 +52,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Rate limits and the concurrency cap; added before CORS so that 429/503
+# responses still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +63,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # Include routes
@@ -69,6 +94,9 @@ if __name__ == "__main__":
     
     # Get port from environment (for Render deployment)
     port = int(os.getenv("PORT", "8000"))
+
+    # Bring the database up to date before the server starts
+    get_router().migrate()
     
     uvicorn.run(
         "main:app",
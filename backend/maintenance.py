@@ -0,0 +1,64 @@
+import logging
+import os
+from sqlalchemy import text
+from scheduler import Scheduler
+from audit import screen_all_shards, SCREENING_INTERVAL
+from routes import purge_expired_otps
+import archive
+import shards
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# The maintenance jobs run by scheduler.py. Intervals and timeouts are in
+# seconds; an interval of 0 turns a job off. Archival moves data out of
+# the live tables, so it only runs on a schedule when asked to.
+OTP_PURGE_INTERVAL = float(os.getenv("OTP_PURGE_INTERVAL", "300"))
+SCREENING_TIMEOUT = float(os.getenv("AUDIT_SCREENING_TIMEOUT", "300"))
+ANALYZE_INTERVAL = float(os.getenv("MAINTENANCE_ANALYZE_INTERVAL", "21600"))
+ANALYZE_TIMEOUT = float(os.getenv("MAINTENANCE_ANALYZE_TIMEOUT", "1800"))
+ARCHIVE_INTERVAL = float(os.getenv("MAINTENANCE_ARCHIVE_INTERVAL", "0"))
+ARCHIVE_TIMEOUT = float(os.getenv("MAINTENANCE_ARCHIVE_TIMEOUT", "3600"))
+
+# Tables with the most churn; VACUUM on a partitioned parent covers its partitions
+HOUSEKEEPING_TABLES = ("dpr", "mpr", "fp", "tombstones", "audit_flags", "record_history", "sync_ledger")
+
+
+def purge_otps():
+    purged = purge_expired_otps()
+    if purged:
+        logger.info(f"Purged {purged} expired OTP(s)")
+
+
+def analyze_databases():
+    """Refresh planner statistics on every shard (and VACUUM on PostgreSQL)"""
+    router = shards.get_router()
+    for name in router.names:
+        engine = router.engines[name]
+        # VACUUM cannot run inside a transaction
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if engine.dialect.name == "postgresql":
+                for table_name in HOUSEKEEPING_TABLES:
+                    conn.execute(text(f"VACUUM (ANALYZE) {table_name}"))
+            else:
+                conn.execute(text("ANALYZE"))
+                conn.execute(text("PRAGMA optimize"))
+        logger.info(f"Analyzed shard {name}")
+
+
+def archive_closed():
+    router = shards.get_router()
+    for name in router.names:
+        with router.open(name) as db:
+            archived = archive.archive_closed_periods(db)
+            if archived:
+                logger.info(f"Archived {len(archived)} period(s) on shard {name}")
+
+
+def register_jobs(scheduler: Scheduler):
+    # OTPs live in each worker's memory, so every worker purges its own.
+    # Screening is shared out through the sync ledger and can run anywhere.
+    scheduler.register("otp_purge", purge_otps, OTP_PURGE_INTERVAL, timeout=60, cluster=False)
+    scheduler.register("audit_screening", screen_all_shards, SCREENING_INTERVAL, timeout=SCREENING_TIMEOUT, cluster=False)
+    scheduler.register("analyze", analyze_databases, ANALYZE_INTERVAL, timeout=ANALYZE_TIMEOUT)
+    scheduler.register("archive", archive_closed, ARCHIVE_INTERVAL, timeout=ARCHIVE_TIMEOUT)
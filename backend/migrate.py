@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Apply database migrations to every shard.
+
+    python migrate.py            apply pending migrations
+    python migrate.py status     show each shard's schema version
+
+Run once per deployment, before starting the API workers.
+"""
+
+import logging
+import sys
+import migrations
+from shards import get_router
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    router = get_router()
+    if command == "status":
+        latest = migrations.latest_version()
+        for name in router.names:
+            current = migrations.applied_version(router.engines[name])
+            state = "up to date" if current >= latest else f"{latest - current} pending"
+            print(f"{name}: version {current} of {latest} ({state})")
+    elif command == "upgrade":
+        for name, applied in router.migrate().items():
+            print(f"{name}: applied {len(applied)} migration(s)")
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import importlib
+import logging
+import os
+import pkgutil
+import re
+import socket
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from types import ModuleType
+from typing import List, Optional
+from sqlalchemy import Column, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from database import SchemaLock, SchemaMigration
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations. Each module in this package named
+# vNNNN_<name>.py is one migration; its upgrade(op) brings the schema from
+# version NNNN - 1 to NNNN. Applied versions are recorded in
+# schema_migrations, and only one process runs migrations at a time
+# (advisory lock on PostgreSQL, a lock row on SQLite). Workers never
+# migrate: at startup they compare the recorded version with the newest
+# migration and refuse to start if the database is behind.
+#
+# A migration runs in one transaction unless it sets ``atomic = False``.
+# Non-atomic migrations autocommit each step, which lets PostgreSQL build
+# indexes with CREATE INDEX CONCURRENTLY (no write lock on the table); their
+# steps must be safe to repeat, since a failure leaves the earlier ones done.
+# Every operation below skips work that is already in place, so databases
+# created by the old create_all startup are adopted by running all
+# migrations over them.
+
+MIGRATION_LOCK_KEY = 72_610_042  # pg_advisory_lock key
+# Seconds to wait for another runner, and after which a lock left by a
+# runner that died is taken over (SQLite)
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "600"))
+MIGRATION_LOCK_STALE = float(os.getenv("MIGRATION_LOCK_STALE", "3600"))
+
+# Run pending migrations at startup instead of refusing to start; meant for
+# single-process development setups
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+
+_MODULE_NAME = re.compile(r"^v(\d{4})_(\w+)$")
+
+
+class SchemaOutOfDate(RuntimeError):
+    """The database is behind the code; run ``python migrate.py``"""
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    module: ModuleType
+
+    @property
+    def atomic(self) -> bool:
+        return getattr(self.module, "atomic", True)
+
+
+_migrations: Optional[List[Migration]] = None
+
+
+def discover() -> List[Migration]:
+    """All migrations in this package, oldest first"""
+    global _migrations
+    if _migrations is None:
+        found = []
+        for info in pkgutil.iter_modules(__path__):
+            match = _MODULE_NAME.match(info.name)
+            if match:
+                module = importlib.import_module(f"{__name__}.{info.name}")
+                found.append(Migration(int(match.group(1)), match.group(2), module))
+        found.sort(key=lambda migration: migration.version)
+        versions = [migration.version for migration in found]
+        if len(set(versions)) != len(versions):
+            raise RuntimeError(f"Duplicate migration versions: {versions}")
+        _migrations = found
+    return _migrations
+
+
+def latest_version() -> int:
+    migrations = discover()
+    return migrations[-1].version if migrations else 0
+
+
+def applied_version(engine: Engine) -> int:
+    """Newest migration applied to a database; 0 for a new or unmigrated one"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+        except (OperationalError, ProgrammingError):
+            # No schema_migrations table yet
+            return 0
+
+
+def pending(engine: Engine) -> List[Migration]:
+    current = applied_version(engine)
+    return [migration for migration in discover() if migration.version > current]
+
+
+def check(engine: Engine, name: str = "primary"):
+    """Raise SchemaOutOfDate unless every migration has been applied.
+
+    One indexed query, so workers can afford it on every boot.
+    """
+    current, latest = applied_version(engine), latest_version()
+    if current < latest:
+        raise SchemaOutOfDate(
+            f"Database {name} is at schema version {current}, the code needs {latest}; run 'python migrate.py'"
+        )
+    if current > latest:
+        logger.warning(f"Database {name} is at schema version {current}, newer than this code ({latest})")
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """Hold the single-runner lock of a database"""
+    if engine.dialect.name == "postgresql":
+        # Autocommit, so the lock connection is not an open transaction;
+        # CREATE INDEX CONCURRENTLY would wait for it to finish
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        return
+
+    SchemaLock.__table__.create(engine, checkfirst=True)
+    holder = f"{socket.gethostname()}:{os.getpid()}"
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+    while True:
+        try:
+            with engine.begin() as conn:
+                conn.execute(SchemaLock.__table__.insert().values(id=1, holder=holder, acquired_at=datetime.now()))
+            break
+        except IntegrityError:
+            with engine.begin() as conn:
+                # A runner that died holding the lock loses it once stale
+                conn.execute(SchemaLock.__table__.delete().where(
+                    SchemaLock.id == 1,
+                    SchemaLock.acquired_at < datetime.now() - timedelta(seconds=MIGRATION_LOCK_STALE)
+                ))
+            if time.monotonic() > deadline:
+                raise RuntimeError("Timed out waiting for the migration lock")
+            time.sleep(0.5)
+    try:
+        yield
+    finally:
+        with engine.begin() as conn:
+            conn.execute(SchemaLock.__table__.delete().where(SchemaLock.id == 1, SchemaLock.holder == holder))
+
+
+class Operations:
+    """Schema operations for migrations; each one skips work already done"""
+
+    def __init__(self, conn: Connection, atomic: bool):
+        self.conn = conn
+        self.atomic = atomic
+        self.dialect = conn.dialect.name
+
+    def has_table(self, table_name: str) -> bool:
+        return inspect(self.conn).has_table(table_name)
+
+    def has_column(self, table_name: str, column_name: str) -> bool:
+        return any(column["name"] == column_name for column in inspect(self.conn).get_columns(table_name))
+
+    def has_index(self, table_name: str, index_name: str) -> bool:
+        return any(index["name"] == index_name for index in inspect(self.conn).get_indexes(table_name))
+
+    def execute(self, statement, parameters=None):
+        return self.conn.execute(text(statement) if isinstance(statement, str) else statement, parameters)
+
+    def create_table(self, table: Table):
+        """Create a table, with its indexes, if it does not exist.
+
+        Migrations define their tables as they were at that version, so a
+        migration does the same thing however the models change later.
+        """
+        table.create(self.conn, checkfirst=True)
+
+    def add_column(self, table_name: str, column: Column):
+        """Add a column to an existing table.
+
+        Columns are added nullable and without a default, which on
+        PostgreSQL only touches the catalog, however big the table.
+        """
+        if self.has_column(table_name, column.name):
+            return
+        column_type = column.type.compile(dialect=self.conn.dialect)
+        self.execute(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}")
+
+    def create_index(self, table_name: str, index_name: str, *columns: str, unique: bool = False):
+        """Create an index on existing columns.
+
+        On PostgreSQL, outside an atomic migration, the index is built
+        concurrently so writes carry on while it builds.
+        """
+        if self.dialect == "postgresql" and not self.atomic:
+            self._create_index_concurrently(table_name, index_name, columns, unique)
+        elif not self.has_index(table_name, index_name):
+            self.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table_name} ({', '.join(columns)})")
+
+    def is_partitioned(self, table_name: str) -> bool:
+        if self.dialect != "postgresql":
+            return False
+        return bool(self.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = CAST(:name AS regclass)", {"name": table_name}
+        ).scalar())
+
+    def _create_index_concurrently(self, table_name: str, index_name: str, columns, unique: bool):
+        column_list = ", ".join(columns)
+        unique = "UNIQUE " if unique else ""
+        if not self.is_partitioned(table_name):
+            self._drop_invalid_index(index_name)
+            self.execute(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} ({column_list})")
+            return
+
+        # A partitioned table cannot be indexed concurrently. Its index is
+        # declared on the parent only (instant), built concurrently on each
+        # partition, and becomes valid once every partition's is attached.
+        self.execute(f"CREATE {unique}INDEX IF NOT EXISTS {index_name} ON ONLY {table_name} ({column_list})")
+        partition_names = self.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:name AS regclass)", {"name": table_name}
+        ).scalars().all()
+        for partition in partition_names:
+            partition_index = f"{partition}_{'_'.join(columns)}_idx"[:63]
+            self._drop_invalid_index(partition_index)
+            self.execute(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} ({column_list})"
+            )
+            self.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {partition_index}")
+
+    def _drop_invalid_index(self, index_name: str):
+        # An interrupted concurrent build leaves an invalid index behind,
+        # which IF NOT EXISTS would otherwise keep
+        invalid = self.execute(
+            "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)", {"name": index_name}
+        ).scalar()
+        if invalid:
+            logger.warning(f"Dropping invalid index {index_name} left by an interrupted build")
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+
+def _apply(engine: Engine, migration: Migration):
+    started = time.monotonic()
+    record = SchemaMigration.__table__.insert().values(
+        version=migration.version, name=migration.name, applied_at=datetime.now()
+    )
+    if migration.atomic:
+        with engine.begin() as conn:
+            migration.module.upgrade(Operations(conn, atomic=True))
+            conn.execute(record)
+    else:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            migration.module.upgrade(Operations(conn, atomic=False))
+            conn.execute(record)
+    logger.info(f"Applied migration {migration.version:04d} {migration.name} in {time.monotonic() - started:.2f}s")
+
+
+def upgrade(engine: Engine, target: int = None) -> List[int]:
+    """Apply pending migrations, up to ``target`` if given; returns the versions applied"""
+    applied = []
+    with migration_lock(engine):
+        SchemaMigration.__table__.create(engine, checkfirst=True)
+        # Read again under the lock: another runner may have finished them
+        for migration in pending(engine):
+            if target is not None and migration.version > target:
+                break
+            _apply(engine, migration)
+            applied.append(migration.version)
+    return applied
@@ -0,0 +1,66 @@
+"""DPR, MPR and FP record tables"""
+from sqlalchemy import Column, DateTime, Float, Integer, JSON, MetaData, String, Table
+
+metadata = MetaData()
+
+dpr = Table(
+    "dpr", metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("name_and_address", String),
+    Column("district", String),
+    Column("state", String),
+    Column("family_size", Integer),
+    Column("income_group", String),
+    Column("centre_code", String),
+    Column("return_no", String),
+    Column("month_and_year", String),
+    Column("household_members", JSON),
+    Column("latitude", Float),
+    Column("longitude", Float),
+    Column("otp_code", String),
+    Column("created_at", DateTime),
+    sqlite_autoincrement=True,
+)
+
+mpr = Table(
+    "mpr", metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+    Column("name_and_address", String),
+    Column("district_state_tel", String),
+    Column("panel_centre", String),
+    Column("centre_code", String),
+    Column("return_no", String),
+    Column("family_size", Integer),
+    Column("income_group", String),
+    Column("month_and_year", String),
+    Column("occupation_of_head", String),
+    Column("items", JSON),
+    Column("latitude", Float),
+    Column("longitude", Float),
+    Column("otp_code", String),
+    Column("created_at", DateTime),
+    sqlite_autoincrement=True,
+)
+
+fp = Table(
+    "fp", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("centre_name", String),
+    Column("centre_code", String),
+    Column("panel_size", Integer),
+    Column("mpr_collected", Integer),
+    Column("not_collected", Integer),
+    Column("with_purchase_data", Integer),
+    Column("nil_mprs", Integer),
+    Column("nil_serial_nos", Integer),
+    Column("latitude", Float),
+    Column("longitude", Float),
+    Column("created_at", DateTime),
+    sqlite_autoincrement=True,
+)
+
+
+def upgrade(op):
+    # Existing databases already have these, from before migrations
+    for table in (dpr, mpr, fp):
+        op.create_table(table)
@@ -0,0 +1,57 @@
+"""Change sequences, tombstones and change counters for delta sync, and the sync ledger"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table
+
+atomic = False
+
+metadata = MetaData()
+
+tombstones = Table(
+    "tombstones", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("table_name", String, nullable=False),
+    Column("record_id", Integer, nullable=False),
+    Column("centre_code", String),
+    Column("change_seq", Integer, nullable=False),
+    Column("deleted_at", DateTime),
+    Index("ix_tombstones_table_change_seq", "table_name", "change_seq"),
+)
+
+change_counters = Table(
+    "change_counters", metadata,
+    Column("table_name", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+sync_cursors = Table(
+    "sync_cursors", metadata,
+    Column("consumer", String, primary_key=True),
+    Column("table_name", String, primary_key=True),
+    Column("planned_seq", Integer, nullable=False),
+    Column("committed_seq", Integer, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+sync_ledger = Table(
+    "sync_ledger", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("consumer", String, nullable=False),
+    Column("table_name", String, nullable=False),
+    Column("start_seq", Integer, nullable=False),
+    Column("end_seq", Integer, nullable=False),
+    Column("status", String, nullable=False),
+    Column("claimed_by", String),
+    Column("claimed_at", DateTime),
+    Column("completed_at", DateTime),
+    Index("ix_sync_ledger_consumer_status", "consumer", "table_name", "status", "start_seq"),
+)
+
+
+def upgrade(op):
+    for table in (tombstones, change_counters, sync_cursors, sync_ledger):
+        op.create_table(table)
+    for table_name in ("dpr", "mpr", "fp"):
+        op.add_column(table_name, Column("updated_at", DateTime))
+        op.add_column(table_name, Column("change_seq", Integer))
+        op.create_index(table_name, f"ix_{table_name}_change_seq", "change_seq")
+        op.create_index(table_name, f"ix_{table_name}_centre_change_seq", "centre_code", "change_seq")
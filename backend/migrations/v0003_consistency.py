@@ -0,0 +1,38 @@
+"""DPR heads and MPR/DPR mismatches for the consistency checks"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table
+
+atomic = False
+
+metadata = MetaData()
+
+dpr_heads = Table(
+    "dpr_heads", metadata,
+    Column("centre_code", String, primary_key=True),
+    Column("return_no", String, primary_key=True),
+    Column("dpr_id", Integer, nullable=False, index=True),
+    Column("family_size", Integer),
+    Column("income_group", String),
+    Column("occupation_of_head", String),
+    Column("updated_at", DateTime),
+)
+
+consistency_mismatches = Table(
+    "consistency_mismatches", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("mpr_id", Integer, nullable=False),
+    Column("dpr_id", Integer, nullable=False),
+    Column("centre_code", String),
+    Column("return_no", String),
+    Column("field", String, nullable=False),
+    Column("mpr_value", String),
+    Column("dpr_value", String),
+    Column("detected_at", DateTime),
+    Index("ix_consistency_mismatches_mpr", "mpr_id", "field", unique=True),
+    Index("ix_consistency_mismatches_centre_field", "centre_code", "field"),
+)
+
+
+def upgrade(op):
+    op.create_table(dpr_heads)
+    op.create_table(consistency_mismatches)
+    op.create_index("mpr", "ix_mpr_centre_return_no", "centre_code", "return_no")
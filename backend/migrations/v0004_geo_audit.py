@@ -0,0 +1,39 @@
+"""Geohash columns for geo queries; centres and audit flags for GPS screening"""
+from sqlalchemy import Column, DateTime, Float, Index, Integer, MetaData, String, Table
+
+atomic = False
+
+metadata = MetaData()
+
+centres = Table(
+    "centres", metadata,
+    Column("centre_code", String, primary_key=True),
+    Column("centre_name", String),
+    Column("state", String),
+    Column("latitude", Float, nullable=False),
+    Column("longitude", Float, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+audit_flags = Table(
+    "audit_flags", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("record_type", String, nullable=False),
+    Column("record_id", Integer, nullable=False),
+    Column("centre_code", String),
+    Column("flag_type", String, nullable=False),
+    Column("distance_km", Float),
+    Column("detail", String),
+    Column("created_at", DateTime),
+    Index("ix_audit_flags_record", "record_type", "record_id", "flag_type", unique=True),
+    Index("ix_audit_flags_type_centre", "flag_type", "centre_code", "created_at"),
+)
+
+
+def upgrade(op):
+    op.create_table(centres)
+    op.create_table(audit_flags)
+    for table_name in ("dpr", "mpr", "fp"):
+        # Bytewise collation on PostgreSQL from v0014 on
+        op.add_column(table_name, Column("geohash", String))
+        op.create_index(table_name, f"ix_{table_name}_geohash", "geohash")
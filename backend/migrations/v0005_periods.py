@@ -0,0 +1,157 @@
+"""Reporting period column on DPR/MPR, and the detached period registry.
+
+Only new PostgreSQL databases get range-partitioned DPR/MPR tables: while
+they are still empty, the plain tables of the earlier migrations are
+replaced by partitioned ones. Turning a table that holds records into a
+partitioned one means rewriting it, which is left to a planned maintenance
+window. Until then partitions.py treats the plain tables like SQLite's: no
+partition DDL, and detached periods move to files.
+"""
+import logging
+import re
+from sqlalchemy import Column, DateTime, Float, Index, Integer, JSON, MetaData, String, Table, column, select, table
+
+atomic = False
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+period_partitions = Table(
+    "period_partitions", metadata,
+    Column("table_name", String, primary_key=True),
+    Column("period", Integer, primary_key=True),
+    Column("location", String, nullable=False),
+    Column("row_count", Integer),
+    Column("detached_at", DateTime),
+)
+
+# DPR/MPR as of this version, partitioned; the partition key must be part
+# of the primary key
+partitioned_tables = {
+    "dpr": Table(
+        "dpr", metadata,
+        Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+        Column("name_and_address", String),
+        Column("district", String),
+        Column("state", String),
+        Column("family_size", Integer),
+        Column("income_group", String),
+        Column("centre_code", String),
+        Column("return_no", String),
+        Column("month_and_year", String),
+        Column("period", Integer, primary_key=True),
+        Column("household_members", JSON),
+        Column("latitude", Float),
+        Column("longitude", Float),
+        Column("geohash", String, index=True),
+        Column("otp_code", String),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+        Column("change_seq", Integer, index=True),
+        Index("ix_dpr_centre_change_seq", "centre_code", "change_seq"),
+        Index("ix_dpr_period_centre", "period", "centre_code"),
+        postgresql_partition_by="RANGE (period)",
+    ),
+    "mpr": Table(
+        "mpr", metadata,
+        Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+        Column("name_and_address", String),
+        Column("district_state_tel", String),
+        Column("panel_centre", String),
+        Column("centre_code", String),
+        Column("return_no", String),
+        Column("family_size", Integer),
+        Column("income_group", String),
+        Column("month_and_year", String),
+        Column("period", Integer, primary_key=True),
+        Column("occupation_of_head", String),
+        Column("items", JSON),
+        Column("latitude", Float),
+        Column("longitude", Float),
+        Column("geohash", String, index=True),
+        Column("otp_code", String),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+        Column("change_seq", Integer, index=True),
+        Index("ix_mpr_centre_change_seq", "centre_code", "change_seq"),
+        Index("ix_mpr_period_centre", "period", "centre_code"),
+        Index("ix_mpr_centre_return_no", "centre_code", "return_no"),
+        postgresql_partition_by="RANGE (period)",
+    ),
+}
+
+# periods.parse_period as of this version
+MONTH_NAMES = {
+    name: index
+    for index, names in enumerate([
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"),
+        ("may",), ("jun", "june"), ("jul", "july"), ("aug", "august"),
+        ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"), ("dec", "december"),
+    ], start=1)
+    for name in names
+}
+MONTH_FIRST = re.compile(r"^\s*(\d{1,2})\s*[/\-. ]\s*(\d{4})\s*$")
+YEAR_FIRST = re.compile(r"^\s*(\d{4})\s*[/\-. ]\s*(\d{1,2})\s*$")
+NAMED_MONTH = re.compile(r"^\s*([A-Za-z]+)\.?\s*[/\-, ]?\s*(\d{2}|\d{4})\s*$")
+
+
+def parse_period(value):
+    if value is None:
+        raise ValueError("Missing month and year")
+    match = MONTH_FIRST.match(value)
+    if match:
+        month, year = int(match.group(1)), int(match.group(2))
+    else:
+        match = YEAR_FIRST.match(value)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+        else:
+            match = NAMED_MONTH.match(value)
+            if not match or match.group(1).lower() not in MONTH_NAMES:
+                raise ValueError(f"Unrecognised month and year: {value!r}")
+            month = MONTH_NAMES[match.group(1).lower()]
+            year = int(match.group(2))
+            if year < 100:
+                year += 2000
+    if not 1 <= month <= 12 or not 1900 <= year <= 9999:
+        raise ValueError(f"Unrecognised month and year: {value!r}")
+    return year * 100 + month
+
+
+def partition_if_empty(op, table_name):
+    if op.dialect != "postgresql" or op.is_partitioned(table_name):
+        return
+    if op.has_table(table_name) and op.execute(select(column("id")).select_from(table(table_name)).limit(1)).first():
+        return
+    op.execute(f"DROP TABLE IF EXISTS {table_name}")
+    op.create_table(partitioned_tables[table_name])
+
+
+def backfill(op, table_name):
+    """Fill the period of rows written before the column existed.
+
+    One UPDATE per distinct month_and_year, of which there are few.
+    """
+    records = table(table_name, column("month_and_year"), column("period"))
+    months = op.execute(
+        select(records.c.month_and_year).where(records.c.period.is_(None)).distinct()
+    ).scalars().all()
+    for month_and_year in months:
+        try:
+            period = parse_period(month_and_year)
+        except ValueError:
+            logger.warning(f"{table_name.upper()} rows with unreadable month_and_year {month_and_year!r} keep no period")
+            continue
+        op.execute(records.update().where(
+            records.c.period.is_(None), records.c.month_and_year == month_and_year
+        ).values(period=period))
+
+
+def upgrade(op):
+    op.create_table(period_partitions)
+    for table_name in ("dpr", "mpr"):
+        partition_if_empty(op, table_name)
+        op.add_column(table_name, Column("period", Integer))
+        backfill(op, table_name)
+        op.create_index(table_name, f"ix_{table_name}_period_centre", "period", "centre_code")
@@ -0,0 +1,16 @@
+"""Shard routing directory"""
+from sqlalchemy import Column, DateTime, MetaData, String, Table
+
+metadata = MetaData()
+
+shard_assignments = Table(
+    "shard_assignments", metadata,
+    Column("key_type", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("shard", String, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+
+def upgrade(op):
+    op.create_table(shard_assignments)
@@ -0,0 +1,27 @@
+"""Record versions on DPR/MPR and their history"""
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, LargeBinary, MetaData, String, Table, column, table
+
+metadata = MetaData()
+
+record_history = Table(
+    "record_history", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("table_name", String, nullable=False),
+    Column("record_id", Integer, nullable=False),
+    Column("version", Integer, nullable=False),
+    Column("valid_from", DateTime),
+    Column("valid_to", DateTime),
+    Column("changed", String),
+    Column("snapshot", Boolean, nullable=False),
+    Column("delta", LargeBinary, nullable=False),
+    Index("ix_record_history_record_version", "table_name", "record_id", "version", unique=True),
+)
+
+
+def upgrade(op):
+    op.create_table(record_history)
+    for table_name in ("dpr", "mpr"):
+        op.add_column(table_name, Column("version", Integer))
+        # Rows written before versioning start at version 1
+        records = table(table_name, column("version"))
+        op.execute(records.update().where(records.c.version.is_(None)).values(version=1))
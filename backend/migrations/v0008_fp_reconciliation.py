@@ -0,0 +1,33 @@
+"""MPR item counts and the FP reporting period, for FP reconciliation"""
+import json
+from sqlalchemy import Column, Integer, String, bindparam, column, select, table
+
+atomic = False
+
+BATCH_SIZE = 1000
+
+
+def backfill_item_counts(op):
+    mpr = table("mpr", column("id"), column("items"), column("item_count"))
+    last_id = 0
+    while True:
+        rows = op.execute(
+            select(mpr.c.id, mpr.c["items"])
+            .where(mpr.c.item_count.is_(None), mpr.c.id > last_id)
+            .order_by(mpr.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        op.execute(
+            mpr.update().where(mpr.c.id == bindparam("record_id")).values(item_count=bindparam("count")),
+            [{"record_id": record_id, "count": len(json.loads(items)) if items else 0} for record_id, items in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade(op):
+    op.add_column("mpr", Column("item_count", Integer))
+    backfill_item_counts(op)
+    op.create_index("mpr", "ix_mpr_centre_period_return_items", "centre_code", "period", "return_no", "item_count")
+    op.add_column("fp", Column("month_and_year", String))
+    op.add_column("fp", Column("period", Integer))
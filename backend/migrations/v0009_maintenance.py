@@ -0,0 +1,20 @@
+"""Leases and last runs of the maintenance scheduler's jobs"""
+from sqlalchemy import Column, DateTime, Float, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+maintenance_jobs = Table(
+    "maintenance_jobs", metadata,
+    Column("name", String, primary_key=True),
+    Column("holder", String),
+    Column("lease_until", DateTime),
+    Column("last_started_at", DateTime),
+    Column("last_finished_at", DateTime),
+    Column("last_duration", Float),
+    Column("last_status", String),
+    Column("last_error", Text),
+)
+
+
+def upgrade(op):
+    op.create_table(maintenance_jobs)
@@ -0,0 +1,30 @@
+"""Signatures and LSH buckets for near-duplicate MPR detection.
+
+Signatures of MPRs filed before this migration are computed by the
+application, with the current algorithm, after migrating (see
+similarity.index_missing).
+"""
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, LargeBinary, MetaData, String, Table
+
+metadata = MetaData()
+
+mpr_signatures = Table(
+    "mpr_signatures", metadata,
+    Column("mpr_id", Integer, primary_key=True),
+    Column("centre_code", String),
+    Column("period", Integer),
+    Column("signature", LargeBinary, nullable=False),
+    Column("updated_at", DateTime),
+)
+
+mpr_lsh_buckets = Table(
+    "mpr_lsh_buckets", metadata,
+    Column("bucket", BigInteger, primary_key=True, autoincrement=False),
+    Column("mpr_id", Integer, primary_key=True, autoincrement=False),
+    Index("ix_mpr_lsh_buckets_mpr", "mpr_id"),
+)
+
+
+def upgrade(op):
+    op.create_table(mpr_signatures)
+    op.create_table(mpr_lsh_buckets)
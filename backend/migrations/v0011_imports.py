@@ -0,0 +1,39 @@
+"""Bulk import jobs and their per-row error reports"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+import_jobs = Table(
+    "import_jobs", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("table_name", String, nullable=False),
+    Column("filename", String),
+    Column("path", String),
+    Column("sha256", String, nullable=False, index=True),
+    Column("status", String, nullable=False),
+    Column("committed_row", Integer, nullable=False),
+    Column("imported", Integer, nullable=False),
+    Column("failed", Integer, nullable=False),
+    Column("skipped", Integer, nullable=False),
+    Column("last_error", Text),
+    Column("created_at", DateTime),
+    Column("started_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("finished_at", DateTime),
+)
+
+import_errors = Table(
+    "import_errors", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("job_id", Integer, nullable=False),
+    Column("row", Integer, nullable=False),
+    Column("field", String),
+    Column("kind", String, nullable=False),
+    Column("message", Text, nullable=False),
+    Index("ix_import_errors_job_row", "job_id", "row"),
+)
+
+
+def upgrade(op):
+    op.create_table(import_jobs)
+    op.create_table(import_errors)
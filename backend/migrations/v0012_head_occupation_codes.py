@@ -0,0 +1,40 @@
+"""Store each head's occupation in the consistency index as its MPR code"""
+from datetime import datetime
+from sqlalchemy import and_, case, column, literal, select, table
+
+# codebook.DPR_TO_MPR_OCCUPATION as of this version
+DPR_TO_MPR_OCCUPATION = {
+    "01": "03", "03": "02", "04": "02", "05": "02", "06": "04",
+    "07": "01", "11": "08", "12": "07", "14": "10",
+}
+
+dpr_heads = table("dpr_heads", column("centre_code"), column("return_no"), column("dpr_id"), column("occupation_of_head"))
+mpr = table("mpr", column("id"), column("centre_code"), column("return_no"), column("occupation_of_head"))
+mismatches = table(
+    "consistency_mismatches", column("mpr_id"), column("dpr_id"), column("centre_code"), column("return_no"),
+    column("field"), column("mpr_value"), column("dpr_value"), column("detected_at")
+)
+
+
+def upgrade(op):
+    # Entries written so far hold the DPR code, which is a different list;
+    # heads whose occupation has no MPR counterpart are no longer checked
+    op.execute(dpr_heads.update().values(occupation_of_head=case(
+        DPR_TO_MPR_OCCUPATION, value=dpr_heads.c.occupation_of_head, else_=None
+    )))
+
+    # Redo the occupation part of the mismatch report against the new codes
+    op.execute(mismatches.delete().where(mismatches.c.field == "occupation_of_head"))
+    found = select(
+        mpr.c.id, dpr_heads.c.dpr_id, mpr.c.centre_code, mpr.c.return_no, literal("occupation_of_head"),
+        mpr.c.occupation_of_head, dpr_heads.c.occupation_of_head, literal(datetime.now())
+    ).join(dpr_heads, and_(
+        dpr_heads.c.centre_code == mpr.c.centre_code, dpr_heads.c.return_no == mpr.c.return_no
+    )).where(
+        mpr.c.occupation_of_head.isnot(None),
+        dpr_heads.c.occupation_of_head.isnot(None),
+        mpr.c.occupation_of_head != dpr_heads.c.occupation_of_head
+    )
+    op.execute(mismatches.insert().from_select(
+        ["mpr_id", "dpr_id", "centre_code", "return_no", "field", "mpr_value", "dpr_value", "detected_at"], found
+    ))
@@ -0,0 +1,6 @@
+"""Source shard of unfinished centre moves"""
+from sqlalchemy import Column, String
+
+
+def upgrade(op):
+    op.add_column("shard_assignments", Column("moving_from", String))
@@ -0,0 +1,13 @@
+"""Compare geohashes bytewise on PostgreSQL, whatever the database's locale"""
+
+GEOHASH_TABLES = ("dpr", "mpr", "fp")
+
+
+def upgrade(op):
+    # Under a locale collation the prefix ranges of geo queries cannot use
+    # the geohash index. Only the collation changes, so the tables are not
+    # rewritten; their geohash indexes are rebuilt.
+    if op.dialect != "postgresql":
+        return
+    for table_name in GEOHASH_TABLES:
+        op.execute(f'ALTER TABLE {table_name} ALTER COLUMN geohash TYPE VARCHAR COLLATE "C"')
@@ -1,6 +1,27 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationInfo, field_validator
+from pydantic_core import PydanticCustomError
 from typing import Optional, List
+from typing_extensions import Annotated, NotRequired, TypedDict
 from datetime import datetime
+from validation import check_purchase_items
+from codebook import get_codebook, check_codes
+from periods import parse_period
+
+# Code-list check shared by the DPR/MPR header field validators
+def _check_code(value, field_name: str, allowed):
+    codes = allowed.get(field_name)
+    if codes is not None and value not in codes:
+        raise PydanticCustomError("unknown_code", "Unknown code '{code}'", {"code": value})
+    return value
+
+# month_and_year must be readable as a reporting period; the original
+# string is kept and the period is derived on write
+def _check_period(value):
+    try:
+        parse_period(value)
+    except ValueError as e:
+        raise PydanticCustomError("period", "{message}", {"message": str(e)})
+    return value
 
 # Base models for common fields
 class LocationBase(BaseModel):
@@ -42,6 +63,30 @@ class PurchaseItem(BaseModel):
     brand_mill_name: str = Field(..., description="Brand/Mill name")
     is_imported: bool = Field(..., description="Whether item is imported")
 
+# Purchase Item record used inside MPR payloads. Same fields as PurchaseItem,
+# but declared as a TypedDict so a whole item list is validated in a single
+# pass straight into plain dicts, with no per-item model objects to build
+# and dump again before storage.
+class PurchaseItemRecord(TypedDict):
+    item_name: Annotated[str, Field(description="Name of the item")]
+    item_code: Annotated[str, Field(description="Item code")]
+    month_of_purchase: Annotated[str, Field(description="Month of purchase")]
+    fibre_code: Annotated[str, Field(description="Fibre code")]
+    sector_of_manufacture_code: Annotated[str, Field(description="Sector of manufacture code")]
+    colour_design_code: Annotated[str, Field(description="Colour/Design code")]
+    gender: NotRequired[Annotated[Optional[str], Field(description="Person gender (M/F)")]]
+    age: NotRequired[Annotated[Optional[int], Field(description="Person age")]]
+    type_of_shop_code: Annotated[str, Field(description="Type of shop code")]
+    purchase_type_code: Annotated[str, Field(description="Purchase type code")]
+    dress_intended_code: Annotated[str, Field(description="Dress intended code")]
+    length_in_meters: Annotated[float, Field(gt=0, description="Length in meters")]
+    price_per_meter: Annotated[float, Field(gt=0, description="Price per meter")]
+    total_amount_paid: Annotated[float, Field(gt=0, description="Total amount paid")]
+    brand_mill_name: Annotated[str, Field(description="Brand/Mill name")]
+    is_imported: Annotated[bool, Field(description="Whether item is imported")]
+
+PurchaseItemList = TypeAdapter(List[PurchaseItemRecord])
+
 # DPR (Demographic Particulars Return) Schema
 class DPRBase(BaseModel):
     name_and_address: str = Field(..., description="Name and address")
@@ -54,6 +99,33 @@ class DPRBase(BaseModel):
     month_and_year: str = Field(..., description="Month and year")
     household_members: List[HouseholdMember] = Field(..., description="Household members")
 
+    @field_validator("month_and_year")
+    @classmethod
+    def _check_month_and_year(cls, value):
+        return _check_period(value)
+
+    @field_validator("income_group")
+    @classmethod
+    def _check_dpr_codes(cls, value, info: ValidationInfo):
+        return _check_code(value, info.field_name, get_codebook().dpr_codes)
+
+    @field_validator("household_members")
+    @classmethod
+    def _check_member_codes(cls, members):
+        allowed = get_codebook().household_member_codes
+        errors = [
+            {"index": index, "field": field, "message": f"Unknown code '{code}'"}
+            for index, member in enumerate(members)
+            for field, code in check_codes(member.__dict__, allowed).items()
+        ]
+        if errors:
+            raise PydanticCustomError(
+                "household_members",
+                "{count} household member error(s)",
+                {"count": len(errors), "errors": errors}
+            )
+        return members
+
 class DPRCreate(DPRBase, LocationBase):
     otp_code: str = Field(..., description="OTP code for verification")
 
@@ -63,7 +135,6 @@ class DPRUpdate(DPRBase, LocationBase):
 class DPRResponse(DPRBase, LocationBase, TimestampBase):
     id: int
     otp_code: str
-    is_synced: bool = False
 
     class Config:
         from_attributes = True
@@ -79,7 +150,40 @@ class MPRBase(BaseModel):
     income_group: str = Field(..., description="Income group")
     month_and_year: str = Field(..., description="Month and year")
     occupation_of_head: str = Field(..., description="Occupation of head of family")
-    items: List[PurchaseItem] = Field(..., description="Purchase items")
+    items: List[PurchaseItemRecord] = Field(..., description="Purchase items")
+
+    @field_validator("items", mode="before")
+    @classmethod
+    def _items_as_mappings(cls, value):
+        # PurchaseItem models are still accepted from callers that build them explicitly
+        if isinstance(value, list):
+            return [item.model_dump() if isinstance(item, BaseModel) else item for item in value]
+        return value
+
+    @field_validator("month_and_year")
+    @classmethod
+    def _check_month_and_year(cls, value):
+        return _check_period(value)
+
+    @field_validator("income_group", "occupation_of_head")
+    @classmethod
+    def _check_mpr_codes(cls, value, info: ValidationInfo):
+        return _check_code(value, info.field_name, get_codebook().mpr_codes)
+
+    @field_validator("items")
+    @classmethod
+    def _check_items(cls, items):
+        errors = check_purchase_items(items, code_lists=get_codebook().purchase_item_codes)
+        if errors:
+            raise PydanticCustomError(
+                "purchase_items",
+                "{count} purchase item error(s)",
+                {"count": len(errors), "errors": errors}
+            )
+        for item in items:
+            item.setdefault("gender", None)
+            item.setdefault("age", None)
+        return items
 
 class MPRCreate(MPRBase, LocationBase):
     otp_code: str = Field(..., description="OTP code for verification")
@@ -90,7 +194,6 @@ class MPRUpdate(MPRBase, LocationBase):
 class MPRResponse(MPRBase, LocationBase, TimestampBase):
     id: int
     otp_code: str
-    is_synced: bool = False
 
     class Config:
         from_attributes = True
@@ -105,17 +208,29 @@ class FPBase(BaseModel):
     with_purchase_data: int = Field(..., ge=0, description="MPRs with purchase data")
     nil_mprs: int = Field(..., ge=0, description="Number of nil MPRs")
     nil_serial_nos: int = Field(..., ge=0, description="Number of nil serial numbers")
+    month_and_year: Optional[str] = Field(None, description="Month and year the counts are for; enables reconciliation with the MPRs")
+
+    @field_validator("month_and_year")
+    @classmethod
+    def _check_month_and_year(cls, value):
+        return _check_period(value) if value is not None else value
 
 class FPCreate(FPBase, LocationBase):
     pass
 
 class FPResponse(FPBase, LocationBase, TimestampBase):
     id: int
-    is_synced: bool = False
 
     class Config:
         from_attributes = True
 
+# Panel centre reference coordinates used by audit screening
+class CentreUpsert(BaseModel):
+    centre_name: Optional[str] = Field(None, description="Name of the centre")
+    state: Optional[str] = Field(None, description="State of the centre")
+    latitude: float = Field(..., ge=-90, le=90, description="Centre latitude")
+    longitude: float = Field(..., ge=-180, le=180, description="Centre longitude")
+
 # OTP Models
 class OTPRequest(BaseModel):
     phone_number: str = Field(..., description="Phone number to send OTP to")
@@ -0,0 +1,248 @@
+import logging
+import os
+from datetime import datetime
+from typing import List
+from sqlalchemy import MetaData, create_engine, func, select, text
+from sqlalchemy.orm import Session
+from database import DPR, MPR, PeriodPartition
+from periods import parse_period, format_period, next_period
+import crud
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# DPR and MPR are partitioned by reporting period. On PostgreSQL they are
+# declaratively partitioned (RANGE on period, one partition per month) and
+# queries filtered by period are pruned by the planner. SQLite has no
+# partitioning: live periods share one table, indexed on (period,
+# centre_code), and a detached period moves to its own SQLite file.
+# PostgreSQL databases created before partitioning keep plain tables (see
+# migration v0005) and are handled like SQLite.
+PARTITIONED_TABLES = {"dpr": DPR, "mpr": MPR}
+
+PARTITION_DIR = os.getenv(
+    "PARTITION_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "partitions")
+)
+
+# {(database url, table_name): bool}; a table only changes kind through a
+# migration, so its relkind is looked up once per process
+_partitioned = {}
+
+# (shard, table_name, period) triples whose PostgreSQL partition this
+# process has already created. Only the DDL is skipped for them: whether a
+# period is detached is checked on every write, since another worker may
+# have detached or archived it.
+_writable = set()
+
+
+class PeriodDetached(ValueError):
+    """A write targets a period that has been detached or archived"""
+
+
+def shard_of(db: Session) -> str:
+    # Sessions from shards.ShardRouter carry their shard name
+    return db.info.get("shard", "primary")
+
+
+def is_postgres(db: Session) -> bool:
+    """Whether the session's shard runs on PostgreSQL; shards may mix dialects"""
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def is_partitioned(db: Session, table_name: str) -> bool:
+    """Whether a table on the session's shard is declaratively partitioned"""
+    if not is_postgres(db):
+        return False
+    key = (str(db.get_bind().url), table_name)
+    if key not in _partitioned:
+        _partitioned[key] = bool(db.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = CAST(:name AS regclass)"), {"name": table_name}
+        ).scalar())
+    return _partitioned[key]
+
+
+def storage_dir(base: str, db: Session) -> str:
+    """Per-shard subdirectory of a storage directory; the primary uses it directly"""
+    shard = shard_of(db)
+    return base if shard == "primary" else os.path.join(base, shard)
+
+
+def partition_name(table_name: str, period: int) -> str:
+    """Name of the partition (or SQLite period file) holding one month"""
+    return f"{table_name}_p{period}"
+
+
+def set_period(record):
+    """Derive the period column from month_and_year"""
+    record.period = parse_period(record.month_and_year)
+
+
+def ensure_partition(db: Session, table_name: str, period: int):
+    """Make sure a period can take writes.
+
+    Raises PeriodDetached for a detached or archived period (one primary-key
+    lookup). On a partitioned PostgreSQL table the month's partition is
+    created on first use, under an advisory lock so concurrent workers do
+    not race on the DDL.
+    """
+    if db.get(PeriodPartition, (table_name, period)) is not None:
+        raise PeriodDetached(f"Period {format_period(period)} of {table_name} is detached")
+    if (shard_of(db), table_name, period) in _writable:
+        return
+    if is_partitioned(db, table_name):
+        name = partition_name(table_name, period)
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} "
+            f"FOR VALUES FROM ({period}) TO ({next_period(period)})"
+        ))
+    _writable.add((shard_of(db), table_name, period))
+
+
+def forget_writable(db: Session, table_name: str, period: int):
+    """Drop a period from this process's partition cache after it leaves the live table"""
+    _writable.discard((shard_of(db), table_name, period))
+
+
+def prepare_write(db: Session, table_name: str, record):
+    """Set a record's period and make sure its partition exists"""
+    set_period(record)
+    ensure_partition(db, table_name, record.period)
+
+
+def _period_file(db: Session, table_name: str, period: int) -> str:
+    return os.path.join(storage_dir(PARTITION_DIR, db), partition_name(table_name, period) + ".db")
+
+
+def _file_table(model, path: str):
+    # The live table's schema, bound to a per-period SQLite file
+    metadata = MetaData()
+    table = model.__table__.to_metadata(metadata)
+    engine = create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    return engine, table
+
+
+def detach_period(db: Session, table_name: str, period: int) -> dict:
+    """Take one month out of the live table.
+
+    On partitioned PostgreSQL tables the partition is detached, which only
+    changes catalog metadata; it stays in the database as a standalone
+    table. Otherwise the rows are moved to a per-period SQLite file. Detached periods drop out of
+    every query on the live table and reject new writes until attached
+    again.
+    """
+    model = PARTITIONED_TABLES[table_name]
+    try:
+        if db.get(PeriodPartition, (table_name, period)) is not None:
+            raise ValueError(f"Period {format_period(period)} of {table_name} is already detached")
+        row_count = db.query(func.count(model.id)).filter(model.period == period).scalar()
+        name = partition_name(table_name, period)
+
+        if is_partitioned(db, table_name):
+            if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+                raise ValueError(f"No partition for period {format_period(period)} of {table_name}")
+            db.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+            location = f"postgresql:{name}"
+        else:
+            if not row_count:
+                raise ValueError(f"No records for period {format_period(period)} of {table_name}")
+            location = _period_file(db, table_name, period)
+            os.makedirs(os.path.dirname(location), exist_ok=True)
+            if os.path.exists(location):
+                os.remove(location)
+            engine, table = _file_table(model, location)
+            try:
+                rows = db.execute(
+                    select(model.__table__).where(model.__table__.c.period == period).execution_options(yield_per=1000)
+                ).mappings()
+                with engine.begin() as conn:
+                    for chunk in rows.partitions():
+                        conn.execute(table.insert(), [dict(row) for row in chunk])
+            finally:
+                engine.dispose()
+            db.query(model).filter(model.period == period).delete(synchronize_session=False)
+
+        db.add(PeriodPartition(
+            table_name=table_name,
+            period=period,
+            location=location,
+            row_count=row_count,
+            detached_at=datetime.now()
+        ))
+        # Listings and stats change, so their validators must too
+        crud.bump_change_counter(db, table_name)
+        db.commit()
+        forget_writable(db, table_name, period)
+        crud.invalidate_cached_table(db, table_name)
+
+        logger.info(f"Detached {table_name} period {format_period(period)} ({row_count} rows) to {location}")
+        return {"table_name": table_name, "period": format_period(period), "rows": row_count, "location": location}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error detaching {table_name} period {period}: {str(e)}")
+        raise
+
+
+def attach_period(db: Session, table_name: str, period: int) -> dict:
+    """Bring a detached month back into the live table"""
+    model = PARTITIONED_TABLES[table_name]
+    try:
+        detached = db.get(PeriodPartition, (table_name, period))
+        if detached is None:
+            raise ValueError(f"Period {format_period(period)} of {table_name} is not detached")
+        location = detached.location
+
+        if is_partitioned(db, table_name):
+            db.execute(text(
+                f"ALTER TABLE {table_name} ATTACH PARTITION {partition_name(table_name, period)} "
+                f"FOR VALUES FROM ({period}) TO ({next_period(period)})"
+            ))
+        else:
+            engine, table = _file_table(model, location)
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(select(table).execution_options(yield_per=1000)).mappings()
+                    for chunk in rows.partitions():
+                        db.execute(model.__table__.insert(), [dict(row) for row in chunk])
+            finally:
+                engine.dispose()
+
+        row_count = detached.row_count
+        db.delete(detached)
+        crud.bump_change_counter(db, table_name)
+        db.commit()
+        crud.invalidate_cached_table(db, table_name)
+        if not is_partitioned(db, table_name):
+            os.remove(location)
+
+        logger.info(f"Attached {table_name} period {format_period(period)} from {location}")
+        return {"table_name": table_name, "period": format_period(period), "rows": row_count}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error attaching {table_name} period {period}: {str(e)}")
+        raise
+
+
+def list_periods(db: Session, table_name: str) -> List[dict]:
+    """Row counts of live periods, plus every detached period"""
+    model = PARTITIONED_TABLES[table_name]
+    periods = [
+        {"period": format_period(period), "status": "attached", "rows": count}
+        for period, count in db.query(model.period, func.count(model.id))
+        .filter(model.period.isnot(None))
+        .group_by(model.period)
+        .all()
+    ]
+    periods += [
+        {
+            "period": format_period(detached.period),
+            "status": "detached",
+            "rows": detached.row_count,
+            "location": detached.location,
+            "detached_at": detached.detached_at.isoformat() if detached.detached_at else None
+        }
+        for detached in db.query(PeriodPartition).filter(PeriodPartition.table_name == table_name)
+    ]
+    return sorted(periods, key=lambda entry: entry["period"])
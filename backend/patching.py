@@ -0,0 +1,207 @@
+import copy
+import difflib
+import json
+from typing import Any, List, Tuple
+
+# Partial updates of JSON documents: JSON Merge Patch (RFC 7386) replaces
+# or removes object members; JSON Patch (RFC 6902) is a list of operations
+# addressed by JSON Pointer, so single array elements (one purchase item,
+# one household member) can be added, replaced or removed.
+MERGE_PATCH = "application/merge-patch+json"
+JSON_PATCH = "application/json-patch+json"
+PATCH_MEDIA_TYPES = (MERGE_PATCH, JSON_PATCH)
+
+
+class PatchError(Exception):
+    """The patch document is malformed"""
+
+
+class PatchConflict(PatchError):
+    """The patch is well formed but cannot be applied to this document"""
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """Apply a JSON Merge Patch; ``target`` is modified where possible"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+    return target
+
+
+def parse_pointer(pointer: str) -> List[str]:
+    """Split a JSON Pointer into unescaped reference tokens"""
+    if not isinstance(pointer, str):
+        raise PatchError(f"Invalid JSON Pointer: {pointer!r}")
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON Pointer: {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _index(container: list, token: str, allow_end: bool = False) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise PatchConflict(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchConflict(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve(document: Any, tokens: List[str]) -> Any:
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchConflict(f"Path not found: /{'/'.join(tokens)}")
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[_index(document, token)]
+        else:
+            raise PatchConflict(f"Path not found: /{'/'.join(tokens)}")
+    return document
+
+
+def _parent(document: Any, pointer: str) -> Tuple[Any, str]:
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise PatchConflict("Operations on the whole document are not supported")
+    return _resolve(document, tokens[:-1]), tokens[-1]
+
+
+def _add(document: Any, pointer: str, value: Any):
+    parent, token = _parent(document, pointer)
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, token, allow_end=True), value)
+    else:
+        raise PatchConflict(f"Path not found: {pointer}")
+
+
+def _remove(document: Any, pointer: str) -> Any:
+    parent, token = _parent(document, pointer)
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise PatchConflict(f"Path not found: {pointer}")
+        return parent.pop(token)
+    if isinstance(parent, list):
+        return parent.pop(_index(parent, token))
+    raise PatchConflict(f"Path not found: {pointer}")
+
+
+def json_patch(document: Any, operations: Any) -> Any:
+    """Apply a JSON Patch; ``document`` is modified in place and returned.
+
+    Operations are applied in order and the patch is atomic for the caller:
+    on any error the caller's copy must be discarded.
+    """
+    if not isinstance(operations, list):
+        raise PatchError("A JSON Patch must be an array of operations")
+    for operation in operations:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise PatchError(f"Invalid patch operation: {operation!r}")
+        op, path = operation["op"], operation["path"]
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"Operation {op} at {path} needs a value")
+        if op in ("move", "copy") and "from" not in operation:
+            raise PatchError(f"Operation {op} at {path} needs a from pointer")
+
+        if op == "add":
+            _add(document, path, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            _remove(document, path)
+        elif op == "replace":
+            _remove(document, path)
+            _add(document, path, copy.deepcopy(operation["value"]))
+        elif op == "move":
+            if path.startswith(operation["from"] + "/"):
+                raise PatchConflict(f"Cannot move {operation['from']} into itself")
+            _add(document, path, _remove(document, operation["from"]))
+        elif op == "copy":
+            _add(document, path, copy.deepcopy(_resolve(document, parse_pointer(operation["from"]))))
+        elif op == "test":
+            if _resolve(document, parse_pointer(path)) != operation["value"]:
+                raise PatchConflict(f"Test failed at {path}")
+        else:
+            raise PatchError(f"Unknown patch operation: {op!r}")
+    return document
+
+
+def apply_patch(document: dict, patch: Any, media_type: str) -> dict:
+    """Apply a merge patch or JSON Patch to a copy of ``document``"""
+    patched = copy.deepcopy(document)
+    if media_type == JSON_PATCH:
+        patched = json_patch(patched, patch)
+    elif media_type == MERGE_PATCH:
+        if not isinstance(patch, dict):
+            raise PatchError("A merge patch for a record must be a JSON object")
+        patched = merge_patch(patched, patch)
+    else:
+        raise PatchError(f"Unsupported patch media type: {media_type}")
+    return patched
+
+
+def changed_fields(before: dict, after: dict) -> List[str]:
+    """Top-level fields whose values differ between two documents"""
+    return [key for key in after if key not in before or before[key] != after[key]] + \
+        [key for key in before if key not in after]
+
+
+def escape_token(token: str) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _element_key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _diff(source: Any, target: Any, path: str, operations: list):
+    if isinstance(source, dict) and isinstance(target, dict):
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": f"{path}/{escape_token(key)}"})
+        for key, value in target.items():
+            child = f"{path}/{escape_token(key)}"
+            if key not in source:
+                operations.append({"op": "add", "path": child, "value": copy.deepcopy(value)})
+            elif source[key] != value:
+                _diff(source[key], value, child, operations)
+    elif isinstance(source, list) and isinstance(target, list):
+        matcher = difflib.SequenceMatcher(
+            a=[_element_key(value) for value in source],
+            b=[_element_key(value) for value in target],
+            autojunk=False
+        )
+        # Last change first, so the indexes of earlier ones still hold
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if tag == "replace" and i2 - i1 == j2 - j1:
+                for offset in range(i2 - i1):
+                    _diff(source[i1 + offset], target[j1 + offset], f"{path}/{i1 + offset}", operations)
+                continue
+            for index in range(i2 - 1, i1 - 1, -1):
+                operations.append({"op": "remove", "path": f"{path}/{index}"})
+            for offset, value in enumerate(target[j1:j2]):
+                operations.append({"op": "add", "path": f"{path}/{i1 + offset}", "value": copy.deepcopy(value)})
+    elif source != target:
+        operations.append({"op": "replace", "path": path, "value": copy.deepcopy(target)})
+
+
+def make_patch(source: Any, target: Any) -> list:
+    """A JSON Patch that turns ``source`` into ``target``.
+
+    Lists are diffed element by element, so one changed purchase item
+    becomes one or two small operations rather than a copy of the list.
+    """
+    operations = []
+    _diff(source, target, "", operations)
+    return operations
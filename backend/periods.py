@@ -0,0 +1,56 @@
+import re
+from typing import Optional
+
+# Reporting periods are stored as integers YYYYMM (202401 for January 2024),
+# so they sort, compare and range-partition naturally.
+MONTH_NAMES = {
+    name: index
+    for index, names in enumerate([
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"),
+        ("may",), ("jun", "june"), ("jul", "july"), ("aug", "august"),
+        ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"), ("dec", "december"),
+    ], start=1)
+    for name in names
+}
+
+# "1/2024" and "01-2024" (app format), "2024-01", "January 2024", "Jan-24"
+MONTH_FIRST = re.compile(r"^\s*(\d{1,2})\s*[/\-. ]\s*(\d{4})\s*$")
+YEAR_FIRST = re.compile(r"^\s*(\d{4})\s*[/\-. ]\s*(\d{1,2})\s*$")
+NAMED_MONTH = re.compile(r"^\s*([A-Za-z]+)\.?\s*[/\-, ]?\s*(\d{2}|\d{4})\s*$")
+
+
+def parse_period(value: Optional[str]) -> int:
+    """Normalise a month_and_year string to a YYYYMM period; raises ValueError"""
+    if value is None:
+        raise ValueError("Missing month and year")
+
+    match = MONTH_FIRST.match(value)
+    if match:
+        month, year = int(match.group(1)), int(match.group(2))
+    else:
+        match = YEAR_FIRST.match(value)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+        else:
+            match = NAMED_MONTH.match(value)
+            if not match or match.group(1).lower() not in MONTH_NAMES:
+                raise ValueError(f"Unrecognised month and year: {value!r}")
+            month = MONTH_NAMES[match.group(1).lower()]
+            year = int(match.group(2))
+            if year < 100:
+                year += 2000
+
+    if not 1 <= month <= 12 or not 1900 <= year <= 9999:
+        raise ValueError(f"Unrecognised month and year: {value!r}")
+    return year * 100 + month
+
+
+def format_period(period: int) -> str:
+    """Format a YYYYMM period as ``YYYY-MM``"""
+    return f"{period // 100:04d}-{period % 100:02d}"
+
+
+def next_period(period: int) -> int:
+    """The period following ``period``"""
+    year, month = divmod(period, 100)
+    return (year + 1) * 100 + 1 if month == 12 else period + 1
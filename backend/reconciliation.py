@@ -0,0 +1,118 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from database import MPR, FP, DPRHead, AuditFlag
+from periods import format_period
+import archive
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Forwarding Proforma counts for a centre and period, computed from the
+# MPRs on the server. Every MPR keeps its number of purchase items in
+# item_count, and (centre_code, period, return_no, item_count) is indexed, so
+# the counts come from one aggregate over the index rather than from the
+# items themselves. A return counts once however many MPRs it filed: with
+# purchase data if any of them lists items, nil otherwise. The panel is the
+# centre's returns with a DPR. The app lists the serial numbers of nil
+# returns; the FP stores how many there are, so nil_serial_nos matches
+# nil_mprs.
+FP_COUNT_FIELDS = ("panel_size", "mpr_collected", "not_collected", "with_purchase_data", "nil_mprs", "nil_serial_nos")
+
+FP_MISMATCH_FLAG = "fp_count_mismatch"
+
+
+def item_count(items) -> int:
+    """Number of purchase items in an MPR's items (JSON text or list)"""
+    if not items:
+        return 0
+    if isinstance(items, str):
+        items = json.loads(items)
+    return len(items)
+
+
+def _archived_return_items(db: Session, centre_code: str, period: int) -> Dict[str, int]:
+    """Most purchase items filed by each return, read from an archived month"""
+    # Archive files may predate item_count, so the items are counted
+    per_return = {}
+    for row in archive.read_period(db, "mpr", period, centre_code, columns=["return_no", "items"]):
+        per_return[row["return_no"]] = max(per_return.get(row["return_no"], 0), item_count(row["items"]))
+    return per_return
+
+
+def panel_size(db: Session, centre_code: str) -> int:
+    """Returns of a centre with a DPR on file"""
+    return db.query(func.count()).select_from(DPRHead).filter(DPRHead.centre_code == centre_code).scalar()
+
+
+def expected_counts(db: Session, centre_code: str, period: int, submitted_panel_size: int = None) -> dict:
+    """The FP counts the server's MPRs support for a centre and period.
+
+    The panel size is taken from the DPRs; without any, from
+    ``submitted_panel_size`` if given.
+    """
+    if archive.is_archived(db, "mpr", period):
+        per_return = _archived_return_items(db, centre_code, period)
+        collected = len(per_return)
+        with_purchase = sum(1 for items in per_return.values() if items > 0)
+    else:
+        # One pass over the (centre_code, period, return_no, item_count) index
+        per_return = select(func.max(MPR.item_count).label("item_count")).where(
+            MPR.centre_code == centre_code, MPR.period == period
+        ).group_by(MPR.return_no).subquery()
+        collected, with_purchase = db.execute(select(
+            func.count(),
+            func.coalesce(func.sum(case((per_return.c.item_count > 0, 1), else_=0)), 0)
+        ).select_from(per_return)).one()
+    nil = collected - with_purchase
+
+    panel = panel_size(db, centre_code) or submitted_panel_size
+    return {
+        "centre_code": centre_code,
+        "period": format_period(period),
+        "panel_size": panel or None,
+        "mpr_collected": collected,
+        "not_collected": max(panel - collected, 0) if panel else None,
+        "with_purchase_data": with_purchase,
+        "nil_mprs": nil,
+        "nil_serial_nos": nil
+    }
+
+
+def reconcile_fp(db: Session, fp: FP) -> Optional[dict]:
+    """Compare a submitted FP with the expected counts and flag differences.
+
+    Replaces the FP's mismatch flag in the caller's transaction. Returns
+    None for an FP without a period.
+    """
+    if fp.period is None:
+        return None
+    expected = expected_counts(db, fp.centre_code, fp.period, fp.panel_size)
+    mismatches = {
+        field: {"submitted": getattr(fp, field), "expected": expected[field]}
+        for field in FP_COUNT_FIELDS
+        if expected[field] is not None and getattr(fp, field) != expected[field]
+    }
+
+    db.query(AuditFlag).filter(
+        AuditFlag.record_type == "fp",
+        AuditFlag.record_id == fp.id,
+        AuditFlag.flag_type == FP_MISMATCH_FLAG
+    ).delete(synchronize_session=False)
+    if mismatches:
+        db.add(AuditFlag(
+            record_type="fp",
+            record_id=fp.id,
+            centre_code=fp.centre_code,
+            flag_type=FP_MISMATCH_FLAG,
+            detail="; ".join(
+                f"{field}: submitted {values['submitted']}, expected {values['expected']}"
+                for field, values in mismatches.items()
+            ),
+            created_at=datetime.now()
+        ))
+        logger.warning(f"FP {fp.id} for centre {fp.centre_code} differs from its MPRs in {', '.join(mismatches)}")
+    return {"expected": expected, "mismatches": mismatches, "reconciled": not mismatches}
@@ -1,24 +1,71 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Request, Response, Query, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from datetime import datetime
-import logging
+import asyncio
 import json
+import logging
+import os
 import random
+import re
 import string
-from database import get_db
-from models import DPRCreate, MPRCreate, FPCreate, DPRUpdate, MPRUpdate, SuccessResponse, ErrorResponse, HealthResponse, OTPRequest, OTPResponse, OTPVerificationRequest, OTPVerificationResponse
-from crud import create_dpr, create_mpr, create_fp, get_database_stats, get_all_dpr, get_all_mpr, get_all_fp, update_dpr, update_mpr
+import uuid
+from database import DPR, MPR, FP, ImportJob
+from models import DPRCreate, MPRCreate, FPCreate, DPRUpdate, MPRUpdate, SuccessResponse, ErrorResponse, HealthResponse, OTPRequest, OTPResponse, OTPVerificationRequest, OTPVerificationResponse, CentreUpsert
+from codebook import get_codebook
+from crud import create_dpr, create_mpr, create_fp, get_all_dpr, get_all_mpr, get_all_fp, update_dpr, update_mpr, reconcile_fp, get_dpr_by_id, get_mpr_by_id, get_fp_by_id, dpr_document, mpr_document, patch_changes, VersionConflict, delete_dpr, delete_mpr, delete_fp, dpr_to_dict, mpr_to_dict, fp_to_dict, find_nearby, get_grid_counts
+from delta_sync import collect_changes
+import geo
+import patching
+import history
+from sync_ledger import claim_ranges, complete_range, release_range, get_range_records, get_range_tombstones, get_consumer_status
+from audit import screen_pending, get_audit_flags, audit_flag_to_dict, upsert_centre
+import consistency
+import similarity
+import estimates
+import partitions
+import archive
+from periods import parse_period
+import reconciliation
+import bundle
+import bulk_import
+from events import event_bus, format_sse, EVENT_HEARTBEAT
+from scheduler import scheduler
+from wire import NegotiatedRoute, NegotiatedResponse, MEDIA_TYPE_ALIASES, JSON, decode_body, representation_etag
+from shards import get_router, get_shard_db, named_shard_db, centre_shard_db, record_db, gather, scatter_counters, scatter_list, scatter_stats
+from cache import record_cache
+from admission import admission
+from http_cache import etag_matches, build_validators, cache_headers, is_not_modified
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create router
-router = APIRouter()
+# Every route negotiates JSON, MessagePack or CBOR (see wire.py)
+router = APIRouter(route_class=NegotiatedRoute, default_response_class=NegotiatedResponse)
 
 # In-memory OTP storage (in production, use Redis or database)
 otp_storage = {}
 
+# OTPs expire after 15 minutes; expired ones are purged by maintenance.py
+OTP_TTL_SECONDS = 900
+
+def purge_expired_otps(now: datetime = None) -> int:
+    """Drop expired OTPs from otp_storage; returns how many were dropped"""
+    now = now or datetime.now()
+    purged = 0
+    # Runs in a maintenance thread, so iterate over a copy
+    for key, stored in list(otp_storage.items()):
+        if (now - stored["created_at"]).total_seconds() > OTP_TTL_SECONDS:
+            # Unless a new OTP replaced it meanwhile
+            if otp_storage.get(key) is stored:
+                otp_storage.pop(key, None)
+                purged += 1
+    return purged
+
 def generate_otp():
     """Generate a 6-digit OTP"""
     return ''.join(random.choices(string.digits, k=6))
@@ -32,11 +79,29 @@ async def health_check():
         database="connected"
     )
 
+@router.get("/codebook", response_model=SuccessResponse)
+async def get_codebook_endpoint(request: Request, response: Response):
+    """Get the code master lists; answers 304 when the device copy is current"""
+    codebook = get_codebook()
+    etag = representation_etag(codebook.etag)
+    headers = {
+        "ETag": etag,
+        "X-Codebook-Version": codebook.version,
+        "Cache-Control": "no-cache"
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return SuccessResponse(
+        message="Code book retrieved successfully",
+        data=codebook.to_dict()
+    )
+
 @router.post("/dpr", response_model=SuccessResponse)
 async def create_dpr_endpoint(
     dpr_data: DPRCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    request: Request
 ):
     """Create a new DPR (Demographic Purchase Return) record for eMTC"""
     try:
@@ -45,7 +110,9 @@ async def create_dpr_endpoint(
         logger.info(f"DPR submission received from {client_ip} - Return No: {dpr_data.return_no}")
         
         # Create the DPR record
-        db_dpr = create_dpr(db, dpr_data)
+        # Written to the shard that holds the centre
+        with get_router().session_for_centre(dpr_data.centre_code) as db:
+            db_dpr = create_dpr(db, dpr_data)
         
         return SuccessResponse(
             message="DPR record created successfully",
@@ -55,6 +122,9 @@ async def create_dpr_endpoint(
                 "created_at": db_dpr.created_at.isoformat()
             }
         )
+    except ValueError as e:
+        # The record's period has been detached
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating DPR record: {str(e)}")
         raise HTTPException(
@@ -65,8 +135,7 @@ async def create_dpr_endpoint(
 @router.post("/mpr", response_model=SuccessResponse)
 async def create_mpr_endpoint(
     mpr_data: MPRCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    request: Request
 ):
     """Create a new MPR (Monthly Purchase Return) record for eMTC"""
     try:
@@ -75,7 +144,9 @@ async def create_mpr_endpoint(
         logger.info(f"MPR submission received from {client_ip} - Return No: {mpr_data.return_no}")
         
         # Create the MPR record
-        db_mpr = create_mpr(db, mpr_data)
+        # Written to the shard that holds the centre
+        with get_router().session_for_centre(mpr_data.centre_code) as db:
+            db_mpr = create_mpr(db, mpr_data)
         
         return SuccessResponse(
             message="MPR record created successfully",
@@ -85,6 +156,9 @@ async def create_mpr_endpoint(
                 "created_at": db_mpr.created_at.isoformat()
             }
         )
+    except ValueError as e:
+        # The record's period has been detached
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating MPR record: {str(e)}")
         raise HTTPException(
@@ -95,8 +169,7 @@ async def create_mpr_endpoint(
 @router.post("/fp", response_model=SuccessResponse)
 async def create_fp_endpoint(
     fp_data: FPCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    request: Request
 ):
     """Create a new FP (Forwarding Performa) record for eMTC"""
     try:
@@ -105,7 +178,14 @@ async def create_fp_endpoint(
         logger.info(f"FP submission received from {client_ip} - Centre: {fp_data.centre_name}")
         
         # Create the FP record
-        db_fp = create_fp(db, fp_data)
+        # Written to the shard that holds the centre
+        with get_router().session_for_centre(fp_data.centre_code) as db:
+            db_fp = create_fp(db, fp_data)
+            # Counts are checked against the MPRs when the FP names its period
+            try:
+                check = reconcile_fp(db, db_fp)
+            except Exception:
+                check = None
         
         return SuccessResponse(
             message="FP record created successfully",
@@ -113,7 +193,8 @@ async def create_fp_endpoint(
                 "id": db_fp.id,
                 "centre_name": db_fp.centre_name,
                 "centre_code": db_fp.centre_code,
-                "created_at": db_fp.created_at.isoformat()
+                "created_at": db_fp.created_at.isoformat(),
+                "reconciliation": check
             }
         )
     except Exception as e:
@@ -123,11 +204,59 @@ async def create_fp_endpoint(
             detail=f"Failed to create FP record: {str(e)}"
         )
 
+def _load_panel(period: int) -> estimates.Panel:
+    # Households and items of every shard
+    panels = get_router().scatter(lambda db: estimates.load_panel(db, period))
+    return estimates.Panel.concat([panels[name] for name in get_router().names])
+
+@router.get("/analytics/estimates")
+def get_estimates_endpoint(
+    request: Request,
+    response: Response,
+    period: str = Query(..., description="Reporting month, e.g. 2024-05"),
+    by: str = Query("income_group", description="Comma-separated: income_group, state, item, fibre, sector")
+):
+    """Per-capita textile quantity and value with standard errors, by the chosen dimensions"""
+    try:
+        period_value = parse_period(period)
+        dimensions = estimates.parse_dimensions(by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        counters = scatter_counters("mpr", "dpr")
+        etag, last_modified = build_validators(f"estimates-{period_value}-{'.'.join(dimensions)}", counters)
+        etag = representation_etag(etag)
+        headers = cache_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        result, cached = estimates.get_estimates(period_value, dimensions, counters, _load_panel)
+        response.headers["X-Estimates-Cache"] = "hit" if cached else "miss"
+        return SuccessResponse(
+            message="Estimates computed successfully",
+            data=result
+        )
+    except Exception as e:
+        logger.error(f"Error computing estimates for {period}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to compute estimates: {str(e)}"
+        )
+
 @router.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(request: Request, response: Response):
     """Get database statistics"""
     try:
-        stats = get_database_stats(db)
+        etag, last_modified = build_validators("stats", scatter_counters("dpr", "mpr", "fp", "sync_ledger"))
+        etag = representation_etag(etag)
+        headers = cache_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        # Summed over every shard
+        stats = scatter_stats()
         return SuccessResponse(
             message="Database statistics retrieved successfully",
             data=stats
@@ -140,34 +269,32 @@ async def get_stats(db: Session = Depends(get_db)):
         )
 
 @router.get("/dpr")
-async def get_all_dpr_endpoint(db: Session = Depends(get_db)):
+async def get_all_dpr_endpoint(
+    request: Request,
+    response: Response,
+    period: str = Query(None, description="Only records for this month, e.g. 2024-01")
+):
     """Get all DPR records"""
     try:
-        dpr_records = get_all_dpr(db)
+        period_value = parse_period(period) if period else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Unchanged tables are answered from the change counter alone
+        prefix = f"dpr-{period_value}" if period_value else "dpr"
+        etag, last_modified = build_validators(prefix, scatter_counters("dpr"))
+        etag = representation_etag(etag)
+        headers = cache_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        dpr_records = scatter_list(get_all_dpr, period=period_value)
         return SuccessResponse(
             message="DPR records retrieved successfully",
             data={
                 "count": len(dpr_records),
-                "records": [
-                    {
-                        "id": dpr.id,
-                        "name_and_address": dpr.name_and_address,
-                        "district": dpr.district,
-                        "state": dpr.state,
-                        "family_size": dpr.family_size,
-                        "income_group": dpr.income_group,
-                        "centre_code": dpr.centre_code,
-                        "return_no": dpr.return_no,
-                        "month_and_year": dpr.month_and_year,
-                        "household_members": json.loads(dpr.household_members) if dpr.household_members else [],
-                        "latitude": dpr.latitude,
-                        "longitude": dpr.longitude,
-                        "otp_code": dpr.otp_code,
-                        "created_at": dpr.created_at.isoformat(),
-                        "is_synced": dpr.is_synced
-                    }
-                    for dpr in dpr_records
-                ]
+                "records": [dpr_to_dict(dpr) for dpr in dpr_records]
             }
         )
     except Exception as e:
@@ -178,35 +305,32 @@ async def get_all_dpr_endpoint(db: Session = Depends(get_db)):
         )
 
 @router.get("/mpr")
-async def get_all_mpr_endpoint(db: Session = Depends(get_db)):
+async def get_all_mpr_endpoint(
+    request: Request,
+    response: Response,
+    period: str = Query(None, description="Only records for this month, e.g. 2024-01")
+):
     """Get all MPR records"""
     try:
-        mpr_records = get_all_mpr(db)
+        period_value = parse_period(period) if period else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        # Unchanged tables are answered from the change counter alone
+        prefix = f"mpr-{period_value}" if period_value else "mpr"
+        etag, last_modified = build_validators(prefix, scatter_counters("mpr"))
+        etag = representation_etag(etag)
+        headers = cache_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        mpr_records = scatter_list(get_all_mpr, period=period_value)
         return SuccessResponse(
             message="MPR records retrieved successfully",
             data={
                 "count": len(mpr_records),
-                "records": [
-                    {
-                        "id": mpr.id,
-                        "name_and_address": mpr.name_and_address,
-                        "district_state_tel": mpr.district_state_tel,
-                        "panel_centre": mpr.panel_centre,
-                        "centre_code": mpr.centre_code,
-                        "return_no": mpr.return_no,
-                        "family_size": mpr.family_size,
-                        "income_group": mpr.income_group,
-                        "month_and_year": mpr.month_and_year,
-                        "occupation_of_head": mpr.occupation_of_head,
-                        "items": json.loads(mpr.items) if mpr.items else [],
-                        "latitude": mpr.latitude,
-                        "longitude": mpr.longitude,
-                        "otp_code": mpr.otp_code,
-                        "created_at": mpr.created_at.isoformat(),
-                        "is_synced": mpr.is_synced
-                    }
-                    for mpr in mpr_records
-                ]
+                "records": [mpr_to_dict(mpr) for mpr in mpr_records]
             }
         )
     except Exception as e:
@@ -217,32 +341,23 @@ async def get_all_mpr_endpoint(db: Session = Depends(get_db)):
         )
 
 @router.get("/fp")
-async def get_all_fp_endpoint(db: Session = Depends(get_db)):
+async def get_all_fp_endpoint(request: Request, response: Response):
     """Get all FP records"""
     try:
-        fp_records = get_all_fp(db)
+        # Unchanged tables are answered from the change counter alone
+        etag, last_modified = build_validators("fp", scatter_counters("fp"))
+        etag = representation_etag(etag)
+        headers = cache_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        fp_records = scatter_list(get_all_fp)
         return SuccessResponse(
             message="FP records retrieved successfully",
             data={
                 "count": len(fp_records),
-                "records": [
-                    {
-                        "id": fp.id,
-                        "centre_name": fp.centre_name,
-                        "centre_code": fp.centre_code,
-                        "panel_size": fp.panel_size,
-                        "mpr_collected": fp.mpr_collected,
-                        "not_collected": fp.not_collected,
-                        "with_purchase_data": fp.with_purchase_data,
-                        "nil_mprs": fp.nil_mprs,
-                        "nil_serial_nos": fp.nil_serial_nos,
-                        "latitude": fp.latitude,
-                        "longitude": fp.longitude,
-                        "created_at": fp.created_at.isoformat(),
-                        "is_synced": fp.is_synced
-                    }
-                    for fp in fp_records
-                ]
+                "records": [fp_to_dict(fp) for fp in fp_records]
             }
         )
     except Exception as e:
@@ -252,12 +367,22 @@ async def get_all_fp_endpoint(db: Session = Depends(get_db)):
             detail=f"Failed to retrieve FP records: {str(e)}"
         )
 
+def _if_match_version(request: Request):
+    """The record version in an If-Match header ("v3", W/"v3" or 3), if any"""
+    value = request.headers.get("if-match")
+    if value is None or value.strip() == "*":
+        return None
+    match = re.fullmatch(r'\s*(?:W/)?"?v?(\d+)"?\s*', value)
+    if not match:
+        raise HTTPException(status_code=400, detail=f"Invalid If-Match header: {value}")
+    return int(match.group(1))
+
 @router.put("/dpr/{dpr_id}", response_model=SuccessResponse)
 async def update_dpr_endpoint(
     dpr_id: int,
     dpr_data: DPRUpdate,
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(record_db(DPR, "dpr_id"))
 ):
     """Update an existing DPR (Demographic Purchase Return) record"""
     try:
@@ -265,20 +390,32 @@ async def update_dpr_endpoint(
         client_ip = request.client.host if request.client else "unknown"
         logger.info(f"DPR update received from {client_ip} - ID: {dpr_id}, Return No: {dpr_data.return_no}")
         
+        # Moving a record to another centre must not move it to another shard
+        if get_router().locate_centre(dpr_data.centre_code) != db.info["shard"]:
+            raise HTTPException(
+                status_code=409,
+                detail="Centre code belongs to another shard; rebalance the centre instead"
+            )
+
         # Convert Pydantic model to dict for update
         update_data = dpr_data.dict()
         
         # Update the DPR record
-        db_dpr = update_dpr(db, dpr_id, update_data)
+        db_dpr = update_dpr(db, dpr_id, update_data, expected_version=_if_match_version(request))
         
         return SuccessResponse(
             message="DPR record updated successfully",
             data={
                 "id": db_dpr.id,
                 "return_no": db_dpr.return_no,
+                "version": db_dpr.version,
                 "updated_at": db_dpr.created_at.isoformat()
             }
         )
+    except HTTPException:
+        raise
+    except (VersionConflict, partitions.PeriodDetached) as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         logger.error(f"DPR record not found: {str(e)}")
         raise HTTPException(
@@ -297,7 +434,7 @@ async def update_mpr_endpoint(
     mpr_id: int,
     mpr_data: MPRUpdate,
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(record_db(MPR, "mpr_id"))
 ):
     """Update an existing MPR (Monthly Purchase Return) record"""
     try:
@@ -305,20 +442,32 @@ async def update_mpr_endpoint(
         client_ip = request.client.host if request.client else "unknown"
         logger.info(f"MPR update received from {client_ip} - ID: {mpr_id}, Return No: {mpr_data.return_no}")
         
+        # Moving a record to another centre must not move it to another shard
+        if get_router().locate_centre(mpr_data.centre_code) != db.info["shard"]:
+            raise HTTPException(
+                status_code=409,
+                detail="Centre code belongs to another shard; rebalance the centre instead"
+            )
+
         # Convert Pydantic model to dict for update
         update_data = mpr_data.dict()
         
         # Update the MPR record
-        db_mpr = update_mpr(db, mpr_id, update_data)
+        db_mpr = update_mpr(db, mpr_id, update_data, expected_version=_if_match_version(request))
         
         return SuccessResponse(
             message="MPR record updated successfully",
             data={
                 "id": db_mpr.id,
                 "return_no": db_mpr.return_no,
+                "version": db_mpr.version,
                 "updated_at": db_mpr.created_at.isoformat()
             }
         )
+    except HTTPException:
+        raise
+    except (VersionConflict, partitions.PeriodDetached) as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         logger.error(f"MPR record not found: {str(e)}")
         raise HTTPException(
@@ -332,6 +481,966 @@ async def update_mpr_endpoint(
             detail=f"Failed to update MPR record: {str(e)}"
         ) 
 
+async def _patch_endpoint(record_type: str, get_fn, document_fn, update_model, update_fn,
+                          record_id: int, request: Request, db: Session):
+    """Apply a merge patch or JSON Patch and write only the fields it changed"""
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    # Plain JSON, MessagePack and CBOR bodies are merge patches
+    body_format = MEDIA_TYPE_ALIASES.get(media_type, JSON)
+    if media_type in MEDIA_TYPE_ALIASES:
+        media_type = patching.MERGE_PATCH
+    if media_type not in patching.PATCH_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Use {patching.MERGE_PATCH}, {patching.JSON_PATCH} or a MessagePack/CBOR merge patch"
+        )
+    if body_format == JSON:
+        try:
+            patch = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Patch body is not valid JSON")
+    else:
+        patch = decode_body(await request.body(), body_format)
+        if isinstance(patch, list):
+            # A list of operations is a JSON Patch whatever it was encoded in
+            media_type = patching.JSON_PATCH
+
+    try:
+        record = get_fn(db, record_id)
+        if record is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{record_type} record not found: Record with ID {record_id} not found"
+            )
+        changes = patch_changes(document_fn(record), update_model, patch, media_type)
+
+        # Moving a record to another centre must not move it to another shard
+        if "centre_code" in changes and get_router().locate_centre(changes["centre_code"]) != db.info["shard"]:
+            raise HTTPException(
+                status_code=409,
+                detail="Centre code belongs to another shard; rebalance the centre instead"
+            )
+
+        expected_version = _if_match_version(request)
+        if expected_version is not None and record.version != expected_version:
+            raise VersionConflict(f"{record_type} record {record_id} is at version {record.version}, not {expected_version}")
+        if changes:
+            record = update_fn(db, record_id, dict(changes), expected_version=expected_version)
+        logger.info(f"{record_type} patched - ID: {record_id}, fields: {sorted(changes) or 'none'}")
+        return SuccessResponse(
+            message=f"{record_type} record patched successfully",
+            data={
+                "id": record.id,
+                "return_no": record.return_no,
+                "changed": sorted(changes),
+                "version": record.version,
+                "updated_at": record.updated_at.isoformat() if record.updated_at else None
+            }
+        )
+    except HTTPException:
+        raise
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except patching.PatchConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except patching.PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error patching {record_type} record: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to patch {record_type} record: {str(e)}"
+        )
+
+@router.patch("/dpr/{dpr_id}", response_model=SuccessResponse)
+async def patch_dpr_endpoint(dpr_id: int, request: Request, db: Session = Depends(record_db(DPR, "dpr_id"))):
+    """Partially update a DPR record (JSON Merge Patch or JSON Patch)"""
+    return await _patch_endpoint("DPR", get_dpr_by_id, dpr_document, DPRUpdate, update_dpr, dpr_id, request, db)
+
+@router.patch("/mpr/{mpr_id}", response_model=SuccessResponse)
+async def patch_mpr_endpoint(mpr_id: int, request: Request, db: Session = Depends(record_db(MPR, "mpr_id"))):
+    """Partially update an MPR record, e.g. one purchase item with JSON Patch"""
+    return await _patch_endpoint("MPR", get_mpr_by_id, mpr_document, MPRUpdate, update_mpr, mpr_id, request, db)
+
+def _get_endpoint(record_type: str, get_fn, to_dict, record_id: int, db: Session, response: Response = None):
+    try:
+        record = get_fn(db, record_id)
+        if record is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{record_type} record not found: Record with ID {record_id} not found"
+            )
+        if response is not None and getattr(record, "version", None) is not None:
+            # Sent back in If-Match by PUT/PATCH to reject concurrent edits
+            response.headers["ETag"] = f'"v{record.version}"'
+        return SuccessResponse(
+            message=f"{record_type} record retrieved successfully",
+            data=to_dict(record)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving {record_type} record: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve {record_type} record: {str(e)}"
+        )
+
+@router.get("/dpr/{dpr_id}", response_model=SuccessResponse)
+async def get_dpr_endpoint(dpr_id: int, response: Response, db: Session = Depends(record_db(DPR, "dpr_id"))):
+    """Get one DPR record; hot records are served from the record cache"""
+    return _get_endpoint("DPR", get_dpr_by_id, dpr_to_dict, dpr_id, db, response)
+
+@router.get("/mpr/{mpr_id}", response_model=SuccessResponse)
+async def get_mpr_endpoint(mpr_id: int, response: Response, db: Session = Depends(record_db(MPR, "mpr_id"))):
+    """Get one MPR record; hot records are served from the record cache"""
+    return _get_endpoint("MPR", get_mpr_by_id, mpr_to_dict, mpr_id, db, response)
+
+@router.get("/fp/expected/{centre_code}/{period}", response_model=SuccessResponse)
+def get_fp_expected_endpoint(centre_code: str, period: str):
+    """FP counts for a centre and period computed from the MPRs on the server, to pre-fill the proforma"""
+    try:
+        period_value = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        with get_router().session_for_centre(centre_code) as db:
+            expected = reconciliation.expected_counts(db, centre_code, period_value)
+        return SuccessResponse(
+            message="Expected FP counts computed successfully",
+            data=expected
+        )
+    except Exception as e:
+        logger.error(f"Error computing expected FP counts for {centre_code}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to compute expected FP counts: {str(e)}"
+        )
+
+@router.get("/bundle/{centre_code}/{period}")
+def get_mpr_bundle_endpoint(centre_code: str, period: str):
+    """Stream every MPR of a centre and period as a ZIP with a SHA-256 manifest"""
+    try:
+        period_value = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        with get_router().session_for_centre(centre_code) as db:
+            found = bundle.has_records(db, centre_code, period_value)
+    except Exception as e:
+        logger.error(f"Error preparing MPR bundle for {centre_code}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to prepare MPR bundle: {str(e)}")
+    if not found:
+        raise HTTPException(status_code=404, detail=f"No MPR records for centre {centre_code} in {period}")
+
+    def content():
+        # The session lives as long as the response streams
+        with get_router().session_for_centre(centre_code) as db:
+            yield from bundle.stream_bundle(db, centre_code, period_value)
+
+    return StreamingResponse(
+        content(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{bundle.bundle_filename(centre_code, period_value)}"'}
+    )
+
+@router.get("/fp/{fp_id}", response_model=SuccessResponse)
+async def get_fp_endpoint(fp_id: int, db: Session = Depends(record_db(FP, "fp_id"))):
+    """Get one FP record; hot records are served from the record cache"""
+    return _get_endpoint("FP", get_fp_by_id, fp_to_dict, fp_id, db)
+
+def _history_endpoint(record_type: str, table_name: str, record_id: int, version, at, db: Session):
+    try:
+        at_value = datetime.fromisoformat(at) if at else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {at}")
+    try:
+        if version is None and at_value is None:
+            versions = history.list_versions(db, table_name, record_id)
+            if not versions:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"{record_type} record not found: Record with ID {record_id} not found"
+                )
+            return SuccessResponse(
+                message=f"{record_type} history retrieved successfully",
+                data={"id": record_id, "versions": versions}
+            )
+
+        record = history.reconstruct(db, table_name, record_id, version=version, at=at_value)
+        if record is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"{record_type} record {record_id} did not exist at that version or time"
+            )
+        return SuccessResponse(
+            message=f"{record_type} version retrieved successfully",
+            data=record
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving {record_type} history: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve {record_type} history: {str(e)}"
+        )
+
+@router.get("/dpr/{dpr_id}/history", response_model=SuccessResponse)
+async def get_dpr_history_endpoint(
+    dpr_id: int,
+    version: int = Query(None, description="Rebuild the record at this version"),
+    at: str = Query(None, description="Rebuild the record as it was at this time (ISO 8601)"),
+    db: Session = Depends(record_db(DPR, "dpr_id"))
+):
+    """List a DPR's versions, or rebuild it at a version or point in time"""
+    return _history_endpoint("DPR", "dpr", dpr_id, version, at, db)
+
+@router.get("/mpr/{mpr_id}/history", response_model=SuccessResponse)
+async def get_mpr_history_endpoint(
+    mpr_id: int,
+    version: int = Query(None, description="Rebuild the record at this version"),
+    at: str = Query(None, description="Rebuild the record as it was at this time (ISO 8601)"),
+    db: Session = Depends(record_db(MPR, "mpr_id"))
+):
+    """List an MPR's versions, or rebuild it at a version or point in time"""
+    return _history_endpoint("MPR", "mpr", mpr_id, version, at, db)
+
+@router.get("/cache", response_model=SuccessResponse)
+async def get_cache_stats_endpoint():
+    """Record cache counters: hits, misses, evictions and invalidations"""
+    return SuccessResponse(
+        message="Cache statistics retrieved successfully",
+        data=dict(record_cache.store.stats(), shared=record_cache.backend is not None)
+    )
+
+@router.get("/admission", response_model=SuccessResponse)
+async def get_admission_stats_endpoint():
+    """Admission counters: admitted, rate limited and shed requests, queue depth"""
+    return SuccessResponse(
+        message="Admission statistics retrieved successfully",
+        data=admission.stats()
+    )
+
+def _filters(value: str):
+    """Comma-separated filter values, e.g. ``?centre_code=C001,C002``"""
+    return [part.strip() for part in value.split(",")] if value else None
+
+@router.get("/stream")
+async def stream_events_endpoint(request: Request, centre_code: str = None, state: str = None, record_type: str = None):
+    """Live feed of DPR/MPR/FP writes as server-sent events.
+
+    Filters take comma-separated values. A client that falls too far behind
+    gets a final ``dropped`` event and is disconnected.
+    """
+    subscriber = event_bus.subscribe(_filters(centre_code), _filters(state), _filters(record_type))
+
+    async def content():
+        try:
+            # Lets proxies and clients see the stream open before the first write
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    if subscriber.dropped:
+                        yield "event: dropped\ndata: {}\n\n"
+                    break
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        content(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/stream/ws")
+async def stream_events_websocket(websocket: WebSocket, centre_code: str = None, state: str = None, record_type: str = None):
+    """Live feed of DPR/MPR/FP writes as JSON WebSocket messages"""
+    await websocket.accept()
+    subscriber = event_bus.subscribe(_filters(centre_code), _filters(state), _filters(record_type))
+
+    async def disconnected():
+        # Clients never send anything; this returns once they go away
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        while True:
+            getter = asyncio.ensure_future(subscriber.get())
+            await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            event = getter.result()
+            if event is None:
+                if subscriber.dropped:
+                    await websocket.send_json({"event": "dropped"})
+                await websocket.close()
+                break
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        event_bus.unsubscribe(subscriber)
+
+@router.get("/stream/stats", response_model=SuccessResponse)
+async def get_stream_stats_endpoint():
+    """Live feed counters: subscribers, events published, delivered and dropped"""
+    return SuccessResponse(
+        message="Live feed statistics retrieved successfully",
+        data=event_bus.stats()
+    )
+
+@router.get("/maintenance", response_model=SuccessResponse)
+def get_maintenance_stats_endpoint():
+    """Maintenance jobs: runs, failures, timeouts and durations, here and cluster-wide"""
+    try:
+        return SuccessResponse(
+            message="Maintenance statistics retrieved successfully",
+            data=scheduler.stats()
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving maintenance statistics: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve maintenance statistics: {str(e)}"
+        )
+
+@router.post("/imports/{table_name}", response_model=SuccessResponse, status_code=202)
+async def start_import_endpoint(
+    table_name: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(..., description="CSV or XLSX sheet of paper returns")
+):
+    """Bulk import a sheet of DPRs or MPRs in the background; the same file again resumes its job"""
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    try:
+        bulk_import.check_table(table_name)
+        if extension not in bulk_import.EXTENSIONS:
+            raise ValueError(f"Unsupported file type {extension or '(none)'}; use {' or '.join(bulk_import.EXTENSIONS)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        os.makedirs(bulk_import.IMPORT_DIR, exist_ok=True)
+        path = os.path.join(bulk_import.IMPORT_DIR, f"{uuid.uuid4().hex}{extension}")
+        with open(path, "wb") as f:
+            while block := await file.read(1 << 20):
+                f.write(block)
+        job = bulk_import.start_job(path, table_name, file.filename)
+        if job.path != path:
+            # An earlier upload of the same file is still on disk
+            os.remove(path)
+        if job.status != "completed":
+            background_tasks.add_task(bulk_import.run_job_in_background, job.id)
+        return SuccessResponse(
+            message="File already imported" if job.status == "completed" else "Import started",
+            data=bulk_import.job_to_dict(job)
+        )
+    except Exception as e:
+        logger.error(f"Error starting {table_name.upper()} import: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to start import: {str(e)}"
+        )
+
+@router.get("/imports/{job_id}", response_model=SuccessResponse)
+def get_import_endpoint(
+    job_id: int,
+    kind: str = Query(None, pattern="^(error|skipped|warning)$"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """An import job's progress and its per-row report"""
+    try:
+        # Jobs live on the primary shard
+        with get_router().open() as db:
+            job = db.get(ImportJob, job_id)
+            if job is None:
+                raise ValueError(f"Import job {job_id} not found")
+            data = bulk_import.job_to_dict(job)
+            data["rows"] = [
+                bulk_import.row_error_to_dict(error) for error in bulk_import.get_errors(db, job_id, kind, skip, limit)
+            ]
+        return SuccessResponse(message="Import job retrieved successfully", data=data)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error retrieving import job {job_id}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve import job: {str(e)}"
+        )
+
+@router.post("/imports/{job_id}/resume", response_model=SuccessResponse, status_code=202)
+def resume_import_endpoint(job_id: int, background_tasks: BackgroundTasks):
+    """Carry on a failed import from the last loaded chunk"""
+    with get_router().open() as db:
+        job = db.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    if job.status == "running":
+        raise HTTPException(status_code=409, detail=f"Import job {job_id} is already running")
+    if job.status != "completed":
+        background_tasks.add_task(bulk_import.run_job_in_background, job_id)
+    return SuccessResponse(
+        message="File already imported" if job.status == "completed" else "Import resumed",
+        data=bulk_import.job_to_dict(job)
+    )
+
+def _delete_endpoint(record_type: str, delete_fn, record_id: int, db: Session):
+    try:
+        if not delete_fn(db, record_id):
+            raise HTTPException(
+                status_code=404,
+                detail=f"{record_type} record not found: Record with ID {record_id} not found"
+            )
+        return SuccessResponse(
+            message=f"{record_type} record deleted successfully",
+            data={"id": record_id}
+        )
+    except HTTPException:
+        raise
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error deleting {record_type} record: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to delete {record_type} record: {str(e)}"
+        )
+
+@router.delete("/dpr/{dpr_id}", response_model=SuccessResponse)
+async def delete_dpr_endpoint(dpr_id: int, db: Session = Depends(record_db(DPR, "dpr_id"))):
+    """Delete a DPR record"""
+    return _delete_endpoint("DPR", delete_dpr, dpr_id, db)
+
+@router.delete("/mpr/{mpr_id}", response_model=SuccessResponse)
+async def delete_mpr_endpoint(mpr_id: int, db: Session = Depends(record_db(MPR, "mpr_id"))):
+    """Delete an MPR record"""
+    return _delete_endpoint("MPR", delete_mpr, mpr_id, db)
+
+@router.delete("/fp/{fp_id}", response_model=SuccessResponse)
+async def delete_fp_endpoint(fp_id: int, db: Session = Depends(record_db(FP, "fp_id"))):
+    """Delete an FP record"""
+    return _delete_endpoint("FP", delete_fp, fp_id, db)
+
+@router.get("/sync/changes", response_model=SuccessResponse)
+async def get_sync_changes_endpoint(
+    since: str = Query(None, description="Sync token from the previous call; omit for a full sync"),
+    centre_code: str = Query(None, description="Only return changes for this centre"),
+    limit: int = Query(500, ge=1, le=5000, description="Maximum changes per record type"),
+    db: Session = Depends(centre_shard_db)
+):
+    """Get records created, updated or deleted since a sync token"""
+    try:
+        changes = collect_changes(db, since, centre_code, limit)
+        return SuccessResponse(
+            message="Changes retrieved successfully",
+            data=changes
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving sync changes: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve sync changes: {str(e)}"
+        )
+
+RECORD_SERIALIZERS = {"dpr": dpr_to_dict, "mpr": mpr_to_dict, "fp": fp_to_dict}
+
+@router.post("/ledger/{consumer}/{table_name}/claim", response_model=SuccessResponse)
+async def claim_ledger_ranges_endpoint(
+    consumer: str,
+    table_name: str,
+    worker: str = Query(..., description="Identifier of the claiming worker"),
+    max_ranges: int = Query(1, ge=1, le=20, description="Maximum ranges to claim"),
+    db: Session = Depends(named_shard_db)
+):
+    """Claim a batch of unprocessed changes for a downstream consumer"""
+    try:
+        ranges = claim_ranges(db, consumer, table_name, worker, max_ranges)
+        to_dict = RECORD_SERIALIZERS[table_name]
+        return SuccessResponse(
+            message=f"{len(ranges)} ledger range(s) claimed",
+            data={
+                "ranges": [
+                    {
+                        "id": ledger_range.id,
+                        "start_seq": ledger_range.start_seq,
+                        "end_seq": ledger_range.end_seq,
+                        "records": [to_dict(record) for record in get_range_records(db, ledger_range)],
+                        "deleted": [tombstone.record_id for tombstone in get_range_tombstones(db, ledger_range)]
+                    }
+                    for ledger_range in ranges
+                ]
+            }
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error claiming ledger ranges: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to claim ledger ranges: {str(e)}"
+        )
+
+@router.post("/ledger/ranges/{range_id}/complete", response_model=SuccessResponse)
+async def complete_ledger_range_endpoint(
+    range_id: int,
+    worker: str = Query(..., description="Identifier of the worker that claimed the range"),
+    db: Session = Depends(named_shard_db)
+):
+    """Mark a claimed ledger range as processed"""
+    try:
+        committed_seq = complete_range(db, range_id, worker)
+        return SuccessResponse(
+            message="Ledger range completed",
+            data={"id": range_id, "committed_seq": committed_seq}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error completing ledger range: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to complete ledger range: {str(e)}"
+        )
+
+@router.post("/ledger/ranges/{range_id}/release", response_model=SuccessResponse)
+async def release_ledger_range_endpoint(range_id: int, db: Session = Depends(named_shard_db)):
+    """Return a claimed ledger range to the pending pool"""
+    try:
+        release_range(db, range_id)
+        return SuccessResponse(message="Ledger range released", data={"id": range_id})
+    except Exception as e:
+        logger.error(f"Error releasing ledger range: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to release ledger range: {str(e)}"
+        )
+
+@router.get("/ledger/{consumer}", response_model=SuccessResponse)
+async def get_ledger_status_endpoint(consumer: str, db: Session = Depends(named_shard_db)):
+    """Get a downstream consumer's processing progress"""
+    try:
+        return SuccessResponse(
+            message="Ledger status retrieved successfully",
+            data=get_consumer_status(db, consumer)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+GEO_MODELS = {"dpr": DPR, "mpr": MPR, "fp": FP}
+
+@router.get("/geo/nearby", response_model=SuccessResponse)
+async def get_nearby_endpoint(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(5.0, gt=0, le=500),
+    record_type: str = Query("mpr", pattern="^(dpr|mpr|fp)$"),
+    centre_code: str = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    shard: str = Query(None, description="Only this shard; defaults to every shard")
+):
+    """Get records submitted within a radius of a point, nearest first"""
+    try:
+        # Each shard ranks its own candidates; the nearest of all are kept
+        results = gather(lambda db: find_nearby(
+            db, GEO_MODELS[record_type], latitude, longitude, radius_km, centre_code, limit
+        ), shard).values()
+        nearby = sorted((match for matches, _ in results for match in matches), key=lambda match: match[0])[:limit]
+        truncated = any(truncated for _, truncated in results)
+        to_dict = RECORD_SERIALIZERS[record_type]
+        return SuccessResponse(
+            message="Nearby records retrieved successfully",
+            data={
+                "count": len(nearby),
+                # More candidates than could be ranked: narrow the radius
+                "truncated": truncated,
+                "records": [
+                    dict(to_dict(record), distance_km=round(distance, 3))
+                    for distance, record in nearby
+                ]
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving nearby records: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve nearby records: {str(e)}"
+        )
+
+@router.get("/geo/grid", response_model=SuccessResponse)
+async def get_grid_endpoint(
+    precision: int = Query(5, ge=1, le=geo.GEOHASH_PRECISION, description="Geohash precision of the grid cells"),
+    record_type: str = Query("mpr", pattern="^(dpr|mpr|fp)$"),
+    centre_code: str = Query(None),
+    prefix: str = Query(None, description="Only cells inside this geohash prefix"),
+    shard: str = Query(None, description="Only this shard; defaults to every shard")
+):
+    """Count records per geohash grid cell"""
+    try:
+        counts = {}
+        for rows in gather(lambda db: get_grid_counts(db, GEO_MODELS[record_type], precision, centre_code, prefix),
+                           shard).values():
+            for cell, count in rows:
+                counts[cell] = counts.get(cell, 0) + count
+        cells = []
+        for cell, count in sorted(counts.items()):
+            min_lat, min_lon, max_lat, max_lon = geo.decode_bounds(cell)
+            cells.append({
+                "cell": cell,
+                "count": count,
+                "latitude": (min_lat + max_lat) / 2,
+                "longitude": (min_lon + max_lon) / 2,
+                "bounds": [min_lat, min_lon, max_lat, max_lon]
+            })
+        return SuccessResponse(
+            message="Grid counts retrieved successfully",
+            data={"precision": precision, "cells": cells}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving grid counts: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve grid counts: {str(e)}"
+        )
+
+@router.put("/audit/centres/{centre_code}", response_model=SuccessResponse)
+def upsert_centre_endpoint(centre_code: str, centre: CentreUpsert):
+    """Set a panel centre's reference coordinates for GPS screening"""
+    try:
+        # Reference data, copied to every shard
+        get_router().scatter(lambda db: upsert_centre(
+            db, centre_code, centre.latitude, centre.longitude, centre.centre_name, centre.state
+        ))
+        return SuccessResponse(
+            message="Centre saved successfully",
+            data={
+                "centre_code": centre_code,
+                "centre_name": centre.centre_name,
+                "state": centre.state,
+                "latitude": centre.latitude,
+                "longitude": centre.longitude
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error saving centre: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to save centre: {str(e)}"
+        )
+
+@router.post("/audit/screen", response_model=SuccessResponse)
+def run_audit_screening_endpoint(
+    max_ranges: int = Query(10, ge=1, le=100),
+    shard: str = Query(None, description="Only this shard; defaults to every shard")
+):
+    """Screen pending DPR/MPR changes now instead of waiting for the background pass"""
+    try:
+        written = gather(lambda db: screen_pending(db, worker="audit-api", max_ranges=max_ranges), shard)
+        return SuccessResponse(
+            message="Audit screening completed",
+            data={"flags_written": sum(written.values())}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error running audit screening: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to run audit screening: {str(e)}"
+        )
+
+@router.get("/audit/flags", response_model=SuccessResponse)
+async def get_audit_flags_endpoint(
+    flag_type: str = Query(None, pattern="^(far_from_centre|duplicate_coordinates|near_duplicate)$"),
+    centre_code: str = Query(None),
+    record_type: str = Query(None, pattern="^(dpr|mpr)$"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    shard: str = Query(None, description="Only this shard; defaults to every shard")
+):
+    """Get GPS screening and near-duplicate flags, newest first"""
+    try:
+        flags = scatter_list(
+            get_audit_flags, skip, limit, key=lambda flag: (flag.created_at, flag.id), reverse=True, shard=shard,
+            flag_type=flag_type, centre_code=centre_code, record_type=record_type
+        )
+        return SuccessResponse(
+            message="Audit flags retrieved successfully",
+            data={"count": len(flags), "flags": [audit_flag_to_dict(flag) for flag in flags]}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving audit flags: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve audit flags: {str(e)}"
+        )
+
+@router.get("/audit/near-duplicates/{mpr_id}", response_model=SuccessResponse)
+async def get_near_duplicates_endpoint(
+    mpr_id: int,
+    threshold: float = Query(None, gt=0, le=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(record_db(MPR, "mpr_id"))
+):
+    """MPRs of the same period that look like re-entries of this one, most similar first"""
+    try:
+        matches = similarity.find_near_duplicates(db, mpr_id, threshold, limit)
+        return SuccessResponse(
+            message="Near-duplicate MPRs retrieved successfully",
+            data={"mpr_id": mpr_id, "count": len(matches), "matches": matches}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error finding near-duplicates of MPR {mpr_id}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to find near-duplicate MPRs: {str(e)}"
+        )
+
+@router.get("/consistency/mismatches", response_model=SuccessResponse)
+async def get_mismatches_endpoint(
+    centre_code: str = Query(None),
+    field: str = Query(None, pattern="^(family_size|income_group|occupation_of_head)$"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    shard: str = Query(None, description="Only this shard; defaults to every shard")
+):
+    """Get MPRs whose header disagrees with the head of household on their DPR"""
+    try:
+        mismatches = scatter_list(
+            consistency.get_mismatches, skip, limit, key=lambda mismatch: (mismatch.detected_at, mismatch.id),
+            reverse=True, shard=shard, centre_code=centre_code, field=field
+        )
+        counts = {}
+        for shard_counts in gather(lambda db: consistency.get_mismatch_counts(db, centre_code), shard).values():
+            for name, count in shard_counts.items():
+                counts[name] = counts.get(name, 0) + count
+        return SuccessResponse(
+            message="Consistency mismatches retrieved successfully",
+            data={
+                "counts": counts,
+                "mismatches": [consistency.mismatch_to_dict(mismatch) for mismatch in mismatches]
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving consistency mismatches: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve consistency mismatches: {str(e)}"
+        )
+
+@router.post("/consistency/rebuild", response_model=SuccessResponse)
+def rebuild_consistency_endpoint(shard: str = Query(None, description="Only this shard; defaults to every shard")):
+    """Rebuild the DPR index and mismatch report from all stored records"""
+    try:
+        totals = {"indexed_returns": 0, "mismatches": 0}
+        for result in gather(consistency.rebuild, shard).values():
+            for key in totals:
+                totals[key] += result[key]
+        return SuccessResponse(
+            message="Consistency index rebuilt successfully",
+            data=totals
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error rebuilding consistency index: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to rebuild consistency index: {str(e)}"
+        )
+
+@router.get("/partitions/{table_name}", response_model=SuccessResponse)
+async def list_partitions_endpoint(table_name: str, db: Session = Depends(get_shard_db)):
+    """List live and detached periods of the DPR or MPR table"""
+    if table_name not in partitions.PARTITIONED_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table_name}")
+    try:
+        return SuccessResponse(
+            message="Periods retrieved successfully",
+            data={"table_name": table_name, "periods": partitions.list_periods(db, table_name)}
+        )
+    except Exception as e:
+        logger.error(f"Error listing periods: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to list periods: {str(e)}"
+        )
+
+def _partition_action(action, table_name: str, period: str, db: Session):
+    if table_name not in partitions.PARTITIONED_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table: {table_name}")
+    try:
+        period_value = parse_period(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return action(db, table_name, period_value)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error changing period {period} of {table_name}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to change period: {str(e)}"
+        )
+
+@router.post("/partitions/{table_name}/{period}/detach", response_model=SuccessResponse)
+def detach_period_endpoint(table_name: str, period: str, db: Session = Depends(get_shard_db)):
+    """Detach one month from the live table"""
+    return SuccessResponse(
+        message="Period detached successfully",
+        data=_partition_action(partitions.detach_period, table_name, period, db)
+    )
+
+@router.post("/partitions/{table_name}/{period}/attach", response_model=SuccessResponse)
+def attach_period_endpoint(table_name: str, period: str, db: Session = Depends(get_shard_db)):
+    """Bring a detached month back into the live table"""
+    return SuccessResponse(
+        message="Period attached successfully",
+        data=_partition_action(partitions.attach_period, table_name, period, db)
+    )
+
+@router.get("/archive", response_model=SuccessResponse)
+async def get_archive_manifest_endpoint(
+    verify: bool = Query(False, description="Re-check every file's SHA-256"),
+    db: Session = Depends(get_shard_db)
+):
+    """List archived periods from the archive manifest"""
+    try:
+        directory = archive.archive_dir(db)
+        manifest = archive.load_manifest(directory)
+        data = {"entries": list(manifest["entries"].values())}
+        if verify:
+            data["verified"] = archive.verify_all(directory)
+        return SuccessResponse(message="Archive manifest retrieved successfully", data=data)
+    except Exception as e:
+        logger.error(f"Error reading archive manifest: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to read archive manifest: {str(e)}"
+        )
+
+@router.post("/archive/run", response_model=SuccessResponse)
+def run_archival_endpoint(db: Session = Depends(get_shard_db)):
+    """Archive every closed period now"""
+    try:
+        archived = archive.archive_closed_periods(db)
+        return SuccessResponse(
+            message=f"{len(archived)} period(s) archived",
+            data={"archived": archived}
+        )
+    except Exception as e:
+        logger.error(f"Error running archival: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to run archival: {str(e)}"
+        )
+
+@router.post("/archive/{table_name}/{period}", response_model=SuccessResponse)
+def archive_period_endpoint(table_name: str, period: str, db: Session = Depends(get_shard_db)):
+    """Move one month of DPR or MPR records to cold storage"""
+    return SuccessResponse(
+        message="Period archived successfully",
+        data=_partition_action(archive.archive_period, table_name, period, db)
+    )
+
+@router.post("/archive/{table_name}/{period}/restore", response_model=SuccessResponse)
+def restore_period_endpoint(table_name: str, period: str, db: Session = Depends(get_shard_db)):
+    """Bring an archived month back into the live table"""
+    return SuccessResponse(
+        message="Period restored successfully",
+        data=_partition_action(archive.restore_period, table_name, period, db)
+    )
+
+@router.get("/shards", response_model=SuccessResponse)
+def get_shards_endpoint():
+    """List shards with their record counts, and the routing assignments"""
+    try:
+        shard_router = get_router()
+        counts = shard_router.scatter(lambda db: {
+            "dpr": db.query(DPR).count(),
+            "mpr": db.query(MPR).count(),
+            "fp": db.query(FP).count()
+        })
+        return SuccessResponse(
+            message="Shards retrieved successfully",
+            data={
+                "primary": shard_router.primary,
+                "shards": [{"name": name, "records": counts[name]} for name in shard_router.names],
+                "assignments": shard_router.assignments()
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving shards: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to retrieve shards: {str(e)}"
+        )
+
+@router.put("/shards/assignments/{key_type}/{key}", response_model=SuccessResponse)
+def assign_shard_endpoint(key_type: str, key: str, shard: str = Query(...)):
+    """Pin a centre or a state to a shard for new centres and future writes"""
+    try:
+        get_router().assign(key_type, key, shard)
+        return SuccessResponse(
+            message="Shard assignment saved successfully",
+            data={"type": key_type, "key": key, "shard": shard}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error saving shard assignment: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to save shard assignment: {str(e)}"
+        )
+
+@router.post("/shards/move/{centre_code}", response_model=SuccessResponse)
+def move_centre_endpoint(centre_code: str, target: str = Query(..., description="Shard to move the centre to")):
+    """Rebalance: move all of a centre's records to another shard"""
+    try:
+        return SuccessResponse(
+            message="Centre moved successfully",
+            data={"centre_code": centre_code, "shard": target, "moved": get_router().move_centre(centre_code, target)}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error moving centre {centre_code}: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to move centre: {str(e)}"
+        )
+
 @router.post("/send-otp", response_model=OTPResponse)
 async def send_otp_endpoint(
     request: Request,
@@ -395,7 +1504,7 @@ async def verify_otp_endpoint(
         
         # Check if OTP is expired (15 minutes)
         time_diff = datetime.now() - stored_otp_data["created_at"]
-        if time_diff.total_seconds() > 900:  # 15 minutes
+        if time_diff.total_seconds() > OTP_TTL_SECONDS:
             del otp_storage[key]
             return OTPVerificationResponse(
                 message="OTP has expired",
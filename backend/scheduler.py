@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from database import MaintenanceJob
+import shards
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# In-app scheduler for periodic maintenance (see maintenance.py for the
+# jobs). Each job runs in a worker thread, off the request path, every
+# ``interval`` seconds give or take ``jitter`` of it. Cluster jobs take a
+# lease on their maintenance_jobs row before running, and a worker only
+# gets it when no other worker holds it and the last run started at least
+# an interval ago (less the jitter) - so however many workers there are,
+# a cluster job runs once per interval. Jobs that keep per-process state
+# run in every worker instead. A job that overruns its timeout is given up
+# on and counted; its thread cannot be stopped, so its lease is renewed
+# until it actually finishes, and only lapses if the worker dies.
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "true").lower() == "true"
+MAINTENANCE_JITTER = float(os.getenv("MAINTENANCE_JITTER", "0.1"))
+
+# Leases last this many timeouts, so a renewal is never late
+LEASE_FACTOR = 2
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Any]
+    interval: float
+    timeout: float
+    cluster: bool = True
+    jitter: float = MAINTENANCE_JITTER
+    # Metrics of the runs in this worker
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    last_duration: Optional[float] = None
+    last_run_at: Optional[datetime] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    running: bool = field(default=False, repr=False)
+
+    def record(self, duration: float, status: str, error: str = None):
+        self.runs += 1
+        self.failures += status == "failed"
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.last_duration = duration
+        self.last_status = status
+        self.last_error = error
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "timeout_seconds": self.timeout,
+            "cluster": self.cluster,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_duration_seconds": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "avg_duration_seconds": round(self.total_duration / self.runs, 3) if self.runs else None,
+            "max_duration_seconds": round(self.max_duration, 3)
+        }
+
+
+class Scheduler:
+    """Runs registered jobs on intervals, each cluster job in one worker at a time"""
+
+    def __init__(self, session_factory: Callable = None, holder: str = None):
+        # Leases live on the primary shard
+        self.session_factory = session_factory or (lambda: shards.get_router().open())
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, Job] = {}
+        self._tasks = []
+
+    def register(self, name: str, func: Callable[[], Any], interval: float, timeout: float,
+                 cluster: bool = True, jitter: float = MAINTENANCE_JITTER) -> Optional[Job]:
+        """Add a job; an interval of 0 or less leaves it off"""
+        if interval <= 0:
+            self.jobs.pop(name, None)
+            return None
+        job = Job(name, func, interval, timeout, cluster, jitter)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        for job in self.jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+        if self.jobs:
+            logger.info(f"Maintenance jobs scheduled: {', '.join(self.jobs)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _delay(self, job: Job) -> float:
+        return job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+
+    async def _loop(self, job: Job):
+        # Workers that boot together spread their first runs over an interval
+        await asyncio.sleep(job.interval * random.uniform(job.jitter, 1))
+        while True:
+            try:
+                await self.run(job)
+            except Exception as e:
+                logger.error(f"Maintenance job {job.name} could not be run: {str(e)}")
+            await asyncio.sleep(self._delay(job))
+
+    async def run(self, job: Job) -> bool:
+        """Run a job now, unless it is still running or another worker has it"""
+        loop = asyncio.get_running_loop()
+        if job.running or (job.cluster and not await loop.run_in_executor(None, self._acquire, job)):
+            job.skipped += 1
+            return False
+
+        job.running = True
+        job.last_run_at = datetime.now()
+        started = time.monotonic()
+
+        def finished(future: asyncio.Future):
+            duration = time.monotonic() - started
+            error = future.exception() if not future.cancelled() else None
+            status = "failed" if error else "timed_out" if timed_out else "ok"
+            job.record(duration, status, str(error) if error else None)
+            job.running = False
+            if error:
+                logger.error(f"Maintenance job {job.name} failed after {duration:.2f}s: {str(error)}")
+            else:
+                logger.info(f"Maintenance job {job.name} finished in {duration:.2f}s")
+            if job.cluster:
+                loop.run_in_executor(None, self._release, job, duration, status, str(error) if error else None)
+
+        timed_out = False
+        future = loop.run_in_executor(None, job.func)
+        future.add_done_callback(finished)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), job.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            job.timeouts += 1
+            logger.warning(f"Maintenance job {job.name} exceeded its {job.timeout}s timeout")
+            if job.cluster:
+                self._tasks.append(asyncio.create_task(self._hold_lease(job, future)))
+        except Exception:
+            # Recorded by finished()
+            pass
+        return True
+
+    def _acquire(self, job: Job) -> bool:
+        now = datetime.now()
+        with self.session_factory() as db:
+            if db.get(MaintenanceJob, job.name) is None:
+                try:
+                    db.add(MaintenanceJob(name=job.name))
+                    db.commit()
+                except IntegrityError:
+                    # Another worker added it first
+                    db.rollback()
+            try:
+                claimed = db.query(MaintenanceJob).filter(
+                    MaintenanceJob.name == job.name,
+                    or_(MaintenanceJob.lease_until.is_(None), MaintenanceJob.lease_until < now),
+                    or_(
+                        MaintenanceJob.last_started_at.is_(None),
+                        MaintenanceJob.last_started_at <= now - timedelta(seconds=job.interval * (1 - job.jitter))
+                    )
+                ).update({
+                    "holder": self.holder,
+                    "lease_until": now + timedelta(seconds=job.timeout * LEASE_FACTOR),
+                    "last_started_at": now
+                }, synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        return claimed == 1
+
+    async def _hold_lease(self, job: Job, future: asyncio.Future):
+        # The thread of a timed-out job keeps going; renew its lease until it
+        # ends, so no other worker starts the job alongside it
+        loop = asyncio.get_running_loop()
+        while not future.done():
+            await loop.run_in_executor(None, self._renew, job)
+            await asyncio.wait({future}, timeout=job.timeout / 2)
+
+    def _renew(self, job: Job):
+        with self.session_factory() as db:
+            db.query(MaintenanceJob).filter(
+                MaintenanceJob.name == job.name,
+                MaintenanceJob.holder == self.holder
+            ).update({"lease_until": datetime.now() + timedelta(seconds=job.timeout * LEASE_FACTOR)}, synchronize_session=False)
+            db.commit()
+
+    def _release(self, job: Job, duration: float, status: str, error: str = None):
+        try:
+            with self.session_factory() as db:
+                db.query(MaintenanceJob).filter(
+                    MaintenanceJob.name == job.name,
+                    MaintenanceJob.holder == self.holder
+                ).update({
+                    "holder": None,
+                    "lease_until": None,
+                    "last_finished_at": datetime.now(),
+                    "last_duration": duration,
+                    "last_status": status,
+                    "last_error": error
+                }, synchronize_session=False)
+                db.commit()
+        except Exception as e:
+            # The lease runs out by itself
+            logger.error(f"Could not release maintenance job {job.name}: {str(e)}")
+
+    def stats(self) -> dict:
+        """This worker's job metrics, plus the cluster's last run of each cluster job"""
+        cluster = {}
+        with self.session_factory() as db:
+            for row in db.query(MaintenanceJob).all():
+                cluster[row.name] = {
+                    "holder": row.holder,
+                    "last_started_at": row.last_started_at.isoformat() if row.last_started_at else None,
+                    "last_finished_at": row.last_finished_at.isoformat() if row.last_finished_at else None,
+                    "last_duration_seconds": round(row.last_duration, 3) if row.last_duration is not None else None,
+                    "last_status": row.last_status,
+                    "last_error": row.last_error
+                }
+        return {
+            "enabled": MAINTENANCE_ENABLED,
+            "worker": self.holder,
+            "jobs": {name: job.stats() for name, job in self.jobs.items()},
+            "cluster": cluster
+        }
+
+
+scheduler = Scheduler()
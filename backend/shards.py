@@ -0,0 +1,476 @@
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Query, Request
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from database import Base, engine, DPR, MPR, FP, Centre, RecordHistory, ShardAssignment
+import consistency
+import similarity
+import crud
+import migrations
+import partitions
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Records are spread over shards by centre. The primary shard is
+# DATABASE_URL; it also holds the routing directory (shard_assignments)
+# and the centre table. More shards come from SHARD_URLS, e.g.
+# "north=postgresql://.../north;south=sqlite:///./south.db". With no
+# SHARD_URLS everything runs on the primary exactly as before.
+PRIMARY_SHARD = "primary"
+
+# Each shard allocates ids from its own block (shard index * block), so an
+# id alone tells which shard holds the record
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "100000000"))
+
+SHARDED_TABLES = {"dpr": DPR, "mpr": MPR, "fp": FP}
+
+# Copy/delete rounds a centre move makes while records keep changing on the
+# source before it gives up (a rerun carries on)
+MOVE_ROUNDS = int(os.getenv("SHARD_MOVE_ROUNDS", "5"))
+
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """Parse ``name=url;name=url`` into an ordered {name: url} dict"""
+    shards = {}
+    for part in filter(None, (part.strip() for part in value.split(";"))):
+        name, _, url = part.partition("=")
+        if not name or not url:
+            raise ValueError(f"Invalid shard definition: {part!r}")
+        shards[name.strip()] = url.strip()
+    return shards
+
+
+def _make_engine(url: str) -> Engine:
+    return create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+
+
+class ShardRouter:
+    """Maps centres and record ids to shards and hands out shard sessions"""
+
+    def __init__(self, engines: Dict[str, Engine]):
+        # The first engine is the primary shard
+        self.names = list(engines)
+        self.engines = dict(engines)
+        self._sessionmakers = {
+            name: sessionmaker(
+                autocommit=False, autoflush=False, expire_on_commit=False, bind=shard_engine, info={"shard": name}
+            )
+            for name, shard_engine in self.engines.items()
+        }
+
+    @classmethod
+    def from_env(cls) -> "ShardRouter":
+        engines = {PRIMARY_SHARD: engine}
+        for name, url in parse_shard_urls(os.getenv("SHARD_URLS", "")).items():
+            engines[name] = _make_engine(url)
+        return cls(engines)
+
+    @property
+    def primary(self) -> str:
+        return self.names[0]
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.names) > 1
+
+    def session(self, name: Optional[str] = None) -> Session:
+        name = name or self.primary
+        if name not in self._sessionmakers:
+            raise ValueError(f"Unknown shard: {name}")
+        return self._sessionmakers[name]()
+
+    @contextmanager
+    def open(self, name: Optional[str] = None):
+        db = self.session(name)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def create_tables(self):
+        """Create the schema on every shard from the models (tests and throwaway databases)"""
+        for index, name in enumerate(self.names):
+            Base.metadata.create_all(bind=self.engines[name])
+            if index:
+                self._reserve_ids(self.engines[name], index * SHARD_ID_BLOCK)
+
+    def migrate(self) -> Dict[str, List[int]]:
+        """Apply pending migrations on every shard and reserve each shard's id block.
+
+        MPRs without a near-duplicate signature (filed before similarity.py
+        existed) are then indexed; migrations only change the schema.
+        """
+        applied = {}
+        for index, name in enumerate(self.names):
+            applied[name] = migrations.upgrade(self.engines[name])
+            if index:
+                self._reserve_ids(self.engines[name], index * SHARD_ID_BLOCK)
+            with self.open(name) as db:
+                similarity.index_missing(db)
+        return applied
+
+    def check_schema(self):
+        """Raise migrations.SchemaOutOfDate if any shard has pending migrations"""
+        for name in self.names:
+            migrations.check(self.engines[name], name)
+
+    def _reserve_ids(self, shard_engine: Engine, start: int):
+        with shard_engine.begin() as conn:
+            for table_name in SHARDED_TABLES:
+                if shard_engine.dialect.name == "sqlite":
+                    # AUTOINCREMENT tables take max(sqlite_sequence, max id) + 1
+                    conn.execute(text(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+                    ), {"name": table_name, "seq": start})
+                    conn.execute(text(
+                        "UPDATE sqlite_sequence SET seq = :seq WHERE name = :name AND seq < :seq"
+                    ), {"name": table_name, "seq": start})
+                else:
+                    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": table_name}).scalar()
+                    if conn.execute(text(f"SELECT last_value FROM {sequence}")).scalar() < start:
+                        conn.execute(text("SELECT setval(:sequence, :seq)"), {"sequence": sequence, "seq": start})
+
+    def shard_for_id(self, record_id: int) -> str:
+        """The shard whose id block contains ``record_id``"""
+        index = record_id // SHARD_ID_BLOCK
+        return self.names[index] if index < len(self.names) else self.primary
+
+    def shard_for_centre(self, centre_code: str) -> str:
+        """Route a centre for a write: its own assignment, then its state's, then a hash.
+
+        A hashed placement is stored as the centre's assignment, so adding
+        shards later never moves existing centres implicitly.
+        """
+        if not self.sharded:
+            return self.primary
+        with self.open() as db:
+            shard, stored = self._placement(db, centre_code)
+            if stored:
+                return shard
+            try:
+                db.add(ShardAssignment(key_type="centre", key=centre_code, shard=shard, updated_at=datetime.now()))
+                db.commit()
+                return shard
+            except IntegrityError:
+                # Another worker placed the centre first
+                db.rollback()
+                return self._checked(db.get(ShardAssignment, ("centre", centre_code)).shard)
+
+    def locate_centre(self, centre_code: str) -> str:
+        """Route a centre like shard_for_centre, without storing anything (checks and reads)"""
+        if not self.sharded:
+            return self.primary
+        with self.open() as db:
+            return self._placement(db, centre_code)[0]
+
+    def _placement(self, db: Session, centre_code: str) -> Tuple[str, bool]:
+        # (shard, whether that placement is stored)
+        assignment = db.get(ShardAssignment, ("centre", centre_code))
+        if assignment is not None:
+            return self._checked(assignment.shard), True
+        centre = db.get(Centre, centre_code)
+        if centre is not None and centre.state:
+            state_assignment = db.get(ShardAssignment, ("state", centre.state))
+            if state_assignment is not None:
+                return self._checked(state_assignment.shard), True
+        return self.names[zlib.crc32(centre_code.encode()) % len(self.names)], False
+
+    def _checked(self, shard: str) -> str:
+        if shard not in self.engines:
+            raise ValueError(f"Shard {shard} is assigned but not configured")
+        return shard
+
+    def session_for_centre(self, centre_code: str):
+        return self.open(self.shard_for_centre(centre_code))
+
+    def find_record_shard(self, model, record_id: int) -> Optional[str]:
+        """The shard holding a record: its id block first, then the rest (after a rebalance)"""
+        home = self.shard_for_id(record_id)
+        if not self.sharded:
+            return home
+        for name in [home] + [name for name in self.names if name != home]:
+            with self.open(name) as db:
+                # Through the record cache, so hot records skip the probe
+                if crud.get_cached_record(db, model, model.__tablename__, record_id) is not None:
+                    return name
+        return None
+
+    def assign(self, key_type: str, key: str, shard: str, moving_from: Optional[str] = None):
+        """Pin a centre or a state to a shard for future writes"""
+        if key_type not in ("centre", "state"):
+            raise ValueError(f"Unknown assignment type: {key_type}")
+        self._checked(shard)
+        with self.open() as db:
+            assignment = db.get(ShardAssignment, (key_type, key))
+            if assignment is None:
+                assignment = ShardAssignment(key_type=key_type, key=key)
+                db.add(assignment)
+            assignment.shard = shard
+            assignment.moving_from = moving_from
+            assignment.updated_at = datetime.now()
+            db.commit()
+
+    def assignments(self) -> List[dict]:
+        with self.open() as db:
+            return [
+                {"type": a.key_type, "key": a.key, "shard": a.shard, "moving_from": a.moving_from}
+                for a in db.query(ShardAssignment).order_by(ShardAssignment.key_type, ShardAssignment.key)
+            ]
+
+    def move_source(self, centre_code: str) -> Optional[str]:
+        """The shard an unfinished move of the centre is coming from"""
+        with self.open() as db:
+            assignment = db.get(ShardAssignment, ("centre", centre_code))
+            return assignment.moving_from if assignment is not None else None
+
+    def move_centre(self, centre_code: str, target: str) -> Dict[str, int]:
+        """Rebalancing: move all of a centre's records to another shard.
+
+        Records keep their ids. They are copied and committed on the target,
+        then the centre is re-pointed with the source recorded on its
+        assignment. Records written on the source in the meantime are copied
+        again, and a source record is only deleted (with a tombstone) at the
+        change sequence that was copied, so each shard's delta feed stays
+        correct and no write is lost. Running it again after a failure
+        finishes the move from the recorded source.
+        """
+        self._checked(target)
+        source = self.move_source(centre_code) or self.shard_for_centre(centre_code)
+        moved = {table_name: 0 for table_name in SHARDED_TABLES}
+        if source == target:
+            return moved
+
+        with self.open(source) as src, self.open(target) as dst:
+            # {table_name: {record id: source change_seq copied}}
+            copied = {table_name: {} for table_name in SHARDED_TABLES}
+            for table_name, model in SHARDED_TABLES.items():
+                self._copy_changed(src, dst, table_name, model, centre_code, copied[table_name])
+
+            # New records go to the target from here on
+            self.assign("centre", centre_code, target, moving_from=source)
+
+            for table_name, model in SHARDED_TABLES.items():
+                for _ in range(MOVE_ROUNDS):
+                    self._copy_changed(src, dst, table_name, model, centre_code, copied[table_name])
+                    moved[table_name] += self._delete_copied(src, dst, table_name, model, copied[table_name])
+                    if not copied[table_name]:
+                        break
+                else:
+                    raise RuntimeError(
+                        f"Centre {centre_code} kept changing on {source}; run the move again to finish it"
+                    )
+
+        self.assign("centre", centre_code, target)
+        logger.info(f"Moved centre {centre_code} from {source} to {target}: {moved}")
+        return moved
+
+    def _copy_changed(self, src: Session, dst: Session, table_name: str, model, centre_code: str,
+                      copied: Dict[int, int]):
+        # Copy the centre's source records not yet copied at their current
+        # change sequence, with their version history
+        src.rollback()  # a fresh snapshot of the source
+        records = [
+            record for record in src.query(model).filter(model.centre_code == centre_code)
+            .order_by(model.id).populate_existing()
+            if copied.get(record.id) != record.change_seq
+        ]
+        if not records:
+            return
+        try:
+            for record in records:
+                values = {c.name: getattr(record, c.name) for c in model.__table__.columns}
+                copy = dst.get(model, record.id, populate_existing=True)
+                if copy is None:
+                    copy = model(**values)
+                    dst.add(copy)
+                else:
+                    # Copied before, or left by an interrupted move
+                    for name, value in values.items():
+                        setattr(copy, name, value)
+                if table_name in partitions.PARTITIONED_TABLES and copy.period is not None:
+                    partitions.ensure_partition(dst, table_name, copy.period)
+                crud.mark_changed(dst, table_name, copy)
+                dst.flush()
+                # DPRs are copied first so the MPR consistency checks find them
+                if table_name == "dpr":
+                    consistency.index_dpr(dst, copy)
+                elif table_name == "mpr":
+                    consistency.check_mpr(dst, copy)
+                    similarity.index_mpr(dst, copy)
+            ids = [record.id for record in records]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                # Rows from an earlier copy or an interrupted move are replaced
+                dst.query(RecordHistory).filter(
+                    RecordHistory.table_name == table_name,
+                    RecordHistory.record_id.in_(chunk)
+                ).delete(synchronize_session=False)
+                for row in src.query(RecordHistory).filter(
+                    RecordHistory.table_name == table_name,
+                    RecordHistory.record_id.in_(chunk)
+                ):
+                    dst.add(RecordHistory(**{
+                        c.name: getattr(row, c.name) for c in RecordHistory.__table__.columns if c.name != "id"
+                    }))
+            dst.commit()
+        except Exception:
+            dst.rollback()
+            raise
+        crud.invalidate_cached_table(dst, table_name)
+        for record in records:
+            copied[record.id] = record.change_seq
+
+    def _delete_copied(self, src: Session, dst: Session, table_name: str, model, copied: Dict[int, int]) -> int:
+        # Delete source records at the change sequence that was copied.
+        # Records written since stay in ``copied`` for another round;
+        # records deleted on the source meanwhile are deleted on the target.
+        deleted = []
+        for record_id, change_seq in list(copied.items()):
+            try:
+                if crud.delete_record(src, model, table_name, record_id, expected_change_seq=change_seq):
+                    deleted.append(record_id)
+                else:
+                    crud.delete_record(dst, model, table_name, record_id)
+                del copied[record_id]
+            except crud.VersionConflict:
+                continue
+        # The source keeps no history for records that now live elsewhere
+        for start in range(0, len(deleted), 500):
+            src.query(RecordHistory).filter(
+                RecordHistory.table_name == table_name,
+                RecordHistory.record_id.in_(deleted[start:start + 500])
+            ).delete(synchronize_session=False)
+        src.commit()
+        return len(deleted)
+
+    def scatter(self, fn: Callable[[Session], object]) -> Dict[str, object]:
+        """Run ``fn(db)`` on every shard concurrently; returns {shard: result}"""
+        def run(name):
+            with self.open(name) as db:
+                return fn(db)
+
+        if not self.sharded:
+            return {self.primary: run(self.primary)}
+        with ThreadPoolExecutor(max_workers=len(self.names)) as pool:
+            return dict(zip(self.names, pool.map(run, self.names)))
+
+
+router = ShardRouter.from_env()
+
+
+def get_router() -> ShardRouter:
+    return router
+
+
+def scatter_counters(*table_names: str) -> list:
+    """Change counters of the given tables on every shard, for ETags"""
+    results = router.scatter(lambda db: crud.get_change_counters(db, *table_names))
+    return [counter for name in router.names for counter in results[name]]
+
+
+def gather(fn: Callable[[Session], object], shard: Optional[str] = None) -> Dict[str, object]:
+    """Run a read on the named shard, or on every shard when none is named"""
+    if shard is None:
+        return router.scatter(fn)
+    try:
+        db = router.session(shard)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        return {shard: fn(db)}
+    finally:
+        db.close()
+
+
+def scatter_list(fetch: Callable, skip: int = 0, limit: int = 100, key: Callable = None, reverse: bool = False,
+                 shard: Optional[str] = None, **kwargs) -> list:
+    """Page through records of all shards in id order, or ordered by ``key``.
+
+    Each shard returns its first ``skip + limit`` records; the merged list
+    is then cut to the requested page. With ``shard`` only that one is read.
+    """
+    results = gather(lambda db: fetch(db, skip=0, limit=skip + limit, **kwargs), shard)
+    merged = sorted(
+        (record for records in results.values() for record in records),
+        key=key or (lambda record: record.id),
+        reverse=reverse
+    )
+    return merged[skip:skip + limit]
+
+
+def scatter_stats() -> dict:
+    """Database statistics summed over all shards"""
+    totals = {}
+    for stats in router.scatter(crud.get_database_stats).values():
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _shard_session(shard: Optional[str]) -> Session:
+    try:
+        return router.session(shard)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def get_shard_db(shard: str = Query(None, description="Shard to use; defaults to the primary shard")):
+    """Dependency for maintenance endpoints (partitions, archive)"""
+    db = _shard_session(shard)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def named_shard_db(shard: str = Query(None, description="Shard to use; required when there are several")):
+    """Dependency for shard-local state such as ledger ranges, which no other shard can answer for"""
+    if shard is None and router.sharded:
+        raise HTTPException(status_code=400, detail="Name the shard: ledgers are kept per shard")
+    db = _shard_session(shard)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def centre_shard_db(request: Request, shard: str = Query(None, description="Shard to use; defaults to the centre's")):
+    """Dependency for centre feeds: the shard the ``centre_code`` query parameter routes to.
+
+    Each shard has its own change sequence, so without a centre the shard
+    has to be named rather than silently reading the primary.
+    """
+    centre_code = request.query_params.get("centre_code")
+    if shard is None:
+        if centre_code:
+            shard = router.locate_centre(centre_code)
+        elif router.sharded:
+            raise HTTPException(status_code=400, detail="Pass centre_code or shard: each shard has its own feed")
+    db = _shard_session(shard)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def record_db(model, param: str):
+    """Dependency factory: a session on the shard holding the record in path ``param``"""
+    def dependency(request: Request):
+        record_id = int(request.path_params[param])
+        name = router.find_record_shard(model, record_id) or router.shard_for_id(record_id)
+        db = router.session(name)
+        try:
+            yield db
+        finally:
+            db.close()
+    return dependency
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from datetime import datetime
+from typing import List, Set
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from database import MPR, MPRSignature, MPRBucket, AuditFlag
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Near-duplicate MPRs: the same household re-entered with small edits under
+# another return number. Each MPR is reduced to a set of features (words of
+# the address and contact line, household fields, and per purchase item its
+# item and fibre codes with a coarse amount bucket), and the set to a
+# MinHash signature of NUM_PERM values; the share of equal values estimates
+# the Jaccard similarity of two MPRs. The signature is cut into LSH_BANDS
+# bands, each hashed with the period into one bucket, and two MPRs of a
+# period become candidates when they share any bucket - a few indexed
+# lookups instead of a comparison with every other MPR. With 16 bands of 4
+# values, pairs at similarity 0.8 are found over 99.9% of the time and pairs
+# at 0.3 about 12%; candidates are then checked against the threshold.
+NUM_PERM = 64
+LSH_BANDS = 16
+ROWS_PER_BAND = NUM_PERM // LSH_BANDS
+
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+NEAR_DUPLICATE_FLAG = "near_duplicate"
+
+# Amounts within about 25% of each other usually share a bucket
+AMOUNT_STEP = 1.25
+
+# Fixed seed: signatures are stored, so every process must permute alike
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_random = np.random.RandomState(48)
+_A = _random.randint(1, 2 ** 32 - 1, NUM_PERM, dtype=np.uint64)
+_B = _random.randint(0, 2 ** 32 - 1, NUM_PERM, dtype=np.uint64)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in _WORD.findall((text or "").lower()) if len(word) > 1]
+
+
+def _amount_bucket(amount) -> int:
+    return round(math.log(amount) / math.log(AMOUNT_STEP)) if amount and amount > 0 else 0
+
+
+def features(mpr) -> Set[str]:
+    """The feature set of an MPR (model or anything with its attributes)"""
+    found = {f"address:{word}" for word in _words(mpr.name_and_address)}
+    found.update(f"contact:{word}" for word in _words(mpr.district_state_tel))
+    found.add(f"family_size:{mpr.family_size}")
+    found.add(f"income_group:{mpr.income_group}")
+    found.add(f"occupation:{mpr.occupation_of_head}")
+    items = json.loads(mpr.items) if isinstance(mpr.items, str) else mpr.items or []
+    for item in items:
+        codes = f"{item.get('item_code')}:{item.get('fibre_code')}"
+        found.add(f"item:{codes}")
+        found.add(f"amount:{codes}:{_amount_bucket(item.get('total_amount_paid'))}")
+    return found
+
+
+def signature(feature_set: Set[str]) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32 values) of a feature set"""
+    hashes = np.array([
+        int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "little")
+        for feature in feature_set
+    ], dtype=np.uint64)
+    # All permutations at once: (a * x + b) mod p for every feature and permutation
+    permuted = (hashes[:, None] * _A + _B) % _MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def estimate_similarity(first: np.ndarray, second: np.ndarray) -> float:
+    return float(np.mean(first == second))
+
+
+def band_buckets(sig: np.ndarray, period) -> List[int]:
+    """One bucket per band; signed 64-bit so they fit a BIGINT"""
+    return [
+        int.from_bytes(hashlib.blake2b(
+            f"{period}:{band}:".encode() + sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes(),
+            digest_size=8
+        ).digest(), "little", signed=True)
+        for band in range(LSH_BANDS)
+    ]
+
+
+def unindex_mpr(db: Session, mpr_id: int):
+    """Drop an MPR's signature and buckets. The caller commits."""
+    # Core statements throughout: these rows are never loaded as objects, so
+    # deleting and re-adding them in one session needs no identity bookkeeping
+    db.execute(delete(MPRBucket).where(MPRBucket.mpr_id == mpr_id))
+    db.execute(delete(MPRSignature).where(MPRSignature.mpr_id == mpr_id))
+
+
+def _matches(db: Session, mpr, sig: np.ndarray, buckets: List[int], threshold: float, limit: int) -> List[dict]:
+    # Joined with the live table, so rows of archived MPRs drop out
+    candidates = db.query(MPR.id, MPR.centre_code, MPR.return_no, MPR.period, MPRSignature.signature).join(
+        MPRSignature, MPRSignature.mpr_id == MPR.id
+    ).filter(
+        MPR.id.in_(db.query(MPRBucket.mpr_id).filter(MPRBucket.bucket.in_(buckets))),
+        MPR.id != mpr.id,
+        # Lets PostgreSQL scan only the period's partition
+        MPR.period == mpr.period
+    ).all()
+    matches = []
+    for record_id, centre_code, return_no, period, stored in candidates:
+        # Resubmissions of the same return are versions, not duplicates
+        if (centre_code, return_no) == (mpr.centre_code, mpr.return_no):
+            continue
+        score = estimate_similarity(sig, np.frombuffer(stored, dtype=np.uint32))
+        if score >= threshold:
+            matches.append({
+                "mpr_id": record_id,
+                "centre_code": centre_code,
+                "return_no": return_no,
+                "period": period,
+                "similarity": round(score, 3)
+            })
+    matches.sort(key=lambda match: -match["similarity"])
+    return matches[:limit]
+
+
+def index_mpr(db: Session, mpr: MPR, threshold: float = None) -> List[dict]:
+    """Store an MPR's signature and buckets and flag its near-duplicates.
+
+    Returns the matches. Runs in the caller's transaction; the caller
+    commits.
+    """
+    threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+    unindex_mpr(db, mpr.id)
+    sig = signature(features(mpr))
+    buckets = band_buckets(sig, mpr.period)
+    db.execute(insert(MPRSignature).values(
+        mpr_id=mpr.id, centre_code=mpr.centre_code, period=mpr.period,
+        signature=sig.tobytes(), updated_at=datetime.now()
+    ))
+    db.execute(insert(MPRBucket), [{"bucket": bucket, "mpr_id": mpr.id} for bucket in set(buckets)])
+
+    matches = _matches(db, mpr, sig, buckets, threshold, limit=5)
+    db.query(AuditFlag).filter(
+        AuditFlag.record_type == "mpr",
+        AuditFlag.record_id == mpr.id,
+        AuditFlag.flag_type == NEAR_DUPLICATE_FLAG
+    ).delete(synchronize_session=False)
+    if matches:
+        db.add(AuditFlag(
+            record_type="mpr",
+            record_id=mpr.id,
+            centre_code=mpr.centre_code,
+            flag_type=NEAR_DUPLICATE_FLAG,
+            detail="; ".join(
+                f"MPR {match['mpr_id']} (centre {match['centre_code']}, return {match['return_no']}): "
+                f"similarity {match['similarity']}"
+                for match in matches
+            ),
+            created_at=datetime.now()
+        ))
+        logger.warning(f"MPR {mpr.id} looks like a near-duplicate of MPR(s) {[match['mpr_id'] for match in matches]}")
+    return matches
+
+
+def index_missing(db: Session, batch_size: int = 1000) -> int:
+    """Index the MPRs that have no signature yet; returns how many.
+
+    Run after migrating, for MPRs filed before near-duplicate detection.
+    They are indexed oldest first, so each is flagged against the ones
+    filed before it, as if it had just arrived.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = db.query(MPR).filter(
+            MPR.id > last_id,
+            ~MPR.id.in_(select(MPRSignature.mpr_id))
+        ).order_by(MPR.id).limit(batch_size).all()
+        if not batch:
+            break
+        for mpr in batch:
+            index_mpr(db, mpr)
+        indexed += len(batch)
+        last_id = batch[-1].id
+        db.commit()
+        db.expunge_all()
+    if indexed:
+        logger.info(f"Near-duplicate signatures computed for {indexed} existing MPRs")
+    return indexed
+
+
+def find_near_duplicates(db: Session, mpr_id: int, threshold: float = None, limit: int = 20) -> List[dict]:
+    """Near-duplicates of a stored MPR, from its LSH buckets"""
+    threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+    mpr = db.query(MPR).filter(MPR.id == mpr_id).first()
+    if mpr is None:
+        raise ValueError(f"MPR record {mpr_id} not found")
+    stored = db.execute(select(MPRSignature.signature).where(MPRSignature.mpr_id == mpr_id)).scalar()
+    if stored is None:
+        raise ValueError(f"MPR record {mpr_id} has no signature yet")
+    sig = np.frombuffer(stored, dtype=np.uint32)
+    return _matches(db, mpr, sig, band_buckets(sig, mpr.period), threshold, limit)
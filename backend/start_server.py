@@ -22,6 +22,10 @@ def main():
     print(f"🔌 Port: {port}")
     print(f"🐛 Debug: {debug}")
     print("=" * 50)
+
+    # Apply pending migrations once, before any worker starts
+    from shards import get_router
+    get_router().migrate()
     
     # Start the server
     uvicorn.run(
@@ -29,7 +33,11 @@ def main():
         host=host,
         port=port,
         reload=debug,
-        log_level="info"
+        log_level="info",
+        # Client IPs (and the per-IP rate limit) come from X-Forwarded-For
+        # when the request arrives through a trusted proxy
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+from database import DPR, MPR, FP, SyncCursor, SyncLedgerRange
+from crud import get_change_counters, get_changed_records, get_tombstones, bump_change_counter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Downstream consumers that process DPR/MPR/FP changes
+CONSUMERS = ("central_tc", "exports", "rollups", "audit")
+
+LEDGER_TABLES = {"dpr": DPR, "mpr": MPR, "fp": FP}
+
+# Width of a ledger range in change sequence numbers
+DEFAULT_RANGE_SIZE = 500
+
+# A claimed range not completed within this time can be claimed again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def _check(consumer: str, table_name: str):
+    if consumer not in CONSUMERS:
+        raise ValueError(f"Unknown consumer: {consumer}")
+    if table_name not in LEDGER_TABLES:
+        raise ValueError(f"Unknown table: {table_name}")
+
+
+def _get_cursor(db: Session, consumer: str, table_name: str, lock: bool = False) -> SyncCursor:
+    query = db.query(SyncCursor).filter(
+        SyncCursor.consumer == consumer,
+        SyncCursor.table_name == table_name
+    )
+    if lock:
+        query = query.with_for_update()
+    cursor = query.first()
+    if cursor is None:
+        cursor = SyncCursor(consumer=consumer, table_name=table_name, planned_seq=0, committed_seq=0)
+        db.add(cursor)
+        db.flush()
+    return cursor
+
+
+def plan_ranges(db: Session, consumer: str, table_name: str, range_size: Optional[int] = None) -> int:
+    """Cut new changes for a consumer into pending ledger ranges.
+
+    Only the consumer's cursor row is locked, and only the change counter
+    is read, so planning never scans the record tables. Returns the number
+    of ranges created; the caller commits.
+    """
+    _check(consumer, table_name)
+    range_size = range_size or DEFAULT_RANGE_SIZE
+    cursor = _get_cursor(db, consumer, table_name, lock=True)
+    (current_seq, _), = get_change_counters(db, table_name)
+
+    created = 0
+    start = cursor.planned_seq
+    while start < current_seq:
+        end = min(start + range_size, current_seq)
+        db.add(SyncLedgerRange(
+            consumer=consumer,
+            table_name=table_name,
+            start_seq=start,
+            end_seq=end,
+            status="pending"
+        ))
+        start = end
+        created += 1
+
+    if created:
+        cursor.planned_seq = current_seq
+        cursor.updated_at = datetime.now()
+    return created
+
+
+def claim_ranges(db: Session, consumer: str, table_name: str, worker: str, max_ranges: int = 1) -> List[SyncLedgerRange]:
+    """Claim up to ``max_ranges`` ranges of work for a worker.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL so concurrent
+    workers each get different ranges without waiting on each other. SQLite
+    has a single writer and ignores the locking clause. Ranges claimed by a
+    worker that did not complete them within CLAIM_TIMEOUT are handed out
+    again.
+    """
+    _check(consumer, table_name)
+    try:
+        plan_ranges(db, consumer, table_name)
+        db.commit()
+
+        now = datetime.now()
+        ranges = (
+            db.query(SyncLedgerRange)
+            .filter(
+                SyncLedgerRange.consumer == consumer,
+                SyncLedgerRange.table_name == table_name,
+                (SyncLedgerRange.status == "pending")
+                | ((SyncLedgerRange.status == "claimed") & (SyncLedgerRange.claimed_at < now - CLAIM_TIMEOUT))
+            )
+            .order_by(SyncLedgerRange.start_seq)
+            .limit(max_ranges)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for ledger_range in ranges:
+            ledger_range.status = "claimed"
+            ledger_range.claimed_by = worker
+            ledger_range.claimed_at = now
+        db.commit()
+
+        if ranges:
+            logger.info(f"{worker} claimed {len(ranges)} {table_name} range(s) for {consumer}")
+        return ranges
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error claiming ledger ranges: {str(e)}")
+        raise
+
+
+def get_range_records(db: Session, ledger_range: SyncLedgerRange):
+    """Get the records whose latest change falls inside a ledger range"""
+    model = LEDGER_TABLES[ledger_range.table_name]
+    return get_changed_records(db, model, ledger_range.start_seq, ledger_range.end_seq, limit=None)
+
+
+def get_range_tombstones(db: Session, ledger_range: SyncLedgerRange):
+    """Get the deletions that fall inside a ledger range, moves off the shard included"""
+    return get_tombstones(db, ledger_range.table_name, ledger_range.start_seq, ledger_range.end_seq, limit=None)
+
+
+def complete_range(db: Session, range_id: int, worker: Optional[str] = None) -> int:
+    """Mark a range processed and advance the consumer's committed watermark.
+
+    Returns the consumer's committed sequence for the range's table.
+    """
+    try:
+        ledger_range = db.query(SyncLedgerRange).filter(SyncLedgerRange.id == range_id).with_for_update().first()
+        if not ledger_range:
+            raise ValueError(f"Ledger range with ID {range_id} not found")
+        if worker is not None and ledger_range.claimed_by != worker:
+            raise ValueError(f"Ledger range {range_id} is not claimed by {worker}")
+
+        ledger_range.status = "done"
+        ledger_range.completed_at = datetime.now()
+        db.flush()
+        committed_seq = _advance_watermark(db, ledger_range.consumer, ledger_range.table_name)
+        db.commit()
+        return committed_seq
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error completing ledger range: {str(e)}")
+        raise
+
+
+def release_range(db: Session, range_id: int):
+    """Hand a claimed range back, e.g. after a processing failure"""
+    db.query(SyncLedgerRange).filter(
+        SyncLedgerRange.id == range_id,
+        SyncLedgerRange.status == "claimed"
+    ).update({"status": "pending", "claimed_by": None, "claimed_at": None})
+    db.commit()
+
+
+def _advance_watermark(db: Session, consumer: str, table_name: str) -> int:
+    # Everything below the oldest unfinished range is processed
+    cursor = _get_cursor(db, consumer, table_name, lock=True)
+    oldest_open = db.query(func.min(SyncLedgerRange.start_seq)).filter(
+        SyncLedgerRange.consumer == consumer,
+        SyncLedgerRange.table_name == table_name,
+        SyncLedgerRange.status != "done"
+    ).scalar()
+    committed_seq = cursor.planned_seq if oldest_open is None else oldest_open
+    if committed_seq == cursor.committed_seq:
+        return committed_seq
+
+    cursor.committed_seq = committed_seq
+    cursor.updated_at = datetime.now()
+    # Finished ranges below the watermark carry no more information
+    db.query(SyncLedgerRange).filter(
+        SyncLedgerRange.consumer == consumer,
+        SyncLedgerRange.table_name == table_name,
+        SyncLedgerRange.status == "done",
+        SyncLedgerRange.end_seq <= committed_seq
+    ).delete(synchronize_session=False)
+    bump_change_counter(db, "sync_ledger")
+    return committed_seq
+
+
+def get_consumer_status(db: Session, consumer: str) -> dict:
+    """Get per-table watermarks and open range counts for a consumer"""
+    if consumer not in CONSUMERS:
+        raise ValueError(f"Unknown consumer: {consumer}")
+
+    status = {}
+    for table_name in LEDGER_TABLES:
+        cursor = db.query(SyncCursor).filter(
+            SyncCursor.consumer == consumer,
+            SyncCursor.table_name == table_name
+        ).first()
+        (current_seq, _), = get_change_counters(db, table_name)
+        open_ranges = db.query(SyncLedgerRange.status, func.count()).filter(
+            SyncLedgerRange.consumer == consumer,
+            SyncLedgerRange.table_name == table_name,
+            SyncLedgerRange.status != "done"
+        ).group_by(SyncLedgerRange.status).all()
+        status[table_name] = {
+            "current_seq": current_seq,
+            "planned_seq": cursor.planned_seq if cursor else 0,
+            "committed_seq": cursor.committed_seq if cursor else 0,
+            "open_ranges": dict(open_ranges),
+        }
+    return status
@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pytest
+
+# Same SQLite file as test_crud_updates; must be set before the backend
+# modules create their engine.
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+
+# Start every run from an empty file so schema changes are picked up
+if os.environ["DATABASE_URL"] == "sqlite:///./test.db" and os.path.exists("test.db"):
+    os.remove("test.db")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def release_connections():
+    """Drop pooled connections after each module.
+
+    test_crud_updates deletes and recreates test.db; connections pooled by
+    an earlier module would otherwise still point at the deleted file.
+    Cached records are dropped for the same reason.
+    """
+    yield
+    from database import engine
+    from cache import record_cache
+    engine.dispose()
+    record_cache.store.clear()
+
+
+@pytest.fixture
+def db():
+    from database import create_tables, SessionLocal
+    create_tables()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+# Record factories. Each test module binds its own centre code (and any
+# other field it needs) so modules sharing test.db do not see each other's
+# records.
+
+def make_item(item_code="401", fibre_code="01", length_in_meters=2.0, total_amount_paid=200.0, **fields):
+    item = {
+        "item_name": f"Item {item_code}", "item_code": item_code, "month_of_purchase": "01", "fibre_code": fibre_code,
+        "sector_of_manufacture_code": "01", "colour_design_code": "01", "gender": "M",
+        "type_of_shop_code": "01", "purchase_type_code": "01", "dress_intended_code": "01",
+        "length_in_meters": length_in_meters, "price_per_meter": total_amount_paid / length_in_meters,
+        "total_amount_paid": total_amount_paid, "brand_mill_name": "Brand", "is_imported": False,
+    }
+    item.update(fields)
+    return item
+
+
+def make_member(**fields):
+    from models import HouseholdMember
+    values = dict(
+        name="Head", relationship_with_head="01", gender="M", age=40, education="08", occupation="03",
+        annual_income_job=50000, annual_income_other=0, other_income_source="None", total_income=50000,
+    )
+    values.update(fields)
+    return HouseholdMember(**values)
+
+
+def make_dpr(return_no="D1", **fields):
+    from models import DPRCreate
+    values = dict(
+        name_and_address="Address", district="District", state="State", family_size=4, income_group="04",
+        centre_code="TEST", return_no=return_no, month_and_year="2024-01", household_members=[make_member()],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+    values.update(fields)
+    return DPRCreate(**values)
+
+
+def make_mpr(return_no="M1", **fields):
+    from models import MPRCreate
+    values = dict(
+        name_and_address="Address", district_state_tel="District, State, 1234567890", panel_centre="Centre",
+        centre_code="TEST", return_no=return_no, family_size=4, income_group="04",
+        month_and_year="2024-01", occupation_of_head="03", items=[],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+    values.update(fields)
+    return MPRCreate(**values)
+
+
+def make_fp(**fields):
+    from models import FPCreate
+    values = dict(
+        centre_name="Centre", centre_code="TEST", panel_size=20, mpr_collected=18, not_collected=2,
+        with_purchase_data=15, nil_mprs=3, nil_serial_nos=3, latitude=12.0, longitude=77.0,
+    )
+    values.update(fields)
+    return FPCreate(**values)
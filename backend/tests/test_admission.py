@@ -0,0 +1,169 @@
+import asyncio
+
+from admission import AdmissionController, AdmissionMiddleware, ConcurrencyLimiter, TokenBuckets, client_ip, route_key
+import admission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_buckets_refill_and_stay_bounded():
+    clock = Clock()
+    buckets = TokenBuckets(rate=2, burst=3, max_keys=4, clock=clock)
+    assert [buckets.take("9876543210") for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("9876543210") == 0.5
+    clock.now = 0.5
+    assert buckets.take("9876543210") == 0
+
+    # Buckets that have refilled are dropped once there are too many keys
+    for i in range(5):
+        buckets.take(f"phone-{i}")
+    clock.now = 10
+    buckets.take("phone-new")
+    assert len(buckets) <= 4
+
+    assert route_key("PUT", "/api/v1/mpr/42") == "PUT /api/v1/mpr/{id}"
+    assert route_key("GET", "/api/v1/dpr/7/history") == "GET /api/v1/dpr/{id}/history"
+
+
+async def _call(app, path, phone=None):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"x-lo-phone", phone.encode())] if phone else []
+    await app({"type": "http", "method": "GET", "path": path, "headers": headers, "client": ("10.0.0.1", 1234)},
+              receive, send)
+    start = sent[0]
+    return start["status"], dict(start["headers"])
+
+
+def test_middleware_limits_and_sheds():
+    release = asyncio.Event()
+
+    async def endpoint(scope, receive, send):
+        if scope["path"] == "/api/v1/slow":
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    controller = AdmissionController(
+        {"phone": TokenBuckets(1, 2), "ip": TokenBuckets(100, 100), "route": TokenBuckets(100, 100)},
+        ConcurrencyLimiter(limit=1, max_queue=1, max_wait=0.05)
+    )
+    app = AdmissionMiddleware(endpoint, controller)
+
+    async def scenario():
+        # Per LO: the third request in a burst of two is turned away
+        assert (await _call(app, "/api/v1/mpr", "9876543210"))[0] == 200
+        assert (await _call(app, "/api/v1/mpr", "9876543210"))[0] == 200
+        status, headers = await _call(app, "/api/v1/mpr", "9876543210")
+        assert status == 429 and headers[b"retry-after"] == b"1"
+        assert (await _call(app, "/api/v1/mpr", "9123456789"))[0] == 200
+
+        # One slot: the second request waits and times out, the third finds the queue full
+        slow = asyncio.ensure_future(_call(app, "/api/v1/slow"))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(_call(app, "/api/v1/mpr"))
+        await asyncio.sleep(0)
+        status, headers = await _call(app, "/api/v1/mpr")
+        assert status == 503 and b"retry-after" in headers
+        assert (await waiting)[0] == 503
+        release.set()
+        assert (await slow)[0] == 200
+
+        # Health checks bypass admission entirely
+        assert (await _call(app, "/health", "9876543210"))[0] == 200
+
+    asyncio.run(scenario())
+    stats = controller.stats()
+    assert stats["rate_limited"]["phone"] == 1
+    assert stats["shed"] == {"queue_full": 1, "wait_timeout": 1}
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+
+def test_cancelled_waiter_passes_on_a_handed_over_slot():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=5, max_wait=5)
+
+    async def scenario():
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # The waiter's request is cancelled, and the slot is handed to it
+        # before it gets to run
+        waiting.cancel()
+        limiter.release()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert limiter.in_flight == 0
+        await asyncio.wait_for(limiter.acquire(), 0.1)
+
+    asyncio.run(scenario())
+
+
+class FakeAsyncRedis:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def register_script(self, script):
+        async def take(keys, args):
+            self.calls.append(keys[0])
+            if self.fail:
+                raise TimeoutError("Timeout reading from socket")
+            return 250
+        return take
+
+
+def test_shared_buckets_are_awaited_and_fall_back_locally():
+    from admission import RedisTokenBuckets
+
+    shared = FakeAsyncRedis()
+    controller = AdmissionController({
+        "phone": RedisTokenBuckets(shared, "phone", 1, 30),
+        "ip": RedisTokenBuckets(FakeAsyncRedis(fail=True), "ip", 1, 1),
+        "route": TokenBuckets(100, 100),
+    })
+    assert asyncio.run(controller.check_rate("9876543210", None, "GET /api/v1/mpr")) == ("phone", 0.25)
+    assert shared.calls == ["emtc:admission:phone:9876543210"]
+    # Redis timing out: the worker's own bucket applies
+    assert asyncio.run(controller.check_rate(None, "10.0.0.1", "GET /api/v1/mpr")) is None
+    assert asyncio.run(controller.check_rate(None, "10.0.0.1", "GET /api/v1/mpr"))[0] == "ip"
+
+
+def test_forged_forwarded_for_does_not_pick_the_ip_bucket(monkeypatch):
+    # uvicorn trusting every peer has already put the first entry in client
+    scope = {"headers": [(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7")], "client": ("6.6.6.6", 0)}
+    monkeypatch.setattr(admission, "FORWARDED_ALLOW_IPS", {"*"})
+    assert client_ip(scope) == "203.0.113.7"
+    # Our own proxies behind the platform one are skipped
+    scope["headers"] = [(b"x-forwarded-for", b"6.6.6.6, 203.0.113.7, 10.0.0.9")]
+    monkeypatch.setattr(admission, "FORWARDED_ALLOW_IPS", {"*", "10.0.0.9"})
+    assert client_ip(scope) == "203.0.113.7"
+    # With named proxies uvicorn's own choice is used
+    monkeypatch.setattr(admission, "FORWARDED_ALLOW_IPS", {"10.0.0.9"})
+    assert client_ip({"headers": scope["headers"], "client": ("203.0.113.7", 0)}) == "203.0.113.7"
+    assert client_ip({"headers": []}) is None
+
+
+def test_rejections_carry_cors_headers(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    # An empty route bucket turns every API request away
+    monkeypatch.setitem(admission.admission.buckets, "route", TokenBuckets(1, 0))
+    response = TestClient(app).get("/api/v1/stats", headers={"Origin": "https://dashboard.example"})
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"] in ("*", "https://dashboard.example")
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
@@ -0,0 +1,127 @@
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from database import create_tables, SessionLocal
+from models import MPRCreate
+import archive
+import crud
+import partitions
+
+
+def make_mpr(month_and_year, return_no):
+    return MPRCreate(
+        name_and_address="Address", district_state_tel="District, State, 1234567890", panel_centre="Centre",
+        centre_code="ARCH", return_no=return_no, family_size=4, income_group="04",
+        month_and_year=month_and_year, occupation_of_head="03",
+        items=[{
+            "item_name": "Shirt", "item_code": "401", "month_of_purchase": "01", "fibre_code": "01",
+            "sector_of_manufacture_code": "01", "colour_design_code": "01", "gender": "M",
+            "type_of_shop_code": "01", "purchase_type_code": "01", "dress_intended_code": "01",
+            "length_in_meters": 2.0, "price_per_meter": 100.0, "total_amount_paid": 200.0,
+            "brand_mill_name": "Brand", "is_imported": False,
+        }],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(partitions, "PARTITION_DIR", str(tmp_path / "partitions"))
+    create_tables()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_closed_periods_archive_and_read_through(db):
+    expected = [crud.mpr_to_dict(crud.create_mpr(db, make_mpr("5/2018", f"A{i}"))) for i in range(3)]
+    crud.create_mpr(db, make_mpr("6/2018", "B0"))
+
+    assert archive.closed_before(datetime(2019, 6, 15), months=12) == 201806
+    archived = archive.archive_closed_periods(db, now=datetime(2019, 6, 15))
+    assert [(entry["table"], entry["period"], entry["rows"]) for entry in archived] == [("mpr", "2018-05", 3)]
+
+    # Gone from the hot table, but listing the period reads the archive file
+    assert crud.get_database_stats(db)["archived_mpr"] == 3
+    records = crud.get_all_mpr(db, limit=1000, period=201805)
+    assert [crud.mpr_to_dict(record) for record in records] == expected
+    assert [r.return_no for r in crud.get_all_mpr(db, limit=1000, period=201806)] == ["B0"]
+
+    manifest = archive.load_manifest(archive.ARCHIVE_DIR)
+    entry = manifest["entries"]["mpr/201805"]
+    assert archive.verify_all(archive.ARCHIVE_DIR) == {"mpr/201805": True}
+    only_ids = archive.read_period(db, "mpr", 201805, columns=["id"])
+    assert [row["id"] for row in only_ids] == [record["id"] for record in expected]
+
+    with pytest.raises(ValueError):
+        crud.create_mpr(db, make_mpr("5/2018", "A9"))
+
+    archive.restore_period(db, "mpr", 201805)
+    assert [crud.mpr_to_dict(record) for record in crud.get_all_mpr(db, limit=1000, period=201805)] == expected
+    assert not os.path.exists(os.path.join(archive.ARCHIVE_DIR, entry["file"]))
+
+
+def test_tampered_archive_file_is_refused(db):
+    crud.create_mpr(db, make_mpr("1/2017", "T0"))
+    entry = archive.archive_period(db, "mpr", 201701)
+    with open(os.path.join(archive.ARCHIVE_DIR, entry["file"]), "ab") as f:
+        f.write(b"x")
+    with pytest.raises(ValueError):
+        archive.read_period(db, "mpr", 201701)
+
+
+def test_archived_pages_stop_reading_after_the_page(db, monkeypatch):
+    ids = [crud.create_mpr(db, make_mpr("3/2016", f"P{i}")).id for i in range(5)]
+    archive.archive_period(db, "mpr", 201603)
+
+    decoded = []
+    column_values = archive._column_values
+
+    def counting_column_values(zf, name):
+        for value in column_values(zf, name):
+            decoded.append(name)
+            yield value
+
+    monkeypatch.setattr(archive, "_column_values", counting_column_values)
+    page = crud.get_all_mpr(db, skip=1, limit=2, period=201603)
+    assert [record.id for record in page] == ids[1:3]
+    # Three rows of each column were decoded, not the whole month
+    assert len(decoded) == 3 * len(archive.partitions.PARTITIONED_TABLES["mpr"].__table__.columns)
+
+
+def test_format_1_archive_files_are_still_read(db, tmp_path):
+    table = partitions.PARTITIONED_TABLES["mpr"].__table__
+    path = str(tmp_path / "v1.zip")
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("columns/id.json", json.dumps([1, 2]))
+        zf.writestr("columns/created_at.json", json.dumps(["2016-03-01T10:00:00", None]))
+    assert archive.read_archive_file(path, table, ["id", "created_at"]) == [
+        {"id": 1, "created_at": datetime(2016, 3, 1, 10, 0)},
+        {"id": 2, "created_at": None},
+    ]
+
+
+def test_periods_stream_to_and_from_the_archive_in_batches(db, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_BATCH_SIZE", 2)
+    expected = [crud.mpr_to_dict(crud.create_mpr(db, make_mpr("8/2015", f"S{i}"))) for i in range(5)]
+
+    written = []
+    write_archive_file = archive.write_archive_file
+
+    def recording_write(path, table, rows):
+        written.append(type(rows))
+        return write_archive_file(path, table, rows)
+
+    monkeypatch.setattr(archive, "write_archive_file", recording_write)
+    entry = archive.archive_period(db, "mpr", 201508)
+    # The rows reach the file as a result stream, not a list
+    assert written and written[0] is not list
+    assert (entry["rows"], entry["min_id"], entry["max_id"]) == (5, expected[0]["id"], expected[-1]["id"])
+
+    assert archive.restore_period(db, "mpr", 201508)["rows"] == 5
+    assert [crud.mpr_to_dict(record) for record in crud.get_all_mpr(db, limit=1000, period=201508)] == expected
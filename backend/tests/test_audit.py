@@ -0,0 +1,76 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+import audit
+import conftest
+import crud
+import geo
+
+make_mpr = partial(conftest.make_mpr, centre_code="AUD1")
+
+
+def test_haversine_array_matches_scalar():
+    lat1, lon1 = np.array([12.97, 28.61]), np.array([77.59, 77.21])
+    lat2, lon2 = np.array([13.08, 19.08]), np.array([80.27, 72.88])
+    distances = geo.haversine_km_array(lat1, lon1, lat2, lon2)
+    for i in range(2):
+        assert distances[i] == pytest.approx(geo.haversine_km(lat1[i], lon1[i], lat2[i], lon2[i]))
+
+
+def test_screening_flags_distant_and_clustered_returns(db):
+    # Screen whatever earlier tests wrote so only this test's records remain
+    while crud.get_unsynced_dpr(db, consumer="audit") or crud.get_unsynced_mpr(db, consumer="audit"):
+        audit.screen_pending(db, max_ranges=100)
+
+    audit.upsert_centre(db, "AUD1", 12.9716, 77.5946, "Audit Centre", "Karnataka")
+    far = crud.create_mpr(db, make_mpr("F1", latitude=13.3409, longitude=77.1010)).id
+    clustered = [crud.create_mpr(db, make_mpr(f"D{i}", latitude=12.9800, longitude=77.6000)).id for i in range(2)]
+    normal = crud.create_mpr(db, make_mpr("N1", latitude=12.9650, longitude=77.5900)).id
+    assert audit.screen_pending(db)["mpr"] == 1
+
+    # The third return from the same spot also flags the two screened earlier
+    clustered.append(crud.create_mpr(db, make_mpr("D2", latitude=12.9800, longitude=77.6000)).id)
+    assert audit.screen_pending(db)["mpr"] == 3
+    assert not crud.get_unsynced_mpr(db, consumer="audit")
+
+    flags = audit.get_audit_flags(db, centre_code="AUD1")
+    by_type = {}
+    for flag in flags:
+        by_type.setdefault(flag.flag_type, set()).add(flag.record_id)
+    assert by_type["far_from_centre"] == {far}
+    assert by_type["duplicate_coordinates"] == set(clustered)
+    assert normal not in by_type["far_from_centre"] | by_type["duplicate_coordinates"]
+    distant = audit.get_audit_flags(db, flag_type="far_from_centre", centre_code="AUD1")[0]
+    assert distant.distance_km > audit.MAX_CENTRE_DISTANCE_KM
+
+    # Moving a record and re-screening replaces its flags rather than adding more
+    crud.update_mpr(db, far, {"latitude": 12.9716, "longitude": 77.5946})
+    audit.screen_pending(db)
+    assert not audit.get_audit_flags(db, flag_type="far_from_centre", centre_code="AUD1")
+
+
+def test_shrunken_clusters_and_deleted_records_lose_their_flags(db):
+    while crud.get_unsynced_dpr(db, consumer="audit") or crud.get_unsynced_mpr(db, consumer="audit"):
+        audit.screen_pending(db, max_ranges=100)
+
+    audit.upsert_centre(db, "AUD1", 12.9716, 77.5946, "Audit Centre", "Karnataka")
+    clustered = [crud.create_mpr(db, make_mpr(f"S{i}", latitude=12.9500, longitude=77.6200)).id for i in range(4)]
+    audit.screen_pending(db)
+
+    def flagged():
+        return {flag.record_id for flag in audit.get_audit_flags(db, flag_type="duplicate_coordinates", limit=1000)}
+
+    assert set(clustered) <= flagged()
+
+    # Deleting a return drops its flags straight away; the rest still cluster
+    crud.delete_mpr(db, clustered[0])
+    assert clustered[0] not in flagged()
+    audit.screen_pending(db)
+    assert set(clustered[1:]) <= flagged()
+
+    # One more moves away: the two left behind are no longer a cluster
+    crud.update_mpr(db, clustered[1], {"latitude": 12.9600, "longitude": 77.6100})
+    audit.screen_pending(db)
+    assert not set(clustered) & flagged()
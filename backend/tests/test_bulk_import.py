@@ -0,0 +1,168 @@
+import csv
+
+import pytest
+from fastapi.testclient import TestClient
+
+from database import SessionLocal, DPR, MPR, ImportJob
+import bulk_import
+import crud
+
+MPR_HEADER = ["Centre Code", "Return No", "Month and Year", "Name and Address", "District State Tel",
+              "Panel Centre", "Family Size", "Income Group", "Occupation of Head", "Latitude", "Longitude",
+              "OTP Code", "Item Name", "Item Code", "Month of Purchase", "Fibre Code",
+              "Sector of Manufacture Code", "Colour Design Code", "Type of Shop Code", "Purchase Type Code",
+              "Dress Intended Code", "Length in Meters", "Price per Meter", "Total Amount Paid",
+              "Brand Mill Name", "Is Imported", "Remarks"]
+
+DPR_HEADER = ["centre_code", "return_no", "month_and_year", "name_and_address", "district", "state",
+              "family_size", "income_group", "latitude", "longitude", "otp_code", "member_name",
+              "relationship_with_head", "gender", "age", "education", "occupation", "annual_income_job",
+              "annual_income_other", "other_income_source", "total_income"]
+
+
+def mpr_return(centre_code, return_no):
+    return [centre_code, return_no, "2024-07", f"House {return_no}", "Madurai, Tamil Nadu, 9876543210",
+            "Centre", "4", "04", "03", "12.0", "77.0", "1234"]
+
+
+def item(code, metres, price, total):
+    return [f"Item {code}", code, "01", "01", "01", "01", "01", "01", "01", str(metres), str(price), str(total),
+            "Brand", "no", "keyed from paper"]
+
+
+def blank_return():
+    return [""] * 12
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def mpr_sheet(path, centre_code, count):
+    rows = []
+    for number in range(count):
+        return_no = f"P{number}"
+        rows.append(mpr_return(centre_code, return_no) + item("401", 2, 100, 200))
+        # Continuation row: the return's columns left blank
+        rows.append(blank_return() + item("402", 1.5, 300, 450))
+    return write_csv(path, MPR_HEADER, rows)
+
+
+def test_mpr_sheet_is_grouped_validated_and_reported_by_row(db, tmp_path):
+    rows = [
+        mpr_return("IMP1", "A1") + item("401", 2, 100, 200),
+        blank_return() + item("402", 1.5, 300, 450),
+        # Nil return: no item columns
+        mpr_return("IMP1", "A2") + [""] * 15,
+        mpr_return("IMP1", "A3") + item("401", 2, 100, 200),
+        # Total does not match length x price
+        mpr_return("IMP1", "A3") + item("403", 2, 100, 999),
+        mpr_return("IMP1", "A4")[:6] + ["0"] + mpr_return("IMP1", "A4")[7:] + item("401", 2, 100, 200),
+    ]
+    path = write_csv(tmp_path / "mpr.csv", MPR_HEADER, rows)
+
+    job = bulk_import.start_job(path, "mpr", session_factory=SessionLocal)
+    summary = bulk_import.run_job(job.id, workers=1, chunk_records=2, session_factory=SessionLocal)
+    assert summary["status"] == "completed"
+    assert (summary["imported"], summary["failed"], summary["skipped"]) == (2, 2, 0)
+    assert summary["committed_row"] == 7
+
+    first = db.query(MPR).filter(MPR.centre_code == "IMP1", MPR.return_no == "A1").one()
+    assert first.item_count == 2 and first.period == 202407
+    assert db.query(MPR).filter(MPR.centre_code == "IMP1", MPR.return_no == "A2").one().item_count == 0
+
+    report = [(error.row, error.field, error.kind) for error in bulk_import.get_errors(db, job.id)]
+    assert report == [(1, "Remarks", "warning"), (6, "total_amount_paid", "error"), (7, "family_size", "error")]
+
+
+def test_failed_import_resumes_after_the_last_loaded_chunk(db, tmp_path, monkeypatch):
+    path = mpr_sheet(tmp_path / "resume.csv", "IMP2", 6)
+    job = bulk_import.start_job(path, "mpr", session_factory=SessionLocal)
+
+    bulk_create = crud.bulk_create
+    calls = []
+
+    def failing_bulk_create(session, table_name, records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            # Written, then the worker dies before the job moves on
+            bulk_create(session, table_name, records)
+            raise RuntimeError("worker lost")
+        return bulk_create(session, table_name, records)
+
+    monkeypatch.setattr(crud, "bulk_create", failing_bulk_create)
+    with pytest.raises(RuntimeError):
+        bulk_import.run_job(job.id, workers=1, chunk_records=2, session_factory=SessionLocal)
+    failed = db.get(ImportJob, job.id)
+    assert failed.status == "failed" and failed.last_error == "worker lost"
+    assert (failed.committed_row, failed.imported) == (5, 2)
+
+    monkeypatch.setattr(crud, "bulk_create", bulk_create)
+    # The same file finds the same job
+    assert bulk_import.start_job(path, "mpr", session_factory=SessionLocal).id == job.id
+    summary = bulk_import.run_job(job.id, workers=1, chunk_records=2, session_factory=SessionLocal)
+    assert summary["status"] == "completed"
+    # The chunk written before the failure is skipped, not duplicated
+    assert (summary["imported"], summary["skipped"]) == (4, 2)
+    assert db.query(MPR).filter(MPR.centre_code == "IMP2").count() == 6
+    assert bulk_import.run_job(job.id, session_factory=SessionLocal)["imported"] == 4
+
+
+def test_dpr_workbook_is_validated_in_worker_processes(db, tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(DPR_HEADER)
+    for number in range(5):
+        household = ["IMP3", f"D{number}", "July 2024", f"House {number}", "District", "Kerala", 2, "04", 12.0, 77.0,
+                     1234]
+        sheet.append(household + ["Head", "01", "M", 40, "08", "03", 50000, 0, "None", 50000])
+        sheet.append([None] * 11 + ["Spouse", "02", "F", 200 if number == 3 else 38, "08", "03", 0, 0, "None", 0])
+    path = str(tmp_path / "dpr.xlsx")
+    workbook.save(path)
+
+    job = bulk_import.start_job(path, "dpr", session_factory=SessionLocal)
+    summary = bulk_import.run_job(job.id, workers=2, chunk_records=2, session_factory=SessionLocal)
+    assert (summary["imported"], summary["failed"]) == (4, 1)
+    dpr = db.query(DPR).filter(DPR.centre_code == "IMP3", DPR.return_no == "D0").one()
+    assert dpr.otp_code == "1234" and dpr.period == 202407
+    assert len(crud.dpr_to_dict(dpr)["household_members"]) == 2
+    # The spouse's row of return D3
+    assert [(error.row, error.field) for error in bulk_import.get_errors(db, job.id)] == [(9, "age")]
+
+
+def test_sheets_without_key_columns_are_rejected():
+    with pytest.raises(ValueError, match="return_no"):
+        bulk_import.map_columns("mpr", ["Centre Code", "Month", "Item Code"])
+    columns, unknown = bulk_import.map_columns("dpr", ["Center Code", "Return Number", "Period", "Member Name", "x"])
+    assert columns == [("record", "centre_code"), ("record", "return_no"), ("record", "month_and_year"),
+                       ("child", "name"), None]
+    assert unknown == ["x"]
+
+
+def test_import_endpoint_runs_the_job_and_reports(db, tmp_path, monkeypatch):
+    from main import app
+    monkeypatch.setattr(bulk_import, "IMPORT_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(bulk_import, "IMPORT_WORKERS", 1)
+    path = mpr_sheet(tmp_path / "upload.csv", "IMP4", 3)
+    client = TestClient(app)
+
+    with open(path, "rb") as f:
+        response = client.post("/api/v1/imports/mpr", files={"file": ("june.csv", f, "text/csv")})
+    assert response.status_code == 202
+    job_id = response.json()["data"]["id"]
+
+    report = client.get(f"/api/v1/imports/{job_id}").json()["data"]
+    assert report["status"] == "completed" and report["imported"] == 3
+    assert report["filename"] == "june.csv"
+    assert report["rows"] == [{"row": 1, "field": "Remarks", "kind": "warning", "message": "Unknown column, ignored"}]
+
+    with open(path, "rb") as f:
+        again = client.post("/api/v1/imports/mpr", files={"file": ("june.csv", f, "text/csv")})
+    assert again.json()["message"] == "File already imported"
+    assert client.post("/api/v1/imports/fp", files={"file": ("june.csv", b"x", "text/csv")}).status_code == 400
+    assert client.get("/api/v1/imports/999999").status_code == 404
@@ -0,0 +1,45 @@
+import hashlib
+import io
+import json
+import zipfile
+from functools import partial
+
+import archive
+import bundle
+import conftest
+import crud
+
+make_mpr = partial(conftest.make_mpr, centre_code="BNDL", month_and_year="2024-05")
+
+
+def test_bundle_streams_one_entry_at_a_time(db):
+    ids = [crud.create_mpr(db, make_mpr(f"R{i}")).id for i in range(5)]
+    crud.create_mpr(db, make_mpr("R9", month_and_year="2024-06"))
+    assert bundle.has_records(db, "BNDL", 202405)
+    assert not bundle.has_records(db, "BNDL", 202407)
+
+    chunks = list(bundle.stream_bundle(db, "BNDL", 202405))
+    # One chunk per MPR, then the manifest and the central directory
+    assert len(chunks) == 6
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        assert manifest["centerCode"] == "BNDL" and manifest["periodId"] == "2024-05"
+        assert sorted(manifest["fileHashes"]) == sorted(f"mpr/R{i}_{id}.json" for i, id in enumerate(ids))
+        for name, digest in manifest["fileHashes"].items():
+            data = archive.read(name)
+            assert hashlib.sha256(data).hexdigest() == digest
+            assert json.loads(data)["centre_code"] == "BNDL"
+
+
+def test_archived_periods_only_bundle_centres_they_hold(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    ids = [crud.create_mpr(db, make_mpr(f"A{i}", month_and_year="2019-02")).id for i in range(2)]
+    archive.archive_period(db, "mpr", 201902)
+
+    assert bundle.has_records(db, "BNDL", 201902)
+    assert not bundle.has_records(db, "NONE", 201902)
+    with zipfile.ZipFile(io.BytesIO(b"".join(bundle.stream_bundle(db, "BNDL", 201902)))) as zf:
+        assert sorted(json.loads(zf.read("manifest.json"))["fileHashes"]) == [
+            f"mpr/A{i}_{id}.json" for i, id in enumerate(ids)
+        ]
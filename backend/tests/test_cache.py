@@ -0,0 +1,93 @@
+from functools import partial
+
+import pytest
+from sqlalchemy import event
+
+from cache import LRUCache, record_cache
+from database import engine
+import cache
+import conftest
+import crud
+
+make_mpr = partial(conftest.make_mpr, centre_code="CACHE")
+
+
+@pytest.fixture
+def db(db):
+    record_cache.store.clear()
+    return db
+
+
+@pytest.fixture
+def statements():
+    seen = []
+
+    def count(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    yield seen
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def test_lru_evicts_oldest_and_expires_entries():
+    now = [0.0]
+    cache = LRUCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None and cache.get("c") == 3
+
+    now[0] = 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (2, 2, 1, 1)
+
+    # A read that started before an invalidation cannot put its value back
+    token = cache.token("a")
+    cache.invalidate("a")
+    cache.put("a", "stale", token)
+    assert cache.get("a") is None
+
+
+def test_repeated_reads_skip_the_database(db, statements):
+    mpr_id = crud.create_mpr(db, make_mpr("C1")).id
+    db.close()
+
+    assert crud.get_mpr_by_id(db, mpr_id).return_no == "C1"
+    db.close()
+    statements.clear()
+    assert crud.get_mpr_by_id(db, mpr_id).return_no == "C1"
+    assert crud.get_mpr_by_return(db, "CACHE", "C1", 202401).id == mpr_id
+    assert crud.get_mpr_by_return(db, "CACHE", "C1", 202401).id == mpr_id
+    # Only the natural-key lookup went to the database, once
+    assert len(statements) == 1
+
+
+def test_writes_invalidate_cached_records(db):
+    mpr_id = crud.create_mpr(db, make_mpr("C2")).id
+    assert crud.get_mpr_by_id(db, mpr_id).family_size == 4
+    db.close()
+
+    # The update starts from the cached snapshot and invalidates it
+    crud.update_mpr(db, mpr_id, {"family_size": 6, "return_no": "C3"})
+    db.close()
+    assert crud.get_mpr_by_id(db, mpr_id).family_size == 6
+    assert crud.get_mpr_by_return(db, "CACHE", "C2", 202401) is None
+    assert crud.get_mpr_by_return(db, "CACHE", "C3", 202401).id == mpr_id
+    db.close()
+
+    assert crud.delete_mpr(db, mpr_id)
+    assert crud.get_mpr_by_id(db, mpr_id) is None
+    assert crud.get_mpr_by_return(db, "CACHE", "C3", 202401) is None
+
+
+def test_ttl_is_short_unless_invalidations_are_shared(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_TTL", None)
+    monkeypatch.setattr(cache, "CACHE_REDIS_URL", None)
+    assert cache.RecordCache.from_env().store.ttl == cache.LOCAL_CACHE_TTL
+    assert cache.default_ttl(shared=True) == cache.SHARED_CACHE_TTL
+
+    monkeypatch.setattr(cache, "CACHE_TTL", 60.0)
+    assert cache.RecordCache.from_env().store.ttl == 60.0
@@ -0,0 +1,63 @@
+from database import create_tables, SessionLocal
+from models import FPCreate
+import crud
+
+
+def make_fp():
+    return FPCreate(
+        centre_name="Centre A",
+        centre_code="CA001",
+        panel_size=20,
+        mpr_collected=18,
+        not_collected=2,
+        with_purchase_data=15,
+        nil_mprs=3,
+        nil_serial_nos=3,
+        latitude=12.0,
+        longitude=77.0,
+    )
+
+
+def test_writes_bump_only_their_table_counter():
+    create_tables()
+    db = SessionLocal()
+
+    (fp_before, _), (dpr_before, _) = crud.get_change_counters(db, "fp", "dpr")
+    fp = crud.create_fp(db, make_fp())
+    crud.delete_fp(db, fp.id)
+    (fp_after, updated_at), (dpr_after, _) = crud.get_change_counters(db, "fp", "dpr")
+
+    assert fp_after == fp_before + 2
+    assert dpr_after == dpr_before
+    assert updated_at is not None
+
+    db.close()
+
+
+def test_change_seqs_are_taken_at_commit_in_order():
+    create_tables()
+    db = SessionLocal()
+
+    (before, _), = crud.get_change_counters(db, "fp")
+    fp = crud.create_fp(db, make_fp())
+    assert fp.change_seq == before + 1
+
+    # Nothing is taken until commit, and a rollback takes nothing
+    first = crud.get_fp_by_id(db, fp.id)
+    crud.mark_changed(db, "fp", first)
+    db.flush()
+    assert crud.get_change_counters(db, "fp")[0][0] == before + 1
+    db.rollback()
+    assert crud.get_change_counters(db, "fp")[0][0] == before + 1
+
+    # One bump for the whole transaction, one number per record
+    second = crud.create_fp(db, make_fp())
+    crud.mark_changed(db, "fp", crud.get_fp_by_id(db, fp.id))
+    crud.mark_changed(db, "fp", crud.get_fp_by_id(db, second.id))
+    crud.mark_changed(db, "fp", crud.get_fp_by_id(db, fp.id))
+    db.commit()
+    assert (crud.get_fp_by_id(db, fp.id).change_seq, crud.get_fp_by_id(db, second.id).change_seq) == (
+        before + 3, before + 4)
+    assert crud.get_change_counters(db, "fp")[0][0] == before + 4
+
+    db.close()
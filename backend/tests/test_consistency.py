@@ -0,0 +1,67 @@
+from conftest import make_member
+import conftest
+import consistency
+import crud
+
+
+def make_dpr(return_no, occupation="01", **fields):
+    members = [
+        make_member(name="Spouse", relationship_with_head="02", gender="F", age=38, occupation="11",
+                    annual_income_job=0, total_income=0),
+        make_member(occupation=occupation),
+    ]
+    return conftest.make_dpr(return_no, centre_code="CONS", household_members=members, **fields)
+
+
+def make_mpr(return_no, **fields):
+    return conftest.make_mpr(return_no, centre_code="CONS", **fields)
+
+
+def fields_for(db, mpr_id):
+    return {m.field: (m.mpr_value, m.dpr_value) for m in consistency.get_mismatches(db, centre_code="CONS", limit=1000)
+            if m.mpr_id == mpr_id}
+
+
+def test_mpr_checked_against_head_of_household(db):
+    crud.create_dpr(db, make_dpr("C1"))
+    matching = crud.create_mpr(db, make_mpr("C1")).id
+    wrong = crud.create_mpr(db, make_mpr("C1", family_size=6, occupation_of_head="05")).id
+    unlinked = crud.create_mpr(db, make_mpr("C-NONE", family_size=9)).id
+
+    assert fields_for(db, matching) == {}
+    assert fields_for(db, wrong) == {"family_size": ("6", "4"), "occupation_of_head": ("05", "03")}
+    assert fields_for(db, unlinked) == {}
+
+    # Correcting the MPR clears its mismatches
+    crud.update_mpr(db, wrong, {"family_size": 4, "occupation_of_head": "03"})
+    assert fields_for(db, wrong) == {}
+
+
+def test_dpr_changes_recheck_linked_mprs(db):
+    dpr = crud.create_dpr(db, make_dpr("C2"))
+    mpr = crud.create_mpr(db, make_mpr("C2")).id
+
+    crud.update_dpr(db, dpr.id, {"income_group": "07"})
+    assert fields_for(db, mpr) == {"income_group": ("04", "07")}
+
+    crud.delete_dpr(db, dpr.id)
+    assert fields_for(db, mpr) == {}
+
+    # A rebuild from the stored records gives the same report
+    crud.create_dpr(db, make_dpr("C2", family_size=5))
+    before = fields_for(db, mpr)
+    consistency.rebuild(db)
+    assert fields_for(db, mpr) == before == {"family_size": ("4", "5")}
+
+
+def test_head_occupation_compared_through_the_code_mapping(db):
+    # DPR "03" (petty business) is MPR "02" (business), not MPR "03" (service)
+    crud.create_dpr(db, make_dpr("C3", occupation="03"))
+    business = crud.create_mpr(db, make_mpr("C3", occupation_of_head="02")).id
+    service = crud.create_mpr(db, make_mpr("C3", occupation_of_head="03")).id
+    assert fields_for(db, business) == {}
+    assert fields_for(db, service) == {"occupation_of_head": ("03", "02")}
+
+    # Agricultural labour has no single MPR code, so the field is not checked
+    crud.create_dpr(db, make_dpr("C4", occupation="08"))
+    assert fields_for(db, crud.create_mpr(db, make_mpr("C4", occupation_of_head="06")).id) == {}
@@ -45,11 +45,11 @@ def test_update_dpr_accepts_plain_dicts():
 
     member = HouseholdMember(
         name="Alice",
-        relationship_with_head="self",
+        relationship_with_head="01",
         gender="F",
         age=30,
-        education="College",
-        occupation="Engineer",
+        education="08",
+        occupation="01",
         annual_income_job=50000,
         annual_income_other=0,
         other_income_source="None",
@@ -61,7 +61,7 @@ def test_update_dpr_accepts_plain_dicts():
         district="District",
         state="State",
         family_size=4,
-        income_group="Middle",
+        income_group="04",
         centre_code="C001",
         return_no="R001",
         month_and_year="2024-01",
@@ -90,15 +90,15 @@ def test_update_mpr_accepts_plain_dicts():
 
     item = PurchaseItem(
         item_name="Shirt",
-        item_code="S001",
-        month_of_purchase="2024-01",
-        fibre_code="F001",
-        sector_of_manufacture_code="SMC",
-        colour_design_code="CDC",
+        item_code="401",
+        month_of_purchase="01",
+        fibre_code="01",
+        sector_of_manufacture_code="01",
+        colour_design_code="04",
         person_age_gender="30M",
-        type_of_shop_code="TSC",
-        purchase_type_code="PTC",
-        dress_intended_code="DIC",
+        type_of_shop_code="01",
+        purchase_type_code="01",
+        dress_intended_code="01",
         length_in_meters=1.0,
         price_per_meter=10.0,
         total_amount_paid=10.0,
@@ -113,9 +113,9 @@ def test_update_mpr_accepts_plain_dicts():
         centre_code="C001",
         return_no="R001",
         family_size=4,
-        income_group="Middle",
+        income_group="04",
         month_and_year="2024-01",
-        occupation_of_head="Engineer",
+        occupation_of_head="03",
         items=[item],
         latitude=12.0,
         longitude=77.0,
@@ -123,15 +123,22 @@ def test_update_mpr_accepts_plain_dicts():
     )
 
     mpr = crud.create_mpr(db, mpr_create)
+    created_items = mpr.items
 
     update_model = MPRUpdate(**mpr_create.dict())
     update_dict = update_model.dict()
-    update_dict["income_group"] = "High"
+    update_dict["income_group"] = "07"
     updated = crud.update_mpr(db, mpr.id, update_dict)
 
     stored_items = json.loads(updated.items)
     assert stored_items[0]["item_name"] == "Shirt"
-    assert updated.income_group == "High"
+    assert updated.income_group == "07"
+    # Same serialization as create, whether the items are dicts or models
+    assert updated.items == created_items
+
+    updated = crud.update_mpr(db, mpr.id, {"items": [item, item]})
+    assert updated.items == crud.PurchaseItemList.dump_json([item.model_dump()] * 2).decode()
+    assert updated.item_count == 2
 
     db.close()
 
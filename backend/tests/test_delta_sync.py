@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import make_fp
+import crud
+from delta_sync import collect_changes, decode_token
+
+
+def test_changes_since_token_include_upserts_and_tombstones(db):
+    token = collect_changes(db, None)["token"]
+
+    first = crud.create_fp(db, make_fp(centre_code="SYNC1"))
+    second = crud.create_fp(db, make_fp(centre_code="SYNC1"))
+    crud.create_fp(db, make_fp(centre_code="SYNC2"))
+    crud.delete_fp(db, second.id)
+
+    result = collect_changes(db, token, centre_code="SYNC1")
+    fp_changes = result["changes"]["fp"]
+    assert [record["id"] for record in fp_changes["upserts"]] == [first.id]
+    assert fp_changes["deleted"] == [second.id]
+    assert result["has_more"] is False
+
+    # Nothing new since the returned token
+    again = collect_changes(db, result["token"], centre_code="SYNC1")
+    assert again["changes"]["fp"] == {"upserts": [], "deleted": []}
+
+    # An update moves the record past the watermark again
+    crud.mark_changed(db, "fp", first)
+    db.commit()
+    updated = collect_changes(db, result["token"], centre_code="SYNC1")
+    assert [record["id"] for record in updated["changes"]["fp"]["upserts"]] == [first.id]
+
+
+def test_changes_are_paged_by_limit(db):
+    token = collect_changes(db, None)["token"]
+    created = [crud.create_fp(db, make_fp(centre_code="SYNC3")).id for _ in range(3)]
+
+    page = collect_changes(db, token, centre_code="SYNC3", limit=2)
+    assert [record["id"] for record in page["changes"]["fp"]["upserts"]] == created[:2]
+    assert page["has_more"] is True
+
+    rest = collect_changes(db, page["token"], centre_code="SYNC3", limit=2)
+    assert [record["id"] for record in rest["changes"]["fp"]["upserts"]] == created[2:]
+    assert rest["has_more"] is False
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(ValueError):
+        decode_token("v1.1.2")
@@ -0,0 +1,80 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+import conftest
+from conftest import make_item
+import crud
+import estimates
+
+make_dpr = partial(conftest.make_dpr, centre_code="EST1", month_and_year="2024-03")
+make_mpr = partial(conftest.make_mpr, centre_code="EST1", month_and_year="2024-03", family_size=1)
+
+
+def test_ratio_estimates_match_a_direct_computation():
+    rng = np.random.default_rng(1)
+    households = 40
+    items = 150
+    panel = estimates.Panel(
+        persons=rng.integers(1, 8, households).astype(float),
+        weights=np.ones(households),
+        household={"income_group": rng.choice(["01", "02"], households).astype(object),
+                   "state": np.array(["Kerala"] * households, dtype=object)},
+        item_household=rng.integers(0, households, items),
+        item={"item": rng.choice(["401", "402", "403"], items).astype(object),
+              "fibre": np.array(["01"] * items, dtype=object),
+              "sector": np.array(["01"] * items, dtype=object)},
+        quantity=rng.uniform(0.5, 5, items),
+        value=rng.uniform(50, 900, items),
+    )
+    rows = estimates.compute(panel, ["income_group", "item"])
+
+    for row in rows:
+        in_domain = panel.household["income_group"] == row["income_group"]
+        x = panel.persons[in_domain]
+        y = np.array([
+            panel.quantity[(panel.item_household == h) & (panel.item["item"] == row["item"])].sum()
+            for h in np.flatnonzero(in_domain)
+        ])
+        ratio = y.sum() / x.sum()
+        n = len(x)
+        se = np.sqrt(n / (n - 1) * ((y - ratio * x) ** 2).sum() / x.sum() ** 2)
+        assert row["households"] == n
+        assert row["quantity_per_capita"] == pytest.approx(ratio, abs=1e-4)
+        assert row["quantity_se"] == pytest.approx(se, abs=1e-4)
+    assert len(rows) == 6
+
+
+def test_estimates_are_cached_until_mprs_change(db):
+    crud.create_dpr(db, make_dpr("E1", family_size=4, state="Kerala"))
+    crud.create_dpr(db, make_dpr("E2", family_size=2, state="Kerala"))
+    crud.create_mpr(db, make_mpr("E1", income_group="01", items=[make_item("401", "01", 4.0, 400.0)]))
+    crud.create_mpr(db, make_mpr("E2", income_group="01", items=[make_item("401", "01", 2.0, 200.0), make_item("402", "02", 1.0, 50.0)]))
+    loads = []
+
+    def load(period):
+        loads.append(period)
+        return estimates.load_panel(db, period)
+
+    counters = crud.get_change_counters(db, "mpr", "dpr")
+    result, cached = estimates.get_estimates(202403, ["state", "item"], counters, load)
+    assert not cached
+    assert result["households"] == 2 and result["persons"] == 6.0
+    shirting = next(row for row in result["estimates"] if row["item"] == "401")
+    assert shirting["state"] == "Kerala"
+    # Household sizes come from the DPRs: 6 metres over 6 persons
+    assert shirting["quantity_per_capita"] == 1.0
+    assert shirting["value_per_capita"] == 100.0
+
+    assert estimates.get_estimates(202403, ["state", "item"], counters, load) == (result, True)
+    crud.create_mpr(db, make_mpr("E3", income_group="02", items=[make_item("401", "01", 3.0, 300.0)]))
+    _, cached = estimates.get_estimates(202403, ["state", "item"], crud.get_change_counters(db, "mpr", "dpr"), load)
+    assert not cached
+    assert loads == [202403, 202403]
+
+
+def test_unknown_dimensions_are_rejected():
+    assert estimates.parse_dimensions("income_group, item,item") == ["income_group", "item"]
+    with pytest.raises(ValueError):
+        estimates.parse_dimensions("district")
@@ -0,0 +1,84 @@
+import asyncio
+from functools import partial
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from database import Centre
+from events import EventBus, event_bus
+from routes import router
+import conftest
+import crud
+
+make_mpr = partial(conftest.make_mpr, centre_code="EVT1", month_and_year="2024-05")
+
+
+def event(centre_code="C1", state="Kerala", record_type="mpr"):
+    return {"record_type": record_type, "action": "created", "id": 1, "centre_code": centre_code, "state": state}
+
+
+def test_subscribers_get_matching_events():
+    async def scenario():
+        bus = EventBus(queue_size=10)
+        everything = bus.subscribe()
+        kerala_mprs = bus.subscribe(states=["Kerala"], record_types=["mpr"])
+        bus.publish(event(state="Kerala"))
+        bus.publish(event(state="Goa"))
+        bus.publish(event(record_type="dpr"))
+
+        assert [e["state"] for e in [await everything.get() for _ in range(3)]] == ["Kerala", "Goa", "Kerala"]
+        assert (await kerala_mprs.get())["seq"] == 1
+        assert kerala_mprs.queue.empty()
+        assert bus.stats()["delivered"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_is_dropped():
+    async def scenario():
+        bus = EventBus(queue_size=2)
+        slow = bus.subscribe()
+        fast = bus.subscribe()
+        for _ in range(2):
+            bus.publish(event())
+        await fast.get()
+        await fast.get()
+        bus.publish(event())
+
+        # The slow one is closed and told why; the fast one carries on
+        assert await slow.get() is None
+        assert slow.dropped
+        assert (await fast.get())["seq"] == 3
+        assert bus.stats()["subscribers"] == 1
+        assert bus.stats()["dropped"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_publish_from_another_thread():
+    async def scenario():
+        bus = EventBus()
+        subscriber = bus.subscribe()
+        await asyncio.to_thread(bus.publish, event())
+        assert (await asyncio.wait_for(subscriber.get(), 1))["centre_code"] == "C1"
+
+    asyncio.run(scenario())
+
+
+def test_writes_reach_websocket_subscribers(db):
+    db.merge(Centre(centre_code="EVT1", centre_name="Centre", state="Kerala", latitude=12.0, longitude=77.0))
+    db.commit()
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+
+    with TestClient(app).websocket_connect("/api/v1/stream/ws?centre_code=EVT1") as websocket:
+        crud.create_mpr(db, make_mpr("E0", centre_code="EVT2"))
+        mpr = crud.create_mpr(db, make_mpr("E1"))
+        received = websocket.receive_json()
+
+    assert received["record_type"] == "mpr"
+    assert received["action"] == "created"
+    assert received["id"] == mpr.id
+    assert received["state"] == "Kerala"
+    assert received["period"] == 202405
+    assert event_bus.stats()["subscribers"] == 0
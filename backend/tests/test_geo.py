@@ -0,0 +1,87 @@
+from functools import partial
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, event, select
+
+from database import FP
+import conftest
+import crud
+import geo
+
+make_fp = partial(conftest.make_fp, centre_code="GEO")
+
+
+def test_geohash_matches_reference_values():
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    lat, lon = geo.decode_center("u4pruydqqvj")
+    assert abs(lat - 57.64911) < 1e-5 and abs(lon - 10.40744) < 1e-5
+    assert geo.encode(None, 77.0) is None
+
+
+def test_covering_cells_contain_every_point_within_radius():
+    center = (12.9716, 77.5946)
+    cells = geo.covering_cells(*center, radius_km=5)
+    for bearing_lat, bearing_lon in [(0.044, 0), (-0.044, 0), (0, 0.045), (0, -0.045), (0.03, 0.03)]:
+        point = (center[0] + bearing_lat, center[1] + bearing_lon)
+        assert geo.haversine_km(*center, *point) <= 5
+        assert any(geo.encode(*point).startswith(cell) for cell in cells)
+
+
+def test_records_are_indexed_and_found_by_cell(db):
+    near = crud.create_fp(db, make_fp(latitude=12.9716, longitude=77.5946))
+    far = crud.create_fp(db, make_fp(latitude=28.6139, longitude=77.2090))
+    assert near.geohash == geo.encode(12.9716, 77.5946)
+
+    found, truncated = crud.find_nearby(db, FP, 12.97, 77.59, radius_km=2, centre_code="GEO")
+    assert near.id in {record.id for _, record in found}
+    assert far.id not in {record.id for _, record in found}
+    assert not truncated
+
+    grid = dict(crud.get_grid_counts(db, FP, 3, centre_code="GEO"))
+    assert grid[near.geohash[:3]] >= 1
+    assert grid[far.geohash[:3]] >= 1
+
+
+def test_nearby_ranks_every_candidate_before_the_limit(db):
+    # More points than the limit, created farthest first
+    created = [crud.create_fp(db, make_fp(latitude=13.5 + step * 0.001, longitude=78.5)).id for step in range(30, 0, -1)]
+    found, truncated = crud.find_nearby(db, FP, 13.5, 78.5, radius_km=10, centre_code="GEO", limit=5)
+    assert [record.id for _, record in found] == created[::-1][:5]
+    assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+    assert not truncated
+
+    found, truncated = crud.find_nearby(db, FP, 13.5, 78.5, radius_km=10, centre_code="GEO", limit=5,
+                                        max_candidates=10)
+    assert truncated and len(found) == 5
+
+
+def test_bounding_box_contains_the_circle():
+    min_lat, max_lat, min_lon, max_lon = geo.bounding_box(12.97, 77.59, 50)
+    for lat, lon in [(min_lat, 77.59), (max_lat, 77.59)]:
+        assert geo.haversine_km(12.97, 77.59, lat, lon) == pytest.approx(50, rel=1e-6)
+    assert geo.haversine_km(12.97, 77.59, 12.97, max_lon) >= 50
+    assert geo.bounding_box(89.9, 0.0, 50)[2:] == (None, None)
+    assert geo.bounding_box(0.0, 179.9, 50)[2:] == (None, None)
+
+
+def _locale_order(a, b):
+    # Like an en_US/ICU collation: punctuation before digits before letters
+    def key(value):
+        return [(0 if not char.isalnum() else 1 if char.isdigit() else 2, char) for char in value]
+    return (key(a) > key(b)) - (key(a) < key(b))
+
+
+def test_prefix_ranges_hold_under_a_locale_collation():
+    engine = create_engine("sqlite://")
+    event.listen(engine, "connect", lambda conn, record: conn.create_collation("LOCALE", _locale_order))
+    probe = Table("geo_probe", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("geohash", String(collation="LOCALE")))
+    probe.metadata.create_all(engine)
+    hashes = ["tdr1v9", "tdr1vb", "tdr1vz", "tdr1w0", "tdr1zz", "tdr200", "tdrz", "zzzz"]
+    with engine.begin() as conn:
+        conn.execute(probe.insert(), [{"geohash": value} for value in hashes])
+        for prefix in ("tdr1v", "tdr1", "tdr1z", "tdr", "zz", "tdr1a"):
+            found = conn.execute(select(probe.c.geohash).where(crud.geohash_prefix_filter(probe.c, prefix))).scalars()
+            assert sorted(found) == [value for value in hashes if value.startswith(prefix)], prefix
+    assert geo.prefix_upper_bound("tdr1z") == "tdr2"
+    assert geo.prefix_upper_bound("zz") is None
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import SessionLocal, RecordHistory
+from conftest import make_item, make_mpr
+import crud
+import history
+
+
+def test_versions_are_kept_as_small_deltas_and_rebuilt(db):
+    items = [make_item() for _ in range(100)]
+    mpr = crud.create_mpr(db, make_mpr("H1", centre_code="HIST", items=items))
+    v1 = crud.mpr_to_dict(mpr)
+    assert v1["version"] == 1
+
+    items[42] = make_item(total_amount_paid=300.0)
+    crud.update_mpr(db, mpr.id, {"items": items})
+    v2 = crud.mpr_to_dict(crud.get_mpr_by_id(db, mpr.id))
+    crud.update_mpr(db, mpr.id, {"family_size": 5}, expected_version=2)
+    assert crud.get_mpr_by_id(db, mpr.id).version == 3
+
+    # One changed item costs a few bytes, not a copy of the record
+    delta = db.query(RecordHistory).filter_by(table_name="mpr", record_id=mpr.id, version=1).one()
+    assert delta.changed == "items"
+    assert len(delta.delta) < len(mpr.items) / 20
+
+    versions = history.list_versions(db, "mpr", mpr.id)
+    assert [(v["version"], v["changed"]) for v in versions] == [(3, ["family_size"]), (2, ["items"]), (1, [])]
+    assert history.reconstruct(db, "mpr", mpr.id, version=1) == v1
+    assert history.reconstruct(db, "mpr", mpr.id, version=2) == v2
+    assert history.reconstruct(db, "mpr", mpr.id, at=datetime.fromisoformat(v2["updated_at"])) == v2
+    assert history.reconstruct(db, "mpr", mpr.id, at=datetime.fromisoformat(v1["created_at"]) - timedelta(days=1)) is None
+
+    # Stale versions are refused
+    with pytest.raises(crud.VersionConflict):
+        crud.update_mpr(db, mpr.id, {"family_size": 6}, expected_version=2)
+
+    # History outlives the record
+    crud.delete_mpr(db, mpr.id)
+    assert history.list_versions(db, "mpr", mpr.id)[0]["deleted"]
+    assert history.reconstruct(db, "mpr", mpr.id, version=1) == v1
+    assert history.reconstruct(db, "mpr", mpr.id, at=datetime.now()) is None
+
+
+def test_concurrent_update_is_rejected(db):
+    mpr = crud.create_mpr(db, make_mpr("H2", centre_code="HIST"))
+    assert crud.get_mpr_by_id(db, mpr.id).version == 1  # now cached at version 1
+    db.close()
+
+    # Another worker updates the record behind this worker's cache
+    other = SessionLocal()
+    try:
+        row = other.query(type(mpr)).filter_by(id=mpr.id).one()
+        row.family_size = 6
+        row.version = 2
+        other.commit()
+    finally:
+        other.close()
+
+    with pytest.raises(crud.VersionConflict):
+        crud.update_mpr(db, mpr.id, {"family_size": 5})
+    # The stale copy was dropped, so a retry sees the other worker's edit
+    assert crud.get_mpr_by_id(db, mpr.id).family_size == 6
+    assert crud.update_mpr(db, mpr.id, {"family_size": 5}).version == 3
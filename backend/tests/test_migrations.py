@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from database import Base
+import migrations
+import similarity
+
+# DPR/MPR/FP as they were created before migrations existed
+LEGACY_SCHEMA = [
+    "CREATE TABLE dpr (id INTEGER PRIMARY KEY, name_and_address VARCHAR, district VARCHAR, state VARCHAR, "
+    "family_size INTEGER, income_group VARCHAR, centre_code VARCHAR, return_no VARCHAR, month_and_year VARCHAR, "
+    "household_members JSON, latitude FLOAT, longitude FLOAT, otp_code VARCHAR, created_at DATETIME, is_synced BOOLEAN)",
+    "CREATE TABLE mpr (id INTEGER PRIMARY KEY, name_and_address VARCHAR, district_state_tel VARCHAR, "
+    "panel_centre VARCHAR, centre_code VARCHAR, return_no VARCHAR, family_size INTEGER, income_group VARCHAR, "
+    "month_and_year VARCHAR, occupation_of_head VARCHAR, items JSON, latitude FLOAT, longitude FLOAT, "
+    "otp_code VARCHAR, created_at DATETIME, is_synced BOOLEAN)",
+    "CREATE TABLE fp (id INTEGER PRIMARY KEY, centre_name VARCHAR, centre_code VARCHAR, panel_size INTEGER, "
+    "mpr_collected INTEGER, not_collected INTEGER, with_purchase_data INTEGER, nil_mprs INTEGER, "
+    "nil_serial_nos INTEGER, latitude FLOAT, longitude FLOAT, created_at DATETIME, is_synced BOOLEAN)",
+]
+
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {
+        table: (
+            {column["name"] for column in inspector.get_columns(table)},
+            {index["name"] for index in inspector.get_indexes(table)},
+        )
+        for table in inspector.get_table_names() if table != "sqlite_sequence"
+    }
+
+
+def test_new_database_matches_the_models(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    with pytest.raises(migrations.SchemaOutOfDate):
+        migrations.check(engine)
+
+    assert migrations.upgrade(engine) == [migration.version for migration in migrations.discover()]
+    migrations.check(engine)
+    assert migrations.upgrade(engine) == []
+
+    reference = create_engine(f"sqlite:///{tmp_path / 'reference.db'}")
+    Base.metadata.create_all(reference)
+    assert schema(engine) == schema(reference)
+
+
+def test_legacy_database_is_brought_up_to_date(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO mpr (id, centre_code, return_no, month_and_year, items) VALUES "
+            "(1, 'C1', 'R1', '2024-01', '[]'), (2, 'C1', 'R2', 'March 2024', '[]'), (3, 'C1', 'R3', '??', '[]')"
+        ))
+
+    migrations.upgrade(engine, target=4)
+    assert migrations.applied_version(engine) == 4
+    migrations.upgrade(engine)
+    migrations.check(engine)
+
+    columns, indexes = schema(engine)["mpr"]
+    assert {"updated_at", "change_seq", "geohash", "period", "version"} <= columns
+    assert {"ix_mpr_change_seq", "ix_mpr_geohash", "ix_mpr_period_centre", "ix_mpr_centre_return_no"} <= indexes
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, period, version FROM mpr ORDER BY id")).all()
+    assert [tuple(row) for row in rows] == [(1, 202401, 1), (2, 202403, 1), (3, None, 1)]
+    # Existing MPRs get near-duplicate signatures from the application, after migrating
+    with Session(bind=engine) as db:
+        assert similarity.index_missing(db) == 3
+        assert similarity.index_missing(db) == 0
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM mpr_signatures")).scalar() == 3
+
+
+def test_only_one_runner_at_a_time(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'locked.db'}")
+    monkeypatch.setattr(migrations, "MIGRATION_LOCK_TIMEOUT", 0.2)
+    with migrations.migration_lock(engine):
+        with pytest.raises(RuntimeError):
+            migrations.upgrade(engine)
+    assert migrations.upgrade(engine)
+
+
+def test_migrations_create_the_schema_of_their_version(tmp_path):
+    # Migrations carry their own table definitions, so replaying an early
+    # one builds that version's schema, not the current models'
+    engine = create_engine(f"sqlite:///{tmp_path / 'v1.db'}")
+    migrations.upgrade(engine, target=1)
+    tables = schema(engine)
+    assert {"dpr", "mpr", "fp"} <= set(tables)
+    assert "tombstones" not in tables
+    assert not {"change_seq", "geohash", "period", "version"} & tables["mpr"][0]
+
+
+def test_head_occupations_are_remapped_to_mpr_codes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'heads.db'}")
+    migrations.upgrade(engine, target=11)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO mpr (id, centre_code, return_no, month_and_year, occupation_of_head) VALUES "
+            "(1, 'C1', 'R1', '2024-01', '01'), (2, 'C1', 'R2', '2024-01', '01'), (3, 'C1', 'R3', '2024-01', '01')"
+        ))
+        # DPR codes: Agriculture, Service, and Infant (no MPR counterpart)
+        conn.execute(text(
+            "INSERT INTO dpr_heads (centre_code, return_no, dpr_id, occupation_of_head) VALUES "
+            "('C1', 'R1', 11, '07'), ('C1', 'R2', 12, '01'), ('C1', 'R3', 13, '13')"
+        ))
+        conn.execute(text(
+            "INSERT INTO consistency_mismatches (mpr_id, dpr_id, centre_code, return_no, field, mpr_value, dpr_value) "
+            "VALUES (1, 11, 'C1', 'R1', 'occupation_of_head', '01', '07')"
+        ))
+
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        heads = conn.execute(text("SELECT return_no, occupation_of_head FROM dpr_heads ORDER BY return_no")).all()
+        found = conn.execute(text("SELECT mpr_id, dpr_id, mpr_value, dpr_value FROM consistency_mismatches")).all()
+    assert [tuple(row) for row in heads] == [("R1", "01"), ("R2", "03"), ("R3", None)]
+    assert [tuple(row) for row in found] == [(2, 12, "01", "03")]
@@ -0,0 +1,96 @@
+import pytest
+from pydantic import ValidationError
+
+from models import MPRCreate
+from validation import check_purchase_items
+
+
+def make_item(**overrides):
+    item = {
+        "item_name": "Shirt",
+        "item_code": "401",
+        "month_of_purchase": "01",
+        "fibre_code": "01",
+        "sector_of_manufacture_code": "01",
+        "colour_design_code": "04",
+        "type_of_shop_code": "01",
+        "purchase_type_code": "01",
+        "dress_intended_code": "01",
+        "length_in_meters": 2.0,
+        "price_per_meter": 100.0,
+        "total_amount_paid": 200.0,
+        "brand_mill_name": "Brand",
+        "is_imported": False,
+    }
+    item.update(overrides)
+    return item
+
+
+def make_mpr(items):
+    return {
+        "name_and_address": "123 Street",
+        "district_state_tel": "District, State, 1234567890",
+        "panel_centre": "Centre",
+        "centre_code": "C001",
+        "return_no": "R001",
+        "family_size": 4,
+        "income_group": "04",
+        "month_and_year": "2024-01",
+        "occupation_of_head": "03",
+        "items": items,
+        "latitude": 12.0,
+        "longitude": 77.0,
+        "otp_code": "1234",
+    }
+
+
+def test_mpr_items_are_plain_dicts_with_defaults():
+    mpr = MPRCreate(**make_mpr([make_item(), make_item(item_name="Saree")]))
+
+    assert mpr.items[1]["item_name"] == "Saree"
+    assert mpr.items[0]["gender"] is None
+    assert mpr.items[0]["age"] is None
+
+
+def test_mpr_item_errors_are_reported_per_item():
+    items = [make_item() for _ in range(5)]
+    items[3] = make_item(total_amount_paid=950.0)
+
+    with pytest.raises(ValidationError) as exc_info:
+        MPRCreate(**make_mpr(items))
+
+    error = exc_info.value.errors()[0]
+    assert error["type"] == "purchase_items"
+    assert error["ctx"]["errors"] == [
+        {
+            "index": 3,
+            "field": "total_amount_paid",
+            "message": "Total 950.00 does not match length x price (200.00)",
+        }
+    ]
+
+
+def test_check_purchase_items_flags_unknown_codes_and_non_positive_values():
+    items = [make_item(fibre_code="99"), make_item(price_per_meter=0.0, total_amount_paid=0.5)]
+
+    errors = check_purchase_items(items, code_lists={"fibre_code": {"01", "02"}})
+
+    assert [(error["index"], error["field"]) for error in errors] == [
+        (0, "fibre_code"),
+        (1, "price_per_meter"),
+    ]
+
+
+def test_unknown_codes_are_rejected_against_the_codebook():
+    items = [make_item(), make_item(fibre_code="F001")]
+    payload = make_mpr(items)
+    payload["occupation_of_head"] = "Engineer"
+
+    with pytest.raises(ValidationError) as exc_info:
+        MPRCreate(**payload)
+
+    errors = {error["loc"][0]: error for error in exc_info.value.errors()}
+    assert errors["occupation_of_head"]["type"] == "unknown_code"
+    assert errors["items"]["ctx"]["errors"] == [
+        {"index": 1, "field": "fibre_code", "message": "Unknown code 'F001'"}
+    ]
@@ -0,0 +1,104 @@
+import pytest
+
+from database import create_tables, SessionLocal
+from models import MPRCreate, MPRUpdate
+import crud
+import partitions
+from periods import parse_period, format_period, next_period
+
+
+def make_mpr(month_and_year, return_no="P1"):
+    return MPRCreate(
+        name_and_address="Address", district_state_tel="District, State, 1234567890", panel_centre="Centre",
+        centre_code="PART", return_no=return_no, family_size=4, income_group="04",
+        month_and_year=month_and_year, occupation_of_head="03", items=[],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, "PARTITION_DIR", str(tmp_path))
+    create_tables()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_month_and_year_formats_normalise_to_one_period():
+    for value in ("3/2023", "03/2023", "2023-03", "03-2023", "March 2023", "Mar-23"):
+        assert parse_period(value) == 202303
+    assert format_period(202303) == "2023-03"
+    assert next_period(202312) == 202401
+    for value in ("13/2023", "2023", "Smarch 2023"):
+        with pytest.raises(ValueError):
+            parse_period(value)
+    with pytest.raises(ValueError):
+        make_mpr("sometime")
+
+
+def test_detach_and_attach_period(db):
+    old = [crud.create_mpr(db, make_mpr("1/2019", f"O{i}")).id for i in range(3)]
+    current = crud.create_mpr(db, make_mpr("2019-02")).id
+
+    assert [r.id for r in crud.get_all_mpr(db, limit=1000, period=201901)] == old
+    (version_before, _), = crud.get_change_counters(db, "mpr")
+
+    result = partitions.detach_period(db, "mpr", 201901)
+    assert result["rows"] == 3
+    assert crud.get_all_mpr(db, limit=1000, period=201901) == []
+    assert [r.id for r in crud.get_all_mpr(db, limit=1000, period=201902)] == [current]
+    (version_after, _), = crud.get_change_counters(db, "mpr")
+    assert version_after > version_before
+
+    # Writes to a detached month are refused; other months are unaffected
+    with pytest.raises(ValueError):
+        crud.create_mpr(db, make_mpr("January 2019"))
+    statuses = {entry["period"]: entry["status"] for entry in partitions.list_periods(db, "mpr")}
+    assert statuses["2019-01"] == "detached" and statuses["2019-02"] == "attached"
+
+    partitions.attach_period(db, "mpr", 201901)
+    assert [r.id for r in crud.get_all_mpr(db, limit=1000, period=201901)] == old
+    crud.create_mpr(db, make_mpr("January 2019"))
+
+
+def test_period_detached_by_another_worker_refuses_writes(db):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    record = crud.create_mpr(db, make_mpr("2018-05", "W1"))
+    partitions.detach_period(db, "mpr", 201805)
+    # Another worker that wrote to the month before it was detached still
+    # has it cached
+    partitions._writable.add(("primary", "mpr", 201805))
+
+    with pytest.raises(partitions.PeriodDetached):
+        crud.create_mpr(db, make_mpr("2018-05", "W2"))
+
+    # Moving a live record into the detached month is a conflict, not "not found"
+    live = crud.create_mpr(db, make_mpr("2018-06", "W3"))
+    payload = {key: value for key, value in crud.mpr_to_dict(live).items() if key in MPRUpdate.model_fields}
+    payload["month_and_year"] = "2018-05"
+    response = TestClient(app).put(f"/api/v1/mpr/{live.id}", json=payload)
+    assert response.status_code == 409
+    assert "detached" in response.json()["detail"]
+
+
+def test_unpartitioned_postgres_tables_take_writes_without_partition_ddl(db, monkeypatch):
+    # A PostgreSQL database adopted by migration v0005 keeps plain dpr/mpr
+    # tables (relkind 'r'); stand in for it on this session's database
+    monkeypatch.setattr(partitions, "is_postgres", lambda session: True)
+    monkeypatch.setitem(partitions._partitioned, (str(db.get_bind().url), "mpr"), False)
+    monkeypatch.setattr(partitions, "_writable", set())
+
+    # PARTITION OF on this table would fail the write
+    record = crud.create_mpr(db, make_mpr("2017-08", "L1"))
+    assert record.period == 201708
+
+    # Detaching moves the month to a file, as on SQLite
+    result = partitions.detach_period(db, "mpr", 201708)
+    assert result["location"].endswith("mpr_p201708.db")
+    with pytest.raises(partitions.PeriodDetached):
+        crud.create_mpr(db, make_mpr("2017-08", "L2"))
+    partitions.attach_period(db, "mpr", 201708)
+    assert [r.id for r in crud.get_all_mpr(db, limit=10, period=201708)] == [record.id]
@@ -0,0 +1,87 @@
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import event
+
+from database import engine
+from models import MPRUpdate
+from conftest import make_item, make_mpr
+import crud
+import patching
+
+
+def test_merge_patch_and_json_patch():
+    document = {"a": 1, "b": {"c": 2, "d": 3}, "items": [1, 2, 3]}
+    assert patching.apply_patch(document, {"a": None, "b": {"c": 5}}, patching.MERGE_PATCH) == \
+        {"b": {"c": 5, "d": 3}, "items": [1, 2, 3]}
+
+    patched = patching.apply_patch(document, [
+        {"op": "test", "path": "/items/1", "value": 2},
+        {"op": "replace", "path": "/items/1", "value": 20},
+        {"op": "add", "path": "/items/-", "value": 4},
+        {"op": "remove", "path": "/items/0"},
+        {"op": "move", "from": "/b/c", "path": "/e"},
+        {"op": "copy", "from": "/e", "path": "/b/f"},
+    ], patching.JSON_PATCH)
+    assert patched == {"a": 1, "b": {"d": 3, "f": 2}, "items": [20, 3, 4], "e": 2}
+    # The original document is untouched
+    assert document["items"] == [1, 2, 3]
+
+    with pytest.raises(patching.PatchConflict):
+        patching.apply_patch(document, [{"op": "test", "path": "/a", "value": 2}], patching.JSON_PATCH)
+    with pytest.raises(patching.PatchConflict):
+        patching.apply_patch(document, [{"op": "remove", "path": "/items/7"}], patching.JSON_PATCH)
+    with pytest.raises(patching.PatchError):
+        patching.apply_patch(document, [{"op": "frobnicate", "path": "/a"}], patching.JSON_PATCH)
+
+
+def test_patching_one_item_writes_only_changed_columns(db):
+    mpr = crud.create_mpr(db, make_mpr("P1", centre_code="PATCH", items=[make_item() for _ in range(50)]))
+
+    changes = crud.patch_changes(crud.mpr_document(mpr), MPRUpdate, [
+        {"op": "replace", "path": "/items/7/price_per_meter", "value": 110.0},
+        {"op": "replace", "path": "/items/7/total_amount_paid", "value": 220.0},
+    ], patching.JSON_PATCH)
+    assert list(changes) == ["items"]
+
+    updates = []
+
+    def capture(conn, cursor, statement, *args):
+        if statement.startswith("UPDATE mpr"):
+            updates.append(statement)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        crud.update_mpr(db, mpr.id, changes)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    # The edit itself, then the change sequence stamped at commit
+    assert len(updates) == 2
+    assert "family_size" not in updates[0] and "name_and_address" not in updates[0]
+    assert updates[1].startswith("UPDATE mpr SET change_seq=?")
+    assert crud.mpr_to_dict(crud.get_mpr_by_id(db, mpr.id))["items"][7]["price_per_meter"] == 110.0
+
+    # Results are validated as a whole record
+    with pytest.raises(ValidationError):
+        crud.patch_changes(crud.mpr_document(mpr), MPRUpdate, {"family_size": 0}, patching.MERGE_PATCH)
+    assert crud.patch_changes(crud.mpr_document(mpr), MPRUpdate, {"family_size": 4}, patching.MERGE_PATCH) == {}
+
+
+def test_binary_patch_bodies_are_decoded(db):
+    from fastapi.testclient import TestClient
+    import msgpack
+    from main import app
+
+    mpr = crud.create_mpr(db, make_mpr("P2", centre_code="PATCH", items=[make_item() for _ in range(2)]))
+    client = TestClient(app)
+    url = f"/api/v1/mpr/{mpr.id}"
+
+    response = client.patch(url, content=msgpack.packb({"family_size": 5}),
+                            headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 200 and response.json()["data"]["changed"] == ["family_size"]
+    # A list of operations is a JSON Patch
+    response = client.patch(url, content=msgpack.packb([{"op": "replace", "path": "/items/1/fibre_code", "value": "02"}]),
+                            headers={"Content-Type": "application/x-msgpack"})
+    assert response.status_code == 200 and response.json()["data"]["changed"] == ["items"]
+
+    assert client.patch(url, content=b"\xc1", headers={"Content-Type": "application/msgpack"}).status_code == 400
+    assert client.patch(url, content=b"x", headers={"Content-Type": "text/plain"}).status_code == 415
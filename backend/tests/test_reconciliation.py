@@ -0,0 +1,48 @@
+from functools import partial
+
+from database import AuditFlag
+from conftest import make_item
+import conftest
+import crud
+import reconciliation
+
+make_dpr = partial(conftest.make_dpr, centre_code="RECON")
+make_mpr = partial(conftest.make_mpr, centre_code="RECON", month_and_year="2024-02")
+make_fp = partial(conftest.make_fp, centre_code="RECON", month_and_year="2024-02", panel_size=4, mpr_collected=3,
+                  not_collected=1, with_purchase_data=2, nil_mprs=1, nil_serial_nos=1)
+
+
+def test_expected_counts_and_fp_reconciliation(db):
+    for return_no in ("R1", "R2", "R3", "R4"):
+        crud.create_dpr(db, make_dpr(return_no))
+    crud.create_mpr(db, make_mpr("R1", items=[make_item(), make_item()]))
+    crud.create_mpr(db, make_mpr("R2", items=[]))
+    resubmitted = crud.create_mpr(db, make_mpr("R3", items=[]))
+    crud.create_mpr(db, make_mpr("R4", items=[make_item()], month_and_year="2024-03"))
+
+    # R3's resubmission lists a purchase, so R3 counts once, with purchase data
+    crud.create_mpr(db, make_mpr("R3", items=[make_item()]))
+    assert resubmitted.item_count == 0
+    crud.update_mpr(db, resubmitted.id, {"items": [make_item()]})
+    assert crud.get_mpr_by_id(db, resubmitted.id).item_count == 1
+
+    assert reconciliation.expected_counts(db, "RECON", 202402) == {
+        "centre_code": "RECON", "period": "2024-02", "panel_size": 4, "mpr_collected": 3, "not_collected": 1,
+        "with_purchase_data": 2, "nil_mprs": 1, "nil_serial_nos": 1,
+    }
+
+    matching = crud.create_fp(db, make_fp())
+    assert crud.reconcile_fp(db, matching)["reconciled"]
+
+    wrong = crud.create_fp(db, make_fp(with_purchase_data=3, nil_mprs=0))
+    result = crud.reconcile_fp(db, wrong)
+    assert result["mismatches"] == {
+        "with_purchase_data": {"submitted": 3, "expected": 2},
+        "nil_mprs": {"submitted": 0, "expected": 1},
+    }
+    flags = db.query(AuditFlag).filter_by(record_type="fp", flag_type=reconciliation.FP_MISMATCH_FLAG).all()
+    assert [flag.record_id for flag in flags] == [wrong.id]
+
+    # Without a period there is nothing to reconcile against
+    undated = crud.create_fp(db, make_fp().model_copy(update={"month_and_year": None}))
+    assert crud.reconcile_fp(db, undated) is None
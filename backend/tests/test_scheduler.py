@@ -0,0 +1,100 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import create_tables, SessionLocal, MaintenanceJob
+from scheduler import Scheduler
+import routes
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    create_tables()
+    with SessionLocal() as db:
+        db.query(MaintenanceJob).delete()
+        db.commit()
+
+
+async def settle(scheduler):
+    # Wait for job threads and lease releases to finish
+    while any(job.running for job in scheduler.jobs.values()):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+
+
+def test_cluster_job_runs_once_per_interval():
+    calls = []
+
+    async def scenario():
+        first, second = Scheduler(SessionLocal, "worker-1"), Scheduler(SessionLocal, "worker-2")
+        for scheduler in (first, second):
+            scheduler.register("rollup", lambda: calls.append(1), interval=3600, timeout=10)
+
+        assert await first.run(first.jobs["rollup"])
+        await settle(first)
+        # The other worker finds the job done for this interval
+        assert not await second.run(second.jobs["rollup"])
+        assert second.jobs["rollup"].skipped == 1
+
+        with SessionLocal() as db:
+            row = db.get(MaintenanceJob, "rollup")
+            assert row.holder is None
+            assert row.last_status == "ok"
+            assert row.last_duration is not None
+            # Once the interval has passed, any worker may run it
+            row.last_started_at = datetime.now() - timedelta(hours=2)
+            db.commit()
+        assert await second.run(second.jobs["rollup"])
+        await settle(second)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_slow_job_times_out_and_keeps_its_lease_until_done():
+    async def scenario():
+        scheduler = Scheduler(SessionLocal, "worker-1")
+        job = scheduler.register("slow", lambda: time.sleep(0.5), interval=0.01, timeout=0.05, jitter=0)
+
+        assert await scheduler.run(job)
+        assert job.timeouts == 1
+        # Still running in its thread: neither this worker nor another starts it again
+        assert not await scheduler.run(job)
+        other = Scheduler(SessionLocal, "worker-2")
+        assert not await other.run(other.register("slow", job.func, interval=0.01, timeout=0.05, jitter=0))
+
+        await settle(scheduler)
+        assert job.runs == 1
+        assert job.last_status == "timed_out"
+        assert job.stats()["max_duration_seconds"] >= 0.5
+
+    asyncio.run(scenario())
+
+
+def test_failures_are_recorded():
+    def broken():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        scheduler = Scheduler(SessionLocal, "worker-1")
+        job = scheduler.register("broken", broken, interval=60, timeout=5, cluster=False)
+        await scheduler.run(job)
+        await settle(scheduler)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.failures == 1
+    assert job.last_error == "boom"
+
+
+def test_expired_otps_are_purged():
+    now = datetime.now()
+    routes.otp_storage.clear()
+    routes.otp_storage["1_login"] = {"otp": "111111", "created_at": now - timedelta(hours=1), "purpose": "login"}
+    routes.otp_storage["2_login"] = {"otp": "222222", "created_at": now, "purpose": "login"}
+
+    assert routes.purge_expired_otps(now) == 1
+    assert list(routes.otp_storage) == ["2_login"]
+    routes.otp_storage.clear()
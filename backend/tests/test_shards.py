@@ -0,0 +1,199 @@
+import pytest
+from sqlalchemy import create_engine
+
+from database import DPR, MPR
+from models import DPRCreate, MPRCreate
+import crud
+import shards
+
+
+def make_dpr(centre_code, return_no):
+    return DPRCreate(
+        name_and_address="Address", district="District", state="State", family_size=4, income_group="04",
+        centre_code=centre_code, return_no=return_no, month_and_year="1/2024", household_members=[],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+
+
+def make_mpr(centre_code, return_no):
+    return MPRCreate(
+        name_and_address="Address", district_state_tel="District, State, 1234567890", panel_centre="Centre",
+        centre_code=centre_code, return_no=return_no, family_size=4, income_group="04",
+        month_and_year="1/2024", occupation_of_head="03", items=[],
+        latitude=12.0, longitude=77.0, otp_code="1234",
+    )
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    engines = {
+        name: create_engine(f"sqlite:///{tmp_path / name}.db", connect_args={"check_same_thread": False})
+        for name in ("primary", "east", "west")
+    }
+    shard_router = shards.ShardRouter(engines)
+    shard_router.create_tables()
+    monkeypatch.setattr(shards, "router", shard_router)
+    yield shard_router
+    for shard_engine in engines.values():
+        shard_engine.dispose()
+
+
+def create(router, make, create_fn, centre_code, return_no):
+    with router.session_for_centre(centre_code) as db:
+        return create_fn(db, make(centre_code, return_no)).id
+
+
+def test_records_route_by_centre_and_ids_identify_the_shard(router):
+    router.assign("centre", "E1", "east")
+    router.assign("centre", "W1", "west")
+
+    east_id = create(router, make_mpr, crud.create_mpr, "E1", "R1")
+    west_id = create(router, make_mpr, crud.create_mpr, "W1", "R1")
+    assert router.shard_for_id(east_id) == "east"
+    assert router.shard_for_id(west_id) == "west"
+    assert router.find_record_shard(MPR, west_id) == "west"
+
+    # Unassigned centres are hashed once and then stay put
+    shard = router.shard_for_centre("H1")
+    assert {"type": "centre", "key": "H1", "shard": shard, "moving_from": None} in router.assignments()
+    router.assign("state", "Kerala", "east")
+    assert router.shard_for_centre("H1") == shard
+
+
+def test_scatter_gather_lists_and_stats(router):
+    router.assign("centre", "E1", "east")
+    router.assign("centre", "W1", "west")
+    ids = [
+        create(router, make_mpr, crud.create_mpr, centre, f"R{i}")
+        for i in range(3) for centre in ("E1", "W1")
+    ]
+
+    page = shards.scatter_list(crud.get_all_mpr, skip=1, limit=3)
+    assert [record.id for record in page] == sorted(ids)[1:4]
+    stats = shards.scatter_stats()
+    assert stats["total_mpr"] == 6
+    assert len(shards.scatter_counters("mpr")) == 3
+
+
+def test_move_centre_keeps_ids_and_leaves_tombstones(router):
+    router.assign("centre", "MV", "east")
+    dpr_id = create(router, make_dpr, crud.create_dpr, "MV", "R1")
+    mpr_id = create(router, make_mpr, crud.create_mpr, "MV", "R1")
+
+    moved = router.move_centre("MV", "west")
+    assert moved == {"dpr": 1, "mpr": 1, "fp": 0}
+    assert router.shard_for_centre("MV") == "west"
+    assert router.find_record_shard(DPR, dpr_id) == "west"
+    assert router.find_record_shard(MPR, mpr_id) == "west"
+
+    with router.open("east") as db:
+        assert db.query(MPR).count() == 0
+        (version, _), = crud.get_change_counters(db, "mpr")
+        assert [t.record_id for t in crud.get_tombstones(db, "mpr", 0, version)] == [mpr_id]
+    # New records for the centre follow it
+    assert router.shard_for_id(create(router, make_mpr, crud.create_mpr, "MV", "R2")) == "west"
+
+
+def test_move_centre_keeps_writes_made_during_the_move(router, monkeypatch):
+    router.assign("centre", "MW", "east")
+    kept = create(router, make_mpr, crud.create_mpr, "MW", "R1")
+    changed = create(router, make_mpr, crud.create_mpr, "MW", "R2")
+
+    assign = router.assign
+
+    def assign_after_writes(key_type, key, shard, moving_from=None):
+        # Writes that land on the source between the copy and the re-point
+        if moving_from is not None:
+            with router.open("east") as db:
+                crud.update_mpr(db, changed, {"family_size": 7})
+                late = crud.create_mpr(db, make_mpr("MW", "R3")).id
+                late_ids.append(late)
+        assign(key_type, key, shard, moving_from)
+
+    late_ids = []
+    monkeypatch.setattr(router, "assign", assign_after_writes)
+    assert router.move_centre("MW", "west") == {"dpr": 0, "mpr": 3, "fp": 0}
+
+    with router.open("west") as db:
+        assert {record.id for record in db.query(MPR)} == {kept, changed} | set(late_ids)
+        assert db.get(MPR, changed).family_size == 7
+    with router.open("east") as db:
+        assert db.query(MPR).count() == 0
+    assert router.move_source("MW") is None
+
+
+def test_interrupted_move_is_finished_by_a_rerun(router, monkeypatch):
+    router.assign("centre", "MR", "east")
+    ids = [create(router, make_mpr, crud.create_mpr, "MR", f"R{i}") for i in range(3)]
+
+    delete_record = crud.delete_record
+    calls = []
+
+    def failing_delete(db, model, table_name, record_id, expected_change_seq=None):
+        calls.append(record_id)
+        if len(calls) == 2:
+            raise RuntimeError("connection lost")
+        return delete_record(db, model, table_name, record_id, expected_change_seq)
+
+    monkeypatch.setattr(crud, "delete_record", failing_delete)
+    with pytest.raises(RuntimeError):
+        router.move_centre("MR", "west")
+    # Already re-pointed, but the source is remembered
+    assert router.shard_for_centre("MR") == "west"
+    assert router.move_source("MR") == "east"
+
+    monkeypatch.setattr(crud, "delete_record", delete_record)
+    assert router.move_centre("MR", "west")["mpr"] == 2
+    assert router.move_source("MR") is None
+    with router.open("east") as db:
+        assert db.query(MPR).count() == 0
+    with router.open("west") as db:
+        assert sorted(record.id for record in db.query(MPR)) == ids
+
+
+def test_geo_and_audit_reads_gather_from_every_shard(router):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    router.assign("centre", "GE", "east")
+    router.assign("centre", "GW", "west")
+    east_id = create(router, make_mpr, crud.create_mpr, "GE", "R1")
+    west_id = create(router, make_mpr, crud.create_mpr, "GW", "R1")
+    client = TestClient(app)
+
+    nearby = client.get("/api/v1/geo/nearby", params={"latitude": 12.0, "longitude": 77.0, "radius_km": 1}).json()
+    assert {record["id"] for record in nearby["data"]["records"]} == {east_id, west_id}
+    grid = client.get("/api/v1/geo/grid", params={"precision": 5}).json()["data"]["cells"]
+    assert [cell["count"] for cell in grid] == [2]
+
+    only_west = client.get("/api/v1/geo/nearby", params={"latitude": 12.0, "longitude": 77.0, "shard": "west"})
+    assert [record["id"] for record in only_west.json()["data"]["records"]] == [west_id]
+    assert client.get("/api/v1/audit/flags", params={"shard": "nowhere"}).status_code == 404
+    assert client.get("/api/v1/consistency/mismatches").json()["data"]["counts"] == {}
+
+
+def test_centre_feeds_route_to_the_centre_and_checks_store_nothing(router):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    router.assign("centre", "SW", "west")
+    west_id = create(router, make_mpr, crud.create_mpr, "SW", "R1")
+    client = TestClient(app)
+
+    changes = client.get("/api/v1/sync/changes", params={"centre_code": "SW"}).json()["data"]
+    assert [record["id"] for record in changes["changes"]["mpr"]["upserts"]] == [west_id]
+    # Without a centre there is no single feed to read
+    assert client.get("/api/v1/sync/changes").status_code == 400
+    assert client.get("/api/v1/sync/changes", params={"shard": "west"}).status_code == 200
+    assert client.get("/api/v1/ledger/audit").status_code == 400
+
+    # A rejected move to a centre hashed elsewhere leaves no assignment behind
+    typo = next(code for code in (f"X{i}" for i in range(100)) if router.locate_centre(code) != "west")
+    payload = {key: value for key, value in crud.mpr_to_dict(router.session("west").get(MPR, west_id)).items()
+               if key in MPRCreate.model_fields}
+    payload["centre_code"] = typo
+    assert client.put(f"/api/v1/mpr/{west_id}", json=payload).status_code == 409
+    assert all(assignment["key"] != typo for assignment in router.assignments())
+
+    rebuilt = client.post("/api/v1/consistency/rebuild").json()["data"]
+    assert rebuilt == {"indexed_returns": 0, "mismatches": 0}
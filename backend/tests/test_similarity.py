@@ -0,0 +1,69 @@
+from functools import partial
+
+from database import AuditFlag, MPRBucket, MPRSignature
+from conftest import make_item
+import conftest
+import crud
+import similarity
+
+ITEMS = [make_item("401", "01", 2.0, 200.0), make_item("402", "02", 2.0, 850.0), make_item("403", "01", 2.0, 1200.0),
+         make_item("404", "03", 2.0, 90.0), make_item("405", "02", 2.0, 400.0)]
+
+make_mpr = partial(conftest.make_mpr, name_and_address="12 Gandhi Road, Ward 4, Madurai",
+                   district_state_tel="Madurai, Tamil Nadu, 9876543210", centre_code="DUP1",
+                   month_and_year="2024-05", items=ITEMS)
+
+
+def near_duplicate_flag(db, mpr_id):
+    return db.query(AuditFlag).filter(
+        AuditFlag.record_type == "mpr", AuditFlag.record_id == mpr_id,
+        AuditFlag.flag_type == similarity.NEAR_DUPLICATE_FLAG
+    ).first()
+
+
+def test_signatures_estimate_jaccard_similarity():
+    first = similarity.features(make_mpr("A"))
+    second = similarity.features(make_mpr("B", items=ITEMS[:4]))
+    jaccard = len(first & second) / len(first | second)
+    estimate = similarity.estimate_similarity(similarity.signature(first), similarity.signature(second))
+    assert abs(estimate - jaccard) < 0.15
+    # Stable across processes: the signature only depends on the features
+    assert (similarity.signature(first) == similarity.signature(set(first))).all()
+
+
+def test_re_entered_mpr_is_flagged(db):
+    original = crud.create_mpr(db, make_mpr("R100"))
+    # Different household, same month
+    other = crud.create_mpr(db, make_mpr("R101", name_and_address="7 Lake View, Anna Nagar, Chennai",
+                                         items=[make_item("410", "04", 2.0, 3000.0)], family_size=2))
+    # Same household again under another return number, one amount edited
+    edited = [make_item("401", "01", 2.0, 210.0)] + ITEMS[1:]
+    copy = crud.create_mpr(db, make_mpr("R150", items=edited))
+
+    assert near_duplicate_flag(db, original.id) is None
+    assert near_duplicate_flag(db, other.id) is None
+    flag = near_duplicate_flag(db, copy.id)
+    assert flag is not None and f"MPR {original.id}" in flag.detail
+
+    matches = similarity.find_near_duplicates(db, original.id)
+    assert [match["mpr_id"] for match in matches] == [copy.id]
+    assert matches[0]["similarity"] >= similarity.NEAR_DUPLICATE_THRESHOLD
+
+    # Editing the copy into something else clears its flag
+    crud.update_mpr(db, copy.id, {"name_and_address": "99 Hill Street, Ooty", "family_size": 7,
+                                  "items": [make_item("420", "05", 2.0, 50.0)]})
+    assert near_duplicate_flag(db, copy.id) is None
+    assert similarity.find_near_duplicates(db, original.id) == []
+
+
+def test_other_periods_and_resubmissions_are_not_candidates(db):
+    address = "3 Temple Street, Srirangam, Trichy"
+    may = crud.create_mpr(db, make_mpr("R200", name_and_address=address))
+    june = crud.create_mpr(db, make_mpr("R201", name_and_address=address, month_and_year="2024-06"))
+    resubmitted = crud.create_mpr(db, make_mpr("R200", name_and_address=address))
+    assert near_duplicate_flag(db, june.id) is None
+    assert near_duplicate_flag(db, resubmitted.id) is None
+
+    crud.delete_mpr(db, may.id)
+    assert db.query(MPRBucket).filter(MPRBucket.mpr_id == may.id).count() == 0
+    assert db.get(MPRSignature, may.id) is None
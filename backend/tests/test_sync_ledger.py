@@ -0,0 +1,68 @@
+from functools import partial
+
+import pytest
+
+import conftest
+import crud
+import sync_ledger
+
+make_fp = partial(conftest.make_fp, centre_code="LEDGER")
+
+
+def test_workers_claim_disjoint_ranges_and_watermark_advances(db, monkeypatch):
+    monkeypatch.setattr(sync_ledger, "DEFAULT_RANGE_SIZE", 2)
+    # Bring the consumer up to date with whatever earlier tests wrote
+    while True:
+        ranges = sync_ledger.claim_ranges(db, "exports", "fp", "setup", max_ranges=20)
+        if not ranges:
+            break
+        for ledger_range in ranges:
+            sync_ledger.complete_range(db, ledger_range.id, "setup")
+
+    created = [crud.create_fp(db, make_fp()).id for _ in range(4)]
+    unsynced_before = len(crud.get_unsynced_fp(db, consumer="exports"))
+
+    first = sync_ledger.claim_ranges(db, "exports", "fp", "worker-1")
+    second = sync_ledger.claim_ranges(db, "exports", "fp", "worker-2")
+    assert first[0].id != second[0].id
+
+    claimed_ids = [
+        record.id
+        for ledger_range in first + second
+        for record in sync_ledger.get_range_records(db, ledger_range)
+    ]
+    assert sorted(claimed_ids) == created
+
+    first_id, first_start = first[0].id, first[0].start_seq
+    second_id, second_end = second[0].id, second[0].end_seq
+
+    # Completing the later range first leaves the watermark behind the gap
+    assert sync_ledger.complete_range(db, second_id, "worker-2") == first_start
+    assert crud.get_committed_seq(db, "exports", "fp") == first_start
+
+    assert sync_ledger.complete_range(db, first_id, "worker-1") == second_end
+    assert crud.get_committed_seq(db, "exports", "fp") == second_end
+    assert unsynced_before == 4
+    assert crud.get_unsynced_fp(db, consumer="exports") == []
+
+
+def test_complete_rejects_other_workers(db):
+    crud.create_fp(db, make_fp())
+    ranges = sync_ledger.claim_ranges(db, "rollups", "fp", "worker-1", max_ranges=20)
+
+    with pytest.raises(ValueError):
+        sync_ledger.complete_range(db, ranges[0].id, "worker-2")
+
+
+def test_ranges_carry_their_deletions(db):
+    while sync_ledger.claim_ranges(db, "central_tc", "fp", "setup", max_ranges=20):
+        pass
+    kept = crud.create_fp(db, make_fp()).id
+    deleted = crud.create_fp(db, make_fp()).id
+    crud.delete_fp(db, deleted)
+
+    ranges = sync_ledger.claim_ranges(db, "central_tc", "fp", "worker-1", max_ranges=20)
+    records = [record.id for ledger_range in ranges for record in sync_ledger.get_range_records(db, ledger_range)]
+    tombstones = [t.record_id for ledger_range in ranges for t in sync_ledger.get_range_tombstones(db, ledger_range)]
+    assert records == [kept]
+    assert tombstones == [deleted]
@@ -0,0 +1,108 @@
+import json
+
+import cbor2
+import msgpack
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from models import MPRCreate
+from wire import NegotiatedRoute, NegotiatedResponse, negotiate, to_columnar
+import wire
+
+
+def make_item(i):
+    return {
+        "item_name": f"Item {i}", "item_code": "401", "month_of_purchase": "01", "fibre_code": "01",
+        "sector_of_manufacture_code": "01", "colour_design_code": "01", "gender": "M",
+        "type_of_shop_code": "01", "purchase_type_code": "01", "dress_intended_code": "01",
+        "length_in_meters": 2.0, "price_per_meter": 100.0, "total_amount_paid": 200.0,
+        "brand_mill_name": "Brand", "is_imported": False,
+    }
+
+
+def make_mpr(items):
+    return {
+        "name_and_address": "Address", "district_state_tel": "District, State, 1234567890",
+        "panel_centre": "Centre", "centre_code": "WIRE", "return_no": "W1", "family_size": 4,
+        "income_group": "04", "month_and_year": "2024-01", "occupation_of_head": "03", "items": items,
+        "latitude": 12.0, "longitude": 77.0, "otp_code": "1234",
+    }
+
+
+router = APIRouter(route_class=NegotiatedRoute, default_response_class=NegotiatedResponse)
+
+
+@router.post("/mpr")
+async def echo_mpr(mpr: MPRCreate):
+    return {"status": "success", "data": mpr.model_dump()}
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def test_negotiate():
+    assert negotiate(None) == ("application/json", False)
+    assert negotiate("application/msgpack") == ("application/msgpack", False)
+    assert negotiate("application/json;q=0.5, application/cbor; columnar=true") == ("application/cbor", True)
+    assert negotiate("text/html, */*") == ("application/json", False)
+
+
+def test_binary_and_columnar_bodies_are_validated_like_json():
+    items = [make_item(i) for i in range(200)]
+    document = make_mpr(items)
+    columnar = make_mpr(to_columnar(items))
+
+    as_json = json.dumps(document).encode()
+    as_msgpack = msgpack.packb(columnar)
+    assert len(as_msgpack) < len(as_json) / 2
+
+    response = client.post("/mpr", content=as_msgpack, headers={
+        "Content-Type": "application/msgpack", "Accept": "application/cbor; columnar=true"
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/cbor"
+    data = cbor2.loads(response.content)["data"]
+    assert data["items"]["item_name"][199] == "Item 199"
+    assert wire.from_columnar(data["items"]) == MPRCreate(**document).model_dump()["items"]
+
+    # JSON clients see no difference
+    response = client.post("/mpr", content=as_json, headers={"Content-Type": "application/json"})
+    assert response.json()["data"]["items"][0]["item_name"] == "Item 0"
+
+    # The same schema rejects bad binary bodies, and errors stay JSON
+    bad = make_mpr(to_columnar(items))
+    bad["family_size"] = 0
+    response = client.post("/mpr", content=msgpack.packb(bad), headers={
+        "Content-Type": "application/msgpack", "Accept": "application/msgpack"
+    })
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "family_size"]
+
+    ragged = make_mpr({"item_name": ["a", "b"], "item_code": ["401"]})
+    response = client.post("/mpr", content=cbor2.dumps(ragged), headers={"Content-Type": "application/cbor"})
+    assert response.status_code == 400
+
+
+def test_each_representation_has_its_own_etag():
+    from main import app as main_app
+    from database import create_tables
+    create_tables()
+    api = TestClient(main_app)
+
+    etags = set()
+    for accept in ("application/json", "application/msgpack", "application/cbor",
+                   "application/cbor; columnar=true"):
+        response = api.get("/api/v1/stats", headers={"Accept": accept})
+        assert response.status_code == 200
+        etags.add(response.headers["etag"])
+        # Revalidating the same representation is still a 304
+        again = api.get("/api/v1/stats", headers={"Accept": accept, "If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+    assert len(etags) == 4
+
+    json_etag = api.get("/api/v1/stats").headers["etag"]
+    response = api.get("/api/v1/stats", headers={"Accept": "application/msgpack", "If-None-Match": json_etag})
+    assert response.status_code == 200
+    assert msgpack.unpackb(response.content)["data"] is not None
@@ -0,0 +1,61 @@
+import numpy as np
+from typing import Dict, List, Mapping, Optional, AbstractSet
+
+# Tolerance used when checking length_in_meters * price_per_meter against
+# total_amount_paid. Field staff round totals to the rupee and occasionally
+# apply small discounts, so an exact match is not expected.
+AMOUNT_RTOL = 0.02
+AMOUNT_ATOL = 1.0
+
+AMOUNT_FIELDS = ("length_in_meters", "price_per_meter", "total_amount_paid")
+
+
+def _item_error(index: int, field: str, message: str) -> Dict:
+    return {"index": int(index), "field": field, "message": message}
+
+
+def check_purchase_items(
+    items: List[Mapping],
+    code_lists: Optional[Mapping[str, AbstractSet[str]]] = None,
+) -> List[Dict]:
+    """Run columnar checks over a list of already type-validated purchase items.
+
+    The numeric columns are checked as NumPy arrays in one pass instead of
+    item by item, and code columns are checked against ``code_lists`` (a
+    mapping of field name to the set of allowed codes). Returns a list of
+    item-level errors sorted by item index; an empty list means the batch
+    is consistent.
+    """
+    if not items:
+        return []
+
+    count = len(items)
+    columns = {
+        field: np.fromiter((item[field] for item in items), dtype=np.float64, count=count)
+        for field in AMOUNT_FIELDS
+    }
+
+    errors = []
+    for field, column in columns.items():
+        for index in np.flatnonzero(~(column > 0)):
+            errors.append(_item_error(index, field, "Value must be greater than 0"))
+
+    expected = columns["length_in_meters"] * columns["price_per_meter"]
+    mismatched = ~np.isclose(expected, columns["total_amount_paid"], rtol=AMOUNT_RTOL, atol=AMOUNT_ATOL)
+    for index in np.flatnonzero(mismatched):
+        errors.append(_item_error(
+            index,
+            "total_amount_paid",
+            f"Total {columns['total_amount_paid'][index]:.2f} does not match "
+            f"length x price ({expected[index]:.2f})"
+        ))
+
+    if code_lists:
+        for field, allowed in code_lists.items():
+            for index, item in enumerate(items):
+                code = item.get(field)
+                if code is not None and code not in allowed:
+                    errors.append(_item_error(index, field, f"Unknown code '{code}'"))
+
+    errors.sort(key=lambda error: error["index"])
+    return errors
@@ -0,0 +1,241 @@
+import contextvars
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:  # optional: only needed for MessagePack clients
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional: only needed for CBOR clients
+    cbor2 = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Binary wire formats. Clients on slow links can send request bodies as
+# MessagePack or CBOR (Content-Type) and ask for responses in either
+# (Accept). Decoded bodies go through the same models.py validation as
+# JSON. The item list of an MPR can also be sent columnar, one array per
+# field ({"item_name": [...], "price_per_meter": [...]}), so the field
+# names are not repeated for every item; responses use that layout when
+# the Accept type carries "columnar=true". JSON remains the default, and
+# errors are always JSON.
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+MEDIA_TYPE_ALIASES = {
+    JSON: JSON,
+    MSGPACK: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    CBOR: CBOR,
+}
+
+# Record fields holding lists of objects that may be sent columnar
+COLUMNAR_FIELDS = ("items",)
+
+# (media type, columnar) negotiated for the response of the current request
+_response_format = contextvars.ContextVar("response_format", default=(JSON, False))
+
+
+def _available(media_type: str) -> bool:
+    return media_type == JSON or (media_type == MSGPACK and msgpack is not None) or \
+        (media_type == CBOR and cbor2 is not None)
+
+
+def parse_media_type(value: str) -> Tuple[str, Dict[str, str]]:
+    """Split ``type/subtype; a=b`` into the lowercased type and its parameters"""
+    media_type, *params = value.split(";")
+    parameters = {}
+    for param in params:
+        key, _, param_value = param.partition("=")
+        parameters[key.strip().lower()] = param_value.strip().strip('"').lower()
+    return media_type.strip().lower(), parameters
+
+
+def negotiate(accept: Optional[str]) -> Tuple[str, bool]:
+    """Pick the response format from an Accept header: (media type, columnar)"""
+    if not accept:
+        return JSON, False
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, parameters = parse_media_type(part)
+        try:
+            quality = float(parameters.get("q", "1"))
+        except ValueError:
+            quality = 0.0
+        canonical = MEDIA_TYPE_ALIASES.get(media_type)
+        if canonical and quality > 0 and _available(canonical):
+            candidates.append((-quality, position, canonical, parameters.get("columnar") == "true"))
+    if not candidates:
+        return JSON, False
+    _, _, media_type, columnar = min(candidates)
+    return media_type, columnar
+
+
+def to_columnar(rows: List[dict]) -> Dict[str, list]:
+    """[{a: 1, b: 2}, {a: 3, b: 4}] -> {a: [1, 3], b: [2, 4]}"""
+    fields = []
+    for row in rows:
+        for field in row:
+            if field not in fields:
+                fields.append(field)
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+def from_columnar(columns: Dict[str, list]) -> List[dict]:
+    """{a: [1, 3], b: [2, 4]} -> [{a: 1, b: 2}, {a: 3, b: 4}]"""
+    if not all(isinstance(values, list) for values in columns.values()):
+        raise ValueError("Columnar fields must be arrays")
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("Columnar fields must be arrays of the same length")
+    count = lengths.pop() if lengths else 0
+    return [{field: values[index] for field, values in columns.items()} for index in range(count)]
+
+
+def expand_columnar(document: Any) -> Any:
+    """Turn columnar record fields in a request body back into lists of objects"""
+    if isinstance(document, dict):
+        for field in COLUMNAR_FIELDS:
+            if isinstance(document.get(field), dict):
+                document[field] = from_columnar(document[field])
+    return document
+
+
+def collapse_columnar(document: Any) -> Any:
+    """Send record fields holding lists of objects columnar, anywhere in a response"""
+    if isinstance(document, dict):
+        return {
+            key: to_columnar(value)
+            if key in COLUMNAR_FIELDS and isinstance(value, list) and all(isinstance(row, dict) for row in value)
+            else collapse_columnar(value)
+            for key, value in document.items()
+        }
+    if isinstance(document, list):
+        return [collapse_columnar(value) for value in document]
+    return document
+
+
+def decode(body: bytes, media_type: str) -> Any:
+    if media_type == MSGPACK:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if media_type == CBOR:
+        return cbor2.loads(body)
+    return json.loads(body)
+
+
+def encode(content: Any, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return msgpack.packb(content, use_bin_type=True)
+    if media_type == CBOR:
+        return cbor2.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def representation_etag(etag: str) -> str:
+    """The ETag of the representation negotiated for the current response.
+
+    JSON, MessagePack, CBOR and the columnar layout are different bytes for
+    the same resource, so each needs its own strong ETag; plain JSON keeps
+    the resource's ETag unchanged.
+    """
+    media_type, columnar = _response_format.get()
+    if media_type == JSON and not columnar:
+        return etag
+    suffix = media_type.split("/")[-1] + ("-columnar" if columnar else "")
+    return f'{etag[:-1]}+{suffix}"' if etag.endswith('"') else f"{etag}+{suffix}"
+
+
+def decode_body(body: bytes, media_type: str) -> Any:
+    """Decode a body a route reads itself (e.g. a PATCH document).
+
+    Columnar fields are expanded. Raises 415 for a format this server
+    cannot read and 400 for a malformed body.
+    """
+    if not _available(media_type):
+        raise HTTPException(status_code=415, detail=f"{media_type} is not supported by this server")
+    try:
+        return expand_columnar(decode(body, media_type))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {media_type} body: {str(e)}")
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSONResponse that renders in the format negotiated for the request"""
+
+    def __init__(self, content: Any, *args, **kwargs):
+        self.media_type, self.columnar = _response_format.get()
+        super().__init__(content, *args, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        if self.columnar:
+            content = collapse_columnar(content)
+        if self.media_type == JSON:
+            return super().render(content)
+        return encode(content, self.media_type)
+
+
+class NegotiatedRoute(APIRoute):
+    """Route that reads MessagePack/CBOR bodies and negotiates the response format"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        has_body = self.body_field is not None
+
+        async def negotiated_handler(request: Request) -> Response:
+            _response_format.set(negotiate(request.headers.get("accept")))
+            if has_body:
+                request = await _decoded_request(request)
+            response = await handler(request)
+            response.headers.setdefault("vary", "Accept")
+            return response
+
+        return negotiated_handler
+
+
+async def _decoded_request(request: Request) -> Request:
+    """The request with its body decoded and columnar fields expanded.
+
+    FastAPI only validates bodies it reads as JSON, so binary bodies are
+    handed over as an already-parsed JSON request.
+    """
+    content_type = request.headers.get("content-type")
+    if not content_type:
+        return request
+    media_type = MEDIA_TYPE_ALIASES.get(parse_media_type(content_type)[0])
+    if media_type is None:
+        return request
+    if not _available(media_type):
+        raise HTTPException(status_code=415, detail=f"{media_type} is not supported by this server")
+    body = await request.body()
+    if not body:
+        return request
+    try:
+        document = decode(body, media_type)
+    except Exception as e:
+        if media_type == JSON:
+            # FastAPI reports malformed JSON itself
+            return request
+        # msgpack and cbor2 raise their own error types for malformed input
+        raise HTTPException(status_code=400, detail=f"Invalid {media_type} body: {str(e)}")
+    try:
+        document = expand_columnar(document)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {media_type} body: {str(e)}")
+
+    scope = dict(request.scope)
+    scope["headers"] = [(key, value) for key, value in request.scope["headers"] if key != b"content-type"]
+    scope["headers"].append((b"content-type", JSON.encode()))
+    decoded = Request(scope, request.receive)
+    decoded._body = body
+    decoded._json = document
+    return decoded